@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+
+"""Compares the time taken by ``configure_logging`` when it exports the
+software environment on every call (as it previously did) against
+using the cached environment snapshot.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script can be executed via the command line as such:
+
+        >>> python benchmark_configure_logging.py --repeats 5
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+"""
+
+import argparse
+import functools
+import logging
+import shutil
+import subprocess
+import tempfile
+import time
+
+from exo_bespin.logging import logging_tools
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=5, help='Number of calls to time')
+    args = parser.parse_args()
+
+    return args
+
+
+def export_environment():
+    """Log the software environment the way ``configure_logging``
+    previously did."""
+
+    environment = subprocess.check_output(['conda', 'env', 'export'], universal_newlines=True)
+    logging.info('Environment:')
+    for line in environment.split('\n'):
+        logging.info(line)
+
+
+def time_configure_logging(log_dir, repeats):
+    """Return the mean time taken by ``configure_logging``.
+
+    Parameters
+    ----------
+    log_dir : str
+        The directory to write log files to
+    repeats : int
+        The number of calls to time
+
+    Returns
+    -------
+    elapsed : float
+        The mean time in seconds
+    """
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        logging_tools.configure_logging('benchmark', log_dir)
+
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+
+    args = _parse_args()
+    log_dir = tempfile.mkdtemp()
+    snapshot_dir = tempfile.mkdtemp()
+    get_environment_snapshot = logging_tools.get_environment_snapshot
+
+    # Before: export the environment on every call
+    logging_tools.get_environment_snapshot = export_environment
+    before = time_configure_logging(log_dir, args.repeats)
+
+    # After: the first call captures the snapshot in the background, later calls hit the cache
+    logging_tools.get_environment_snapshot = functools.partial(get_environment_snapshot, snapshot_dir)
+    first = time_configure_logging(log_dir, 1)
+    get_environment_snapshot(snapshot_dir, wait=True)
+    after = time_configure_logging(log_dir, args.repeats)
+
+    print('{:>28} {:>14}'.format('mode', 'per call (s)'))
+    print('{:>28} {:>14.4f}'.format('export on every call', before))
+    print('{:>28} {:>14.4f}'.format('snapshot (cache miss)', first))
+    print('{:>28} {:>14.4f}'.format('snapshot (cache hit)', after))
+
+    shutil.rmtree(log_dir)
+    shutil.rmtree(snapshot_dir)
@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+
+"""Measures the per-job control-plane overhead of ``aws_tools``: reading
+the AWS configuration, creating ``boto3`` clients and resources, and
+loading the SSH key, with and without the session manager's caching.
+
+No AWS requests are made, so no AWS account is needed.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script can be executed via the command line as such:
+
+        >>> python benchmark_control_plane.py --repeats 20
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import boto3
+import paramiko
+
+from exo_bespin.aws.session_manager import SessionManager
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=20, help='Number of jobs to time')
+    args = parser.parse_args()
+
+    return args
+
+
+def time_job(job, repeats):
+    """Return the mean time taken by the given job.
+
+    Parameters
+    ----------
+    job : func
+        The job to time
+    repeats : int
+        The number of times to run the job
+
+    Returns
+    -------
+    elapsed : float
+        The mean time in seconds
+    """
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        job()
+
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+
+    args = _parse_args()
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    # Write a configuration file and SSH key for the benchmark
+    work_dir = tempfile.mkdtemp()
+    ssh_file = os.path.join(work_dir, 'key.pem')
+    paramiko.RSAKey.generate(2048).write_private_key_file(ssh_file)
+    config_file = os.path.join(work_dir, 'aws_config.json')
+    with open(config_file, 'w') as f:
+        json.dump({'ec2_id': 'lt-021de8b904bc2b728', 'ssh_file': ssh_file}, f)
+
+    # The control-plane work done for a job before the session manager
+    def uncached_job():
+        for _ in range(3):
+            with open(config_file, 'r') as f:
+                json.load(f)
+        boto3.resource('ec2')
+        boto3.resource('ec2')
+        boto3.client('ec2')
+        paramiko.RSAKey.from_private_key_file(ssh_file)
+
+    # The same work through the session manager
+    manager = SessionManager(config_file)
+
+    def cached_job():
+        for _ in range(3):
+            manager.get_config()
+        manager.get_resource('ec2')
+        manager.get_resource('ec2')
+        manager.get_client('ec2')
+        manager.get_key(ssh_file)
+
+    first_job = time_job(cached_job, 1)
+    uncached = time_job(uncached_job, args.repeats)
+    cached = time_job(cached_job, args.repeats)
+
+    print('{:>24} {:>16}'.format('mode', 'per job (ms)'))
+    print('{:>24} {:>16.3f}'.format('uncached', uncached * 1000))
+    print('{:>24} {:>16.3f}'.format('cached (first job)', first_job * 1000))
+    print('{:>24} {:>16.3f}'.format('cached (later jobs)', cached * 1000))
+
+    shutil.rmtree(work_dir)
@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+
+"""Compares the per-job startup overhead of running a retrieval in a
+new ``python`` process against submitting it to the retrieval daemon.
+
+The startup overhead is the time taken to go from a job specification
+on disk to a ``PlatonWrapper`` object that is ready to retrieve.
+Without the daemon, this includes starting the interpreter, importing
+``platon``, ``corner``, and ``matplotlib``, and building a
+``Retriever``.  With the daemon, it includes starting the (standard
+library only) client, and forking the daemon.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script can be executed via the command line as such:
+
+        >>> python benchmark_daemon.py --repeats 5
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+    - ``platon``
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark_job_spec import build_wrapper
+from exo_bespin.atmospheric_retrievals import retrieval_daemon
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=5, help='Number of jobs to time')
+    args = parser.parse_args()
+
+    return args
+
+
+def time_command(command, cwd, repeats):
+    """Return the mean time taken to run the given command.
+
+    Parameters
+    ----------
+    command : list
+        The command to run
+    cwd : str
+        The directory to run the command from
+    repeats : int
+        The number of times to run the command
+
+    Returns
+    -------
+    elapsed : float
+        The mean time in seconds
+    """
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        subprocess.run(command, cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+
+    args = _parse_args()
+    work_dir = tempfile.mkdtemp()
+    socket_path = os.path.join(work_dir, 'daemon.sock')
+    build_wrapper().save_job_spec(work_dir)
+
+    # Without the daemon
+    cold = [sys.executable, '-c', 'from exo_bespin.atmospheric_retrievals.platon_wrapper import PlatonWrapper; '
+                                  'PlatonWrapper.from_job_spec()']
+    cold_time = time_command(cold, work_dir, args.repeats)
+
+    # With the daemon
+    daemon = subprocess.Popen([sys.executable, retrieval_daemon.__file__, 'serve', '--socket', socket_path],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while not retrieval_daemon.ping(socket_path):
+        time.sleep(0.1)
+    client = [sys.executable, retrieval_daemon.__file__, 'submit', 'multinest', '--dry-run', '--socket', socket_path]
+    client_time = time_command(client, work_dir, args.repeats)
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        retrieval_daemon.submit('multinest', work_dir, socket_path, dry_run=True)
+    submit_time = (time.perf_counter() - start) / args.repeats
+    daemon.terminate()
+
+    print('{:>32} {:>14}'.format('mode', 'startup (s)'))
+    print('{:>32} {:>14.3f}'.format('new process', cold_time))
+    print('{:>32} {:>14.3f}'.format('daemon (command line client)', client_time))
+    print('{:>32} {:>14.3f}'.format('daemon (in-process submit)', submit_time))
+
+    shutil.rmtree(work_dir)
@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+
+"""Compares the size and round-trip (write and read) time of the job
+specification used to ship retrievals to an executing machine against
+pickling the whole ``PlatonWrapper`` object.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script can be executed via the command line as such:
+
+        >>> python benchmark_job_spec.py
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+    - ``platon``
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+from exo_bespin.atmospheric_retrievals.examples import get_example_data
+from exo_bespin.atmospheric_retrievals.platon_wrapper import JOB_DATA_FILE, JOB_SPEC_FILE, PlatonWrapper
+from platon.constants import R_sun, R_jup, M_jup
+
+
+def build_wrapper():
+    """Return a ``PlatonWrapper`` object that is ready to perform a
+    retrieval of the ``hd209458b`` example data.
+
+    Returns
+    -------
+    pw : obj
+        A ``PlatonWrapper`` object
+    """
+
+    params = {'Rs': 1.19, 'Mp': 0.73, 'Rp': 1.39, 'T': 1476.81, 'logZ': 0, 'CO_ratio': 0.53,
+              'log_cloudtop_P': 4, 'log_scatt_factor': 0, 'scatt_slope': 4, 'error_multiple': 1}
+
+    pw = PlatonWrapper()
+    pw.set_parameters(params)
+    pw.fit_info.add_gaussian_fit_param('Rs', 0.02*R_sun)
+    pw.fit_info.add_gaussian_fit_param('Mp', 0.04*M_jup)
+    pw.fit_info.add_uniform_fit_param('Rp', 0.9*(1.39 * R_jup), 1.1*(1.39 * R_jup))
+    pw.fit_info.add_uniform_fit_param('T', 300, 3000)
+    pw.fit_info.add_uniform_fit_param("log_scatt_factor", 0, 2)
+    pw.fit_info.add_uniform_fit_param("logZ", -1, 3)
+    pw.fit_info.add_uniform_fit_param("log_cloudtop_P", -0.99, 7)
+    pw.fit_info.add_uniform_fit_param("error_multiple", 0.5, 5)
+    pw.bins, pw.depths, pw.errors = get_example_data('hd209458b')
+
+    return pw
+
+
+def time_pickle(pw, work_dir):
+    """Return the size of, and the time to write and read, a pickled
+    ``PlatonWrapper`` object.
+
+    Parameters
+    ----------
+    pw : obj
+        A ``PlatonWrapper`` object
+    work_dir : str
+        The directory in which to write files
+
+    Returns
+    -------
+    size : int
+        The size of the payload in bytes
+    elapsed : float
+        The round-trip time in seconds
+    """
+
+    filename = os.path.join(work_dir, 'pw.obj')
+
+    start = time.perf_counter()
+    with open(filename, 'wb') as f:
+        pickle.dump(pw, f)
+    with open(filename, 'rb') as f:
+        pickle.load(f)
+    elapsed = time.perf_counter() - start
+
+    return os.path.getsize(filename), elapsed
+
+
+def time_job_spec(pw, work_dir):
+    """Return the size of, and the time to write and read, a job
+    specification.
+
+    The read time includes rebuilding the ``PlatonWrapper`` object,
+    which is what the executing machine has to do in either case.
+
+    Parameters
+    ----------
+    pw : obj
+        A ``PlatonWrapper`` object
+    work_dir : str
+        The directory in which to write files
+
+    Returns
+    -------
+    size : int
+        The size of the payload in bytes
+    elapsed : float
+        The round-trip time in seconds
+    """
+
+    start = time.perf_counter()
+    pw.save_job_spec(work_dir)
+    PlatonWrapper.from_job_spec(work_dir)
+    elapsed = time.perf_counter() - start
+
+    size = sum(os.path.getsize(os.path.join(work_dir, filename)) for filename in [JOB_SPEC_FILE, JOB_DATA_FILE])
+
+    return size, elapsed
+
+
+if __name__ == '__main__':
+
+    work_dir = tempfile.mkdtemp()
+    pw = build_wrapper()
+
+    pickle_size, pickle_time = time_pickle(pw, work_dir)
+    spec_size, spec_time = time_job_spec(pw, work_dir)
+
+    print('{:>10} {:>14} {:>16}'.format('payload', 'size (bytes)', 'round trip (s)'))
+    print('{:>10} {:>14} {:>16.3f}'.format('pickle', pickle_size, pickle_time))
+    print('{:>10} {:>14} {:>16.3f}'.format('job spec', spec_size, spec_time))
+
+    shutil.rmtree(work_dir)
@@ -0,0 +1,150 @@
+#! /usr/bin/env python
+
+"""Compares the size of the results page of a fit, and the time taken
+to build it, when every line of ``lc.dat`` is put into the page (as the
+results view previously did) against serving the light curve from the
+results API, parsed once and downsampled to the width of the plot, for
+synthetic light curves of increasing length.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script can be executed via the command line as such:
+
+        >>> python benchmark_light_curves.py --width 1000
+
+Dependencies
+------------
+
+    - ``django``
+    - ``exo_bespin``
+    - ``numpy``
+"""
+
+import argparse
+import gzip
+import json
+import os
+import time
+
+import django
+import numpy as np
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'exo_bespin.website.bespin_proj.settings')
+django.setup()
+
+from exo_bespin.website.bespin_app import light_curves
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='The numbers of points of the light curves')
+    parser.add_argument('--width', type=int, default=1000, help='The width of the plot, in pixels')
+    args = parser.parse_args()
+
+    return args
+
+
+def make_results(n_points):
+    """Return the contents of a synthetic ``lc.dat`` file.
+
+    Parameters
+    ----------
+    n_points : int
+        The number of points of the light curve
+
+    Returns
+    -------
+    results : str
+        The contents of the file
+    """
+
+    times = np.linspace(-0.1, 0.1, n_points)
+    fluxes = 1 - 0.01 * (np.abs(times) < 0.02) + np.random.normal(0, 1e-4, n_points)
+
+    return ''.join('{:.8f} {:.8f} 0.0001 inst\n'.format(time, flux) for time, flux in zip(times, fluxes))
+
+
+def time_api(results, width):
+    """Return the size of a downsampled, gzipped JSON response of the
+    results API, the time taken to build it from the stored light
+    curve, and the time taken to parse and encode the light curve once.
+
+    Parameters
+    ----------
+    results : str
+        The contents of the ``lc.dat`` file
+    width : int
+        The width of the plot, in pixels
+
+    Returns
+    -------
+    size : int
+        The size of the response in bytes
+    elapsed : float
+        The time taken to build the response, in seconds
+    parse_time : float
+        The time taken to parse and encode the light curve, in seconds
+    """
+
+    start = time.perf_counter()
+    light_curve = light_curves.encode_light_curve(results)
+    parse_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    columns, data, n_rows = light_curves.slice_light_curve(light_curve, width=width)
+    content = {'columns': columns, 'n_rows': n_rows, 'data': dict(zip(columns, data.tolist()))}
+    response = gzip.compress(json.dumps(content).encode('utf-8'))
+
+    return len(response), time.perf_counter() - start, parse_time
+
+
+def time_raw_lines(results):
+    """Return the size of the lines of the results as put into the
+    page, and the time taken to build them.
+
+    Parameters
+    ----------
+    results : str
+        The contents of the ``lc.dat`` file
+
+    Returns
+    -------
+    size : int
+        The size of the lines in bytes
+    elapsed : float
+        The time taken, in seconds
+    """
+
+    start = time.perf_counter()
+    page = str(results.splitlines(True))
+
+    return len(page.encode('utf-8')), time.perf_counter() - start
+
+
+if __name__ == '__main__':
+
+    args = _parse_args()
+
+    print('{:>10} {:>14} {:>12} {:>14} {:>12} {:>14}'.format(
+        'points', 'raw size (B)', 'raw (s)', 'API size (B)', 'API (s)', 'parse once (s)'))
+    for n_points in args.lengths:
+        results = make_results(n_points)
+        raw_size, raw_time = time_raw_lines(results)
+        api_size, api_time, parse_time = time_api(results, args.width)
+        print('{:>10} {:>14} {:>12.4f} {:>14} {:>12.4f} {:>14.4f}'.format(
+            n_points, raw_size, raw_time, api_size, api_time, parse_time))
@@ -0,0 +1,146 @@
+#! /usr/bin/env python
+
+"""Compares the time taken to find the 95th percentile retrieval time
+of a method by scanning every log file against querying the ``sqlite``
+log index, for a directory of synthetic ``jsonl`` log files.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script can be executed via the command line as such:
+
+        >>> python benchmark_log_index.py --files 2000 --records 200
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from exo_bespin.logging.log_index import LogIndex, _percentile
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=2000, help='Number of log files')
+    parser.add_argument('--records', type=int, default=200, help='Number of records per log file')
+    args = parser.parse_args()
+
+    return args
+
+
+def time_scan(log_dir, method, since):
+    """Return the time taken to find the 95th percentile retrieval time
+    by reading every log file.
+
+    Parameters
+    ----------
+    log_dir : str
+        The directory of log files
+    method : str
+        The retrieval method
+    since : float
+        Only include records since this time
+
+    Returns
+    -------
+    elapsed : float
+        The time in seconds
+    p95 : float
+        The 95th percentile
+    """
+
+    start = time.perf_counter()
+    durations = []
+    for filename in os.listdir(log_dir):
+        with open(os.path.join(log_dir, filename), 'r') as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get('stage') == 'retrieve' and record.get('method') == method and \
+                        record['created'] >= since:
+                    durations.append(record['duration'])
+
+    return time.perf_counter() - start, _percentile(sorted(durations), 95)
+
+
+def write_logs(log_dir, n_files, n_records):
+    """Write synthetic log files, with one record in ten being the
+    timing of a retrieval.
+
+    Parameters
+    ----------
+    log_dir : str
+        The directory to write log files to
+    n_files : int
+        The number of log files
+    n_records : int
+        The number of records per log file
+    """
+
+    now = time.time()
+    for file_number in range(n_files):
+        with open(os.path.join(log_dir, 'log_{}.jsonl'.format(file_number)), 'w') as f:
+            created = now - random.uniform(0, 30 * 86400)
+            for record_number in range(n_records):
+                record = {'created': created + record_number, 'level': 'INFO', 'job_id': str(file_number),
+                          'message': 'Some output of the retrieval'}
+                if record_number % 10 == 0:
+                    record.update({'stage': 'retrieve', 'method': random.choice(['emcee', 'multinest']),
+                                   'duration': random.uniform(60, 3600)})
+                f.write(json.dumps(record) + '\n')
+
+
+if __name__ == '__main__':
+
+    args = _parse_args()
+    log_dir = tempfile.mkdtemp()
+    index_dir = tempfile.mkdtemp()
+    write_logs(log_dir, args.files, args.records)
+    since = time.time() - 7 * 86400
+
+    scan_time, scan_p95 = time_scan(log_dir, 'multinest', since)
+
+    with LogIndex(os.path.join(index_dir, 'index.sqlite')) as index:
+        start = time.perf_counter()
+        index.update([log_dir])
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index.update([log_dir])
+        update_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index_p95 = index.percentile('retrieve', 95, method='multinest', since=since)
+        query_time = time.perf_counter() - start
+
+    assert abs(scan_p95 - index_p95) < 1e-6
+
+    print('{:>28} {:>12}'.format('operation', 'time (s)'))
+    print('{:>28} {:>12.4f}'.format('scan every log file', scan_time))
+    print('{:>28} {:>12.4f}'.format('build index', build_time))
+    print('{:>28} {:>12.4f}'.format('update index (no changes)', update_time))
+    print('{:>28} {:>12.4f}'.format('query index', query_time))
+
+    shutil.rmtree(log_dir)
+    shutil.rmtree(index_dir)
@@ -0,0 +1,109 @@
+#! /usr/bin/env python
+
+"""Times small retrievals of the ``hd209458b`` example data over a grid
+of wavelength bins and sampler settings, and calibrates the cost model
+of ``instance_selection`` with the timings.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script can be executed via the command line as such:
+
+        >>> python benchmark_retrieval_cost.py
+
+    The calibrated coefficients are saved to
+    ``~/.exo_bespin/cost_model.json``, where they are picked up by
+    ``instance_selection.estimate_job_time``.
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+    - ``platon``
+"""
+
+import argparse
+import time
+
+from benchmark_job_spec import build_wrapper
+from exo_bespin.aws.instance_selection import COST_MODEL_FILE, calibrate, estimate_job_time
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', type=str, default=COST_MODEL_FILE, help='File to save the coefficients to')
+    args = parser.parse_args()
+
+    return args
+
+
+def time_retrieval(method, bin_step, **kwargs):
+    """Time a retrieval of every ``bin_step``-th bin of the example
+    data.
+
+    Parameters
+    ----------
+    method : str
+        The retrieval method.  Can either be ``emcee`` or
+        ``multinest``.
+    bin_step : int
+        The step between the bins to keep
+    **kwargs
+        Sampler settings: ``n_live`` for ``multinest``, or
+        ``n_walkers`` and ``n_steps`` for ``emcee``
+
+    Returns
+    -------
+    record : dict
+        A benchmark record for ``instance_selection.calibrate``
+    """
+
+    pw = build_wrapper()
+    pw.bins, pw.depths, pw.errors = pw.bins[::bin_step], pw.depths[::bin_step], pw.errors[::bin_step]
+
+    start = time.perf_counter()
+    if method == 'emcee':
+        pw.retriever.run_emcee(pw.bins, pw.depths, pw.errors, pw.fit_info, nwalkers=kwargs['n_walkers'],
+                               nsteps=kwargs['n_steps'])
+    elif method == 'multinest':
+        pw.retriever.run_multinest(pw.bins, pw.depths, pw.errors, pw.fit_info, nlive=kwargs['n_live'])
+    wall_time = time.perf_counter() - start
+
+    return dict(method=method, n_bins=len(pw.bins), n_params=len(pw.fit_info.fit_param_names),
+                wall_time=wall_time, **kwargs)
+
+
+if __name__ == '__main__':
+
+    args = _parse_args()
+
+    records = []
+    for bin_step in [1, 2, 4]:
+        for n_walkers, n_steps in [(20, 50), (40, 100)]:
+            records.append(time_retrieval('emcee', bin_step, n_walkers=n_walkers, n_steps=n_steps))
+        for n_live in [25, 50]:
+            records.append(time_retrieval('multinest', bin_step, n_live=n_live))
+
+    model = calibrate(records, args.output)
+
+    print('{:>10} {:>6} {:>8} {:>12} {:>12}'.format('method', 'bins', 'samples', 'measured (s)', 'model (s)'))
+    for record in records:
+        samples = record.get('n_live') or record['n_walkers'] * record['n_steps']
+        settings = {key: value for key, value in record.items() if key not in ['method', 'wall_time']}
+        print('{:>10} {:>6} {:>8} {:>12.2f} {:>12.2f}'.format(
+            record['method'], record['n_bins'], samples, record['wall_time'],
+            estimate_job_time(record['method'], model=model, **settings)))
+    print('\nSaved coefficients to {}'.format(args.output))
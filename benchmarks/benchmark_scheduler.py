@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+
+"""Benchmarks the end-to-end latency and fan-out throughput of the
+``Scheduler`` using local executors, so that the orchestration overhead
+can be measured without access to AWS.
+
+Each job uploads a small input file, runs a script that sleeps for a
+fixed amount of time, and downloads a small output file.  On a machine
+with enough cores, the throughput should scale with the number of
+executors, and the difference between the latency per job and the job
+compute time is the orchestration overhead.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script can be executed via the command line as such:
+
+        >>> python benchmark_scheduler.py --jobs 50 --executors 1 2 4 8
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+
+from exo_bespin.execution.executors import LocalExecutor
+from exo_bespin.execution.scheduler import Job, Scheduler
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=50, help='Number of jobs to run')
+    parser.add_argument('--executors', type=int, nargs='+', default=[1, 2, 4, 8], help='Numbers of executors to try')
+    parser.add_argument('--job-seconds', type=float, default=0.2, help='Compute time of each job')
+    args = parser.parse_args()
+
+    return args
+
+
+def benchmark(n_jobs, n_executors, job_seconds):
+    """Run ``n_jobs`` jobs on ``n_executors`` local executors and
+    return the scheduler report.
+
+    Parameters
+    ----------
+    n_jobs : int
+        The number of jobs to run
+    n_executors : int
+        The number of executors to run the jobs on
+    job_seconds : float
+        The compute time of each job
+
+    Returns
+    -------
+    report : dict
+        The report returned by ``Scheduler.run``
+    """
+
+    work_dir = tempfile.mkdtemp()
+    input_file = os.path.join(work_dir, 'input.txt')
+    with open(input_file, 'w') as f:
+        f.write('input')
+    job_script = os.path.join(work_dir, 'job.py')
+    with open(job_script, 'w') as f:
+        f.write('import time\ntime.sleep({})\nprint("done")\n'.format(job_seconds))
+
+    scheduler = Scheduler(LocalExecutor, n_executors, database=os.path.join(work_dir, 'jobs.db'),
+                          output_dir=work_dir)
+    for index in range(n_jobs):
+        job = Job('job-{}'.format(index), job_script, args=['> output.txt'], uploads=[input_file],
+                  downloads=['output.txt'])
+        scheduler.submit(job)
+    report = scheduler.run()
+
+    shutil.rmtree(work_dir)
+
+    return report
+
+
+if __name__ == '__main__':
+
+    args = _parse_args()
+    logging.disable(logging.CRITICAL)
+
+    print('{:>9} {:>12} {:>16} {:>16} {:>16}'.format(
+        'executors', 'wall time', 'jobs/second', 'latency/job', 'utilization'))
+    for n_executors in args.executors:
+        report = benchmark(args.jobs, n_executors, args.job_seconds)
+        utilization = sum(report['utilization'].values()) / n_executors
+        latency = report['wall_time'] * n_executors / report['jobs_completed']
+        print('{:>9} {:>11.2f}s {:>16.2f} {:>15.3f}s {:>16.1%}'.format(
+            n_executors, report['wall_time'], report['throughput'], latency, utilization))
@@ -0,0 +1,137 @@
+#! /usr/bin/env python
+
+"""Compares how long users wait for their fits to start when the job
+queue runs the oldest job first (as it previously did) against the
+fair-share scheduler, under a simulated load of one heavy user, who
+submits a large batch at once, and several light users, who submit a
+fit now and then.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script can be executed via the command line as such:
+
+        >>> python benchmark_scheduling.py --capacity 4 --batch-size 200
+
+Dependencies
+------------
+
+    - ``django``
+    - ``exo_bespin``
+"""
+
+import argparse
+import os
+import random
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'exo_bespin.website.bespin_proj.settings')
+django.setup()
+
+from exo_bespin.website.bespin_app import scheduling
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--capacity', type=int, default=4, help='The number of fits run at once')
+    parser.add_argument('--duration', type=float, default=1800, help='The duration of each fit, in seconds')
+    parser.add_argument('--batch-size', type=int, default=200, help='The number of fits of the heavy user')
+    parser.add_argument('--light-users', type=int, default=5, help='The number of light users')
+    parser.add_argument('--interval', type=float, default=3600,
+                        help='The mean number of seconds between the fits of each light user')
+    parser.add_argument('--period', type=float, default=24 * 3600,
+                        help='The number of seconds over which the light users submit fits')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the random load')
+    args = parser.parse_args()
+
+    return args
+
+
+def make_load(batch_size, light_users, interval, period, seed=0):
+    """Return the submissions of a simulated load.
+
+    Parameters
+    ----------
+    batch_size : int
+        The number of fits the heavy user submits at once
+    light_users : int
+        The number of light users
+    interval : float
+        The mean number of seconds between the fits of each light user
+    period : float
+        The number of seconds over which the light users submit fits
+    seed : int
+        The seed of the random submission times
+
+    Returns
+    -------
+    submissions : list
+        The ``(submitted, owner, priority)`` of each fit
+    """
+
+    generator = random.Random(seed)
+    submissions = [(0., 'heavy', 0)] * batch_size
+    for number in range(light_users):
+        submitted = generator.expovariate(1 / interval)
+        while submitted < period:
+            submissions.append((submitted, 'light-{}'.format(number), 0))
+            submitted += generator.expovariate(1 / interval)
+
+    return submissions
+
+
+def time_waits(submissions, capacity, duration, fair_share):
+    """Return the mean and longest waits of the heavy and light users.
+
+    Parameters
+    ----------
+    submissions : list
+        The ``(submitted, owner, priority)`` of each fit
+    capacity : int
+        The number of fits run at once
+    duration : float
+        The duration of each fit, in seconds
+    fair_share : bool
+        Whether to use the fair-share scheduler
+
+    Returns
+    -------
+    waits : dict
+        The ``(mean, longest)`` wait, in seconds, keyed by ``heavy``
+        and ``light``
+    """
+
+    starts = scheduling.simulate(submissions, capacity, duration, fair_share=fair_share)
+    waits = {'heavy': [], 'light': []}
+    for start, (submitted, owner, _) in zip(starts, submissions):
+        waits['heavy' if owner == 'heavy' else 'light'].append(start - submitted)
+
+    return {user: (sum(values) / len(values), max(values)) for user, values in waits.items() if values}
+
+
+if __name__ == '__main__':
+
+    args = _parse_args()
+
+    submissions = make_load(args.batch_size, args.light_users, args.interval, args.period, args.seed)
+    print('{} fits, {} of them from the heavy user, on {} instances'.format(
+        len(submissions), args.batch_size, args.capacity))
+    print('{:>12} {:>8} {:>14} {:>14}'.format('scheduler', 'user', 'mean wait (h)', 'max wait (h)'))
+    for name, fair_share in [('oldest', False), ('fair-share', True)]:
+        for user, (mean, longest) in sorted(time_waits(submissions, args.capacity, args.duration,
+                                                       fair_share).items()):
+            print('{:>12} {:>8} {:>14.2f} {:>14.2f}'.format(name, user, mean / 3600, longest / 3600))
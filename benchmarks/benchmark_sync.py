@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+
+"""Benchmarks the incremental sync of the ``exo_bespin`` repository
+after editing the middle of its largest file, compared to copying the
+whole tree.
+
+Two edits are measured: one that changes a line in place, keeping the
+length of the file, and one that inserts a line.  Files are compared in
+fixed-size blocks (not with rolling checksums, as ``rsync`` does), so
+an insertion shifts, and so resends, every block after it, while an
+edit in place resends only the blocks it touches.
+
+The sync is performed to a local directory, so the benchmark measures
+the bytes that would be sent over the network and the local cost of
+hashing and comparing files.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script can be executed via the command line as such:
+
+        >>> python benchmark_sync.py
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from exo_bespin.aws import aws_tools
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def full_copy(local_dir, remote_dir):
+    """Copy every file of the given directory, as ``transfer_to_ec2``
+    would, and return the number of bytes copied.
+
+    Parameters
+    ----------
+    local_dir : str
+        The directory to copy
+    remote_dir : str
+        The directory to copy to
+
+    Returns
+    -------
+    n_bytes : int
+        The number of bytes copied
+    """
+
+    shutil.rmtree(remote_dir, ignore_errors=True)
+    shutil.copytree(local_dir, remote_dir, ignore=shutil.ignore_patterns(*aws_tools.SYNC_EXCLUDE))
+    n_bytes = sum(os.path.getsize(os.path.join(root, filename))
+                  for root, dirs, files in os.walk(remote_dir) for filename in files)
+
+    return n_bytes
+
+
+def get_largest_file(local_dir):
+    """Return the path of the largest file in the given directory.
+
+    Parameters
+    ----------
+    local_dir : str
+        The directory to search
+
+    Returns
+    -------
+    path : str
+        The path of the largest file
+    """
+
+    paths = [os.path.join(root, filename) for root, dirs, files in os.walk(local_dir) for filename in files]
+
+    return max(paths, key=os.path.getsize)
+
+
+def time_edit(local_dir, remote_dir, filesystem, path, edit):
+    """Apply the given edit to the middle of the given file, and return
+    the stats and duration of the sync that follows.
+
+    Parameters
+    ----------
+    local_dir : str
+        The directory to sync
+    remote_dir : str
+        The directory to sync to
+    filesystem : obj
+        A ``LocalFileSystem`` object
+    path : str
+        The path of the file to edit
+    edit : func
+        A function that takes the contents of the file and the offset
+        of its middle, and returns the new contents
+
+    Returns
+    -------
+    stats : dict
+        The stats of the sync (see ``sync_directory``)
+    duration : float
+        The duration of the sync, in seconds
+    """
+
+    with open(path, 'rb') as f:
+        contents = f.read()
+    with open(path, 'wb') as f:
+        f.write(edit(contents, len(contents) // 2))
+
+    start = time.perf_counter()
+    stats = aws_tools.sync_directory(local_dir, remote_dir, filesystem)
+
+    return stats, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+
+    work_dir = tempfile.mkdtemp()
+    local_dir = os.path.join(work_dir, 'local')
+    remote_dir = os.path.join(work_dir, 'remote')
+    shutil.copytree(REPO_DIR, local_dir, ignore=shutil.ignore_patterns(*aws_tools.SYNC_EXCLUDE))
+    os.mkdir(remote_dir)
+    filesystem = aws_tools.LocalFileSystem()
+
+    start = time.perf_counter()
+    copy_bytes = full_copy(local_dir, os.path.join(work_dir, 'copy'))
+    copy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    initial = aws_tools.sync_directory(local_dir, remote_dir, filesystem)
+    initial_time = time.perf_counter() - start
+
+    # Edit the middle of the largest file, first in place and then by
+    # inserting a line
+    path = get_largest_file(local_dir)
+    in_place, in_place_time = time_edit(local_dir, remote_dir, filesystem, path,
+                                        lambda contents, middle: contents[:middle] + b'#' + contents[middle + 1:])
+    inserted, inserted_time = time_edit(local_dir, remote_dir, filesystem, path,
+                                        lambda contents, middle: contents[:middle] + b'# A new line\n' +
+                                        contents[middle:])
+
+    print('Edited {} ({} bytes, {} byte blocks)'.format(os.path.relpath(path, local_dir), os.path.getsize(path),
+                                                       aws_tools.SYNC_BLOCK_SIZE))
+    print('{:>24} {:>8} {:>12} {:>10}'.format('transfer', 'files', 'bytes', 'time (s)'))
+    print('{:>24} {:>8} {:>12} {:>10.3f}'.format('full copy', '-', copy_bytes, copy_time))
+    print('{:>24} {:>8} {:>12} {:>10.3f}'.format('initial sync', initial['files'], initial['bytes'], initial_time))
+    print('{:>24} {:>8} {:>12} {:>10.3f}'.format('sync after edit in place', in_place['files'], in_place['bytes'],
+                                                 in_place_time))
+    print('{:>24} {:>8} {:>12} {:>10.3f}'.format('sync after inserted line', inserted['files'], inserted['bytes'],
+                                                 inserted_time))
+
+    shutil.rmtree(work_dir)
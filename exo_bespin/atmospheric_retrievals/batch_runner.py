@@ -0,0 +1,339 @@
+#! /usr/bin/env python
+
+"""Runs a batch of atmospheric retrievals concurrently on a single
+machine.
+
+A single retrieval only uses a few cores, so running one retrieval at a
+time leaves most of a large EC2 instance idle.  This module packs
+several retrievals onto one machine: each retrieval is run in its own
+process and its own output directory, with at most ``N`` threads per
+retrieval and at most ``vCPUs // N`` retrievals running at once, so
+that ``jobs x threads per job <= vCPUs``.
+
+On the user's side, ``run_batch`` writes a job specification (see
+``PlatonWrapper.save_job_spec``) for each retrieval into a single
+archive, uploads it to an executing machine, runs this module there,
+and downloads a single archive containing the results of every
+retrieval, along with the return code of each.  ``run_batch`` raises
+an error naming the retrievals that failed, once the results of the
+others have been saved.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    Users can run a batch of retrievals with an executor as such:
+    ::
+
+        from exo_bespin.atmospheric_retrievals.batch_runner import run_batch
+        from exo_bespin.execution.executors import get_executor
+
+        wrappers = {'hd209458b': pw1, 'wasp-39b': pw2}
+        run_batch(get_executor('ec2'), wrappers, 'multinest', threads_per_job=2)
+
+    This will create ``hd209458b/`` and ``wasp-39b/`` directories
+    containing the results of each retrieval.
+
+    On the executing machine, this module is run via the command line
+    as such:
+
+        >>> python batch_runner.py multinest --archive batch.tar.gz --threads-per-job 2
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+
+from exo_bespin.logging.queue_logging import LogListener
+
+BATCH_ARCHIVE = 'batch.tar.gz'
+BATCH_DIR = 'batch'
+BATCH_LOG = 'batch.log'
+RESULTS_ARCHIVE = 'batch_results.tar.gz'
+RETURN_CODES_FILE = 'return_codes.json'
+PLATON_WRAPPER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'platon_wrapper.py')
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+
+def _extract(archive, path='.'):
+    """Extract the given archive into the given directory, refusing
+    members that are not regular files or directories, or that would be
+    written outside of it.
+
+    Parameters
+    ----------
+    archive : str
+        The path of the archive
+    path : str
+        The directory to extract the archive into
+    """
+
+    with tarfile.open(archive, 'r:gz') as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(path, filter='data')
+            return
+
+        # Versions of Python without extraction filters
+        root = os.path.realpath(path)
+        for member in tar.getmembers():
+            destination = os.path.realpath(os.path.join(root, member.name))
+            if not (member.isfile() or member.isdir()) or os.path.commonpath([root, destination]) != root:
+                raise tarfile.TarError('Refusing to extract {}'.format(member.name))
+        tar.extractall(path)
+
+
+def _get_vcpus():
+    """Return the number of vCPUs available to this process.
+
+    Returns
+    -------
+    vcpus : int
+        The number of available vCPUs
+    """
+
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('method', type=str, help='Retrieval method (either "emcee" or "multinest"')
+    parser.add_argument('--archive', type=str, default=BATCH_ARCHIVE, help='Archive of job specifications')
+    parser.add_argument('--threads-per-job', type=int, default=1, help='Number of threads used by each retrieval')
+    args = parser.parse_args()
+
+    return args
+
+
+def archive_results(job_dirs, archive, log_file=None, return_codes=None):
+    """Write the outputs of every job into a single archive.  The job
+    specifications themselves are not included.
+
+    Parameters
+    ----------
+    job_dirs : list
+        The job directories
+    archive : str
+        The path of the archive to write
+    log_file : str
+        The combined log file of the batch, if any, which is added to
+        the top level of the archive
+    return_codes : dict
+        The return code of each retrieval, keyed by job directory (see
+        ``run_jobs``), if any, which are added to the top level of the
+        archive as a JSON file, keyed by job ID
+    """
+
+    with tarfile.open(archive, 'w:gz') as tar:
+        if log_file is not None and os.path.exists(log_file):
+            tar.add(log_file, arcname=os.path.basename(log_file))
+        if return_codes is not None:
+            contents = json.dumps({os.path.basename(job_dir): return_code
+                                   for job_dir, return_code in return_codes.items()}).encode('utf-8')
+            info = tarfile.TarInfo(RETURN_CODES_FILE)
+            info.size = len(contents)
+            tar.addfile(info, io.BytesIO(contents))
+        for job_dir in job_dirs:
+            for root, dirs, files in os.walk(job_dir):
+                for filename in files:
+                    if filename in ['job.json', 'job.npz']:
+                        continue
+                    path = os.path.join(root, filename)
+                    tar.add(path, arcname=os.path.relpath(path, os.path.dirname(job_dir)))
+
+
+def get_concurrency(threads_per_job, vcpus=None):
+    """Return the number of jobs that can run at once such that
+    ``jobs x threads per job <= vCPUs``.
+
+    Parameters
+    ----------
+    threads_per_job : int
+        The number of threads used by each job
+    vcpus : int
+        The number of vCPUs.  Defaults to the number available to this
+        process.
+
+    Returns
+    -------
+    concurrency : int
+        The number of concurrent jobs (at least 1)
+    """
+
+    vcpus = vcpus or _get_vcpus()
+
+    return max(1, vcpus // threads_per_job)
+
+
+def run_batch(executor, wrappers, method, threads_per_job=1, output_dir='.'):
+    """Run several retrievals concurrently on one executing machine.
+
+    Parameters
+    ----------
+    executor : obj
+        An un-booted ``Executor`` object.  It is booted before, and
+        released after, running the batch.
+    wrappers : dict
+        ``PlatonWrapper`` objects with their parameters, priors, and
+        data set, keyed by a unique job ID
+    method : str
+        The retrieval method.  Can either be ``emcee`` or
+        ``multinest``.
+    threads_per_job : int
+        The number of threads used by each retrieval
+    output_dir : str
+        The directory in which per-job results directories are created
+
+    Returns
+    -------
+    output : list
+        The lines of standard output from running the batch
+
+    Raises
+    ------
+    RuntimeError
+        If any retrieval failed, once the results of every retrieval
+        have been saved
+    """
+
+    assert method in ['multinest', 'emcee'], 'Unrecognized method: {}'.format(method)
+
+    # Write all of the job specifications into a single archive
+    work_dir = tempfile.mkdtemp()
+    for job_id, pw in wrappers.items():
+        job_dir = os.path.join(work_dir, BATCH_DIR, job_id)
+        os.makedirs(job_dir)
+        pw.save_job_spec(job_dir)
+    archive = os.path.join(work_dir, BATCH_ARCHIVE)
+    with tarfile.open(archive, 'w:gz') as tar:
+        tar.add(os.path.join(work_dir, BATCH_DIR), arcname=BATCH_DIR)
+
+    with executor:
+        executor.upload(archive)
+        output, errors = executor.run_python('exo_bespin/atmospheric_retrievals/batch_runner.py', method,
+                                             '--threads-per-job', threads_per_job)
+        for line in output + errors:
+            logging.info(line)
+        executor.download(RESULTS_ARCHIVE, work_dir)
+
+    _extract(os.path.join(work_dir, RESULTS_ARCHIVE), output_dir)
+    shutil.rmtree(work_dir)
+
+    logging.info('Results of {} retrievals saved to {}'.format(len(wrappers), output_dir))
+
+    # Report the retrievals that failed, or whose return code is missing
+    return_codes_file = os.path.join(output_dir, RETURN_CODES_FILE)
+    return_codes = {}
+    if os.path.exists(return_codes_file):
+        with open(return_codes_file, 'r') as f:
+            return_codes = json.load(f)
+    failed = sorted(job_id for job_id in wrappers if return_codes.get(job_id) != 0)
+    for job_id in failed:
+        logging.error('Retrieval {} failed with return code {} (see {})'.format(
+            job_id, return_codes.get(job_id), os.path.join(output_dir, job_id, 'output.log')))
+    if failed:
+        raise RuntimeError('{} of {} retrievals failed: {}'.format(len(failed), len(wrappers), ', '.join(failed)))
+
+    return output
+
+
+def run_jobs(job_dirs, method, threads_per_job=1, script=PLATON_WRAPPER_SCRIPT, log_file=BATCH_LOG):
+    """Run one retrieval per job directory, packing as many concurrent
+    retrievals onto this machine as its vCPUs allow.
+
+    Each retrieval is run from within its job directory, so its outputs
+    are written there, and its standard output and error are saved to
+    an ``output.log`` file there.  The log records of every retrieval
+    are written to a single log file by a log listener (see
+    ``queue_logging``), tagged with the job directory and the worker
+    that ran it.
+
+    Parameters
+    ----------
+    job_dirs : list
+        Directories that each contain a job specification
+    method : str
+        The retrieval method.  Can either be ``emcee`` or
+        ``multinest``.
+    threads_per_job : int
+        The number of threads used by each retrieval
+    script : str
+        The script that performs a retrieval from the job
+        specification in the current directory
+    log_file : str
+        The combined log file of the batch
+
+    Returns
+    -------
+    return_codes : dict
+        The return code of each retrieval, keyed by job directory
+    """
+
+    concurrency = get_concurrency(threads_per_job)
+    logging.info('Running {} jobs, {} at a time with {} threads each'.format(len(job_dirs), concurrency,
+                                                                               threads_per_job))
+
+    env = dict(os.environ, **{variable: str(threads_per_job) for variable in THREAD_VARIABLES})
+
+    def run_job(job_dir):
+        job_env = dict(env, **listener.worker_environment(os.path.basename(job_dir),
+                                                          threading.current_thread().name))
+        with open(os.path.join(job_dir, 'output.log'), 'w') as log:
+            process = subprocess.run([sys.executable, script, method], cwd=job_dir, env=job_env,
+                                     stdout=log, stderr=subprocess.STDOUT)
+        logging.info('Job {} finished with return code {}'.format(job_dir, process.returncode))
+        return process.returncode
+
+    with LogListener(log_file) as listener, ThreadPoolExecutor(max_workers=concurrency,
+                                                             thread_name_prefix='worker') as pool:
+        return_codes = dict(zip(job_dirs, pool.map(run_job, job_dirs)))
+
+    return return_codes
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO,
+                        stream=sys.stdout)
+
+    # Parse arguments
+    args = _parse_args()
+
+    # Unpack the job specifications, replacing those of any previous batch
+    shutil.rmtree(BATCH_DIR, ignore_errors=True)
+    _extract(args.archive)
+    job_dirs = sorted(os.path.join(BATCH_DIR, job_id) for job_id in os.listdir(BATCH_DIR))
+
+    # Do the retrievals
+    return_codes = run_jobs(job_dirs, args.method, args.threads_per_job)
+
+    # Collect all of the results, and their return codes, into a single archive
+    archive_results(job_dirs, RESULTS_ARCHIVE, BATCH_LOG, return_codes)
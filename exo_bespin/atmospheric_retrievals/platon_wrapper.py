@@ -73,18 +73,46 @@ Use
         # Save a plot of the results
         pw.make_plot()
 
+    To find out where a slow retrieval spends its time, create the
+    ``PlatonWrapper`` with ``profile=True`` (or set the
+    ``EXO_BESPIN_PROFILE`` environment variable).  The retrieval is then
+    run under a sampling profiler, and a ``<method>_profile.folded``
+    file of collapsed stacks, from which a flamegraph can be made, is
+    saved next to the results (and fetched back when processing
+    remotely).
+
+    Passing ``track_memory=True`` logs the peak memory of each stage,
+    and the lines of code that allocated the most memory (which slows
+    down the stages).  Passing ``memory_budget`` (in MB, or setting the
+    ``EXO_BESPIN_MEMORY_BUDGET`` environment variable) logs the peak
+    memory of each stage, and makes a stage fail with a
+    ``MemoryBudgetError`` as soon as it exceeds the budget (or, if the
+    ``PlatonWrapper`` is used outside the main thread, once the stage
+    finishes; see ``MemoryTracker``).
+
+    When processing remotely (see ``use_aws`` and ``use_executor``),
+    the retrieval is shipped to the executing machine as a small job
+    specification rather than as a pickled ``PlatonWrapper`` object:
+    a ``job.json`` file containing the parameters and priors, and a
+    ``job.npz`` file containing the bins, depths, and errors.  The
+    ``PlatonWrapper`` is rebuilt from these files on the executing
+    machine via ``PlatonWrapper.from_job_spec``.
+
 Dependencies
 ------------
 
     - ``corner``
     - ``exo_bespin``
     - ``matplotlib``
+    - ``numpy``
     - ``platon``
 """
 
 import argparse
 import datetime
+import functools
 import getpass
+import json
 import logging
 import os
 import pickle
@@ -94,15 +122,27 @@ import time
 
 import corner
 import matplotlib
+import numpy as np
 from platon.retriever import Retriever
 from platon.constants import R_sun, R_jup, M_jup
 
-from exo_bespin.aws.aws_tools import build_environment
-from exo_bespin.aws.aws_tools import log_output
-from exo_bespin.aws.aws_tools import start_ec2
-from exo_bespin.aws.aws_tools import stop_ec2
-from exo_bespin.aws.aws_tools import transfer_from_ec2
-from exo_bespin.aws.aws_tools import transfer_to_ec2
+from exo_bespin.atmospheric_retrievals.retrieval_daemon import DAEMON_SCRIPT
+from exo_bespin.atmospheric_retrievals.retrieval_daemon import start_daemon
+from exo_bespin.atmospheric_retrievals.retrieval_daemon import stop_daemon
+from exo_bespin.aws.aws_tools import find_environment_image
+from exo_bespin.aws.aws_tools import log_telemetry
+from exo_bespin.execution.executors import CommandError, EC2Executor
+from exo_bespin.execution.pipeline import Pipeline
+from exo_bespin.execution.scheduler import Job
+from exo_bespin.execution.telemetry import TELEMETRY_FILE, TELEMETRY_SCRIPT
+from exo_bespin.logging import profiling, queue_logging, tracing
+from exo_bespin.logging.logging_tools import LOG_FORMAT_VARIABLE, MemoryTracker, create_file_handler
+
+JOB_SPEC_FILE = 'job.json'
+JOB_DATA_FILE = 'job.npz'
+PROFILE_FILE = '{}_profile.folded'
+REMOTE_JOB_DIR = 'retrieval'
+TRACE_FILE = 'trace.json'
 
 
 def _apply_factors(params):
@@ -122,13 +162,47 @@ def _apply_factors(params):
     return params
 
 
-def _log_execution_time(start_time):
-    """Logs the execution time of the retrieval.
+def _get_fit_params(fit_info):
+    """Return a JSON-serializable description of the parameters that
+    are being fit for and their priors.
+
+    Parameters
+    ----------
+    fit_info : obj
+        A ``platon.fit_info.FitInfo`` object
+
+    Returns
+    -------
+    fit_params : list
+        A list of dictionaries, one per fit parameter, containing the
+        name of the parameter, the type of prior (``gaussian`` or
+        ``uniform``), and the values needed to recreate the prior.
+    """
+
+    fit_params = []
+    for name in fit_info.fit_param_names:
+        param = fit_info.all_params[name]
+        fit_param = {'name': name, 'low_guess': float(param.low_guess), 'high_guess': float(param.high_guess)}
+        if hasattr(param, 'std'):
+            fit_param.update({'prior': 'gaussian', 'std': float(param.std)})
+        else:
+            fit_param.update({'prior': 'uniform', 'low_lim': float(param.low_lim), 'high_lim': float(param.high_lim)})
+        fit_params.append(fit_param)
+
+    return fit_params
+
+
+def _log_execution_time(start_time, method):
+    """Logs the execution time of the retrieval.  The record carries
+    the ``retrieve`` stage, the method, and the duration in seconds, for
+    structured (``jsonl``) log files.
 
     Parameters
     ----------
     start_time : obj
         The start time of the retrieval execution
+    method : str
+        The method of the retrieval
     """
 
     end_time = time.time()
@@ -136,7 +210,8 @@ def _log_execution_time(start_time):
     # Log execution time
     hours, remainder_time = divmod(end_time - start_time, 60 * 60)
     minutes, seconds = divmod(remainder_time, 60)
-    logging.info('Retrieval Execution Time: {}:{}:{}'.format(int(hours), int(minutes), int(seconds)))
+    logging.info('Retrieval Execution Time: {}:{}:{}'.format(int(hours), int(minutes), int(seconds)),
+                 extra={'stage': 'retrieve', 'method': method, 'duration': end_time - start_time})
 
 
 def _parse_args():
@@ -150,11 +225,39 @@ def _parse_args():
 
     parser = argparse.ArgumentParser()
     parser.add_argument('method', type=str, help='Retrieval method (either "emcee" or "multinest"')
+    parser.add_argument('--job-dir', type=str, default='.', help='Directory containing the job specification')
     args = parser.parse_args()
 
     return args
 
 
+def _track_memory(method):
+    """Decorator to log the memory use of a ``PlatonWrapper`` method,
+    and to enforce the object's memory budget (see ``MemoryTracker``),
+    if either is asked for.
+
+    Parameters
+    ----------
+    method : func
+        The method to track
+
+    Returns
+    -------
+    wrapped : func
+        The wrapped method
+    """
+
+    @functools.wraps(method)
+    def wrapped(self, *args, **kwargs):
+        tracker = MemoryTracker(method.__name__, self.memory_budget, trace_allocations=self.track_memory)
+        if not self.track_memory and tracker.budget_mb is None:
+            return method(self, *args, **kwargs)
+        with tracker:
+            return method(self, *args, **kwargs)
+
+    return wrapped
+
+
 def _validate_parameters(supplied_params):
     """Ensure the supplied parameters are valid.  Throw assertion
     errors if they are not.
@@ -195,22 +298,48 @@ class PlatonWrapper():
     """Class object for running the platon atmospheric retrieval
     software."""
 
-    def __init__(self):
-        """Initialize the class object."""
+    def __init__(self, retriever=None, profile=None, memory_budget=None, track_memory=False):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        retriever : obj
+            A ``platon.retriever.Retriever`` object to use.  A new one
+            is created if not provided.
+        profile : bool
+            Whether to profile the retrieval.  Defaults to whether the
+            ``EXO_BESPIN_PROFILE`` environment variable is set.
+        memory_budget : float
+            The memory budget of each stage (``set_parameters``,
+            ``retrieve``, ``save_results``, and ``make_plot``), in MB
+            of resident memory.  A stage that exceeds it is stopped
+            with a ``MemoryBudgetError``.  Defaults to the
+            ``EXO_BESPIN_MEMORY_BUDGET`` environment variable, if set.
+        track_memory : bool
+            Whether to log the peak memory of each stage and the lines
+            of code that allocated the most memory during it
+        """
 
         self.ec2_id = ''
         self.output_results = 'results.dat'
         self.output_plot = 'corner.png'
-        self.retriever = Retriever()
+        self.retriever = retriever or Retriever()
         self.ssh_file = ''
         self.aws = False
+        self.executor = None
+        self.daemon = False
+        self.profile = profiling.profiling_enabled() if profile is None else profile
+        self.memory_budget = memory_budget
+        self.track_memory = track_memory
         self._configure_logging()
 
     def _configure_logging(self):
         """Creates a log file that logs the execution of the script.
 
         Log files are written to a ``logs/`` subdirectory within the
-        current working directory.
+        current working directory, unless the ``EXO_BESPIN_LOG_ADDRESS``
+        environment variable is set, in which case records are sent to
+        the log listener at that address (see ``queue_logging``).
 
         Returns
         -------
@@ -218,23 +347,27 @@ class PlatonWrapper():
             The start time of the script execution
         """
 
-        # Define save location
-        log_file = 'logs/{}.log'.format(datetime.datetime.now().strftime('%Y-%m-%d-%H-%M'))
+        # Send records to the log listener of a parallel run, if any
+        if os.environ.get(queue_logging.LOG_ADDRESS_VARIABLE):
+            queue_logging.configure_queue_logging()
+        else:
+
+            # Define save location
+            log_format = os.environ.get(LOG_FORMAT_VARIABLE, 'text')
+            extension = 'jsonl' if log_format == 'jsonl' else 'log'
+            log_file = 'logs/{}.{}'.format(datetime.datetime.now().strftime('%Y-%m-%d-%H-%M'), extension)
 
-        # Create the subdirectory if necessary
-        if not os.path.exists('logs/'):
-            os.mkdir('logs/')
+            # Create the subdirectory if necessary
+            if not os.path.exists('logs/'):
+                os.mkdir('logs/')
 
-        # Make sure no other root handlers exist before configuring the logger
-        for handler in logging.root.handlers[:]:
-            logging.root.removeHandler(handler)
+            # Make sure no other root handlers exist before configuring the logger
+            for handler in logging.root.handlers[:]:
+                logging.root.removeHandler(handler)
 
-        # Create the log file
-        logging.basicConfig(filename=log_file,
-                            format='%(asctime)s %(levelname)s: %(message)s',
-                            datefmt='%m/%d/%Y %H:%M:%S %p',
-                            level=logging.INFO)
-        print('Log file initialized to {}'.format(log_file))
+            # Create the log file
+            logging.basicConfig(handlers=[create_file_handler(log_file, log_format)], level=logging.INFO)
+            print('Log file initialized to {}'.format(log_file))
 
         # Log environment information
         logging.info('User: ' + getpass.getuser())
@@ -244,6 +377,56 @@ class PlatonWrapper():
 
         self.start_time = time.time()
 
+    @classmethod
+    @tracing.trace()
+    def from_job_spec(cls, job_dir='.', retriever=None):
+        """Rebuild a ``PlatonWrapper`` object from a job specification
+        written by ``save_job_spec``.
+
+        Parameters
+        ----------
+        job_dir : str
+            The directory containing the ``job.json`` and ``job.npz``
+            files
+        retriever : obj
+            A ``platon.retriever.Retriever`` object to use.  A new one
+            is created if not provided.
+
+        Returns
+        -------
+        pw : obj
+            A ``PlatonWrapper`` object that is ready to ``retrieve``
+        """
+
+        with open(os.path.join(job_dir, JOB_SPEC_FILE), 'r') as f:
+            spec = json.load(f)
+
+        pw = cls(retriever, profile=spec.get('profile'), memory_budget=spec.get('memory_budget'),
+                 track_memory=spec.get('track_memory', False))
+        logging.info('Read job specification from {}'.format(job_dir))
+
+        # Parameters have already been validated and had factors applied
+        pw.params = spec['params']
+        pw.fit_info = pw.retriever.get_default_fit_info(**pw.params)
+        for fit_param in spec['fit_params']:
+            if fit_param['prior'] == 'gaussian':
+                pw.fit_info.add_gaussian_fit_param(fit_param['name'], fit_param['std'],
+                                                   fit_param['low_guess'], fit_param['high_guess'])
+            elif fit_param['prior'] == 'uniform':
+                pw.fit_info.add_uniform_fit_param(fit_param['name'], fit_param['low_lim'], fit_param['high_lim'],
+                                                  fit_param['low_guess'], fit_param['high_guess'])
+
+        data = np.load(os.path.join(job_dir, JOB_DATA_FILE))
+        pw.bins = data['bins']
+        pw.depths = data['depths']
+        pw.errors = data['errors']
+        if 'wavelengths' in data:
+            pw.wavelengths = data['wavelengths']
+
+        return pw
+
+    @tracing.trace()
+    @_track_memory
     def make_plot(self):
         """Create a corner plot that shows the results of the retrieval."""
 
@@ -267,6 +450,8 @@ class PlatonWrapper():
         print('Corner plot saved to {}'.format(self.output_plot))
         logging.info('Corner plot saved to {}'.format(self.output_plot))
 
+    @tracing.trace()
+    @_track_memory
     def retrieve(self, method):
         """Perform the atmopsheric retrieval via the given method
 
@@ -282,49 +467,68 @@ class PlatonWrapper():
         # Ensure that the method parameter is valid
         assert method in ['multinest', 'emcee'], 'Unrecognized method: {}'.format(method)
         self.method = method
-
-        # For processing on AWS
-        if self.aws:
-
-            # Start or create an EC2 instance
-            instance, key, client = start_ec2(self.ssh_file, self.ec2_id)
-
-            # Build the environment on EC2 instance if necessary
-            if self.build_required:
-                build_environment(instance, key, client)
-
-            # Transfer object file to EC2
-            transfer_to_ec2(instance, key, client, 'pw.obj')
-
-            # Connect to the EC2 instance and run commands
-            command = './exo_bespin/exo_bespin/aws/exo_bespin-env-init.sh python exo_bespin/exo_bespin/atmospheric_retrievals/platon_wrapper.py {}'.format(self.method)
-            client.connect(hostname=instance.public_dns_name, username='ec2-user', pkey=key)
-            stdin, stdout, stderr = client.exec_command(command)
-            output = stdout.read()
-            errors = stderr.read()
-            log_output(output)
-            log_output(errors)
-
-            # Trasfer output products from EC2 to user
+        start_time = time.time()
+
+        # For processing on AWS or another execution backend
+        if self.executor is not None:
+
+            # Run the retrieval, either via the retrieval daemon or a new
+            # process, sampling its resource use alongside it.  The daemon's
+            # child process that runs the retrieval samples itself, as the
+            # submitting client only waits for it.
+            telemetry_file = '{}/{}'.format(REMOTE_JOB_DIR, TELEMETRY_FILE)
+            script = 'exo_bespin/atmospheric_retrievals/platon_wrapper.py'
+            args = [self.method, '--job-dir', REMOTE_JOB_DIR]
+            if self.daemon:
+                script, args = DAEMON_SCRIPT, ['submit'] + args + ['--telemetry', telemetry_file]
+            else:
+                script, args = TELEMETRY_SCRIPT, ['--output', telemetry_file, script] + args
             if self.method == 'emcee':
-                transfer_from_ec2(instance, key, client, 'emcee_results.obj')
-                transfer_from_ec2(instance, key, client, 'emcee_corner.png')
+                outputs = ['emcee_results.obj', 'emcee_corner.png']
             elif self.method == 'multinest':
-                transfer_from_ec2(instance, key, client, 'multinest_results.dat')
-                transfer_from_ec2(instance, key, client, 'multinest_corner.png')
-
-            # Terminate or stop the EC2 instance
-            stop_ec2(self.ec2_id, instance)
+                outputs = ['multinest_results.dat', 'multinest_corner.png']
+            outputs.extend([TELEMETRY_FILE, TRACE_FILE])
+            if self.profile:
+                outputs.append(PROFILE_FILE.format(self.method))
+
+            # The job specification is written while the executing machine boots
+            job = Job(REMOTE_JOB_DIR, script, args, prepare=self.save_job_spec,
+                      uploads=[(filename, '{}/{}'.format(REMOTE_JOB_DIR, filename))
+                               for filename in [JOB_SPEC_FILE, JOB_DATA_FILE]],
+                      downloads=['{}/{}'.format(REMOTE_JOB_DIR, filename) for filename in outputs])
+            pipeline = Pipeline(self.executor, setup=start_daemon if self.daemon else None,
+                                teardown=stop_daemon if self.daemon else None)
+            try:
+                output, errors = pipeline.run([job])[job.job_id]
+            except CommandError as error:
+                for line in error.output + error.errors:
+                    logging.error(line)
+                raise
+            for line in output + errors:
+                logging.info(line)
+            log_telemetry(TELEMETRY_FILE)
+
+            # Add the spans of the remote retrieval to the local trace
+            if os.path.exists(TRACE_FILE):
+                tracing.load_json(TRACE_FILE)
+
+            # Raise any error releasing the executing machine, which
+            # may otherwise be left running
+            pipeline.wait()
 
         # For processing locally
         else:
-            if self.method == 'emcee':
-                self.result = self.retriever.run_emcee(self.bins, self.depths, self.errors, self.fit_info)
-            elif self.method == 'multinest':
-                self.result = self.retriever.run_multinest(self.bins, self.depths, self.errors, self.fit_info, plot_best=False)
+            with tracing.span('platon.run_{}'.format(self.method), n_bins=len(self.bins)), \
+                    profiling.profile(PROFILE_FILE.format(self.method), enabled=self.profile):
+                if self.method == 'emcee':
+                    self.result = self.retriever.run_emcee(self.bins, self.depths, self.errors, self.fit_info)
+                elif self.method == 'multinest':
+                    self.result = self.retriever.run_multinest(self.bins, self.depths, self.errors, self.fit_info, plot_best=False)
 
-        _log_execution_time(self.start_time)
+        _log_execution_time(start_time, self.method)
 
+    @tracing.trace()
+    @_track_memory
     def save_results(self):
         """Save the results of the retrieval to an output file."""
 
@@ -344,6 +548,35 @@ class PlatonWrapper():
         print('Results file saved to {}'.format(self.output_results))
         logging.info('Results file saved to {}'.format(self.output_results))
 
+    @tracing.trace()
+    def save_job_spec(self, job_dir='.'):
+        """Write a job specification from which the retrieval can be
+        rebuilt (see ``from_job_spec``).
+
+        The parameters and priors are written to a ``job.json`` file,
+        and the bins, depths, and errors are written to a ``job.npz``
+        file.
+
+        Parameters
+        ----------
+        job_dir : str
+            The directory in which to write the files
+        """
+
+        spec = {'params': self.params, 'fit_params': _get_fit_params(self.fit_info), 'profile': self.profile,
+                'memory_budget': self.memory_budget, 'track_memory': self.track_memory}
+        with open(os.path.join(job_dir, JOB_SPEC_FILE), 'w') as f:
+            json.dump(spec, f, indent=4)
+
+        data = {'bins': np.asarray(self.bins), 'depths': np.asarray(self.depths), 'errors': np.asarray(self.errors)}
+        if hasattr(self, 'wavelengths'):
+            data['wavelengths'] = np.asarray(self.wavelengths)
+        np.savez(os.path.join(job_dir, JOB_DATA_FILE), **data)
+
+        print('Saved job specification to {}'.format(job_dir))
+        logging.info('Saved job specification to {}'.format(job_dir))
+
+    @_track_memory
     def set_parameters(self, params):
         """Set necessary parameters to perform the retrieval.
 
@@ -387,29 +620,50 @@ class PlatonWrapper():
         self.ssh_file = ssh_file
         self.ec2_id = ec2_id
 
-        # If the ec2_id is a template ID, then building the instance is required
+        # If the ec2_id is a template ID without a pre-built environment
+        # image, then building the instance is required
         if ec2_id.split('-')[0] == 'lt':
-            self.build_required = True
+            self.build_required = find_environment_image(ec2_id) is None
         else:
             self.build_required = False
 
-        # Write out object to file
-        with open('pw.obj', 'wb') as f:
-            pickle.dump(self, f)
-        print('Saved PlatonWrapper object to pw.obj')
-        logging.info('Saved PlatonWrapper object to pw.obj')
-
+        self.use_executor(EC2Executor(ssh_file, ec2_id, build_environment=self.build_required))
         self.aws = True
 
+    def use_executor(self, executor, daemon=False):
+        """Sets the execution backend used to perform processing (e.g.
+        a ``LocalExecutor``, ``SSHExecutor``, or ``EC2Executor``; see
+        the ``exo_bespin.execution.executors`` module).
+
+        Parameters
+        ----------
+        executor : obj
+            An ``Executor`` object.
+        daemon : bool
+            Whether to submit the retrieval to a persistent retrieval
+            daemon on the executing machine (see the
+            ``retrieval_daemon`` module) rather than starting a new
+            process.  This avoids reloading the retrieval software for
+            every job on executing machines that run several
+            retrievals at once.  The daemon is stopped once the last
+            of them is released.
+        """
+
+        print('Using {} executor for processing'.format(executor.name))
+        logging.info('Using {} executor for processing'.format(executor.name))
+
+        self.executor = executor
+        self.daemon = daemon
+
 
 if __name__ == '__main__':
 
-    # Parse arguments
+    # Parse arguments, and work from within the job directory
     args = _parse_args()
+    os.chdir(args.job_dir)
 
-    # Read in PlatonWrapper object
-    with open('pw.obj', 'rb') as f:
-        pw = pickle.load(f)
+    # Rebuild PlatonWrapper object from the job specification
+    pw = PlatonWrapper.from_job_spec()
 
     # Do some retrievals
     pw.retrieve(args.method)
@@ -419,3 +673,6 @@ if __name__ == '__main__':
 
     # Make corner plot of results
     pw.make_plot()
+
+    # Save the timings of the retrieval, to be fetched with the results
+    tracing.export_json(TRACE_FILE)
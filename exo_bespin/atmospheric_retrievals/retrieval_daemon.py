@@ -0,0 +1,529 @@
+#! /usr/bin/env python
+
+"""A long-lived worker process that performs atmospheric retrievals
+from job specifications.
+
+Running ``platon_wrapper.py`` for every retrieval means activating the
+``conda`` environment, importing ``platon``, ``corner``, and
+``matplotlib``, and building a ``platon`` ``Retriever`` (which loads
+its data tables) every time.  The daemon does all of this once, then
+listens on a local UNIX socket for job submissions.  Each submitted job
+is run in a child process forked from the daemon, so it starts with
+everything already loaded, and a failing job cannot take the daemon
+down with it.
+
+Requests and replies are single lines of JSON.  The client side of
+this module only uses the standard library, so submitting a job is
+cheap.
+
+The daemon answers a ``ping`` with a fingerprint of the code it
+loaded, so that a daemon left running from before the code on the
+executing machine changed is restarted rather than reused.  Executors
+that use the daemon attach to it, and detach when they are released;
+the daemon stops, once its running jobs have finished, when the last
+one detaches.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    On the executing machine, the daemon is started via the command
+    line as such:
+
+        >>> python retrieval_daemon.py serve
+
+    Jobs are then submitted from within a directory containing a job
+    specification (see ``PlatonWrapper.save_job_spec``) as such:
+
+        >>> python retrieval_daemon.py submit multinest
+
+    From the user's machine, the daemon can be used by passing
+    ``daemon=True`` to ``PlatonWrapper.use_executor``, which starts the
+    daemon on the executing machine if it is not already running (see
+    ``start_daemon``), and stops it when the executing machine is
+    released (see ``stop_daemon``).
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+    - ``platon`` (``serve`` only)
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from exo_bespin.execution import telemetry
+from exo_bespin.logging import tracing
+
+DAEMON_SCRIPT = 'exo_bespin/atmospheric_retrievals/retrieval_daemon.py'
+DAEMON_SOCKET = os.path.join(os.path.expanduser('~'), '.exo_bespin_daemon.sock')
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('task', type=str, choices=['serve', 'submit', 'ping', 'attach', 'detach', 'stop'],
+                        help='Task to perform')
+    parser.add_argument('method', type=str, nargs='?', help='Retrieval method (either "emcee" or "multinest"')
+    parser.add_argument('--job-dir', type=str, default='.', help='Directory containing the job specification')
+    parser.add_argument('--socket', type=str, default=DAEMON_SOCKET, help='Path of the daemon socket')
+    parser.add_argument('--dry-run', action='store_true', help='Only rebuild the job, without retrieving')
+    parser.add_argument('--telemetry', type=str, default=None,
+                        help='The CSV file to write samples of the resource use of the job to')
+    args = parser.parse_args()
+
+    return args
+
+
+def _get_fingerprint():
+    """Return a fingerprint of the code that the daemon runs, which is
+    that of the ``exo_bespin`` package and the version of Python.
+
+    Returns
+    -------
+    fingerprint : str
+        The hexadecimal fingerprint
+    """
+
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    sha = hashlib.sha256(sys.version.encode('utf-8'))
+    for root, dirs, files in os.walk(package_dir):
+        dirs[:] = sorted(directory for directory in dirs if directory != '__pycache__')
+        for filename in sorted(files):
+            if filename.endswith('.py'):
+                path = os.path.join(root, filename)
+                sha.update(os.path.relpath(path, package_dir).encode('utf-8'))
+                with open(path, 'rb') as f:
+                    sha.update(f.read())
+
+    return sha.hexdigest()
+
+
+def _ping_remote(executor):
+    """Return the state of the daemon on the given executor.
+
+    Parameters
+    ----------
+    executor : obj
+        A booted ``Executor`` object
+
+    Returns
+    -------
+    state : str
+        ``ok`` if the daemon is running the code on the executing
+        machine, ``stale`` if it is running other code, and ``not
+        running`` otherwise
+    """
+
+    from exo_bespin.execution.executors import CommandError
+
+    # The ping exits with a non-zero status unless the daemon is ok
+    try:
+        output, errors = executor.run_python(DAEMON_SCRIPT, 'ping')
+    except CommandError as error:
+        output = error.output
+
+    return output[0].strip() if output and output[0].strip() else 'not running'
+
+
+def _preload():
+    """Import the retrieval software and build a ``Retriever``.
+
+    Returns
+    -------
+    platon_wrapper : obj
+        The ``PlatonWrapper`` class
+    retriever : obj
+        A ``platon.retriever.Retriever`` object
+    """
+
+    from platon.retriever import Retriever
+    from exo_bespin.atmospheric_retrievals.platon_wrapper import PlatonWrapper
+
+    return PlatonWrapper, Retriever()
+
+
+def _receive(connection):
+    """Read a single JSON message from the given socket.
+
+    Parameters
+    ----------
+    connection : obj
+        A connected ``socket.socket`` object
+
+    Returns
+    -------
+    message : dict
+        The message
+    """
+
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = connection.recv(4096)
+        if not chunk:
+            raise ConnectionError('Connection closed before a complete message was received')
+        data += chunk
+
+    return json.loads(data.decode('utf-8'))
+
+
+def _send(connection, message):
+    """Write a single JSON message to the given socket.
+
+    Parameters
+    ----------
+    connection : obj
+        A connected ``socket.socket`` object
+    message : dict
+        The message
+    """
+
+    connection.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+
+def _run_job(request, platon_wrapper, retriever):
+    """Run the requested job in the current (forked) process.  This
+    function never returns.
+
+    Parameters
+    ----------
+    request : dict
+        The job request, containing ``job_dir``, ``method``,
+        ``dry_run``, and ``telemetry``
+    platon_wrapper : obj
+        The ``PlatonWrapper`` class
+    retriever : obj
+        A preloaded ``platon.retriever.Retriever`` object
+    """
+
+    # The job samples its own resource use, as the client that submitted
+    # it only waits for the reply
+    finished = threading.Event()
+    sampler = None
+    if request.get('telemetry'):
+        sampler = threading.Thread(target=telemetry.sample_process,
+                                   args=(os.getpid(), finished.wait, request['telemetry']), daemon=True)
+        sampler.start()
+
+    return_code = 0
+    try:
+        os.chdir(request['job_dir'])
+
+        # Send all output of the job to a log file in the job directory
+        log_fd = os.open('output.log', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(log_fd, sys.stdout.fileno())
+        os.dup2(log_fd, sys.stderr.fileno())
+
+        # Only the spans of this job are exported with its results
+        tracing.clear()
+        pw = platon_wrapper.from_job_spec('.', retriever=retriever)
+        if not request.get('dry_run'):
+            pw.retrieve(request['method'])
+            pw.save_results()
+            pw.make_plot()
+            tracing.export_json('trace.json')
+    except BaseException:
+        traceback.print_exc()
+        return_code = 1
+    finally:
+        finished.set()
+        if sampler is not None:
+            sampler.join()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(return_code)
+
+
+def _reply_when_finished(connection, pid, start_time):
+    """Wait for the given child process to finish, then reply to the
+    client with its return code.
+
+    Parameters
+    ----------
+    connection : obj
+        The client's ``socket.socket`` connection
+    pid : int
+        The process ID of the child running the job
+    start_time : float
+        The time at which the job was received
+    """
+
+    with connection:
+        _, status = os.waitpid(pid, 0)
+        return_code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+        _send(connection, {'status': 'done', 'return_code': return_code, 'elapsed': time.time() - start_time})
+
+
+def _request(command, socket_path=DAEMON_SOCKET):
+    """Send the given command (e.g. ``attach``) to the daemon and
+    return its reply.
+
+    Parameters
+    ----------
+    command : str
+        The command
+    socket_path : str
+        The path of the daemon socket
+
+    Returns
+    -------
+    reply : dict
+        The reply of the daemon, or ``None`` if no daemon is listening
+        on the socket
+    """
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(socket_path)
+            _send(connection, {'command': command})
+            return _receive(connection)
+    except (ConnectionError, FileNotFoundError, OSError):
+        return None
+
+
+def ping(socket_path=DAEMON_SOCKET):
+    """Return the fingerprint of the code run by the daemon listening on
+    the given socket.
+
+    Parameters
+    ----------
+    socket_path : str
+        The path of the daemon socket
+
+    Returns
+    -------
+    fingerprint : str
+        The fingerprint (see ``_get_fingerprint``), or ``None`` if the
+        daemon is not running
+    """
+
+    reply = _request('ping', socket_path)
+    if reply is None or reply['status'] != 'ok':
+        return None
+
+    return reply.get('fingerprint', '')
+
+
+def serve(socket_path=DAEMON_SOCKET):
+    """Preload the retrieval software and serve job requests on the
+    given socket until stopped.
+
+    The daemon stops when it is sent ``stop``, or when the last of the
+    executors attached to it detaches, once the jobs it is running have
+    finished.
+
+    Parameters
+    ----------
+    socket_path : str
+        The path of the daemon socket
+    """
+
+    # The fingerprint is taken before anything is loaded, so that code
+    # changed while loading makes the daemon stale
+    fingerprint = _get_fingerprint()
+
+    # Preload everything that a retrieval needs
+    start_time = time.time()
+    platon_wrapper, retriever = _preload()
+    logging.info('Preloaded retrieval software in {:.2f} seconds'.format(time.time() - start_time))
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    n_attached = 0
+    replies = []
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_path)
+        server.listen()
+        logging.info('Listening on {}'.format(socket_path))
+
+        while True:
+            connection, _ = server.accept()
+            try:
+                request = _receive(connection)
+            except (ConnectionError, ValueError):
+                connection.close()
+                continue
+
+            if request['command'] == 'ping':
+                with connection:
+                    _send(connection, {'status': 'ok', 'fingerprint': fingerprint, 'attached': n_attached})
+
+            elif request['command'] == 'run':
+                logging.info('Running job in {}'.format(request['job_dir']))
+                pid = os.fork()
+                if pid == 0:
+                    server.close()
+                    _run_job(request, platon_wrapper, retriever)
+                replies.append(threading.Thread(target=_reply_when_finished, args=(connection, pid, time.time()),
+                                                daemon=True))
+                replies[-1].start()
+
+            elif request['command'] in ['attach', 'detach', 'stop']:
+                n_attached += {'attach': 1, 'detach': -1, 'stop': 0}[request['command']]
+                stopping = request['command'] == 'stop' or n_attached <= 0
+
+                # The socket is removed before replying, so that a daemon
+                # started once this one has replied keeps its own socket
+                if stopping:
+                    os.remove(socket_path)
+                with connection:
+                    _send(connection, {'status': 'ok', 'attached': max(n_attached, 0)})
+                if stopping:
+                    break
+
+            else:
+                with connection:
+                    _send(connection, {'status': 'error', 'message': 'Unknown command'})
+
+    # Let the running jobs finish, and their clients get their replies
+    logging.info('Stopping once {} running jobs have finished'.format(sum(reply.is_alive() for reply in replies)))
+    for reply in replies:
+        reply.join()
+
+
+def start_daemon(executor, timeout=300):
+    """Start the daemon on the given (booted) executor, if it is not
+    already running the code on the executing machine, wait for it to
+    be ready, and attach the executor to it.
+
+    A daemon that is running other code (e.g. from before the code was
+    synced to the executing machine) is stopped and replaced.
+
+    Parameters
+    ----------
+    executor : obj
+        A booted ``Executor`` object
+    timeout : int
+        The number of seconds to wait for the daemon to be ready
+    """
+
+    state = _ping_remote(executor)
+    if state == 'stale':
+        logging.info('Stopping retrieval daemon, whose code has changed')
+        executor.run_python(DAEMON_SCRIPT, 'stop')
+
+    if state != 'ok':
+        logging.info('Starting retrieval daemon')
+        executor.run('nohup {} {} serve > daemon.log 2>&1 &'.format(
+            executor.python_command, os.path.join(executor.repo_dir, DAEMON_SCRIPT)))
+
+        start_time = time.time()
+        while _ping_remote(executor) != 'ok':
+            if time.time() - start_time > timeout:
+                raise TimeoutError('Retrieval daemon did not start within {} seconds'.format(timeout))
+            time.sleep(1)
+        logging.info('Retrieval daemon is ready')
+
+    executor.run_python(DAEMON_SCRIPT, 'attach')
+
+
+def stop_daemon(executor):
+    """Detach the given executor from the daemon, which stops once no
+    executors are attached to it.  This is to be called before the
+    executor is released.
+
+    Parameters
+    ----------
+    executor : obj
+        A booted ``Executor`` object, attached with ``start_daemon``
+    """
+
+    output, errors = executor.run_python(DAEMON_SCRIPT, 'detach')
+    logging.info('Detached from retrieval daemon ({})'.format(' '.join(output).strip()))
+
+
+def submit(method, job_dir='.', socket_path=DAEMON_SOCKET, dry_run=False, telemetry_file=None):
+    """Submit a job to the daemon and wait for it to finish.
+
+    Parameters
+    ----------
+    method : str
+        The retrieval method.  Can either be ``emcee`` or
+        ``multinest``.
+    job_dir : str
+        The directory containing the job specification.  The outputs
+        of the job are written to this directory.
+    socket_path : str
+        The path of the daemon socket
+    dry_run : bool
+        If ``True``, the job is only rebuilt from its specification,
+        which is useful for measuring the startup overhead of a job.
+    telemetry_file : str
+        The CSV file to which the job writes samples of its resource
+        use (see ``telemetry.sample_process``), if any
+
+    Returns
+    -------
+    reply : dict
+        The reply of the daemon, containing the ``return_code`` and
+        ``elapsed`` time of the job
+    """
+
+    assert method in ['multinest', 'emcee'], 'Unrecognized method: {}'.format(method)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        _send(connection, {'command': 'run', 'method': method, 'job_dir': os.path.abspath(job_dir),
+                           'dry_run': dry_run,
+                           'telemetry': os.path.abspath(telemetry_file) if telemetry_file else None})
+        reply = _receive(connection)
+
+    return reply
+
+
+if __name__ == '__main__':
+
+    args = _parse_args()
+
+    if args.task == 'serve':
+        logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO,
+                            stream=sys.stdout)
+        serve(args.socket)
+
+    elif args.task == 'ping':
+        fingerprint = ping(args.socket)
+        if fingerprint is None:
+            state = 'not running'
+        else:
+            state = 'ok' if fingerprint == _get_fingerprint() else 'stale'
+        print(state)
+        sys.exit(0 if state == 'ok' else 1)
+
+    elif args.task in ['attach', 'detach', 'stop']:
+
+        # Only attaching needs the daemon to be running
+        reply = _request(args.task, args.socket)
+        if reply is None:
+            print('not running')
+            sys.exit(1 if args.task == 'attach' else 0)
+        print('{} attached'.format(reply['attached']))
+
+    elif args.task == 'submit':
+        reply = submit(args.method, args.job_dir, args.socket, args.dry_run, args.telemetry)
+
+        # Relay the output of the job, as if it had been run directly
+        with open(os.path.join(args.job_dir, 'output.log'), 'r') as f:
+            print(f.read())
+        sys.exit(reply['return_code'])
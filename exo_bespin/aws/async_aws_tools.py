@@ -0,0 +1,469 @@
+"""This module contains ``asyncio`` counterparts of the functions in
+``aws_tools``, so that a single event loop can boot, poll, and drive
+many EC2 instances at once.
+
+The functions in ``aws_tools`` block on the AWS API and on SSH, so
+managing ``N`` instances with them takes either ``N`` times as long or
+``N`` threads that mostly sleep.  Here, each blocking AWS API call or
+SSH operation is offloaded to a shared thread pool, while all waiting
+(for an instance to be running, for a file to exist, between retries)
+is done with ``asyncio.sleep`` in the event loop and does not hold a
+thread.  Only single attempts are offloaded; retries (e.g. of copying a
+file to an instance that is not yet reachable) are made from the event
+loop.  The number of AWS API calls and SSH operations in flight at
+once are each capped by a semaphore, so that booting a large fleet does
+not trip AWS API rate limits or exhaust local sockets.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script is inteneded to be imported and used by other modules,
+    for example:
+
+        import asyncio
+        from exo_bespin.aws.async_aws_tools import AsyncEC2Manager
+
+        async def main():
+            manager = AsyncEC2Manager(max_api_calls=5, max_ssh_operations=20)
+            instances = await manager.start_many(ssh_file, ec2_id, 10)
+            await asyncio.gather(*[manager.wait_for_instance(*instance) for instance in instances])
+            results = await asyncio.gather(*[manager.run_command('hostname', *instance)
+                                             for instance in instances])
+            await asyncio.gather(*[manager.stop_ec2(ec2_id, instance) for instance, _, _ in instances])
+
+        asyncio.run(main())
+
+Dependencies
+------------
+
+    Dependent libraries include:
+
+    - boto3
+    - paramiko
+    - scp
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import logging
+import os
+
+import paramiko
+from scp import SCPClient
+
+from exo_bespin.aws import aws_tools, session_manager
+
+MAX_ATTEMPTS = 10
+POLL_INTERVAL = 5
+
+
+def _put_file(instance, key, client, filename):
+    """Make one attempt to copy a file to the given EC2 instance.
+
+    Parameters
+    ----------
+    instance : obj
+        A ``boto3`` AWS EC2 instance object.
+    key : obj
+        A ``paramiko.rsakey.RSAKey`` object.
+    client : obj
+        A ``paramiko.client.SSHClient`` object.
+    filename : str
+        The path to the file to transfer
+    """
+
+    client.connect(hostname=instance.public_dns_name, username='ec2-user', pkey=key)
+    scp = SCPClient(client.get_transport())
+    scp.put(filename)
+
+
+async def gather_limited(coroutines, limit):
+    """Run the given coroutines concurrently, with at most ``limit``
+    of them running at once.
+
+    Parameters
+    ----------
+    coroutines : list
+        The coroutines to run
+    limit : int
+        The maximum number of coroutines to run at once
+
+    Returns
+    -------
+    results : list
+        The results of the coroutines, in the order given
+    """
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*[run(coroutine) for coroutine in coroutines])
+
+
+class AsyncEC2Manager():
+    """Provides coroutines for managing EC2 instances from a single
+    event loop.
+
+    The instances, keys, and clients used and returned by the
+    coroutines are the same objects used by ``aws_tools``.
+    """
+
+    def __init__(self, max_api_calls=10, max_ssh_operations=20, poll_interval=POLL_INTERVAL):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        max_api_calls : int
+            The maximum number of AWS API calls in flight at once
+        max_ssh_operations : int
+            The maximum number of SSH operations (commands and
+            transfers) in flight at once
+        poll_interval : float
+            The number of seconds between polls when waiting for an
+            instance or a file
+        """
+
+        self.max_api_calls = max_api_calls
+        self.max_ssh_operations = max_ssh_operations
+        self.poll_interval = poll_interval
+
+        self._pool = ThreadPoolExecutor(max_workers=max_api_calls + max_ssh_operations)
+        self._semaphores = None
+
+    async def _offload(self, kind, function, *args):
+        """Run the given blocking function in the thread pool, once a
+        slot of the given kind is available.
+
+        Parameters
+        ----------
+        kind : str
+            Either ``api`` or ``ssh``
+        function : func
+            The blocking function to run
+        *args
+            Arguments for the function
+
+        Returns
+        -------
+        result : obj
+            The return value of the function
+        """
+
+        # Semaphores are created on first use so that they belong to the running event loop
+        if self._semaphores is None:
+            self._semaphores = {'api': asyncio.Semaphore(self.max_api_calls),
+                                'ssh': asyncio.Semaphore(self.max_ssh_operations)}
+
+        async with self._semaphores[kind]:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, functools.partial(function, *args))
+
+    def close(self):
+        """Shut down the thread pool."""
+
+        self._pool.shutdown(wait=True)
+
+    async def run_command(self, command, instance, key, client):
+        """Execute the given command on the given EC2 instance.  See
+        ``aws_tools.run_command``.
+
+        Parameters
+        ----------
+        command : str
+            The command to run (e.g. ``python run_myscript.py``)
+        instance : obj
+            A ``boto3`` AWS EC2 instance object.
+        key : obj
+            A ``paramiko.rsakey.RSAKey`` object.
+        client : obj
+            A ``paramiko.client.SSHClient`` object.
+
+        Returns
+        -------
+        output : list
+            The lines of standard output from running the command
+        errors : list
+            The lines of standard error output from running the command
+        """
+
+        return await self._offload('ssh', aws_tools.run_command, command, instance, key, client)
+
+    async def start_ec2(self, ssh_file, ec2_id, use_image=True, timeout=600):
+        """Create a new EC2 instance or start an existing EC2 instance,
+        and wait for it to be running.  See ``aws_tools.start_ec2``.
+
+        Parameters
+        ----------
+        ssh_file : str
+            Relative path to SSH public key to be used by AWS (e.g.
+            ``~/.ssh/exo_bespin.pem``).
+        ec2_id : str
+            The AWS EC2 template id (e.g. ``lt-021de8b904bc2b728``) or
+            instance ID (e.g. ``i-0d0c8ca4ab324b260``).
+        use_image : bool
+            Whether to use a matching pre-built environment image, if
+            one exists, when creating a new instance.
+        timeout : float
+            The number of seconds to wait for the instance to be running
+
+        Returns
+        -------
+        instance : obj
+            A ``boto3`` AWS EC2 instance object.
+        key : obj
+            A ``paramiko.rsakey.RSAKey`` object.
+        client : obj
+            A ``paramiko.client.SSHClient`` object.
+        """
+
+        instance = await self._offload('api', aws_tools.launch_ec2, ec2_id, use_image)
+
+        # A new instance that does not come up is terminated rather than left running
+        try:
+            await self.wait_until_running(instance, timeout)
+        except BaseException:
+            if ec2_id.split('-')[0] == 'lt':
+                await self.stop_ec2(ec2_id, instance)
+            raise
+
+        # Establish SSH key and client
+        key = await self._offload('ssh', session_manager.get_key, ssh_file)
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+        return instance, key, client
+
+    async def start_many(self, ssh_file, ec2_id, count, use_image=True, timeout=600):
+        """Create ``count`` new EC2 instances from the given launch
+        template concurrently, and wait for all of them to be running.
+
+        If any of the instances can not be started, those that were are
+        terminated, and the error is raised.
+
+        Parameters
+        ----------
+        ssh_file : str
+            Relative path to SSH public key to be used by AWS (e.g.
+            ``~/.ssh/exo_bespin.pem``).
+        ec2_id : str
+            The AWS EC2 template id (e.g. ``lt-021de8b904bc2b728``)
+        count : int
+            The number of instances to create
+        use_image : bool
+            Whether to use a matching pre-built environment image, if
+            one exists
+        timeout : float
+            The number of seconds to wait for each instance to be
+            running
+
+        Returns
+        -------
+        instances : list
+            An ``(instance, key, client)`` tuple for each instance
+        """
+
+        assert ec2_id.split('-')[0] == 'lt', 'Multiple instances can only be created from a launch template'
+
+        results = await asyncio.gather(*[self.start_ec2(ssh_file, ec2_id, use_image, timeout)
+                                         for _ in range(count)], return_exceptions=True)
+        instances = [result for result in results if not isinstance(result, BaseException)]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            logging.error('Could not start {} of {} EC2 instances, terminating the rest'.format(len(errors), count))
+            await asyncio.gather(*[self.stop_ec2(ec2_id, instance) for instance, _, _ in instances],
+                                 return_exceptions=True)
+            raise errors[0]
+        logging.info('Started {} EC2 instances'.format(count))
+
+        return instances
+
+    async def stop_ec2(self, ec2_id, instance):
+        """Terminate or stop the given EC2 instance.  See
+        ``aws_tools.stop_ec2``.
+
+        Parameters
+        ----------
+        ec2_id : str
+            The AWS EC2 template id (e.g. ``lt-021de8b904bc2b728``) or
+            instance ID (e.g. ``i-0d0c8ca4ab324b260``).
+        instance : obj
+            A ``boto3`` AWS EC2 instance object.
+        """
+
+        await self._offload('api', aws_tools.stop_ec2, ec2_id, instance)
+
+    async def sync_to_ec2(self, instance, key, client, local_dir, remote_dir):
+        """Incrementally copy a local directory to the given EC2
+        instance.  See ``aws_tools.sync_to_ec2``.
+
+        Parameters
+        ----------
+        instance : obj
+            A ``boto3`` AWS EC2 instance object.
+        key : obj
+            A ``paramiko.rsakey.RSAKey`` object.
+        client : obj
+            A ``paramiko.client.SSHClient`` object.
+        local_dir : str
+            The local directory to copy
+        remote_dir : str
+            The directory to copy to, relative to the instance's
+            ``$HOME`` directory
+
+        Returns
+        -------
+        stats : dict
+            The number of ``files``, ``blocks``, and ``bytes`` that were
+            transferred
+        """
+
+        return await self._offload('ssh', aws_tools.sync_to_ec2, instance, key, client, local_dir, remote_dir)
+
+    async def transfer_from_ec2(self, instance, key, client, filename):
+        """Copy a file from the given EC2 instance.  See
+        ``aws_tools.transfer_from_ec2``.
+
+        Parameters
+        ----------
+        instance : obj
+            A ``boto3`` AWS EC2 instance object.
+        key : obj
+            A ``paramiko.rsakey.RSAKey`` object.
+        client : obj
+            A ``paramiko.client.SSHClient`` object.
+        filename : str
+            The path to the file to transfer
+        """
+
+        await self._offload('ssh', aws_tools.transfer_from_ec2, instance, key, client, filename)
+
+    async def transfer_to_ec2(self, instance, key, client, filename):
+        """Copy a file to the given EC2 instance, retrying while it is
+        unreachable.  See ``aws_tools.transfer_to_ec2``.
+
+        Parameters
+        ----------
+        instance : obj
+            A ``boto3`` AWS EC2 instance object.
+        key : obj
+            A ``paramiko.rsakey.RSAKey`` object.
+        client : obj
+            A ``paramiko.client.SSHClient`` object.
+        filename : str
+            The path to the file to transfer
+        """
+
+        logging.info('Copying {} to EC2'.format(filename))
+
+        for _ in range(MAX_ATTEMPTS):
+            try:
+                await self._offload('ssh', _put_file, instance, key, client, filename)
+                return
+            except Exception:
+                logging.warning('Could not connect to {}, retrying.'.format(instance.public_dns_name))
+                await asyncio.sleep(self.poll_interval)
+
+        logging.critical('Could not connect to {}'.format(instance.public_dns_name))
+
+    async def wait_for_file(self, instance, key, client, filename, max_polls=100):
+        """Wait for the existance of the given ``filename`` on the
+        given EC2 instance.  See ``aws_tools.wait_for_file``.
+
+        Parameters
+        ----------
+        instance : obj
+            A ``boto3`` AWS EC2 instance object.
+        key : obj
+            A ``paramiko.rsakey.RSAKey`` object.
+        client : obj
+            A ``paramiko.client.SSHClient`` object.
+        filename : str
+            The filename of interest, relative to the instance's
+            ``$HOME`` directory
+        max_polls : int
+            The number of times to look for the file before giving up
+
+        Returns
+        -------
+        file_exists : bool
+            Whether the file exists
+        """
+
+        for _ in range(max_polls):
+            try:
+                output, errors = await self.run_command('ls {}'.format(filename), instance, key, client)
+                if os.path.basename(filename) in output:
+                    return True
+            except Exception:
+                pass
+            await asyncio.sleep(self.poll_interval)
+
+        logging.warning('Timeout encountered when waiting for {} on {}'.format(filename, instance.public_dns_name))
+
+        return False
+
+    async def wait_for_instance(self, instance, key, client, max_polls=100):
+        """Wait for the given EC2 instance to be completely set up with
+        the ``exo_bespin`` software environment.  See
+        ``aws_tools.wait_for_instance``.
+
+        Parameters
+        ----------
+        instance : obj
+            A ``boto3`` AWS EC2 instance object.
+        key : obj
+            A ``paramiko.rsakey.RSAKey`` object.
+        client : obj
+            A ``paramiko.client.SSHClient`` object.
+        max_polls : int
+            The number of times to check the instance before giving up
+
+        Returns
+        -------
+        ready : bool
+            Whether the instance is ready
+        """
+
+        return await self.wait_for_file(instance, key, client, 'cloud-init-output.log', max_polls)
+
+    async def wait_until_running(self, instance, timeout=600):
+        """Wait for the given EC2 instance to be in the ``running``
+        state.
+
+        Parameters
+        ----------
+        instance : obj
+            A ``boto3`` AWS EC2 instance object.
+        timeout : float
+            The number of seconds to wait
+
+        Raises
+        ------
+        TimeoutError
+            If the instance is not running within ``timeout`` seconds
+        RuntimeError
+            If the instance is terminated while waiting
+        """
+
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+
+        while True:
+            await self._offload('api', instance.reload)
+            state = instance.state['Name']
+            if state == 'running':
+                return
+            if state in ['shutting-down', 'terminated']:
+                raise RuntimeError('EC2 instance {} is {}'.format(instance.id, state))
+            if loop.time() - start_time > timeout:
+                raise TimeoutError('EC2 instance {} is not running after {} seconds'.format(instance.id, timeout))
+            await asyncio.sleep(self.poll_interval)
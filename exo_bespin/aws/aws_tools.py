@@ -36,19 +36,50 @@ Dependencies
     where the ``ec2_id`` contains the ID for an EC2 launch template
     or an existing EC2 instance, and ``ssh_file`` points to the SSH
     public key used for logging into an AWS account.
+
+    To avoid building the ``exo-bespin`` environment every time a new
+    EC2 instance is launched from a launch template, users can bake
+    the environment into an AMI once via:
+
+        python aws_tools.py build-image
+
+    Subsequent calls to ``start_ec2`` with the launch template ID will
+    automatically use the matching pre-built image.  Images are keyed
+    by a hash of the ``environment.yml`` file, the environment build
+    script, and the ``exo_bespin`` package version, so a new image is
+    required whenever any of these change.
 """
 
+import argparse
 import base64
+import fnmatch
+import hashlib
 import json
 import logging
 import os
+import posixpath
 import time
 
-import boto3
+try:
+    from importlib import metadata
+except ImportError:  # Python 3.7
+    metadata = None
+
 import paramiko
 from scp import SCPClient
 
+from exo_bespin.aws import session_manager
+from exo_bespin.execution import telemetry
+from exo_bespin.logging import profiling, tracing
 
+ENVIRONMENT_KEY_TAG = 'exo-bespin-env-key'
+LAUNCH_TEMPLATE_TAG = 'exo-bespin-launch-template'
+SYNC_BLOCK_SIZE = 64 * 1024
+SYNC_EXCLUDE = ['.git', '__pycache__', '.pytest_cache', '*.pyc', '*.egg-info', 'logs']
+SYNC_MANIFEST = '.exo_bespin_manifest.json'
+
+
+@tracing.trace()
 def build_environment(instance, key, client):
     """Builds an ``exo-bespin`` environment on the given AWS EC2 instance
 
@@ -85,37 +116,215 @@ def build_environment(instance, key, client):
     log_output(output)
 
 
-def create_ec2_launch_template(platform='linux'):
-    """Creates an ``exo-besin`` EC2 launch template
+def _get_package_version():
+    """Return the installed version of the ``exo_bespin`` package.
+
+    Returns
+    -------
+    version : str
+        The package version (e.g. ``0.0.0``), or ``0.0.0`` if it is not
+        installed or cannot be read on this version of Python
+    """
+
+    if metadata is None:
+        return '0.0.0'
+
+    try:
+        version = metadata.version('exo_bespin')
+    except metadata.PackageNotFoundError:
+        version = '0.0.0'
+
+    return version
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('task', type=str, nargs='?', default='create-template',
+                        choices=['create-template', 'build-image'],
+                        help='Create an EC2 launch template or bake the exo-bespin environment into an image')
+    parser.add_argument('--platform', type=str, default='linux', help='Either "linux" or "ubuntu"')
+    parser.add_argument('--instance-type', type=str, default='t2.medium', help='The EC2 instance type')
+    args = parser.parse_args()
+
+    return args
+
+
+@tracing.trace()
+def build_environment_image(ec2_id=None, ssh_file=None):
+    """Builds the ``exo-bespin`` environment once and snapshots it
+    into an AMI that ``start_ec2`` will use for future launches.
+
+    An EC2 instance is launched from the given launch template, the
+    environment is built via the template's user data, and the
+    resulting instance is imaged and then terminated.  The image is
+    tagged with the environment key (see ``get_environment_key``) and
+    the launch template ID.  If a matching image already exists, it is
+    returned and nothing is built.
+
+    Parameters
+    ----------
+    ec2_id : str
+        The AWS EC2 template id (e.g. ``lt-021de8b904bc2b728``).
+        Defaults to the ``ec2_id`` in the config file.
+    ssh_file : str
+        Relative path to SSH public key to be used by AWS.  Defaults to
+        the ``ssh_file`` in the config file.
+
+    Returns
+    -------
+    image_id : str
+        The ID of the pre-built AMI (e.g. ``ami-0a1b2c3d4e5f67890``)
+    """
+
+    ec2_id = ec2_id or get_config()['ec2_id']
+    ssh_file = ssh_file or get_config()['ssh_file']
+    assert ec2_id.split('-')[0] == 'lt', 'Environment images can only be built from a launch template'
+
+    image_id = find_environment_image(ec2_id)
+    if image_id:
+        logging.info('Environment image {} is already up to date'.format(image_id))
+        return image_id
+
+    environment_key = get_environment_key()
+    logging.info('Building environment image for key {}'.format(environment_key))
+
+    # Launch a fresh instance and let the user data build the environment.
+    # The instance is terminated however the build ends, so that a failed
+    # or timed out build does not leave it running.
+    instance, key, client = start_ec2(ssh_file, ec2_id, use_image=False)
+    try:
+        wait_for_instance(instance, key, client)
+
+        # Remove the completion marker so that instances launched from the
+        # image only report ready once they have booted
+        run_command('rm -f cloud-init-output.log', instance, key, client)
+
+        # Snapshot the instance into an image
+        ec2_client = session_manager.get_client('ec2')
+        response = ec2_client.create_image(
+            InstanceId=instance.id,
+            Name='exo-bespin-env-{}-{}'.format(ec2_id, environment_key[:16]),
+            Description='exo-bespin environment {}'.format(environment_key),
+            TagSpecifications=[{
+                'ResourceType': 'image',
+                'Tags': [{'Key': ENVIRONMENT_KEY_TAG, 'Value': environment_key},
+                         {'Key': LAUNCH_TEMPLATE_TAG, 'Value': ec2_id}]
+            }, ],
+        )
+        image_id = response['ImageId']
+        ec2_client.get_waiter('image_available').wait(ImageIds=[image_id])
+        logging.info('Created environment image {}'.format(image_id))
+    finally:
+        stop_ec2(ec2_id, instance)
+
+    return image_id
+
+
+def build_manifest(local_dir, block_size=SYNC_BLOCK_SIZE, exclude=SYNC_EXCLUDE):
+    """Return a manifest of the files in the given directory, which
+    records the size, permissions, and a hash of each fixed-size block
+    of every file.
+
+    Parameters
+    ----------
+    local_dir : str
+        The directory of interest
+    block_size : int
+        The size of each block in bytes
+    exclude : list
+        File or directory name patterns (e.g. ``*.pyc``) to leave out
+
+    Returns
+    -------
+    manifest : dict
+        A dictionary with a ``block_size`` key and a ``files`` key,
+        which maps the ``/``-separated path of each file relative to
+        ``local_dir`` to its ``size``, ``mode``, and list of block
+        ``hashes``.
+    """
+
+    files = {}
+    for root, dirs, filenames in os.walk(local_dir):
+        dirs[:] = sorted(d for d in dirs if not any(fnmatch.fnmatch(d, pattern) for pattern in exclude))
+        for filename in sorted(filenames):
+            if filename == SYNC_MANIFEST or any(fnmatch.fnmatch(filename, pattern) for pattern in exclude):
+                continue
+            path = os.path.join(root, filename)
+            hashes = []
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(block_size), b''):
+                    hashes.append(hashlib.sha1(block).hexdigest())
+            relative_path = os.path.relpath(path, local_dir).replace(os.sep, '/')
+            files[relative_path] = {'size': os.path.getsize(path), 'mode': os.stat(path).st_mode & 0o777,
+                                    'hashes': hashes}
+
+    manifest = {'block_size': block_size, 'files': files}
+
+    return manifest
+
+
+def create_ec2_launch_template(platform='linux', instance_type='t2.medium'):
+    """Creates an ``exo-besin`` EC2 launch template, or finds the one
+    that was created before for the same platform and instance type
 
     Parameters
     ----------
     platform : str
         The operating system to use.  Must be either ``linux`` or
         ``ubuntu``
+    instance_type : str
+        The EC2 instance type to use (see
+        ``instance_selection.recommend_instance``)
+
+    Returns
+    -------
+    template_id : str
+        The ID of the launch template (e.g. ``lt-021de8b904bc2b728``),
+        which can be used as the ``ec2_id`` of ``start_ec2``
     """
 
     assert platform in ['linux', 'ubuntu'], 'Provided platform must be either "linux" or "ubuntu"'
 
+    # Name templates for other instance types after their type
+    name = f'exo-bespin-lt-{platform}'
+    if instance_type != 't2.medium':
+        name = f'{name}-{instance_type}'
+
+    # Reuse the template if it already exists
+    client = session_manager.get_client('ec2')
+    templates = client.describe_launch_templates(
+        Filters=[{'Name': 'launch-template-name', 'Values': [name]}])['LaunchTemplates']
+    if templates:
+        template_id = templates[0]['LaunchTemplateId']
+        print('\nUsing existing EC2 Launch Template {} ({})\n'.format(name, template_id))
+        return template_id
+
     if platform == 'linux':
         ami = 'ami-098f16afa9edf40be'
     elif platform == 'ubuntu':
         ami = 'ami-0dba2cb6798deb6d8'
 
     # Gather user data and encode with base 64
-    with open('build-exo_bespin-env-cpu.sh', 'r') as f:
+    with open(os.path.join(os.path.dirname(__file__), 'build-exo_bespin-env-cpu.sh'), 'r') as f:
         user_data = f.read()
     user_data = user_data.encode('ascii')
     user_data = base64.b64encode(user_data)
     user_data = user_data.decode('ascii')
 
     # Create launch template
-    client = boto3.client('ec2')
     response = client.create_launch_template(
-        LaunchTemplateName=f'exo-bespin-lt-{platform}',
+        LaunchTemplateName=name,
         LaunchTemplateData={
             'ImageId': ami,
-            'InstanceType': 't2.medium',
+            'InstanceType': instance_type,
             'KeyName': get_config()['key_pair_name'],
             'UserData': user_data,
             'NetworkInterfaces': [{
@@ -137,10 +346,78 @@ def create_ec2_launch_template(platform='linux'):
 
     print('\nCreated EC2 Launch Template:\n\n{}\n'.format(response))
 
+    return response['LaunchTemplate']['LaunchTemplateId']
+
+
+def diff_manifests(local_manifest, remote_manifest):
+    """Return the blocks of each file that differ between the local and
+    remote manifests (see ``build_manifest``).
+
+    Parameters
+    ----------
+    local_manifest : dict
+        The manifest of the local directory
+    remote_manifest : dict
+        The manifest of the remote directory as of the last sync
+
+    Returns
+    -------
+    changes : dict
+        The indices of the changed blocks, keyed by the path of each
+        file that needs to be transferred.  Files that are identical
+        are left out.
+    """
+
+    remote_files = remote_manifest.get('files', {})
+    if remote_manifest.get('block_size') != local_manifest['block_size']:
+        remote_files = {}
+
+    changes = {}
+    for path, local_file in local_manifest['files'].items():
+        remote_hashes = remote_files.get(path, {}).get('hashes', [])
+        blocks = [index for index, block_hash in enumerate(local_file['hashes'])
+                  if index >= len(remote_hashes) or remote_hashes[index] != block_hash]
+        if blocks or path not in remote_files or remote_files[path]['size'] != local_file['size']:
+            changes[path] = blocks
+
+    return changes
+
+
+def find_environment_image(ec2_id):
+    """Return the ID of the pre-built environment image that matches
+    the current environment key and the given launch template, if one
+    exists.
+
+    Parameters
+    ----------
+    ec2_id : str
+        The AWS EC2 template id (e.g. ``lt-021de8b904bc2b728``).
+
+    Returns
+    -------
+    image_id : str or None
+        The ID of the newest matching AMI, or ``None`` if no image has
+        been built for the current environment.
+    """
+
+    ec2_client = session_manager.get_client('ec2')
+    response = ec2_client.describe_images(
+        Owners=['self'],
+        Filters=[{'Name': 'tag:{}'.format(ENVIRONMENT_KEY_TAG), 'Values': [get_environment_key()]},
+                 {'Name': 'tag:{}'.format(LAUNCH_TEMPLATE_TAG), 'Values': [ec2_id]},
+                 {'Name': 'state', 'Values': ['available']}])
+
+    images = sorted(response['Images'], key=lambda image: image['CreationDate'])
+    if not images:
+        return None
+
+    return images[-1]['ImageId']
+
 
 def get_config():
     """Return a dictionary that holds the contents of the
-    ``aws_config.json`` config file.
+    ``aws_config.json`` config file.  The file is only re-read when it
+    changes (see ``session_manager.SessionManager.get_config``).
 
     Returns
     -------
@@ -148,15 +425,95 @@ def get_config():
         A dictionary that holds the contents of the config file.
     """
 
-    config_file_location = os.path.join(os.path.dirname(__file__), 'aws_config.json')
+    return session_manager.get_config()
+
+
+def get_environment_key():
+    """Return a key that uniquely identifies the ``exo-bespin``
+    environment that would be built on an EC2 instance.
+
+    The key is a SHA-256 hash of the ``environment.yml`` file, the
+    environment build script, and the ``exo_bespin`` package version.
+    The ``environment.yml`` file is only found next to a source
+    checkout of the package; when the package is installed without
+    it, the key is computed from the build script and the package
+    version alone.
+
+    Returns
+    -------
+    environment_key : str
+        The hexadecimal environment key
+    """
+
+    aws_dir = os.path.dirname(__file__)
+    environment_files = [os.path.join(aws_dir, '..', '..', 'environment.yml'),
+                         os.path.join(aws_dir, 'build-exo_bespin-env-cpu.sh')]
+
+    sha = hashlib.sha256()
+    for environment_file in environment_files:
+        if not os.path.isfile(environment_file):
+            logging.warning('{} not found; it is left out of the environment key'.format(
+                os.path.basename(environment_file)))
+            continue
+        with open(environment_file, 'rb') as f:
+            sha.update(f.read())
+    sha.update(_get_package_version().encode('utf-8'))
+
+    return sha.hexdigest()
+
+
+@tracing.trace()
+def launch_ec2(ec2_id, use_image=True):
+    """Create a new EC2 instance or start an existing EC2 instance,
+    without waiting for it to be running.
+
+    See ``start_ec2`` for details on how the instance is created.
+
+    Parameters
+    ----------
+    ec2_id : str
+        The AWS EC2 template id (e.g. ``lt-021de8b904bc2b728``) or
+        instance ID (e.g. ``i-0d0c8ca4ab324b260``).
+    use_image : bool
+        Whether to use a matching pre-built environment image, if one
+        exists, when creating a new instance.
+
+    Returns
+    -------
+    instance : obj
+        A ``boto3`` AWS EC2 instance object.
+    """
+
+    ec2 = session_manager.get_resource('ec2')
 
-    if not os.path.isfile(config_file_location):
-        raise FileNotFoundError('Missing AWS configuration file ("aws_config.json")')
+    # If the given ec2_id is for an EC2 template, then create the EC2 instance
+    if ec2_id.split('-')[0] == 'lt':
+        LaunchTemplate = {'LaunchTemplateId': ec2_id}
+        overrides = {}
+        image_id = find_environment_image(ec2_id) if use_image else None
+        if image_id:
+            with open(os.path.join(os.path.dirname(__file__), 'exo_bespin-env-ready.sh'), 'r') as f:
+                overrides = {'ImageId': image_id, 'UserData': f.read()}
+            logging.info('Using pre-built environment image {}'.format(image_id))
+        instances = ec2.create_instances(
+            LaunchTemplate=LaunchTemplate,
+            MaxCount=1,
+            MinCount=1,
+            **overrides)
+        instance = instances[0]
+        logging.info('Launched EC2 instance {}'.format(instance.id))
+
+    # If the given ec2_id is for an existing EC2 instance, then start it
+    else:
+        instance = ec2.Instance(ec2_id)
 
-    with open(config_file_location, 'r') as config_file:
-        settings = json.load(config_file)
+        # An instance that is still stopping can not be started until it has stopped
+        if instance.state['Name'] == 'stopping':
+            instance.wait_until_stopped()
+        instance.start()
+        logging.info('Started EC2 instance {}'.format(ec2_id))
 
-    return settings
+    return instance
 
 
 def log_output(output):
@@ -174,8 +531,39 @@ def log_output(output):
         logging.info(line)
 
 
+def log_telemetry(filename):
+    """Logs a summary of the resource use of a remote job, as sampled
+    by ``telemetry.py`` and fetched with the job's results.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the fetched ``telemetry.csv`` file
+    """
+
+    if not os.path.exists(filename):
+        logging.warning('No telemetry found at {}'.format(filename))
+        return
+
+    summary = telemetry.summarize(filename)
+    if not summary['samples']:
+        logging.warning('No telemetry samples in {}'.format(filename))
+        return
+
+    logging.info('Resource use over {duration:.1f} seconds ({samples} samples):'.format(**summary))
+    logging.info('    CPU utilization: {mean_cpu:.1f}% mean, {peak_cpu:.1f}% peak, '
+                 '{busiest_core:.1f}% mean on the busiest core'.format(**summary))
+    logging.info('    Load average: {mean_load:.2f} mean, {peak_load:.2f} peak'.format(**summary))
+    logging.info('    Memory: {peak_rss_mb:.1f} MB peak RSS of the job, '
+                 '{peak_memory_used_mb:.1f} MB peak in use on the machine'.format(**summary))
+    logging.info('    Disk I/O: {read_mb:.1f} MB read, {write_mb:.1f} MB written'.format(**summary))
+
+
+@tracing.trace()
 def run_command(command, instance, key, client):
-    """Executes the given command on the given EC2 instance
+    """Executes the given command on the given EC2 instance.  If
+    profiling is enabled (see ``profiling.profiling_enabled``), it is
+    also enabled for the command.
 
     Parameters
     ----------
@@ -197,7 +585,7 @@ def run_command(command, instance, key, client):
     """
 
     client.connect(hostname=instance.public_dns_name, username='ec2-user', pkey=key)
-    stdin, stdout, stderr = client.exec_command(command)
+    stdin, stdout, stderr = client.exec_command(profiling.forward_environment(command))
     output = stdout.read()
     errors = stderr.read()
 
@@ -210,13 +598,19 @@ def run_command(command, instance, key, client):
     return output, errors
 
 
-def start_ec2(ssh_file, ec2_id):
+@tracing.trace()
+def start_ec2(ssh_file, ec2_id, use_image=True):
     """Create a new EC2 instance or start an existing EC2 instance.
 
     A new EC2 instance will be created if the supplied ``ec2_id`` is an
     EC2 template ID.  An existing EC2 instance will be started if the
     supplied ``ec2_id`` is an ID for an existing EC2 instance.
 
+    When creating a new instance, a pre-built environment image that
+    matches the current environment (see ``build_environment_image``)
+    is used in place of the template's image if one exists, in which
+    case the environment build in the template's user data is skipped.
+
     Parameters
     ----------
     ssh_file : str
@@ -225,6 +619,9 @@ def start_ec2(ssh_file, ec2_id):
     ec2_id : str
         The AWS EC2 template id (e.g. ``lt-021de8b904bc2b728``) or
         instance ID (e.g. ``i-0d0c8ca4ab324b260``).
+    use_image : bool
+        Whether to use a matching pre-built environment image, if one
+        exists, when creating a new instance.
 
     Returns
     -------
@@ -236,35 +633,19 @@ def start_ec2(ssh_file, ec2_id):
         A ``paramiko.client.SSHClient`` object.
     """
 
-    ec2 = boto3.resource('ec2')
-
-    # If the given ec2_id is for an EC2 template, then create the EC2 instance
-    if ec2_id.split('-')[0] == 'lt':
-        LaunchTemplate = {'LaunchTemplateId': ec2_id}
-        instances = ec2.create_instances(
-            LaunchTemplate=LaunchTemplate,
-            MaxCount=1,
-            MinCount=1)
-        instance = instances[0]
-        logging.info('Launched EC2 instance {}'.format(instance.id))
-
-    # If the given ec2_id is for an existing EC2 instance, then start it
-    else:
-        instance = ec2.Instance(ec2_id)
-        instance.start()
-        logging.info('Started EC2 instance {}'.format(ec2_id))
-
+    instance = launch_ec2(ec2_id, use_image)
     instance.wait_until_running()
     instance.load()
 
     # Establish SSH key and client
-    key = paramiko.RSAKey.from_private_key_file(ssh_file)
+    key = session_manager.get_key(ssh_file)
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
     return instance, key, client
 
 
+@tracing.trace()
 def stop_ec2(ec2_id, instance):
     """Terminates or stops the given AWS EC2 instance.
 
@@ -281,7 +662,7 @@ def stop_ec2(ec2_id, instance):
         A ``boto3`` AWS EC2 instance object.
     """
 
-    ec2 = boto3.resource('ec2')
+    ec2 = session_manager.get_resource('ec2')
 
     # If the given ec2_id is for an EC2 template, then terminate the EC2 instance
     if ec2_id.split('-')[0] == 'lt':
@@ -294,6 +675,142 @@ def stop_ec2(ec2_id, instance):
         logging.info('Stopped EC2 instance {}'.format(ec2_id))
 
 
+def sync_directory(local_dir, remote_dir, sftp, block_size=SYNC_BLOCK_SIZE, exclude=SYNC_EXCLUDE):
+    """Incrementally copy the contents of a local directory to a remote
+    directory, transferring only the blocks of files that changed since
+    the last sync, and removing the files that were removed locally.
+
+    A manifest of the remote directory is kept in a
+    ``.exo_bespin_manifest.json`` file within it.  Files in the remote
+    directory that are modified by other means are therefore not
+    detected, and only files that were copied by an earlier sync are
+    removed (directories that they leave empty are kept).  Blocks are
+    compared at fixed offsets, so inserting or removing bytes in the
+    middle of a file transfers every block after the change.
+
+    Parameters
+    ----------
+    local_dir : str
+        The local directory to copy
+    remote_dir : str
+        The remote directory to copy to
+    sftp : obj
+        A ``paramiko.SFTPClient`` object, or a ``LocalFileSystem``
+        object for syncing to a local directory
+    block_size : int
+        The size of each block in bytes
+    exclude : list
+        File or directory name patterns (e.g. ``*.pyc``) to leave out
+
+    Returns
+    -------
+    stats : dict
+        The number of ``files``, ``blocks``, and ``bytes`` that were
+        transferred, and the number of files that were ``deleted``
+    """
+
+    local_manifest = build_manifest(local_dir, block_size, exclude)
+
+    # Read the manifest from the last sync, if there was one
+    manifest_file = posixpath.join(remote_dir, SYNC_MANIFEST)
+    try:
+        with sftp.open(manifest_file, 'r') as f:
+            remote_manifest = json.loads(f.read())
+    except (IOError, ValueError):
+        remote_manifest = {}
+
+    changes = diff_manifests(local_manifest, remote_manifest)
+    stats = {'files': len(changes), 'blocks': 0, 'bytes': 0, 'deleted': 0}
+
+    # Remove the files that were synced before but no longer exist locally
+    for path in sorted(set(remote_manifest.get('files', {})) - set(local_manifest['files'])):
+        try:
+            sftp.remove(posixpath.join(remote_dir, path))
+        except IOError:
+            continue
+        stats['deleted'] += 1
+
+    for path, blocks in changes.items():
+        local_file = local_manifest['files'][path]
+        remote_file = posixpath.join(remote_dir, path)
+
+        # Create any missing parent directories
+        parent = remote_dir
+        for directory in path.split('/')[:-1]:
+            parent = posixpath.join(parent, directory)
+            try:
+                sftp.stat(parent)
+            except IOError:
+                sftp.mkdir(parent)
+
+        # Write the changed blocks in place and trim the file to size.  If
+        # the remote file has gone missing, write it in its entirety.
+        try:
+            remote = sftp.open(remote_file, 'r+b')
+        except IOError:
+            remote = sftp.open(remote_file, 'wb')
+            blocks = range(len(local_file['hashes']))
+        with open(os.path.join(local_dir, path), 'rb') as local, remote:
+            for index in blocks:
+                local.seek(index * block_size)
+                block = local.read(block_size)
+                remote.seek(index * block_size)
+                remote.write(block)
+                stats['blocks'] += 1
+                stats['bytes'] += len(block)
+            remote.truncate(local_file['size'])
+        sftp.chmod(remote_file, local_file['mode'])
+
+    with sftp.open(manifest_file, 'w') as f:
+        f.write(json.dumps(local_manifest))
+
+    logging.info('Synced {} to {}: {} files, {} blocks, {} bytes transferred, {} files deleted'.format(
+        local_dir, remote_dir, stats['files'], stats['blocks'], stats['bytes'], stats['deleted']))
+
+    return stats
+
+
+@tracing.trace()
+def sync_to_ec2(instance, key, client, local_dir, remote_dir):
+    """Incrementally copy the contents of a local directory to the given
+    EC2 instance, transferring only the blocks of files that changed
+    since the last sync (see ``sync_directory``).
+
+    Parameters
+    ----------
+    instance : obj
+        A ``boto3`` AWS EC2 instance object.
+    key : obj
+        A ``paramiko.rsakey.RSAKey`` object.
+    client : obj
+        A ``paramiko.client.SSHClient`` object.
+    local_dir : str
+        The local directory to copy
+    remote_dir : str
+        The directory to copy to, relative to the instance's ``$HOME``
+        directory (e.g. ``exo_bespin``)
+
+    Returns
+    -------
+    stats : dict
+        The number of ``files``, ``blocks``, and ``bytes`` that were
+        transferred, and the number of files that were ``deleted``
+    """
+
+    client.connect(hostname=instance.public_dns_name, username='ec2-user', pkey=key)
+    sftp = client.open_sftp()
+    try:
+        sftp.stat(remote_dir)
+    except IOError:
+        sftp.mkdir(remote_dir)
+
+    stats = sync_directory(local_dir, remote_dir, sftp)
+    sftp.close()
+
+    return stats
+
+
+@tracing.trace()
 def transfer_from_ec2(instance, key, client, filename):
     """Copy files from EC2 user back to the user
 
@@ -316,6 +833,7 @@ def transfer_from_ec2(instance, key, client, filename):
     scp.get(filename)
 
 
+@tracing.trace()
 def transfer_to_ec2(instance, key, client, filename):
     """Copy parameter file from user to EC2 instance
 
@@ -350,6 +868,21 @@ def transfer_to_ec2(instance, key, client, filename):
             iterations += 1
 
 
+def update_config(**values):
+    """Set the given values (e.g. ``ec2_id``) in the
+    ``aws_config.json`` config file, keeping its other values (see
+    ``session_manager.SessionManager.update_config``).
+
+    Parameters
+    ----------
+    **values
+        The values to set
+    """
+
+    session_manager.update_config(**values)
+
+
+@tracing.trace()
 def wait_for_file(instance, key, client, filename):
     """Waits for the existance of the given ``filename`` on the given
     EC2 instance before proceeding.
@@ -397,6 +930,7 @@ def wait_for_file(instance, key, client, filename):
             time.sleep(10)
 
 
+@tracing.trace()
 def wait_for_instance(instance, key, client):
     """Waits for the given EC2 instance to be completely set up with
     the `exo_bespin` software environment.
@@ -419,6 +953,34 @@ def wait_for_instance(instance, key, client):
     wait_for_file(instance, key, client, 'cloud-init-output.log')
 
 
+class LocalFileSystem():
+    """Provides the parts of the ``paramiko.SFTPClient`` interface used
+    by ``sync_directory`` for the local file system, so that
+    directories can also be synced locally."""
+
+    def chmod(self, path, mode):
+        os.chmod(path, mode)
+
+    def mkdir(self, path):
+        os.mkdir(path)
+
+    def open(self, filename, mode='r'):
+        return open(filename, mode)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def stat(self, path):
+        return os.stat(path)
+
+
 if __name__ == '__main__':
 
-    create_ec2_launch_template()
+    args = _parse_args()
+
+    if args.task == 'create-template':
+        template_id = create_ec2_launch_template(args.platform, args.instance_type)
+        update_config(ec2_id=template_id)
+        print('Set the ec2_id of aws_config.json to {}'.format(template_id))
+    elif args.task == 'build-image':
+        build_environment_image()
@@ -0,0 +1,4 @@
+#! /bin/bash
+
+# User data for instances launched from a pre-built exo-bespin environment image
+cp /var/log/cloud-init-output.log /home/ec2-user/  # Signify that the instance is ready for use
@@ -0,0 +1,361 @@
+#! /usr/bin/env python
+
+"""Estimates the cost of atmospheric retrievals and selects the EC2
+instance type and number of instances to run them on.
+
+The wall time of a retrieval is modeled as a fixed overhead plus a cost
+per likelihood evaluation, where the cost of each evaluation grows
+linearly with the number of wavelength bins:
+
+    time = c0 + c1 * evaluations + c2 * evaluations * bins
+
+The number of likelihood evaluations is ``walkers x steps`` for
+``emcee``, and is taken to be ``live points x free parameters`` for
+``multinest``.  The coefficients of each method are fit by
+non-negative least squares to timings of benchmark retrievals run on
+the local machine (see ``calibrate`` and
+``benchmarks/benchmark_retrieval_cost.py``), and saved to
+``~/.exo_bespin/cost_model.json``.  Until a calibration has been
+saved, rough default coefficients are used.
+
+Each instance type is described by its vCPUs, memory, hourly price,
+the speed of one of its vCPUs relative to the calibration machine,
+and the fraction of a vCPU that it can sustain.  The sustained fraction
+is below one for burstable (``t2``/``t3``) types, which are throttled
+to their baseline once their CPU credits are spent.  For a batch of
+jobs, ``recommend_instance`` finds the cheapest instance type and
+number of instances that finish the batch within a target wall time.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This module can be imported and used by other modules, for example:
+
+        from exo_bespin.aws.instance_selection import estimate_job_time, recommend_instance
+
+        job_time = estimate_job_time('multinest', n_bins=20, n_params=8)
+        recommendation = recommend_instance(job_time, n_jobs=10, target_time=3600)
+
+    or executed via the command line, which creates an EC2 launch
+    template with the recommended instance type (or reuses the one
+    created before), and sets it as the ``ec2_id`` of
+    ``aws_config.json``, so that it is used by ``start_ec2``:
+
+        >>> python instance_selection.py multinest --bins 20 --params 8 --jobs 10 --target-time 3600
+
+    Supplying ``--dry-run`` only prints the estimate and the
+    recommendation.
+
+Dependencies
+------------
+
+    Dependent libraries include:
+
+    - boto3
+    - numpy
+    - paramiko
+    - scipy
+    - scp
+"""
+
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+from scipy.optimize import nnls
+
+from exo_bespin.atmospheric_retrievals.batch_runner import get_concurrency
+from exo_bespin.aws.aws_tools import create_ec2_launch_template, update_config
+
+BOOT_TIME = 120
+COST_MODEL_FILE = os.path.join(os.path.expanduser('~'), '.exo_bespin', 'cost_model.json')
+DEFAULT_COEFFICIENTS = {'emcee': [20., 2e-3, 2e-5], 'multinest': [20., 1e-1, 1e-3]}
+INSTANCE_TYPES = {
+    't2.medium': {'vcpus': 2, 'memory': 4, 'price': 0.0464, 'speed': 1.0, 'baseline': 0.4},
+    't3.large': {'vcpus': 2, 'memory': 8, 'price': 0.0832, 'speed': 1.1, 'baseline': 0.3},
+    'c5.large': {'vcpus': 2, 'memory': 4, 'price': 0.085, 'speed': 1.3, 'baseline': 1.0},
+    'c5.xlarge': {'vcpus': 4, 'memory': 8, 'price': 0.17, 'speed': 1.3, 'baseline': 1.0},
+    'c5.2xlarge': {'vcpus': 8, 'memory': 16, 'price': 0.34, 'speed': 1.3, 'baseline': 1.0},
+    'c5.4xlarge': {'vcpus': 16, 'memory': 32, 'price': 0.68, 'speed': 1.3, 'baseline': 1.0},
+    'c5.9xlarge': {'vcpus': 36, 'memory': 72, 'price': 1.53, 'speed': 1.3, 'baseline': 1.0},
+    'm5.xlarge': {'vcpus': 4, 'memory': 16, 'price': 0.192, 'speed': 1.2, 'baseline': 1.0},
+    'm5.4xlarge': {'vcpus': 16, 'memory': 64, 'price': 0.768, 'speed': 1.2, 'baseline': 1.0}}
+
+
+def _features(method, n_bins, n_params, n_live=100, n_walkers=50, n_steps=1000):
+    """Return the features of the cost model for a retrieval.
+
+    Parameters
+    ----------
+    method : str
+        The retrieval method.  Can either be ``emcee`` or
+        ``multinest``.
+    n_bins : int
+        The number of wavelength bins
+    n_params : int
+        The number of free parameters
+    n_live : int
+        The number of live points (``multinest`` only)
+    n_walkers : int
+        The number of walkers (``emcee`` only)
+    n_steps : int
+        The number of steps (``emcee`` only)
+
+    Returns
+    -------
+    features : obj
+        A ``numpy`` array of the model features
+    """
+
+    assert method in ['multinest', 'emcee'], 'Unrecognized method: {}'.format(method)
+
+    if method == 'emcee':
+        evaluations = n_walkers * n_steps
+    elif method == 'multinest':
+        evaluations = n_live * n_params
+
+    return np.array([1., evaluations, evaluations * n_bins])
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('method', type=str, help='Retrieval method (either "emcee" or "multinest"')
+    parser.add_argument('--bins', type=int, required=True, help='Number of wavelength bins')
+    parser.add_argument('--params', type=int, required=True, help='Number of free parameters')
+    parser.add_argument('--live-points', type=int, default=100, help='Number of live points (multinest)')
+    parser.add_argument('--walkers', type=int, default=50, help='Number of walkers (emcee)')
+    parser.add_argument('--steps', type=int, default=1000, help='Number of steps (emcee)')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of retrievals to run')
+    parser.add_argument('--target-time', type=float, default=3600, help='Target wall time in seconds')
+    parser.add_argument('--threads-per-job', type=int, default=1, help='Number of threads used by each retrieval')
+    parser.add_argument('--platform', type=str, default='linux', help='Either "linux" or "ubuntu"')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the estimate and recommendation')
+    args = parser.parse_args()
+
+    return args
+
+
+def calibrate(records, filename=COST_MODEL_FILE):
+    """Fit the cost model to timings of benchmark retrievals and save
+    the coefficients.
+
+    Parameters
+    ----------
+    records : list
+        Dictionaries describing each benchmark retrieval, containing
+        the ``method``, ``n_bins``, ``n_params``, ``wall_time`` (in
+        seconds), and ``n_live`` or ``n_walkers`` and ``n_steps``
+    filename : str
+        The path of the file to save the coefficients to, or ``None``
+        to not save them
+
+    Returns
+    -------
+    model : dict
+        The coefficients of the model, keyed by method
+    """
+
+    model = dict(DEFAULT_COEFFICIENTS)
+
+    for method in ['emcee', 'multinest']:
+        method_records = [record for record in records if record['method'] == method]
+        if not method_records:
+            continue
+        assert len(method_records) >= 3, 'At least 3 {} benchmark retrievals are required'.format(method)
+
+        features = np.array([_features(**{key: value for key, value in record.items() if key != 'wall_time'})
+                             for record in method_records])
+        wall_times = np.array([record['wall_time'] for record in method_records])
+        coefficients, _ = nnls(features, wall_times)
+        model[method] = [float(coefficient) for coefficient in coefficients]
+
+    if filename is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        with open(filename, 'w') as f:
+            json.dump(model, f, indent=4)
+
+    return model
+
+
+def estimate_from_wrapper(pw, method, **kwargs):
+    """Estimate the wall time of the retrieval configured in the given
+    ``PlatonWrapper`` object.
+
+    Parameters
+    ----------
+    pw : obj
+        A ``PlatonWrapper`` object with its data set and priors
+    method : str
+        The retrieval method.  Can either be ``emcee`` or
+        ``multinest``.
+    **kwargs
+        Other arguments for ``estimate_job_time`` (e.g. ``n_live``)
+
+    Returns
+    -------
+    job_time : float
+        The estimated wall time, in seconds, on one vCPU of the
+        calibration machine
+    """
+
+    return estimate_job_time(method, len(pw.bins), len(pw.fit_info.fit_param_names), **kwargs)
+
+
+def estimate_job_time(method, n_bins, n_params, n_live=100, n_walkers=50, n_steps=1000, model=None):
+    """Estimate the wall time of a retrieval.
+
+    Parameters
+    ----------
+    method : str
+        The retrieval method.  Can either be ``emcee`` or
+        ``multinest``.
+    n_bins : int
+        The number of wavelength bins
+    n_params : int
+        The number of free parameters
+    n_live : int
+        The number of live points (``multinest`` only)
+    n_walkers : int
+        The number of walkers (``emcee`` only)
+    n_steps : int
+        The number of steps (``emcee`` only)
+    model : dict
+        The coefficients of the model, keyed by method.  Defaults to
+        the saved calibration (see ``load_cost_model``).
+
+    Returns
+    -------
+    job_time : float
+        The estimated wall time, in seconds, on one vCPU of the
+        calibration machine
+    """
+
+    model = model or load_cost_model()
+    features = _features(method, n_bins, n_params, n_live, n_walkers, n_steps)
+
+    return float(np.dot(model[method], features))
+
+
+def load_cost_model(filename=COST_MODEL_FILE):
+    """Return the saved coefficients of the cost model, or the default
+    coefficients if no calibration has been saved.
+
+    Parameters
+    ----------
+    filename : str
+        The path of the saved coefficients
+
+    Returns
+    -------
+    model : dict
+        The coefficients of the model, keyed by method
+    """
+
+    if not os.path.exists(filename):
+        return dict(DEFAULT_COEFFICIENTS)
+
+    with open(filename, 'r') as f:
+        model = json.load(f)
+
+    return model
+
+
+def recommend_instance(job_time, n_jobs=1, target_time=3600, threads_per_job=1, memory_per_job=1.,
+                       max_instances=20, instance_types=INSTANCE_TYPES):
+    """Return the cheapest instance type and number of instances that
+    run a batch of jobs within the target wall time.  If no option
+    meets the target, the fastest option is returned.
+
+    Each instance runs ``vCPUs // threads per job`` jobs at once (see
+    ``batch_runner.get_concurrency``), limited by its memory, and the
+    jobs are run in waves across all instances.
+
+    Parameters
+    ----------
+    job_time : float
+        The wall time of one job, in seconds, on one vCPU of the
+        calibration machine (see ``estimate_job_time``)
+    n_jobs : int
+        The number of jobs in the batch
+    target_time : float
+        The target wall time of the batch, in seconds, including the
+        time to boot the instances
+    threads_per_job : int
+        The number of threads used by each job
+    memory_per_job : float
+        The memory used by each job, in GiB
+    max_instances : int
+        The maximum number of instances to use
+    instance_types : dict
+        The candidate instance types (see ``INSTANCE_TYPES``)
+
+    Returns
+    -------
+    recommendation : dict
+        The ``instance_type``, number of ``instances``, number of
+        ``jobs_per_instance`` run at once, estimated ``wall_time`` (in
+        seconds) and ``cost`` (in US dollars), and whether the option
+        ``meets_target``
+    """
+
+    options = []
+    for instance_type, specs in instance_types.items():
+        jobs_per_instance = min(get_concurrency(threads_per_job, specs['vcpus']),
+                                int(specs['memory'] // memory_per_job))
+        if jobs_per_instance < 1:
+            continue
+        instance_job_time = job_time / (specs['speed'] * specs['baseline'])
+
+        for instances in range(1, min(max_instances, math.ceil(n_jobs / jobs_per_instance)) + 1):
+            waves = math.ceil(n_jobs / (instances * jobs_per_instance))
+            wall_time = BOOT_TIME + waves * instance_job_time
+            options.append({
+                'instance_type': instance_type,
+                'instances': instances,
+                'jobs_per_instance': jobs_per_instance,
+                'wall_time': wall_time,
+                'cost': instances * specs['price'] * wall_time / 3600,
+                'meets_target': wall_time <= target_time})
+
+    assert options, 'No instance type has enough memory for the jobs'
+
+    meeting_target = [option for option in options if option['meets_target']]
+    if meeting_target:
+        return min(meeting_target, key=lambda option: (option['cost'], option['wall_time']))
+
+    return min(options, key=lambda option: (option['wall_time'], option['cost']))
+
+
+if __name__ == '__main__':
+
+    args = _parse_args()
+
+    job_time = estimate_job_time(args.method, args.bins, args.params, args.live_points, args.walkers, args.steps)
+    recommendation = recommend_instance(job_time, args.jobs, args.target_time, args.threads_per_job)
+
+    print('\nEstimated time per retrieval: {:.0f} seconds on one calibration vCPU'.format(job_time))
+    print('Recommended instance type: {instance_type}'.format(**recommendation))
+    print('Instances: {instances} ({jobs_per_instance} jobs at a time on each)'.format(**recommendation))
+    print('Estimated wall time: {:.0f} seconds (target {:.0f} seconds{})'.format(
+        recommendation['wall_time'], args.target_time, '' if recommendation['meets_target'] else ', not met'))
+    print('Estimated cost: ${:.2f}\n'.format(recommendation['cost']))
+
+    if not args.dry_run:
+        template_id = create_ec2_launch_template(args.platform, recommendation['instance_type'])
+        update_config(ec2_id=template_id)
+        print('Set the ec2_id of aws_config.json to {}'.format(template_id))
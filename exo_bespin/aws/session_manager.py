@@ -0,0 +1,267 @@
+"""This module contains a central manager for the AWS configuration,
+``boto3`` clients and resources, and SSH keys, so that they are only
+loaded or created once per process.
+
+Reading ``aws_config.json``, creating a ``boto3`` session, client, or
+resource, and parsing an RSA key each take from milliseconds (JSON,
+keys) to tens of milliseconds (``boto3``), and were previously repeated
+for every call to the ``aws_tools`` functions.  The session manager
+caches each of them:
+
+    - The configuration is re-read only when the modification time or
+      size of the configuration file changes.
+    - ``boto3`` clients are thread safe, so one client per service is
+      shared by all threads.
+    - ``boto3`` sessions and resources are not thread safe, so a
+      single session is only used while holding a lock, and each thread
+      gets its own resource per service.
+    - Each RSA key file is parsed once, and again only if it changes.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script is inteneded to be imported and used by other modules,
+    for example:
+
+        from exo_bespin.aws.session_manager import get_client, get_config, get_key, get_resource
+
+        ec2 = get_resource('ec2')
+        key = get_key(get_config()['ssh_file'])
+
+Dependencies
+------------
+
+    Dependent libraries include:
+
+    - boto3
+    - paramiko
+"""
+
+import json
+import os
+import threading
+
+import boto3
+import paramiko
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aws_config.json')
+
+
+def _file_signature(filename):
+    """Return the modification time and size of the given file, which
+    change whenever the file is rewritten.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the file
+
+    Returns
+    -------
+    signature : tuple
+        The modification time (in nanoseconds) and size of the file
+    """
+
+    stat = os.stat(filename)
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_client(service_name):
+    """Return the shared ``boto3`` client for the given service.  See
+    ``SessionManager.get_client``."""
+
+    return _session_manager.get_client(service_name)
+
+
+def get_config():
+    """Return the contents of the ``aws_config.json`` config file.  See
+    ``SessionManager.get_config``."""
+
+    return _session_manager.get_config()
+
+
+def get_key(ssh_file):
+    """Return the RSA key in the given file.  See
+    ``SessionManager.get_key``."""
+
+    return _session_manager.get_key(ssh_file)
+
+
+def get_resource(service_name):
+    """Return the calling thread's ``boto3`` resource for the given
+    service.  See ``SessionManager.get_resource``."""
+
+    return _session_manager.get_resource(service_name)
+
+
+def reset():
+    """Discard all cached objects.  See ``SessionManager.reset``."""
+
+    _session_manager.reset()
+
+
+def update_config(**values):
+    """Set the given values in the ``aws_config.json`` config file.
+    See ``SessionManager.update_config``."""
+
+    _session_manager.update_config(**values)
+
+
+class SessionManager():
+    """Caches the AWS configuration, ``boto3`` clients and resources,
+    and SSH keys.  A single manager may be shared by multiple threads.
+    """
+
+    def __init__(self, config_file=CONFIG_FILE):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        config_file : str
+            The path to the ``aws_config.json`` file
+        """
+
+        self.config_file = config_file
+        self._lock = threading.Lock()
+        self.reset()
+
+    def _get_session(self):
+        """Return the shared ``boto3`` session.  Must be called while
+        holding the lock.
+
+        Returns
+        -------
+        session : obj
+            A ``boto3.session.Session`` object
+        """
+
+        if self._session is None:
+            self._session = boto3.session.Session()
+
+        return self._session
+
+    def get_client(self, service_name):
+        """Return the shared ``boto3`` client for the given service.
+
+        Parameters
+        ----------
+        service_name : str
+            The name of the AWS service (e.g. ``ec2``)
+
+        Returns
+        -------
+        client : obj
+            A ``boto3`` client object
+        """
+
+        with self._lock:
+            if service_name not in self._clients:
+                self._clients[service_name] = self._get_session().client(service_name)
+            return self._clients[service_name]
+
+    def get_config(self):
+        """Return a dictionary that holds the contents of the
+        configuration file, re-reading the file only if it changed.
+
+        Returns
+        -------
+        settings : dict
+            A dictionary that holds the contents of the config file.
+        """
+
+        if not os.path.isfile(self.config_file):
+            raise FileNotFoundError('Missing AWS configuration file ("aws_config.json")')
+
+        signature = _file_signature(self.config_file)
+        with self._lock:
+            if self._config is None or self._config[0] != signature:
+                with open(self.config_file, 'r') as config_file:
+                    self._config = (signature, json.load(config_file))
+            settings = dict(self._config[1])
+
+        return settings
+
+    def get_key(self, ssh_file):
+        """Return the RSA key in the given file, parsing the file only
+        if it has not been parsed before or has changed.
+
+        Parameters
+        ----------
+        ssh_file : str
+            Path to the SSH private key (e.g. ``~/.ssh/exo_bespin.pem``)
+
+        Returns
+        -------
+        key : obj
+            A ``paramiko.rsakey.RSAKey`` object.
+        """
+
+        ssh_file = os.path.expanduser(ssh_file)
+        signature = _file_signature(ssh_file)
+        with self._lock:
+            if ssh_file not in self._keys or self._keys[ssh_file][0] != signature:
+                self._keys[ssh_file] = (signature, paramiko.RSAKey.from_private_key_file(ssh_file))
+            return self._keys[ssh_file][1]
+
+    def get_resource(self, service_name):
+        """Return the calling thread's ``boto3`` resource for the given
+        service.
+
+        Parameters
+        ----------
+        service_name : str
+            The name of the AWS service (e.g. ``ec2``)
+
+        Returns
+        -------
+        resource : obj
+            A ``boto3`` resource object
+        """
+
+        if not hasattr(self._resources, 'cache'):
+            self._resources.cache = {}
+        if service_name not in self._resources.cache:
+            with self._lock:
+                self._resources.cache[service_name] = self._get_session().resource(service_name)
+
+        return self._resources.cache[service_name]
+
+    def reset(self):
+        """Discard all cached objects, e.g. after changing AWS
+        credentials."""
+
+        with self._lock:
+            self._clients = {}
+            self._config = None
+            self._keys = {}
+            self._resources = threading.local()
+            self._session = None
+
+    def update_config(self, **values):
+        """Set the given values in the configuration file, keeping its
+        other values.  The file is written under a temporary name and
+        then renamed, so that it is never read half written.
+
+        Parameters
+        ----------
+        **values
+            The values to set (e.g. ``ec2_id``)
+        """
+
+        settings = self.get_config() if os.path.isfile(self.config_file) else {}
+        settings.update(values)
+
+        temporary_file = '{}.{}.tmp'.format(self.config_file, os.getpid())
+        with open(temporary_file, 'w') as config_file:
+            json.dump(settings, config_file, indent=4)
+        os.replace(temporary_file, self.config_file)
+
+
+# The session manager shared by the ``aws_tools`` functions
+_session_manager = SessionManager()
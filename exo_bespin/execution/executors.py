@@ -0,0 +1,871 @@
+"""This module contains execution backends for running ``exo_bespin``
+jobs on local or remote machines.
+
+Every backend implements the same ``boot``/``upload``/``run``/
+``download``/``release`` lifecycle, so that code which orchestrates a
+job (e.g. ``PlatonWrapper.retrieve`` or the ``bespin`` web app) does
+not need to know where the job is actually executed.  Available
+backends include:
+
+    - ``LocalExecutor`` - runs commands as subprocesses inside a
+      temporary directory that stands in for the remote ``$HOME``
+    - ``SSHExecutor`` - runs commands on any host reachable via SSH,
+      such as ``localhost`` or a local container running ``sshd``
+    - ``EC2Executor`` - starts (or creates) an AWS EC2 instance and
+      runs commands on it via SSH
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script is inteneded to be imported and used by other modules,
+    for example:
+
+        from exo_bespin.execution.executors import LocalExecutor
+
+        with LocalExecutor() as executor:
+            executor.upload('params.json')
+            output, errors = executor.run_python('run_fit.py')
+            executor.download('results/lc.dat')
+
+    Output can be followed while a command runs by passing an ``on_line``
+    function, which is given each line of standard output or error (or
+    each update of a progress bar) as soon as it arrives:
+
+        executor.run_python('run_fit.py', on_line=print)
+
+    A command that exits with a non-zero status raises a
+    ``CommandError``, which holds its exit status and output.
+
+    Executors may also be built by name, for example:
+
+        from exo_bespin.execution.executors import get_executor
+        executor = get_executor('ec2')
+
+Dependencies
+------------
+
+    Dependent libraries include:
+
+    - boto3
+    - paramiko
+    - scp
+"""
+
+import functools
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import paramiko
+from scp import SCPClient
+
+from exo_bespin.aws import aws_tools, session_manager
+from exo_bespin.logging import profiling
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+REMOTE_PYTHON_COMMAND = './exo_bespin/exo_bespin/aws/exo_bespin-env-init.sh python'
+REMOTE_REPO_DIR = 'exo_bespin'
+STREAM_CHUNK_SIZE = 4096
+
+
+def _check_status(command, status, output, errors):
+    """Return the output of a finished command, or raise an error if
+    it exited with a non-zero status.
+
+    Parameters
+    ----------
+    command : str
+        The command that was run
+    status : int
+        The exit status of the command
+    output : bytes
+        The raw standard output of the command
+    errors : bytes
+        The raw standard error of the command
+
+    Returns
+    -------
+    output : list
+        The lines of standard output of the command
+    errors : list
+        The lines of standard error of the command
+
+    Raises
+    ------
+    CommandError
+        If the command exited with a non-zero status
+    """
+
+    output, errors = _format_output(output), _format_output(errors)
+    if status != 0:
+        raise CommandError(command, status, output, errors)
+
+    return output, errors
+
+
+def _format_output(output):
+    """Return the given command output as a list of readable lines.
+
+    Parameters
+    ----------
+    output : bytes
+        The raw output of a command
+
+    Returns
+    -------
+    lines : list
+        The lines of the output
+    """
+
+    output = output.decode('utf-8')
+    lines = output.replace('\t', '  ').replace('\r', '').replace("\'", "").split('\n')
+
+    return lines
+
+
+def _stream_command(read_output, read_errors, on_line):
+    """Read the standard output and error of a running command to their
+    ends, passing each line to the given function as soon as it is
+    complete.
+
+    Parameters
+    ----------
+    read_output : func
+        A function that takes a number of bytes and returns up to that
+        many bytes of standard output as soon as any are available, or
+        no bytes once the output has ended
+    read_errors : func
+        The same, for standard error
+    on_line : func
+        A function that takes a line of output.  It is called from two
+        threads, one for each stream.
+
+    Returns
+    -------
+    output : bytes
+        The raw standard output of the command
+    errors : bytes
+        The raw standard error of the command
+    """
+
+    streams = {}
+    errors_thread = threading.Thread(target=lambda: streams.update(errors=_stream_lines(read_errors, on_line)))
+    errors_thread.start()
+    output = _stream_lines(read_output, on_line)
+    errors_thread.join()
+
+    return output, streams.get('errors', b'')
+
+
+def _stream_lines(read, on_line):
+    """Read a stream of command output to its end, passing each line to
+    the given function as soon as it is complete.
+
+    Lines end with either a newline or a carriage return, the latter
+    being used by progress bars (e.g. of ``tqdm``) to update the same
+    line.
+
+    Parameters
+    ----------
+    read : func
+        A function that takes a number of bytes and returns up to that
+        many bytes of the stream as soon as any are available, or no
+        bytes once the stream has ended
+    on_line : func
+        A function that takes a line of output
+
+    Returns
+    -------
+    output : bytes
+        The raw contents of the stream
+    """
+
+    chunks = []
+    line = b''
+    for chunk in iter(functools.partial(read, STREAM_CHUNK_SIZE), b''):
+        chunks.append(chunk)
+        lines = re.split(b'[\r\n]', line + chunk)
+        line = lines.pop()
+        for complete_line in lines:
+            if complete_line.strip():
+                on_line(complete_line.decode('utf-8', errors='replace'))
+    if line.strip():
+        on_line(line.decode('utf-8', errors='replace'))
+
+    return b''.join(chunks)
+
+
+def get_executor(backend, **kwargs):
+    """Return an executor for the given backend.
+
+    Parameters
+    ----------
+    backend : str
+        The name of the backend.  Can be ``local``, ``ssh``, or
+        ``ec2``.
+    **kwargs
+        Keyword arguments passed to the executor.  For ``ec2``, the
+        ``ssh_file`` and ``ec2_id`` default to the values in the
+        ``aws_config.json`` file.
+
+    Returns
+    -------
+    executor : obj
+        An ``Executor`` object
+    """
+
+    assert backend in ['local', 'ssh', 'ec2'], 'Unrecognized backend: {}'.format(backend)
+
+    if backend == 'local':
+        executor = LocalExecutor(**kwargs)
+    elif backend == 'ssh':
+        executor = SSHExecutor(**kwargs)
+    elif backend == 'ec2':
+        if not {'ssh_file', 'ec2_id'} <= set(kwargs):
+            kwargs.setdefault('ssh_file', aws_tools.get_config()['ssh_file'])
+            kwargs.setdefault('ec2_id', aws_tools.get_config()['ec2_id'])
+        executor = EC2Executor(**kwargs)
+
+    return executor
+
+
+class Executor():
+    """Base class for execution backends.
+
+    Subclasses must implement ``boot``, ``upload``, ``run``,
+    ``download``, and ``release``.  Executors can be used as context
+    managers, in which case they are booted on entry and released on
+    exit, even if an error occurs.
+    """
+
+    name = 'executor'
+
+    def __init__(self, python_command, repo_dir):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        python_command : str
+            The command used to invoke ``python`` within the
+            ``exo-bespin`` environment on the executing machine.
+        repo_dir : str
+            The location of the ``exo_bespin`` repository on the
+            executing machine.
+        """
+
+        self.python_command = python_command
+        self.repo_dir = repo_dir
+
+    def __enter__(self):
+
+        # Release whatever a failed boot has started (e.g. an EC2
+        # instance that never became reachable), since __exit__ is not
+        # called when __enter__ fails
+        try:
+            self.boot()
+        except Exception:
+            self.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def boot(self):
+        """Make the executing machine ready to accept commands."""
+
+        raise NotImplementedError
+
+    def download(self, filename, local_path='.'):
+        """Copy a file from the executing machine to the user.
+
+        Parameters
+        ----------
+        filename : str
+            The path to the file, relative to the executing machine's
+            working directory.
+        local_path : str
+            The local directory or path to copy the file to.
+        """
+
+        raise NotImplementedError
+
+    def release(self):
+        """Release the executing machine."""
+
+        raise NotImplementedError
+
+    def run(self, command, on_line=None):
+        """Execute the given command on the executing machine.
+
+        Parameters
+        ----------
+        command : str
+            The command to run (e.g. ``python run_myscript.py``)
+        on_line : func
+            An optional function that is given each line of standard
+            output and error as soon as it is produced
+
+        Returns
+        -------
+        output : list
+            The lines of standard output from running the command
+        errors : list
+            The lines of standard error from running the command
+
+        Raises
+        ------
+        CommandError
+            If the command exits with a non-zero status
+        """
+
+        raise NotImplementedError
+
+    def run_python(self, script, *args, on_line=None):
+        """Execute a script from the ``exo_bespin`` repository within
+        the ``exo-bespin`` environment on the executing machine.
+
+        Parameters
+        ----------
+        script : str
+            The path to the script relative to the top level of the
+            repository (e.g. ``run_fit.py``)
+        *args
+            Command line arguments for the script
+        on_line : func
+            An optional function that is given each line of standard
+            output and error as soon as it is produced
+
+        Returns
+        -------
+        output : list
+            The lines of standard output from running the script
+        errors : list
+            The lines of standard error from running the script
+
+        Raises
+        ------
+        CommandError
+            If the script exits with a non-zero status
+        """
+
+        command = ' '.join([self.python_command, os.path.join(self.repo_dir, script)] + [str(arg) for arg in args])
+        if on_line is not None:
+            return self.run(command, on_line=on_line)
+
+        return self.run(command)
+
+    def sync(self, local_dir, remote_dir):
+        """Incrementally copy a local directory to the executing
+        machine, transferring only the parts of files that changed
+        since the last sync (see ``aws_tools.sync_directory``).
+
+        Parameters
+        ----------
+        local_dir : str
+            The local directory to copy
+        remote_dir : str
+            The destination, relative to the executing machine's
+            working directory (e.g. ``exo_bespin``)
+
+        Returns
+        -------
+        stats : dict
+            The number of ``files``, ``blocks``, and ``bytes`` that
+            were transferred, and the number of files that were
+            ``deleted``
+        """
+
+        raise NotImplementedError
+
+    def upload(self, filename, remote_path=''):
+        """Copy a file from the user to the executing machine.
+
+        Parameters
+        ----------
+        filename : str
+            The local path to the file to transfer
+        remote_path : str
+            The destination, relative to the executing machine's
+            working directory.  Defaults to the working directory
+            itself.
+        """
+
+        raise NotImplementedError
+
+
+class LocalExecutor(Executor):
+    """Executes commands as local subprocesses.
+
+    Each executor gets its own working directory, which stands in for
+    the ``$HOME`` directory of a remote machine; commands are run from
+    within it with ``$HOME`` pointing to it.
+    """
+
+    name = 'local'
+
+    def __init__(self, work_dir=None, python_command=sys.executable, repo_dir=REPO_DIR):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        work_dir : str
+            The working directory for the executor.  If not provided, a
+            temporary directory is created on boot and removed on
+            release.
+        python_command : str
+            The command used to invoke ``python``.  Defaults to the
+            current interpreter.
+        repo_dir : str
+            The location of the ``exo_bespin`` repository.  Defaults to
+            the repository this module is installed from.
+        """
+
+        super().__init__(python_command, repo_dir)
+        self.work_dir = work_dir
+        self._temporary = work_dir is None
+
+    def boot(self):
+        """Create the working directory."""
+
+        if self._temporary:
+            self.work_dir = tempfile.mkdtemp(prefix='exo_bespin_')
+        os.makedirs(self.work_dir, exist_ok=True)
+        logging.info('Booted local executor in {}'.format(self.work_dir))
+
+    def download(self, filename, local_path='.'):
+        """Copy a file from the working directory to the user.
+
+        Parameters
+        ----------
+        filename : str
+            The path to the file, relative to the working directory.
+        local_path : str
+            The local directory or path to copy the file to.
+        """
+
+        logging.info('Copying {} from {}'.format(filename, self.work_dir))
+        shutil.copy(os.path.join(self.work_dir, filename), local_path)
+
+    def release(self):
+        """Remove the working directory if it was temporary."""
+
+        if self._temporary and self.work_dir is not None:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            self.work_dir = None
+        logging.info('Released local executor')
+
+    def run(self, command, on_line=None):
+        """Execute the given command from within the working directory.
+
+        Parameters
+        ----------
+        command : str
+            The command to run (e.g. ``python run_myscript.py``)
+        on_line : func
+            An optional function that is given each line of standard
+            output and error as soon as it is produced
+
+        Returns
+        -------
+        output : list
+            The lines of standard output from running the command
+        errors : list
+            The lines of standard error from running the command
+
+        Raises
+        ------
+        CommandError
+            If the command exits with a non-zero status
+        """
+
+        env = dict(os.environ, HOME=self.work_dir)
+        if on_line is None:
+            process = subprocess.run(command, shell=True, cwd=self.work_dir, env=env,
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output, errors = process.stdout, process.stderr
+        else:
+            with subprocess.Popen(command, shell=True, cwd=self.work_dir, env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+                output, errors = _stream_command(functools.partial(os.read, process.stdout.fileno()),
+                                                 functools.partial(os.read, process.stderr.fileno()), on_line)
+
+        return _check_status(command, process.returncode, output, errors)
+
+    def sync(self, local_dir, remote_dir):
+        """Incrementally copy a local directory into the working
+        directory.
+
+        Parameters
+        ----------
+        local_dir : str
+            The local directory to copy
+        remote_dir : str
+            The destination, relative to the working directory
+
+        Returns
+        -------
+        stats : dict
+            The number of ``files``, ``blocks``, and ``bytes`` that
+            were transferred, and the number of files that were
+            ``deleted``
+        """
+
+        destination = os.path.join(self.work_dir, remote_dir)
+        os.makedirs(destination, exist_ok=True)
+
+        return aws_tools.sync_directory(local_dir, destination, aws_tools.LocalFileSystem())
+
+    def upload(self, filename, remote_path=''):
+        """Copy a file from the user to the working directory.
+
+        Parameters
+        ----------
+        filename : str
+            The local path to the file to transfer
+        remote_path : str
+            The destination, relative to the working directory.
+        """
+
+        logging.info('Copying {} to {}'.format(filename, self.work_dir))
+        destination = os.path.join(self.work_dir, remote_path)
+        if os.path.dirname(destination):
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copy(filename, destination)
+
+
+class SSHExecutor(Executor):
+    """Executes commands on a host that is reachable via SSH.
+
+    This can be used to run jobs on ``localhost`` or on a local
+    container running ``sshd`` as a stand-in for an EC2 instance.  A
+    single SSH connection is reused for every command and transfer.
+    """
+
+    name = 'ssh'
+
+    def __init__(self, hostname=None, ssh_file=None, username='ec2-user', port=22,
+                 python_command=REMOTE_PYTHON_COMMAND, repo_dir=REMOTE_REPO_DIR):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        hostname : str
+            The host to connect to (e.g. ``localhost``)
+        ssh_file : str
+            The path to the private SSH key used to connect to the host
+        username : str
+            The user to log in as
+        port : int
+            The SSH port of the host
+        python_command : str
+            The command used to invoke ``python`` within the
+            ``exo-bespin`` environment on the host.
+        repo_dir : str
+            The location of the ``exo_bespin`` repository on the host,
+            relative to the user's home directory.
+        """
+
+        super().__init__(python_command, repo_dir)
+        self.hostname = hostname
+        self.ssh_file = ssh_file
+        self.username = username
+        self.port = port
+        self.key = None
+        self.client = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Connect to the host if not already connected, retrying while
+        the host is unreachable.  Threads that share the executor (e.g.
+        the stages of a ``Pipeline``) wait for the one that connects.
+
+        Returns
+        -------
+        client : obj
+            A connected ``paramiko.client.SSHClient`` object.
+        """
+
+        with self._lock:
+            if self.key is None:
+                self.key = session_manager.get_key(self.ssh_file)
+            if self.client is None:
+                self.client = paramiko.SSHClient()
+                self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+            transport = self.client.get_transport()
+            if transport is not None and transport.is_active():
+                return self.client
+
+            iterations = 0
+            while True:
+                try:
+                    self.client.connect(hostname=self.hostname, port=self.port, username=self.username, pkey=self.key)
+                    return self.client
+                except Exception:
+                    iterations += 1
+                    if iterations >= 10:
+                        logging.critical('Could not connect to {}'.format(self.hostname))
+                        raise
+                    logging.warning('Could not connect to {}, retrying.'.format(self.hostname))
+                    time.sleep(5)
+
+    def _scp(self):
+        """Return an ``SCPClient`` over the existing SSH connection.
+
+        Returns
+        -------
+        scp : obj
+            A ``scp.SCPClient`` object.
+        """
+
+        return SCPClient(self._connect().get_transport())
+
+    def boot(self):
+        """Connect to the host."""
+
+        self._connect()
+        logging.info('Connected to {}'.format(self.hostname))
+
+    def download(self, filename, local_path='.'):
+        """Copy a file from the host to the user.
+
+        Parameters
+        ----------
+        filename : str
+            The path to the file, relative to the user's home directory
+            on the host.
+        local_path : str
+            The local directory or path to copy the file to.
+        """
+
+        logging.info('Copying {} from {}'.format(filename, self.hostname))
+        self._scp().get(filename, local_path)
+
+    def release(self):
+        """Close the SSH connection."""
+
+        if self.client is not None:
+            self.client.close()
+        logging.info('Disconnected from {}'.format(self.hostname))
+
+    def run(self, command, on_line=None):
+        """Execute the given command on the host.
+
+        Parameters
+        ----------
+        command : str
+            The command to run (e.g. ``python run_myscript.py``)
+        on_line : func
+            An optional function that is given each line of standard
+            output and error as soon as it arrives from the host
+
+        Returns
+        -------
+        output : list
+            The lines of standard output from running the command
+        errors : list
+            The lines of standard error from running the command
+
+        Raises
+        ------
+        CommandError
+            If the command exits with a non-zero status
+        """
+
+        stdin, stdout, stderr = self._connect().exec_command(profiling.forward_environment(command))
+        if on_line is None:
+            output = stdout.read()
+            errors = stderr.read()
+        else:
+            output, errors = _stream_command(stdout.channel.recv, stdout.channel.recv_stderr, on_line)
+
+        return _check_status(command, stdout.channel.recv_exit_status(), output, errors)
+
+    def sync(self, local_dir, remote_dir):
+        """Incrementally copy a local directory to the host.
+
+        Parameters
+        ----------
+        local_dir : str
+            The local directory to copy
+        remote_dir : str
+            The destination, relative to the user's home directory on
+            the host.
+
+        Returns
+        -------
+        stats : dict
+            The number of ``files``, ``blocks``, and ``bytes`` that
+            were transferred, and the number of files that were
+            ``deleted``
+        """
+
+        sftp = self._connect().open_sftp()
+        try:
+            sftp.stat(remote_dir)
+        except IOError:
+            sftp.mkdir(remote_dir)
+        stats = aws_tools.sync_directory(local_dir, remote_dir, sftp)
+        sftp.close()
+
+        return stats
+
+    def upload(self, filename, remote_path=''):
+        """Copy a file from the user to the host.
+
+        Parameters
+        ----------
+        filename : str
+            The local path to the file to transfer
+        remote_path : str
+            The destination, relative to the user's home directory on
+            the host.
+        """
+
+        logging.info('Copying {} to {}'.format(filename, self.hostname))
+        remote_dir = os.path.dirname(remote_path)
+        if remote_dir:
+            self.run('mkdir -p {}'.format(remote_dir))
+        self._scp().put(filename, remote_path or '.')
+
+
+class EC2Executor(SSHExecutor):
+    """Executes commands on an AWS EC2 instance.
+
+    On boot, a new instance is created (if ``ec2_id`` is a launch
+    template ID) or an existing instance is started (if ``ec2_id`` is
+    an instance ID).  On release, the instance is terminated or
+    stopped, respectively.
+
+    Executors (e.g. of the workers of the ``bespin`` web app) given
+    the same instance ID share that instance: it is started by the
+    first of them to boot, and stopped once the last of them is
+    released.
+    """
+
+    name = 'ec2'
+
+    # The existing instances in use, and the number of executors using
+    # each of them, keyed by instance ID
+    _shared_instances = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, ssh_file, ec2_id, build_environment=False):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        ssh_file : str
+            Relative path to SSH public key to be used by AWS (e.g.
+            ``~/.ssh/exo_bespin.pem``).
+        ec2_id : str
+            The AWS EC2 template id (e.g. ``lt-021de8b904bc2b728``) or
+            instance ID (e.g. ``i-0d0c8ca4ab324b260``).
+        build_environment : bool
+            Whether to build the ``exo-bespin`` environment on the
+            instance after it boots, rather than waiting for it to be
+            built by the instance's user data.
+        """
+
+        super().__init__(ssh_file=ssh_file)
+        self.ec2_id = ec2_id
+        self.build_environment = build_environment
+        self.instance = None
+
+    def _is_shared(self):
+        """Return whether ``ec2_id`` is an existing instance, which is
+        shared with other executors, rather than a launch template.
+
+        Returns
+        -------
+        shared : bool
+            Whether the instance is shared
+        """
+
+        return self.ec2_id.split('-')[0] != 'lt'
+
+    def boot(self):
+        """Start or create the EC2 instance and wait for the
+        ``exo-bespin`` environment to be ready."""
+
+        if not self._is_shared():
+            self.instance, self.key, self.client = aws_tools.start_ec2(self.ssh_file, self.ec2_id)
+        else:
+            with self._shared_lock:
+                instance, n_users = self._shared_instances.get(self.ec2_id, (None, 0))
+                if instance is None:
+                    self.instance, self.key, self.client = aws_tools.start_ec2(self.ssh_file, self.ec2_id)
+                else:
+                    self.instance = instance
+                    self.key = session_manager.get_key(self.ssh_file)
+                    self.client = paramiko.SSHClient()
+                    self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                self._shared_instances[self.ec2_id] = (self.instance, n_users + 1)
+        self.hostname = self.instance.public_dns_name
+
+        if self.build_environment:
+            aws_tools.build_environment(self.instance, self.key, self.client)
+        else:
+            aws_tools.wait_for_instance(self.instance, self.key, self.client)
+
+    def release(self):
+        """Close the SSH connection and stop or terminate the EC2
+        instance, unless other executors are still using it."""
+
+        super().release()
+        if self.instance is None:
+            return
+
+        if not self._is_shared():
+            aws_tools.stop_ec2(self.ec2_id, self.instance)
+        else:
+            with self._shared_lock:
+                instance, n_users = self._shared_instances.pop(self.ec2_id)
+                if n_users > 1:
+                    self._shared_instances[self.ec2_id] = (instance, n_users - 1)
+                    logging.info('EC2 instance {} is still used by {} executors'.format(self.ec2_id, n_users - 1))
+                else:
+                    aws_tools.stop_ec2(self.ec2_id, self.instance)
+        self.instance = None
+
+
+class CommandError(RuntimeError):
+    """Raised when a command run by an executor exits with a non-zero
+    status."""
+
+    def __init__(self, command, status, output, errors):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        command : str
+            The command that was run
+        status : int
+            The exit status of the command
+        output : list
+            The lines of standard output of the command
+        errors : list
+            The lines of standard error of the command
+        """
+
+        message = 'Command {} exited with status {}'.format(command, status)
+        last_errors = [line for line in errors if line.strip()][-5:]
+        if last_errors:
+            message += ':\n' + '\n'.join(last_errors)
+        super().__init__(message)
+        self.command = command
+        self.status = status
+        self.output = output
+        self.errors = errors
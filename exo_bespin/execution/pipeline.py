@@ -0,0 +1,292 @@
+"""This module contains a pipelined orchestrator that overlaps the
+independent stages of running jobs on an executor.
+
+Run strictly in sequence, a job waits for the executing machine to boot
+before its inputs are even prepared, and the machine sits idle while
+the results of one job are downloaded before the next job starts.  The
+``Pipeline`` instead runs the stages concurrently where they do not
+depend on each other:
+
+    - the inputs of every job are prepared while the machine boots
+    - the inputs of the next job are uploaded while the current job
+      computes
+    - the outputs of each job are downloaded while the next job
+      computes
+    - the machine is released in the background once all downloads
+      have finished (or, if a stage fails, once the stages already
+      under way have finished, and those not yet started have been
+      cancelled), and any error releasing it is raised by ``wait``
+
+The start and end time of every stage of every job is recorded, and a
+Gantt-style report of the timings is written to the log.  Callers that
+show progress (e.g. the ``bespin`` web app) can also be told when each
+stage starts, and be given each line of output of a job as it runs.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script is inteneded to be imported and used by other modules,
+    for example:
+
+        from exo_bespin.execution.executors import get_executor
+        from exo_bespin.execution.pipeline import Pipeline
+        from exo_bespin.execution.scheduler import Job
+
+        job = Job('fit', 'run_fit.py', prepare=write_params, uploads=['params.json'],
+                  downloads=['results/lc.dat'])
+        pipeline = Pipeline(get_executor('ec2'))
+        outputs = pipeline.run([job])
+        print(pipeline.report())
+        pipeline.wait()
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import functools
+import logging
+import threading
+import time
+
+from exo_bespin.logging import tracing
+
+
+class Pipeline():
+    """Runs jobs on a single executor, overlapping independent
+    stages."""
+
+    def __init__(self, executor, setup=None, teardown=None, on_stage=None, on_output=None):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        executor : obj
+            An un-booted ``Executor`` object
+        setup : func
+            An optional function that takes the booted executor and
+            prepares it for running jobs.  It is run as part of the
+            ``boot`` stage.
+        teardown : func
+            An optional function that takes the executor and undoes
+            the ``setup`` function (e.g. stops what it started).  It is
+            run as part of the ``release`` stage, before the executor
+            is released, if the setup function has run.
+        on_stage : func
+            An optional function that takes a job ID (``executor`` for
+            the ``boot`` and ``release`` stages) and the name of a
+            stage, and is called as each stage starts
+        on_output : func
+            An optional function that takes a job ID and a line of
+            output, and is called with each line of output of the job
+            as it is produced
+        """
+
+        self.executor = executor
+        self.setup = setup
+        self.teardown = teardown
+        self.on_stage = on_stage
+        self.on_output = on_output
+        self.timings = []
+        self._lock = threading.Lock()
+        self._release = None
+        self._set_up = False
+        self._start_time = None
+
+    def _boot(self):
+        """Boot the executor and run the setup function."""
+
+        self.executor.boot()
+        if self.setup is not None:
+            self.setup(self.executor)
+            self._set_up = True
+
+    def _download(self, job, local_dir):
+        """Download the outputs of the given job, and then remove its
+        ``cleanup`` paths from the executing machine.
+
+        Parameters
+        ----------
+        job : obj
+            A ``Job`` object
+        local_dir : str
+            The local directory to download the outputs to
+        """
+
+        for filename in job.downloads:
+            self.executor.download(filename, local_dir)
+        for path in job.cleanup:
+            self.executor.run('rm -rf {}'.format(path))
+
+    def _release_executor(self):
+        """Run the teardown function, if the setup function has run,
+        and release the executor, even if the teardown fails."""
+
+        try:
+            if self.teardown is not None and self._set_up:
+                self.teardown(self.executor)
+        finally:
+            self.executor.release()
+
+    def _stage(self, job_id, stage, function, *args):
+        """Run the given function as a stage of the given job and record
+        its timing.
+
+        Parameters
+        ----------
+        job_id : str
+            The job identifier
+        stage : str
+            The name of the stage (e.g. ``upload``)
+        function : func
+            The function to run
+        *args
+            Arguments for the function
+
+        Returns
+        -------
+        result : obj
+            The return value of the function
+        """
+
+        if self.on_stage is not None:
+            self.on_stage(job_id, stage)
+
+        start = time.time() - self._start_time
+        try:
+            with tracing.span('pipeline.{}'.format(stage), job_id=job_id):
+                return function(*args)
+        finally:
+            end = time.time() - self._start_time
+            with self._lock:
+                self.timings.append((job_id, stage, start, end))
+            logging.info('Stage {} of job {} took {:.3f} seconds'.format(stage, job_id, end - start),
+                         extra={'job_id': job_id, 'stage': stage, 'duration': end - start})
+
+    def _upload(self, job, boot, prepare):
+        """Upload the inputs of the given job once the executor has
+        booted and the inputs have been prepared.
+
+        Parameters
+        ----------
+        job : obj
+            A ``Job`` object
+        boot : obj
+            The ``Future`` of the boot stage
+        prepare : obj
+            The ``Future`` of the job's prepare stage, or ``None``
+        """
+
+        boot.result()
+        if prepare is not None:
+            prepare.result()
+
+        for upload in job.uploads:
+            if isinstance(upload, str):
+                upload = (upload, '')
+            self.executor.upload(*upload)
+
+    def report(self, width=50):
+        """Return a Gantt-style report of the timing of each stage.
+
+        Parameters
+        ----------
+        width : int
+            The width of the chart in characters
+
+        Returns
+        -------
+        report : str
+            The report
+        """
+
+        with self._lock:
+            timings = sorted(self.timings, key=lambda timing: timing[2])
+        total = max([end for _, _, _, end in timings] + [1e-9])
+
+        lines = ['{:<16} {:<9} {:>8} {:>8}  {}'.format('job', 'stage', 'start', 'end', 'timeline')]
+        for job_id, stage, start, end in timings:
+            offset = int(round(start / total * width))
+            length = max(1, int(round((end - start) / total * width)))
+            bar = (' ' * offset + '#' * length)[:width]
+            lines.append('{:<16} {:<9} {:>7.2f}s {:>7.2f}s |{:<{width}}|'.format(
+                job_id, stage, start, end, bar, width=width))
+
+        return '\n'.join(lines)
+
+    def run(self, jobs, local_dir='.'):
+        """Run the given jobs and download their outputs.
+
+        This returns once all outputs have been downloaded; the
+        executor is then released in the background (see ``wait``).
+        If a stage fails, the stages that have not started are
+        cancelled, and the executor is released once those under way
+        have finished, so that it is not released while in use.
+
+        Parameters
+        ----------
+        jobs : list
+            The ``Job`` objects to run.  Each job's ``prepare`` function
+            (if any) is run while the executor boots.
+        local_dir : str
+            The local directory to download outputs to
+
+        Returns
+        -------
+        outputs : dict
+            The ``(output, errors)`` of each job, keyed by job ID
+        """
+
+        self._start_time = time.time()
+        pool = ThreadPoolExecutor(max_workers=4)
+        outputs = {}
+        stages = []
+
+        try:
+            boot = pool.submit(self._stage, 'executor', 'boot', self._boot)
+            prepares = [pool.submit(self._stage, job.job_id, 'prepare', job.prepare) if job.prepare else None
+                        for job in jobs]
+            uploads = [pool.submit(self._stage, job.job_id, 'upload', self._upload, job, boot, prepare)
+                       for job, prepare in zip(jobs, prepares)]
+            stages.extend([boot] + [prepare for prepare in prepares if prepare is not None] + uploads)
+
+            downloads = []
+            for job, upload in zip(jobs, uploads):
+                upload.result()
+                compute = functools.partial(self.executor.run_python, job.script, *job.args)
+                if self.on_output is not None:
+                    compute = functools.partial(compute, on_line=functools.partial(self.on_output, job.job_id))
+                outputs[job.job_id] = self._stage(job.job_id, 'compute', compute)
+                downloads.append(pool.submit(self._stage, job.job_id, 'download', self._download, job, local_dir))
+                stages.append(downloads[-1])
+
+            for download in downloads:
+                download.result()
+
+        finally:
+            for stage in stages:
+                stage.cancel()
+            wait(stages)
+            self._release = pool.submit(self._stage, 'executor', 'release', self._release_executor)
+            pool.shutdown(wait=False)
+
+        logging.info('Pipeline timings:')
+        for line in self.report().split('\n'):
+            logging.info(line)
+
+        return outputs
+
+    def wait(self):
+        """Wait for the executor to be released, raising the error of
+        the release, if it failed (e.g. if an EC2 instance could not be
+        stopped)."""
+
+        if self._release is not None:
+            self._release.result()
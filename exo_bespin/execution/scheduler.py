@@ -0,0 +1,454 @@
+"""This module contains a scheduler that distributes a queue of jobs
+across multiple executors.
+
+Each of the ``M`` executors (e.g. ``M`` EC2 instances, or ``M`` local
+subprocess executors) is booted once and then repeatedly takes the next
+job from the queue, uploads its inputs, runs it, and downloads its
+outputs into a per-job directory.  If an executor fails while running a
+job (e.g. its connection is lost), the executor is released and
+replaced and the job is put back on the queue, up to a maximum number
+of attempts.  A job that itself fails (i.e. exits with a non-zero
+status) is marked as failed at once, without being retried, and its
+executor is kept for the next job.  The state of every job
+is tracked in a local ``sqlite`` job database, so that a campaign that
+is interrupted can be resumed without re-running finished jobs.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script is inteneded to be imported and used by other modules,
+    for example:
+
+        from exo_bespin.execution.executors import get_executor
+        from exo_bespin.execution.scheduler import Scheduler, retrieval_job
+
+        scheduler = Scheduler(lambda: get_executor('ec2'), n_executors=4)
+        for target in targets:
+            scheduler.submit(retrieval_job(target, os.path.join('jobs', target), 'multinest'))
+        report = scheduler.run()
+
+    The returned report contains the throughput of the campaign and the
+    utilization of each executor.
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+"""
+
+import collections
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from exo_bespin.execution.executors import CommandError
+
+
+def retrieval_job(job_id, job_dir, method):
+    """Return a ``Job`` that performs an atmospheric retrieval from the
+    given job specification.
+
+    Parameters
+    ----------
+    job_id : str
+        A unique identifier for the job (e.g. ``hd209458b``)
+    job_dir : str
+        The directory containing the job specification written by
+        ``PlatonWrapper.save_job_spec``
+    method : str
+        The retrieval method.  Can either be ``emcee`` or
+        ``multinest``.
+
+    Returns
+    -------
+    job : obj
+        A ``Job`` object
+    """
+
+    assert method in ['multinest', 'emcee'], 'Unrecognized method: {}'.format(method)
+
+    if method == 'emcee':
+        downloads = ['emcee_results.obj', 'emcee_corner.png']
+    elif method == 'multinest':
+        downloads = ['multinest_results.dat', 'multinest_corner.png']
+
+    job = Job(job_id, 'exo_bespin/atmospheric_retrievals/platon_wrapper.py', args=[method],
+              uploads=[os.path.join(job_dir, 'job.json'), os.path.join(job_dir, 'job.npz')], downloads=downloads)
+
+    return job
+
+
+class Job():
+    """A unit of work for the ``Scheduler``."""
+
+    def __init__(self, job_id, script, args=(), uploads=(), downloads=(), prepare=None, cleanup=()):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        job_id : str
+            A unique identifier for the job
+        script : str
+            The script to run, relative to the top level of the
+            ``exo_bespin`` repository (see ``Executor.run_python``)
+        args : list
+            Command line arguments for the script
+        uploads : list
+            The files to upload before running the script.  Each item is
+            either a local path, or a ``(local_path, remote_path)``
+            tuple.
+        downloads : list
+            The files to download after running the script, relative to
+            the executor's working directory.
+        prepare : func
+            An optional function, taking no arguments, that writes the
+            files to upload.  It is run locally before uploading.
+        cleanup : list
+            The files or directories to remove from the executing
+            machine once the outputs have been downloaded, relative to
+            the executor's working directory.
+        """
+
+        self.job_id = job_id
+        self.script = script
+        self.args = list(args)
+        self.uploads = list(uploads)
+        self.downloads = list(downloads)
+        self.prepare = prepare
+        self.cleanup = list(cleanup)
+        self.attempts = 0
+
+
+class JobDatabase():
+    """A local ``sqlite`` database that tracks the status of jobs.
+
+    Jobs are either ``queued``, ``running``, ``done``, or ``failed``.
+    The database may be shared by multiple threads.
+    """
+
+    def __init__(self, filename):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        filename : str
+            The path to the database file.  Use ``:memory:`` for a
+            database that is not saved to disk.
+        """
+
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'job_id TEXT PRIMARY KEY, status TEXT, attempts INTEGER, executor TEXT, '
+                'submitted REAL, started REAL, finished REAL, error TEXT)')
+
+    def _execute(self, statement, parameters=()):
+        """Execute the given SQL statement and return all result rows.
+
+        Parameters
+        ----------
+        statement : str
+            The SQL statement
+        parameters : tuple
+            Values for the placeholders of the statement
+
+        Returns
+        -------
+        rows : list
+            The result rows
+        """
+
+        with self._lock, self._connection:
+            rows = self._connection.execute(statement, parameters).fetchall()
+
+        return rows
+
+    def add(self, job_id):
+        """Add a queued job to the database, unless it already exists.
+
+        Parameters
+        ----------
+        job_id : str
+            The job identifier
+        """
+
+        self._execute('INSERT OR IGNORE INTO jobs (job_id, status, attempts, submitted) VALUES (?, ?, 0, ?)',
+                      (job_id, 'queued', time.time()))
+
+    def counts(self):
+        """Return the number of jobs with each status.
+
+        Returns
+        -------
+        counts : dict
+            The number of jobs, keyed by status
+        """
+
+        return dict(self._execute('SELECT status, COUNT(*) FROM jobs GROUP BY status'))
+
+    def status(self, job_id):
+        """Return the status of the given job.
+
+        Parameters
+        ----------
+        job_id : str
+            The job identifier
+
+        Returns
+        -------
+        status : str or None
+            The status of the job, or ``None`` if the job is unknown
+        """
+
+        rows = self._execute('SELECT status FROM jobs WHERE job_id = ?', (job_id,))
+
+        return rows[0][0] if rows else None
+
+    def update(self, job_id, status, **fields):
+        """Update the status (and optionally other fields) of a job.
+
+        Parameters
+        ----------
+        job_id : str
+            The job identifier
+        status : str
+            The new status of the job
+        **fields
+            Other columns to update (e.g. ``executor``, ``error``)
+        """
+
+        columns = ['status'] + list(fields)
+        assignments = ', '.join('{} = ?'.format(column) for column in columns)
+        values = [status] + list(fields.values()) + [job_id]
+        self._execute('UPDATE jobs SET {} WHERE job_id = ?'.format(assignments), values)
+
+
+class Scheduler():
+    """Distributes queued jobs across multiple executors."""
+
+    def __init__(self, executor_factory, n_executors, database='jobs.db', output_dir='.', max_attempts=3):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        executor_factory : func
+            A function that takes no arguments and returns a new,
+            un-booted ``Executor`` object.
+        n_executors : int
+            The number of executors to run jobs on concurrently
+        database : str
+            The path to the job database
+        output_dir : str
+            The directory in which per-job output directories are
+            created
+        max_attempts : int
+            The number of times a job is attempted, if its executor
+            fails, before it is marked as failed
+        """
+
+        self.executor_factory = executor_factory
+        self.n_executors = n_executors
+        self.database = JobDatabase(database)
+        self.output_dir = output_dir
+        self.max_attempts = max_attempts
+
+        self._queue = queue.Queue()
+        self._outstanding = 0
+        self._lock = threading.Lock()
+        self._utilization = {}
+        self._finished = collections.Counter()
+
+    def _finish(self, status):
+        """Record that a job has reached a final state.
+
+        Parameters
+        ----------
+        status : str
+            The final state of the job (``done`` or ``failed``)
+        """
+
+        with self._lock:
+            self._outstanding -= 1
+            self._finished[status] += 1
+
+    def _run_job(self, executor, job):
+        """Upload, run, and download the given job with the given
+        executor.
+
+        Parameters
+        ----------
+        executor : obj
+            A booted ``Executor`` object
+        job : obj
+            The ``Job`` to run
+
+        Raises
+        ------
+        CommandError
+            If the job exits with a non-zero status, in which case its
+            outputs are not downloaded
+        """
+
+        if job.prepare is not None:
+            job.prepare()
+
+        for upload in job.uploads:
+            if isinstance(upload, str):
+                upload = (upload, '')
+            executor.upload(*upload)
+
+        try:
+            output, errors = executor.run_python(job.script, *job.args)
+        except CommandError as error:
+            logging.info('Output of failed job {}:'.format(job.job_id))
+            for line in error.output + error.errors:
+                logging.info(line)
+            raise
+        logging.info('Output of job {}:'.format(job.job_id))
+        for line in output + errors:
+            logging.info(line)
+
+        job_dir = os.path.join(self.output_dir, job.job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        for filename in job.downloads:
+            executor.download(filename, job_dir)
+        for path in job.cleanup:
+            executor.run('rm -rf {}'.format(path))
+
+    def _worker(self, slot):
+        """Repeatedly run jobs from the queue on one executor until all
+        jobs have reached a final state.
+
+        Parameters
+        ----------
+        slot : int
+            The index of the executor slot
+        """
+
+        name = 'executor-{}'.format(slot)
+        start_time = time.time()
+        busy_time = 0.
+        executor = None
+
+        while True:
+            with self._lock:
+                if self._outstanding == 0:
+                    break
+            try:
+                job = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            job.attempts += 1
+            job_start = time.time()
+            try:
+                if executor is None:
+                    executor = self.executor_factory()
+                    executor.boot()
+                self.database.update(job.job_id, 'running', executor=name, attempts=job.attempts, started=job_start)
+                self._run_job(executor, job)
+            except CommandError as error:
+
+                # The job itself failed, so it would fail again, and its
+                # executor is still fine to run the next job
+                logging.warning('Job {} failed on {}: {}'.format(job.job_id, name, error))
+                self.database.update(job.job_id, 'failed', finished=time.time(), error=str(error))
+                self._finish('failed')
+            except Exception as error:
+                logging.warning('Job {} failed on {}: {}'.format(job.job_id, name, error))
+
+                # Replace the executor, since it may be in a bad state
+                if executor is not None:
+                    try:
+                        executor.release()
+                    except Exception:
+                        logging.warning('Could not release {}'.format(name))
+                    executor = None
+
+                if job.attempts < self.max_attempts:
+                    self.database.update(job.job_id, 'queued', attempts=job.attempts, error=str(error))
+                    self._queue.put(job)
+                else:
+                    self.database.update(job.job_id, 'failed', finished=time.time(), error=str(error))
+                    self._finish('failed')
+            else:
+                self.database.update(job.job_id, 'done', finished=time.time())
+                self._finish('done')
+            busy_time += time.time() - job_start
+
+        if executor is not None:
+            executor.release()
+
+        with self._lock:
+            self._utilization[name] = busy_time / max(time.time() - start_time, 1e-9)
+
+    def run(self):
+        """Run all submitted jobs and return a report of the campaign.
+
+        Returns
+        -------
+        report : dict
+            The number of jobs completed and failed in this run, the
+            wall time, the throughput (in jobs per second), and the
+            utilization (the fraction of time spent running jobs) of
+            each executor.  Jobs that were already done in the job
+            database are not counted.
+        """
+
+        logging.info('Running {} jobs on {} executors'.format(self._outstanding, self.n_executors))
+        start_time = time.time()
+        with self._lock:
+            self._finished.clear()
+            self._utilization.clear()
+
+        workers = [threading.Thread(target=self._worker, args=(slot,)) for slot in range(self.n_executors)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        wall_time = time.time() - start_time
+        report = {
+            'jobs_completed': self._finished['done'],
+            'jobs_failed': self._finished['failed'],
+            'wall_time': wall_time,
+            'throughput': self._finished['done'] / wall_time,
+            'utilization': dict(self._utilization)}
+
+        logging.info('Completed {} jobs ({} failed) in {:.2f} seconds ({:.3f} jobs/second)'.format(
+            report['jobs_completed'], report['jobs_failed'], wall_time, report['throughput']))
+        for name, utilization in sorted(report['utilization'].items()):
+            logging.info('Utilization of {}: {:.1%}'.format(name, utilization))
+
+        return report
+
+    def submit(self, job):
+        """Add a job to the queue.  Jobs that are already marked as done
+        in the job database are skipped.
+
+        Parameters
+        ----------
+        job : obj
+            The ``Job`` to run
+        """
+
+        self.database.add(job.job_id)
+        if self.database.status(job.job_id) == 'done':
+            logging.info('Skipping job {}, which is already done'.format(job.job_id))
+            return
+
+        self.database.update(job.job_id, 'queued')
+        with self._lock:
+            self._outstanding += 1
+        self._queue.put(job)
@@ -0,0 +1,327 @@
+#! /usr/bin/env python
+
+"""A lightweight resource sampler that runs next to a job on the
+executing machine.
+
+The sampler starts the job as a child process and, until the job
+finishes, records a sample every few seconds of:
+
+    - the utilization of each CPU core
+    - the 1-minute load average
+    - the resident memory (RSS) of the job and all of its children
+    - the memory in use on the whole machine
+    - the data read from and written to disk
+
+Samples are read from ``/proc`` (so only Linux is supported) and are
+appended to a CSV file as they are taken, so that the time series
+survives a job that crashes.  The sampler exits with the return code
+of the job, and only uses the standard library, so it adds no start-up
+cost beyond that of the interpreter.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    On the executing machine, a job is run under the sampler via the
+    command line as such:
+
+        >>> python telemetry.py --output telemetry.csv --interval 2 exo_bespin/atmospheric_retrievals/platon_wrapper.py multinest
+
+    where the job's script is given relative to the top level of the
+    repository.  Jobs run by the retrieval daemon are instead sampled
+    by the daemon's child process that runs them (see
+    ``sample_process``).  Once the CSV file has been fetched, it can be
+    summarized with ``summarize`` (see also ``aws_tools.log_telemetry``).
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+"""
+
+import argparse
+import csv
+import logging
+import os
+import subprocess
+import sys
+import time
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SAMPLE_INTERVAL = 2
+SECTOR_SIZE = 512
+TELEMETRY_FILE = 'telemetry.csv'
+TELEMETRY_SCRIPT = 'exo_bespin/execution/telemetry.py'
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', type=str, default=TELEMETRY_FILE, help='The CSV file to write samples to')
+    parser.add_argument('--interval', type=float, default=SAMPLE_INTERVAL, help='Seconds between samples')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='The script to run, relative to the top level of the repository, and its arguments')
+    args = parser.parse_args()
+
+    return args
+
+
+def _read_cpu_times():
+    """Return the busy and total CPU time of each core.
+
+    Returns
+    -------
+    cpu_times : list
+        A ``(busy, total)`` tuple of clock ticks for each core
+    """
+
+    cpu_times = []
+    with open('/proc/stat', 'r') as f:
+        for line in f:
+            fields = line.split()
+            if fields[0].startswith('cpu') and fields[0] != 'cpu':
+                ticks = [int(field) for field in fields[1:]]
+                idle = ticks[3] + (ticks[4] if len(ticks) > 4 else 0)
+                cpu_times.append((sum(ticks) - idle, sum(ticks)))
+
+    return cpu_times
+
+
+def _read_disk_bytes():
+    """Return the total number of bytes read from and written to the
+    machine's disks since boot.
+
+    Returns
+    -------
+    read_bytes : int
+        The number of bytes read
+    written_bytes : int
+        The number of bytes written
+    """
+
+    disks = [disk for disk in os.listdir('/sys/block') if not disk.startswith(('loop', 'ram'))]
+
+    read_bytes, written_bytes = 0, 0
+    with open('/proc/diskstats', 'r') as f:
+        for line in f:
+            fields = line.split()
+            if fields[2] in disks:
+                read_bytes += int(fields[5]) * SECTOR_SIZE
+                written_bytes += int(fields[9]) * SECTOR_SIZE
+
+    return read_bytes, written_bytes
+
+
+def _read_memory_used():
+    """Return the memory in use on the machine.
+
+    Returns
+    -------
+    memory_used : int
+        The memory in use, in bytes
+    """
+
+    meminfo = {}
+    with open('/proc/meminfo', 'r') as f:
+        for line in f:
+            name, value = line.split(':')
+            meminfo[name] = int(value.split()[0]) * 1024
+
+    return meminfo['MemTotal'] - meminfo.get('MemAvailable', meminfo['MemFree'])
+
+
+def _read_tree_rss(pid):
+    """Return the resident memory of the given process and all of its
+    descendants.
+
+    Parameters
+    ----------
+    pid : int
+        The process ID
+
+    Returns
+    -------
+    rss : int
+        The resident memory, in bytes
+    """
+
+    # Map each process to its parent
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry), 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        parent = int(stat[stat.rindex(')') + 2:].split()[1])
+        children.setdefault(parent, []).append(int(entry))
+
+    rss = 0
+    pids = [pid]
+    while pids:
+        process = pids.pop()
+        pids.extend(children.get(process, []))
+        try:
+            with open('/proc/{}/statm'.format(process), 'r') as f:
+                rss += int(f.read().split()[1]) * PAGE_SIZE
+        except OSError:
+            continue
+
+    return rss
+
+
+def sample(command, output=TELEMETRY_FILE, interval=SAMPLE_INTERVAL):
+    """Run the given command, sampling resource use into a CSV file
+    until it finishes.
+
+    Parameters
+    ----------
+    command : list
+        The command to run
+    output : str
+        The CSV file to write samples to
+    interval : float
+        The number of seconds between samples
+
+    Returns
+    -------
+    return_code : int
+        The return code of the command
+    """
+
+    process = subprocess.Popen(command)
+
+    def wait(timeout):
+        try:
+            process.wait(timeout=timeout)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+
+    sample_process(process.pid, wait, output, interval)
+
+    return process.returncode
+
+
+def sample_process(pid, wait, output=TELEMETRY_FILE, interval=SAMPLE_INTERVAL):
+    """Sample resource use into a CSV file until the given process
+    finishes.
+
+    This is used by ``sample``, and by jobs that are not started by
+    the sampler, such as those of the retrieval daemon, which sample
+    themselves from a background thread.
+
+    Parameters
+    ----------
+    pid : int
+        The ID of the process whose resident memory (and that of its
+        descendants) is sampled
+    wait : func
+        A function that takes a number of seconds, waits up to that
+        long for the process to finish, and returns whether it has
+        finished (e.g. ``threading.Event.wait``)
+    output : str
+        The CSV file to write samples to
+    interval : float
+        The number of seconds between samples
+    """
+
+    if not os.path.exists('/proc/stat'):
+        logging.warning('Resource sampling is only supported on Linux')
+        while not wait(interval):
+            pass
+        return
+
+    start_time = time.time()
+    cpu_times = _read_cpu_times()
+    disk_bytes = _read_disk_bytes()
+    header = ['time', 'load_1m', 'rss_mb', 'memory_used_mb', 'read_mb', 'write_mb'] + \
+             ['cpu_{}'.format(core) for core in range(len(cpu_times))]
+
+    with open(output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+
+        finished = False
+        while not finished:
+            finished = wait(interval)
+
+            # Utilization of each core, and disk I/O, over the interval
+            new_cpu_times = _read_cpu_times()
+            utilization = [100. * (busy - old_busy) / max(total - old_total, 1)
+                           for (busy, total), (old_busy, old_total) in zip(new_cpu_times, cpu_times)]
+            new_disk_bytes = _read_disk_bytes()
+            read_mb, write_mb = [(new - old) / 1e6 for new, old in zip(new_disk_bytes, disk_bytes)]
+            cpu_times, disk_bytes = new_cpu_times, new_disk_bytes
+
+            row = [time.time() - start_time, os.getloadavg()[0], _read_tree_rss(pid) / 1e6,
+                   _read_memory_used() / 1e6, read_mb, write_mb] + utilization
+            writer.writerow(['{:.3f}'.format(value) for value in row])
+            f.flush()
+
+
+def summarize(filename):
+    """Summarize the samples in the given CSV file.
+
+    Parameters
+    ----------
+    filename : str
+        The CSV file written by ``sample``
+
+    Returns
+    -------
+    summary : dict
+        The ``duration`` (in seconds) and number of ``samples``, the
+        ``mean_cpu`` and ``peak_cpu`` utilization (in percent, averaged
+        over cores), the ``busiest_core`` utilization (in percent,
+        averaged over time), the ``mean_load`` and ``peak_load``, the
+        ``peak_rss_mb`` of the job, the ``peak_memory_used_mb`` of the
+        machine, and the total ``read_mb`` and ``write_mb``
+    """
+
+    with open(filename, 'r', newline='') as f:
+        rows = [{key: float(value) for key, value in row.items()} for row in csv.DictReader(f)]
+
+    if not rows:
+        return {'duration': 0., 'samples': 0}
+
+    cores = [key for key in rows[0] if key.startswith('cpu_')]
+    cpu = [sum(row[core] for core in cores) / len(cores) for row in rows]
+    summary = {
+        'duration': rows[-1]['time'],
+        'samples': len(rows),
+        'mean_cpu': sum(cpu) / len(cpu),
+        'peak_cpu': max(cpu),
+        'busiest_core': max(sum(row[core] for row in rows) / len(rows) for core in cores),
+        'mean_load': sum(row['load_1m'] for row in rows) / len(rows),
+        'peak_load': max(row['load_1m'] for row in rows),
+        'peak_rss_mb': max(row['rss_mb'] for row in rows),
+        'peak_memory_used_mb': max(row['memory_used_mb'] for row in rows),
+        'read_mb': sum(row['read_mb'] for row in rows),
+        'write_mb': sum(row['write_mb'] for row in rows)}
+
+    return summary
+
+
+if __name__ == '__main__':
+
+    args = _parse_args()
+    assert args.command, 'No command was given'
+
+    script, script_args = args.command[0], args.command[1:]
+    command = [sys.executable, os.path.join(REPO_DIR, script)] + script_args
+    sys.exit(sample(command, args.output, args.interval))
@@ -0,0 +1,399 @@
+#! /usr/bin/env python
+
+"""Builds and queries a small ``sqlite`` index of structured (``jsonl``)
+log files, so that questions such as "what was the 95th percentile
+retrieval time for multinest over the last week?" can be answered
+without reading every log file.
+
+The index holds one row per log record that has a ``stage`` (e.g. the
+``retrieve`` stage of a ``PlatonWrapper``, or the ``upload`` stage of a
+``Pipeline`` job), with its time, level, job ID, method, duration, and
+message, and is indexed by stage, method, and time.  Updating the index
+is incremental:
+
+    - Log files that have not changed since the last update are
+      skipped after a single ``stat``.
+    - Log files that have grown (log files are only appended to) are
+      read from where the last update stopped.
+    - Log files that have shrunk or been replaced are re-indexed, and
+      records of log files that no longer exist are removed.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    The index can be updated and queried via the command line as such:
+
+        >>> python log_index.py --log-dir ~/exo_bespin_logs --stage retrieve --method multinest --since 7d --percentile 95
+
+    or from within python:
+
+        from exo_bespin.logging.log_index import LogIndex
+
+        index = LogIndex('log_index.sqlite')
+        index.update(['~/exo_bespin_logs'])
+        p95 = index.percentile('retrieve', 95, method='multinest', since=time.time() - 7 * 86400)
+
+Dependencies
+------------
+
+    - ``exo_bespin``
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import sqlite3
+import time
+
+INDEX_FILE = os.path.join(os.path.expanduser('~'), 'exo_bespin_logs', 'log_index.sqlite')
+LOG_DIR = os.path.join(os.path.expanduser('~'), 'exo_bespin_logs')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    file_id INTEGER NOT NULL,
+    created REAL NOT NULL,
+    level TEXT,
+    job_id TEXT,
+    stage TEXT NOT NULL,
+    method TEXT,
+    duration REAL,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS records_by_stage ON records (stage, method, created);
+CREATE INDEX IF NOT EXISTS records_by_job ON records (job_id);
+CREATE INDEX IF NOT EXISTS records_by_file ON records (file_id);
+"""
+
+
+def _parse_args():
+    """Parses and returns command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An object containing the command line argument values.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index', type=str, default=INDEX_FILE, help='The sqlite index file')
+    parser.add_argument('--log-dir', type=str, action='append', help='A directory of log files to index')
+    parser.add_argument('--stage', type=str, default='retrieve', help='The stage to query (e.g. retrieve)')
+    parser.add_argument('--method', type=str, default=None, help='The retrieval method to query')
+    parser.add_argument('--job-id', type=str, default=None, help='The job ID to query')
+    parser.add_argument('--since', type=str, default=None,
+                        help='Only query records since a time, either relative (e.g. 7d, 12h) or a date (YYYY-MM-DD)')
+    parser.add_argument('--percentile', type=float, action='append', help='The percentile(s) to report')
+    args = parser.parse_args()
+
+    return args
+
+
+def _parse_record(line):
+    """Parse a line of a ``jsonl`` log file into a row of the index.
+
+    Parameters
+    ----------
+    line : bytes
+        A line of the log file
+
+    Returns
+    -------
+    row : tuple or None
+        The ``created``, ``level``, ``job_id``, ``stage``, ``method``,
+        ``duration``, and ``message`` of the record, or ``None`` if the
+        line is malformed or the record has no stage
+    """
+
+    try:
+        record = json.loads(line.decode('utf-8'))
+        if not isinstance(record, dict) or not record.get('stage'):
+            return None
+        duration = record.get('duration')
+        return (float(record['created']), record.get('level'), record.get('job_id'), str(record['stage']),
+                record.get('method'), float(duration) if duration is not None else None, record.get('message'))
+    except (ValueError, KeyError, TypeError, UnicodeDecodeError):
+        return None
+
+
+def _percentile(values, q):
+    """Return a percentile of the given values, using linear
+    interpolation between the closest ranks.
+
+    Parameters
+    ----------
+    values : list
+        The values, in ascending order
+    q : float
+        The percentile, between 0 and 100
+
+    Returns
+    -------
+    percentile : float or None
+        The percentile, or ``None`` if there are no values
+    """
+
+    assert 0 <= q <= 100, 'Percentile must be between 0 and 100'
+
+    if not values:
+        return None
+
+    rank = (len(values) - 1) * q / 100.
+    lower, upper = math.floor(rank), math.ceil(rank)
+
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def parse_since(since, now=None):
+    """Convert a relative time (e.g. ``7d``, ``12h``, ``30m``) or a date
+    (``YYYY-MM-DD``) into seconds since the epoch.
+
+    Parameters
+    ----------
+    since : str
+        The relative time or date
+    now : float
+        The current time, in seconds since the epoch
+
+    Returns
+    -------
+    timestamp : float
+        The time, in seconds since the epoch
+    """
+
+    now = time.time() if now is None else now
+    units = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+    if since[-1] in units and since[:-1].replace('.', '', 1).isdigit():
+        return now - float(since[:-1]) * units[since[-1]]
+
+    return datetime.datetime.strptime(since, '%Y-%m-%d').timestamp()
+
+
+class LogIndex():
+    """An incrementally updated ``sqlite`` index of the records of
+    ``jsonl`` log files that have a stage."""
+
+    def __init__(self, index_file=INDEX_FILE):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        index_file : str
+            The path of the ``sqlite`` index file, which is created if
+            it does not exist
+        """
+
+        self.index_file = index_file
+        index_dir = os.path.dirname(os.path.abspath(index_file))
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+
+        self._connection = sqlite3.connect(index_file)
+        self._connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _add_file(self, path, stat, known):
+        """Add the new records of the given log file to the index.
+
+        Parameters
+        ----------
+        path : str
+            The path of the log file
+        stat : obj
+            The ``os.stat_result`` of the log file
+        known : tuple or None
+            The ``file_id``, ``inode``, ``size``, ``mtime_ns``, and
+            ``offset`` of the log file at the last update, if any
+
+        Returns
+        -------
+        n_records : int
+            The number of records added
+        """
+
+        # Start over if the file was replaced or truncated
+        if known is not None and (known[1] != stat.st_ino or stat.st_size < known[4]):
+            self._connection.execute('DELETE FROM records WHERE file_id = ?', (known[0],))
+            known = known[:4] + (0,)
+
+        if known is None:
+            cursor = self._connection.execute(
+                'INSERT INTO files (path, inode, size, mtime_ns, offset) VALUES (?, ?, ?, ?, 0)',
+                (path, stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            file_id, offset = cursor.lastrowid, 0
+        else:
+            file_id, offset = known[0], known[4]
+
+        # Only complete lines are indexed, so that a line being written is read in full next time
+        rows = []
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                row = _parse_record(line)
+                if row is not None:
+                    rows.append((file_id,) + row)
+
+        self._connection.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self._connection.execute('UPDATE files SET inode = ?, size = ?, mtime_ns = ?, offset = ? WHERE file_id = ?',
+                                 (stat.st_ino, stat.st_size, stat.st_mtime_ns, offset, file_id))
+
+        return len(rows)
+
+    def close(self):
+        """Close the index file."""
+
+        self._connection.close()
+
+    def durations(self, stage, method=None, job_id=None, since=None, until=None):
+        """Return the durations of the records of the given stage.
+
+        Parameters
+        ----------
+        stage : str
+            The stage (e.g. ``retrieve``)
+        method : str
+            Only include records of this retrieval method
+        job_id : str
+            Only include records of this job
+        since : float
+            Only include records since this time, in seconds since the
+            epoch
+        until : float
+            Only include records before this time, in seconds since the
+            epoch
+
+        Returns
+        -------
+        durations : list
+            The durations, in seconds, in ascending order
+        """
+
+        query = 'SELECT duration FROM records WHERE stage = ? AND duration IS NOT NULL'
+        parameters = [stage]
+        for column, operator, value in [('method', '=', method), ('job_id', '=', job_id),
+                                        ('created', '>=', since), ('created', '<', until)]:
+            if value is not None:
+                query += ' AND {} {} ?'.format(column, operator)
+                parameters.append(value)
+        query += ' ORDER BY duration'
+
+        return [row[0] for row in self._connection.execute(query, parameters)]
+
+    def percentile(self, stage, q, **kwargs):
+        """Return a percentile of the durations of the records of the
+        given stage (see ``_percentile``).
+
+        Parameters
+        ----------
+        stage : str
+            The stage (e.g. ``retrieve``)
+        q : float
+            The percentile, between 0 and 100
+        **kwargs
+            Filters for the records (see ``durations``)
+
+        Returns
+        -------
+        percentile : float or None
+            The percentile, in seconds, or ``None`` if there are no
+            matching records
+        """
+
+        return _percentile(self.durations(stage, **kwargs), q)
+
+    def update(self, log_dirs):
+        """Bring the index up to date with the ``jsonl`` log files in the
+        given directories (and their subdirectories).
+
+        Parameters
+        ----------
+        log_dirs : list
+            The directories of log files
+
+        Returns
+        -------
+        n_records : int
+            The number of records added to the index
+        """
+
+        known_files = {row[0]: row[1:] for row in self._connection.execute(
+            'SELECT path, file_id, inode, size, mtime_ns, offset FROM files')}
+
+        n_records, seen = 0, set()
+        with self._connection:
+            for log_dir in log_dirs:
+                for root, dirs, files in os.walk(os.path.abspath(os.path.expanduser(log_dir))):
+                    for filename in files:
+                        if not filename.endswith('.jsonl'):
+                            continue
+                        path = os.path.join(root, filename)
+                        try:
+                            stat = os.stat(path)
+                        except OSError:
+                            continue
+                        seen.add(path)
+
+                        # Skip files that have not changed since the last update
+                        known = known_files.get(path)
+                        if known is not None and (known[1], known[2], known[3]) == \
+                                (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+                            continue
+                        n_records += self._add_file(path, stat, known)
+
+            # Forget log files that no longer exist
+            log_roots = tuple(os.path.join(os.path.abspath(os.path.expanduser(log_dir)), '') for log_dir in log_dirs)
+            for path, known in known_files.items():
+                if path.startswith(log_roots) and path not in seen:
+                    self._connection.execute('DELETE FROM records WHERE file_id = ?', (known[0],))
+                    self._connection.execute('DELETE FROM files WHERE file_id = ?', (known[0],))
+
+        logging.info('Indexed {} new log records'.format(n_records))
+
+        return n_records
+
+
+if __name__ == '__main__':
+
+    args = _parse_args()
+    since = parse_since(args.since) if args.since else None
+
+    with LogIndex(args.index) as index:
+        start_time = time.time()
+        n_records = index.update(args.log_dir or [LOG_DIR])
+        update_time = time.time() - start_time
+
+        start_time = time.time()
+        durations = index.durations(args.stage, method=args.method, job_id=args.job_id, since=since)
+        percentiles = [(q, _percentile(durations, q)) for q in args.percentile or [50, 95]]
+        query_time = time.time() - start_time
+
+    print('Indexed {} new records in {:.3f} seconds'.format(n_records, update_time))
+    print('{} records of stage {}{}'.format(len(durations), args.stage,
+                                              ' ({})'.format(args.method) if args.method else ''))
+    for q, value in percentiles:
+        if value is not None:
+            print('    p{:g}: {:.3f} seconds'.format(q, value))
+    print('Queried in {:.1f} milliseconds'.format(query_time * 1000))
@@ -25,16 +25,132 @@ Use
 
     This will create a log file at the location
     ``/user/myself/log_files/my_log.log``
+
+    With ``log_format='jsonl'`` (or the ``EXO_BESPIN_LOG_FORMAT``
+    environment variable set to ``jsonl``), the log file is instead
+    written as one JSON object per line, which includes the job ID,
+    stage, and duration of records that have them, for example:
+
+        logging.info('Retrieval finished', extra={'stage': 'retrieve', 'duration': 812.4})
+
+    Directories of such log files can be indexed and queried with the
+    ``log_index`` module.
+
+    Rather than the full software environment, the log file contains
+    the path to a snapshot of the environment, which is cached in
+    ``$HOME/exo_bespin_logs/environments/`` (see
+    ``get_environment_snapshot``).
+
+    The memory use of a stage of processing can be logged with a
+    ``MemoryTracker``, for example:
+
+        with MemoryTracker('retrieve', budget_mb=8000):
+            run_my_retrieval()
+
+    which logs the peak resident memory of the stage, and raises a
+    ``MemoryBudgetError`` as soon as the resident memory exceeds the
+    budget, if the stage runs in the main thread.  A stage run in
+    another thread (e.g. by a worker pool) fails when it next calls
+    ``check``, or when it finishes, for example:
+
+        with MemoryTracker('retrieve', budget_mb=8000) as tracker:
+            for step in steps:
+                run_my_step(step)
+                tracker.check()
+
+    With ``trace_allocations=True``, the lines of code that allocated
+    the most memory during the stage are logged as well.
 """
 
 import datetime
+import functools
 import getpass
+import hashlib
+import json
 import logging
 import os
+import shutil
+import site
 import socket
+import signal
 import subprocess
 import sys
+import threading
 import time
+import tracemalloc
+import _thread
+
+from exo_bespin.logging import queue_logging, tracing
+
+# The resource module is only available on Unix
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ENVIRONMENT_DIR = os.path.join(os.path.expanduser('~'), 'exo_bespin_logs', 'environments')
+LOG_FORMAT_VARIABLE = 'EXO_BESPIN_LOG_FORMAT'
+MEMORY_BUDGET_VARIABLE = 'EXO_BESPIN_MEMORY_BUDGET'
+
+# The attributes of every log record, as opposed to those given via ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+# Snapshots of the environment that are being captured, keyed by filename
+_snapshot_errors = {}
+_snapshot_lock = threading.Lock()
+_snapshot_threads = {}
+
+
+def _capture_environment(command, filename):
+    """Write the output of the given command to the given file.  The
+    file is written under a temporary name and then renamed, so that it
+    only ever exists complete.
+
+    Parameters
+    ----------
+    command : list
+        The command that describes the software environment
+    filename : str
+        The path of the snapshot file
+    """
+
+    temporary_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        environment = subprocess.check_output(command, universal_newlines=True, stderr=subprocess.DEVNULL)
+        with open(temporary_filename, 'w') as f:
+            f.write(environment)
+        os.replace(temporary_filename, filename)
+    except (OSError, subprocess.CalledProcessError) as error:
+        logging.warning('Could not capture the software environment into {}: {}'.format(filename, error))
+        with _snapshot_lock:
+            _snapshot_errors[filename] = error
+    finally:
+        with _snapshot_lock:
+            _snapshot_threads.pop(filename, None)
+
+
+def _get_conda_prefix():
+    """Return the prefix of the active ``conda`` environment, which is
+    the environment exported by ``conda env export``.
+
+    Returns
+    -------
+    prefix : str or None
+        The prefix of the environment, or ``None`` if ``conda`` is not
+        available
+    """
+
+    if os.environ.get('CONDA_PREFIX'):
+        return os.environ['CONDA_PREFIX']
+    if os.path.isdir(os.path.join(sys.prefix, 'conda-meta')):
+        return sys.prefix
+
+    # Without an active environment, conda exports its base environment
+    conda_exe = os.environ.get('CONDA_EXE') or shutil.which('conda')
+    if conda_exe:
+        return os.path.dirname(os.path.dirname(os.path.realpath(conda_exe)))
+
+    return None
 
 
 def _log_environment_info():
@@ -46,14 +162,65 @@ def _log_environment_info():
     logging.info('Python Version: ' + sys.version.replace('\n', ''))
     logging.info('Python Executable Path: ' + sys.executable)
 
-    # Log the software environment
-    environment = subprocess.check_output(['conda', 'env', 'export'], universal_newlines=True)
-    logging.info('Environment:')
-    for line in environment.split('\n'):
-        logging.info(line)
+    # Log a reference to the snapshot of the software environment, or
+    # why there is none
+    snapshot = get_environment_snapshot()
+    if snapshot in _snapshot_errors:
+        logging.warning('Environment: could not be captured ({})'.format(_snapshot_errors[snapshot]))
+    else:
+        logging.info('Environment: {}'.format(snapshot))
 
 
-def configure_logging(log_filename, log_dir=os.path.join(os.path.expanduser("~"), 'exo_bespin_logs/')):
+def _read_rss():
+    """Return the current and peak resident memory (RSS) of this
+    process.
+
+    Returns
+    -------
+    rss : int
+        The current resident memory, in bytes
+    peak_rss : int
+        The highest resident memory since the process started, or since
+        it was last reset by ``_reset_peak_rss``, in bytes
+    """
+
+    try:
+        with open('/proc/self/status', 'r') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(status['VmRSS'].split()[0]) * 1024, int(status['VmHWM'].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        pass
+
+    # Without /proc, only the peak is available (in bytes on macOS and kilobytes elsewhere), if at all
+    if resource is None:
+        return 0, 0
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+
+    return peak_rss, peak_rss
+
+
+def _reset_peak_rss():
+    """Reset the peak resident memory of this process to its current
+    resident memory, where supported (Linux).
+
+    Returns
+    -------
+    reset : bool
+        Whether the peak was reset
+    """
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def configure_logging(log_filename, log_dir=os.path.join(os.path.expanduser("~"), 'exo_bespin_logs/'),
+                      log_format=None, job_id=None):
     """Configure the log file with a standard logging format.
 
     By default, the log file will be written to a ``exo_bespin_logs/``
@@ -66,30 +233,49 @@ def configure_logging(log_filename, log_dir=os.path.join(os.path.expanduser("~")
     log_filename : str
         The name that will be used to create the log file (e.g.
         ``my_log_<timestamp>.log``)
+    log_dir : str
+        The directory in which to write the log file
+    log_format : str
+        Either ``text`` or ``jsonl`` (see ``create_file_handler``).
+        Defaults to the ``EXO_BESPIN_LOG_FORMAT`` environment variable,
+        or ``text``.
+    job_id : str
+        The job ID to tag records with.  Defaults to the
+        ``EXO_BESPIN_JOB_ID`` environment variable, if set.
+
+    If the ``EXO_BESPIN_LOG_ADDRESS`` environment variable is set, the
+    process is a parallel worker, and its records are instead sent to
+    the log listener at that address (see ``queue_logging``).
 
     Returns
     -------
     full_filename : str
-        The full path to the created log file
+        The full path to the created log file, or ``None`` if records
+        are sent to a log listener
     """
 
+    # Send records to the log listener of a parallel run
+    if os.environ.get(queue_logging.LOG_ADDRESS_VARIABLE):
+        queue_logging.configure_queue_logging()
+        _log_environment_info()
+        return None
+
     # Make sure log_dir exists
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
 
     # Build complete log filename
+    log_format = log_format or os.environ.get(LOG_FORMAT_VARIABLE, 'text')
     timestamp = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M')
-    full_filename = os.path.join(log_dir, '{0}_{1}.log'.format(log_filename, timestamp))
+    extension = 'jsonl' if log_format == 'jsonl' else 'log'
+    full_filename = os.path.join(log_dir, '{0}_{1}.{2}'.format(log_filename, timestamp, extension))
 
     # Make sure no other root lhandlers exist before configuring the logger
     for handler in logging.root.handlers[:]:
         logging.root.removeHandler(handler)
 
     # Create the log file and set the permissions
-    logging.basicConfig(filename=full_filename,
-                        format='%(asctime)s %(levelname)s: %(message)s',
-                        datefmt='%m/%d/%Y %H:%M:%S %p',
-                        level=logging.INFO)
+    logging.basicConfig(handlers=[create_file_handler(full_filename, log_format, job_id)], level=logging.INFO)
 
     print('Log file initialized to {}'.format(full_filename))
 
@@ -99,8 +285,108 @@ def configure_logging(log_filename, log_dir=os.path.join(os.path.expanduser("~")
     return full_filename
 
 
+def create_file_handler(filename, log_format='text', job_id=None):
+    """Create a handler that writes log records to the given file in
+    the given format.
+
+    Parameters
+    ----------
+    filename : str
+        The path of the log file
+    log_format : str
+        Either ``text``, for the standard format of one line of text
+        per record, or ``jsonl``, for one JSON object per record (see
+        ``JSONFormatter``)
+    job_id : str
+        The job ID to tag records with.  Defaults to the
+        ``EXO_BESPIN_JOB_ID`` environment variable, if set.
+
+    Returns
+    -------
+    handler : obj
+        A ``logging.FileHandler`` object
+    """
+
+    assert log_format in ['text', 'jsonl'], 'Unrecognized log format: {}'.format(log_format)
+
+    handler = logging.FileHandler(filename)
+    if log_format == 'jsonl':
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s',
+                                               datefmt='%m/%d/%Y %H:%M:%S %p'))
+
+    job_id = job_id or os.environ.get(queue_logging.JOB_ID_VARIABLE)
+    if job_id:
+        handler.addFilter(queue_logging.ContextFilter(job_id, os.environ.get(queue_logging.WORKER_VARIABLE, '-')))
+
+    return handler
+
+
+def get_environment_snapshot(snapshot_dir=ENVIRONMENT_DIR, wait=False):
+    """Return the path to a snapshot of the software environment (the
+    output of ``conda env export``, or of ``pip freeze`` if ``conda``
+    is not available).
+
+    Snapshots are cached on disk, keyed on a hash of the environment's
+    prefix and the modification times of its ``conda-meta`` and
+    ``site-packages`` directories, which change whenever a package is
+    installed or removed.  If there is no snapshot for the current
+    environment, one is captured in a background thread, so the
+    returned file may not exist yet.  The thread is a daemon, so that
+    it does not hold up the exit of a script; a snapshot that is not
+    complete by then is captured by the next run instead.  If the
+    capture fails, the error is logged, and it is not tried again by
+    this process.
+
+    Parameters
+    ----------
+    snapshot_dir : str
+        The directory in which snapshots are cached
+    wait : bool
+        Whether to wait for a snapshot that is being captured
+
+    Returns
+    -------
+    filename : str
+        The path of the snapshot file
+    """
+
+    prefix = _get_conda_prefix()
+    if prefix is not None:
+        command = ['conda', 'env', 'export', '--prefix', prefix]
+        directories = [os.path.join(prefix, 'conda-meta')]
+    else:
+        prefix = sys.prefix
+        command = [sys.executable, '-m', 'pip', 'freeze']
+        directories = []
+    directories += site.getsitepackages() if hasattr(site, 'getsitepackages') else []
+
+    # Key the snapshot on the state of the environment
+    fingerprint = hashlib.sha256(prefix.encode('utf-8'))
+    for directory in directories:
+        if os.path.isdir(directory):
+            fingerprint.update('{}:{}'.format(directory, os.stat(directory).st_mtime_ns).encode('utf-8'))
+    filename = os.path.join(snapshot_dir, 'environment-{}.txt'.format(fingerprint.hexdigest()[:16]))
+
+    # Capture the snapshot in the background if it is not cached
+    with _snapshot_lock:
+        thread = _snapshot_threads.get(filename)
+        if thread is None and not os.path.exists(filename) and filename not in _snapshot_errors:
+            os.makedirs(snapshot_dir, exist_ok=True)
+            thread = threading.Thread(target=_capture_environment, args=(command, filename), daemon=True)
+            _snapshot_threads[filename] = thread
+            thread.start()
+
+    if wait and thread is not None:
+        thread.join()
+
+    return filename
+
+
 def log_timing(func):
-    """Decorator to time a module or function within a code.
+    """Decorator to time a module or function within a code.  Each call
+    is also recorded as a span (see ``tracing.span``).
 
     Parameters
     ----------
@@ -110,19 +396,272 @@ def log_timing(func):
     Returns
     -------
     wrapped : func
-        The wrapped function. Will log the time."""
+        The wrapped function. Will log the time, and return the return
+        value of ``func``."""
 
+    @functools.wraps(func)
     def wrapped(*args, **kwargs):
 
         # Call the function and time it
-        start = time.time()
-        func(*args, **kwargs)
-        end = time.time()
+        with tracing.span(tracing.get_span_name(func)) as span:
+            result = func(*args, **kwargs)
 
         # Log execution time
-        hours, remainder = divmod(end - start, 60 * 60)
+        hours, remainder = divmod(span.duration, 60 * 60)
         minutes, seconds = divmod(remainder, 60)
         logging.info('')
-        logging.info('Elapsed Time of {}: {}:{}:{}'.format(func.__name__, int(hours), int(minutes), int(seconds)))
+        logging.info('Elapsed Time of {}: {}:{:02d}:{:06.3f}'.format(func.__name__, int(hours), int(minutes), seconds),
+                     extra={'stage': span.name, 'duration': span.duration})
+
+        return result
 
     return wrapped
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats log records as single-line JSON objects.
+
+    Each object contains the ``time`` (in ISO 8601 format) and
+    ``created`` (in seconds since the epoch) of the record, its
+    ``level``, ``logger``, and ``message``, and any attributes given
+    to the record via ``extra`` or a filter, such as ``job_id``,
+    ``stage`` (the name of a stage of processing), and ``duration``
+    (in seconds).
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'created': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()}
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+class MemoryBudgetError(MemoryError):
+    """Raised when the memory use of a stage exceeds its budget."""
+
+
+class MemoryTracker():
+    """Tracks the memory use of a stage of processing (e.g. a method of
+    ``PlatonWrapper``), and logs it when the stage finishes.
+
+    Two measures of memory use are tracked:
+
+        - The peak resident memory (RSS) of the process during the
+          stage, which is what the operating system (and its
+          out-of-memory killer) sees.
+        - If ``trace_allocations`` is set, the memory allocated by
+          Python and ``numpy`` during the stage, as traced by
+          ``tracemalloc``, from which the lines of code that allocated
+          the most memory are logged.  Tracing slows down allocation
+          heavy code, so it is off by default.
+
+    A background thread samples the resident memory while the stage
+    runs.  The peak of the stage is the highest of the samples, and of
+    the peak kept by the kernel (``VmHWM``) if it could be reset when
+    the stage started; it is reset for the whole process, so only
+    while no other tracker is active, so that nested or concurrent
+    trackers do not wipe each other's peaks.
+
+    If a memory budget is given, the stage is failed as soon as the
+    sampled resident memory exceeds it: a stage running in the main
+    thread is interrupted (as by ``Ctrl-C``), and the interrupt is
+    turned into a ``MemoryBudgetError`` when it reaches the tracker.
+    Other threads can not be interrupted, so a stage running in one
+    fails with a ``MemoryBudgetError`` when it next calls ``check``, or
+    otherwise when it finishes.
+    """
+
+    _active = 0
+    _active_lock = threading.Lock()
+
+    def __init__(self, stage, budget_mb=None, trace_allocations=False, top=5, interval=0.5):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+        budget_mb : float
+            The memory budget of the stage, in MB of resident memory.
+            Defaults to the ``EXO_BESPIN_MEMORY_BUDGET`` environment
+            variable, if set.
+        trace_allocations : bool
+            Whether to trace allocations with ``tracemalloc``, which
+            slows down allocation heavy code
+        top : int
+            The number of allocation sites to log
+        interval : float
+            The number of seconds between checks of the budget
+        """
+
+        if budget_mb is None and os.environ.get(MEMORY_BUDGET_VARIABLE):
+            budget_mb = float(os.environ[MEMORY_BUDGET_VARIABLE])
+
+        self.stage = stage
+        self.budget_mb = budget_mb
+        self.trace_allocations = trace_allocations
+        self.top = top
+        self.interval = interval
+
+        self.exceeded_mb = None
+        self.start_rss_mb = None
+        self.peak_rss_mb = None
+        self.peak_traced_mb = None
+        self.top_allocations = []
+
+        self._exceeded_snapshot = None
+        self._interruptible = False
+        self._interrupted = False
+        self._reset_peak = False
+        self._sampled_peak_mb = 0.
+        self._snapshot = None
+        self._started_tracing = False
+        self._stopped = threading.Event()
+        self._watchdog = None
+
+    def __enter__(self):
+        self.start_rss_mb = _read_rss()[0] / 1e6
+        self._sampled_peak_mb = self.start_rss_mb
+        with self._active_lock:
+            if MemoryTracker._active == 0:
+                self._reset_peak = _reset_peak_rss()
+            MemoryTracker._active += 1
+
+        # Only the main thread can be interrupted, and only if Python
+        # handles SIGINT (see ``_thread.interrupt_main``)
+        self._interruptible = (threading.current_thread() is threading.main_thread() and
+                               signal.getsignal(signal.SIGINT) is signal.default_int_handler)
+
+        if self.trace_allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._snapshot = tracemalloc.take_snapshot()
+
+        self._stopped.clear()
+        self._watchdog = threading.Thread(target=self._watch, name='exo-bespin-memory', daemon=True)
+        self._watchdog.start()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self._stopped.set()
+            self._watchdog.join()
+
+            # The interrupt of a stage that finished just as it exceeded
+            # its budget may not have arrived yet
+            if self._interrupted and exc_type is not KeyboardInterrupt:
+                time.sleep(1)
+        except KeyboardInterrupt as error:
+            if not self._interrupted:
+                raise
+            exc_type, exc_value = KeyboardInterrupt, error
+        finally:
+            with self._active_lock:
+                MemoryTracker._active -= 1
+
+        rss, peak_rss = _read_rss()
+        self._sampled_peak_mb = max(self._sampled_peak_mb, rss / 1e6)
+        self.peak_rss_mb = max(self._sampled_peak_mb, peak_rss / 1e6) if self._reset_peak else self._sampled_peak_mb
+        if self.trace_allocations:
+            self.peak_traced_mb = tracemalloc.get_traced_memory()[1] / 1e6
+            self.top_allocations = self._get_top_allocations()
+            if self._started_tracing:
+                tracemalloc.stop()
+        self._log()
+
+        # The interrupt of the watchdog becomes the error of the budget,
+        # while a stage that failed for another reason keeps its own error
+        if exc_type is None:
+            self.check()
+        elif exc_type is KeyboardInterrupt and self._interrupted:
+            try:
+                self.check()
+            except MemoryBudgetError as error:
+                raise error from exc_value
+
+        return False
+
+    def _get_top_allocations(self):
+        """Return the lines of code that allocated the most memory
+        during the stage, counting the memory that was still allocated
+        at the end of the stage (or when the budget was exceeded).
+
+        Returns
+        -------
+        top_allocations : list
+            A ``(location, size_mb)`` tuple for each line of code,
+            largest first
+        """
+
+        snapshot = self._exceeded_snapshot or tracemalloc.take_snapshot()
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')])
+        differences = snapshot.compare_to(self._snapshot, 'lineno')
+
+        top_allocations = []
+        for difference in differences[:self.top]:
+            if difference.size_diff <= 0:
+                break
+            frame = difference.traceback[0]
+            top_allocations.append(('{}:{}'.format(frame.filename, frame.lineno), difference.size_diff / 1e6))
+
+        return top_allocations
+
+    def _log(self):
+        """Log the memory use of the stage."""
+
+        logging.info('Memory of {}: peak RSS {:.1f} MB (started at {:.1f} MB)'.format(
+            self.stage, self.peak_rss_mb, self.start_rss_mb))
+        if self.trace_allocations:
+            logging.info('    Peak traced allocations: {:.1f} MB'.format(self.peak_traced_mb))
+            for location, size_mb in self.top_allocations:
+                logging.info('    {:.1f} MB allocated at {}'.format(size_mb, location))
+
+    def _watch(self):
+        """Sample the resident memory until the stage finishes, and
+        fail the stage if it exceeds the budget."""
+
+        while not self._stopped.wait(self.interval):
+            rss_mb = _read_rss()[0] / 1e6
+            self._sampled_peak_mb = max(self._sampled_peak_mb, rss_mb)
+            if self.budget_mb is None or rss_mb <= self.budget_mb or self.exceeded_mb is not None:
+                continue
+
+            logging.error('Memory use of {} ({:.1f} MB) exceeded its budget of {:.1f} MB'.format(
+                self.stage, rss_mb, self.budget_mb))
+            if self.trace_allocations:
+                self._exceeded_snapshot = tracemalloc.take_snapshot()
+            self.exceeded_mb = rss_mb
+            if self._interruptible and not self._stopped.is_set():
+                self._interrupted = True
+                _thread.interrupt_main()
+
+    def check(self):
+        """Raise a ``MemoryBudgetError`` if the stage has exceeded its
+        budget.  Long stages can call this now and then to fail as soon
+        as they exceed it.
+
+        Raises
+        ------
+        MemoryBudgetError
+            If the resident memory exceeded the budget
+        """
+
+        if self.exceeded_mb is not None:
+            raise MemoryBudgetError('Memory use of {} ({:.1f} MB) exceeded its budget of {:.1f} MB'.format(
+                self.stage, self.exceeded_mb, self.budget_mb))
@@ -0,0 +1,249 @@
+"""This module contains an opt-in, low-overhead statistical profiler
+for ``exo_bespin`` jobs.
+
+While profiling, a background thread wakes up at a fixed interval
+(100 times a second by default) and records the Python call stack of
+the profiled thread.  Only the stack is read, so the job itself is not
+instrumented and runs at close to full speed, and the number of samples
+in which a function appears is proportional to the time spent in it.
+
+The samples are written in the "collapsed stack" format, with one line
+per distinct stack of semicolon-separated frames, root first, followed
+by the number of samples, e.g.:
+
+    platon_wrapper.py:retrieve;retriever.py:run_multinest;... 1234
+
+which can be turned into a flamegraph with ``flamegraph.pl`` or
+viewed directly with ``https://www.speedscope.app``.
+
+Profiling is enabled by passing ``profile=True`` to ``PlatonWrapper``,
+or by setting the ``EXO_BESPIN_PROFILE`` environment variable, which is
+also passed on to commands run on executing machines.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script is inteneded to be imported and used by other modules,
+    for example:
+
+        from exo_bespin.logging import profiling
+
+        with profiling.profile('retrieval.folded'):
+            run_my_retrieval()
+"""
+
+import collections
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+
+PROFILE_INTERVAL = 0.01
+PROFILE_VARIABLE = 'EXO_BESPIN_PROFILE'
+
+
+def _frame_label(frame):
+    """Return the label of the given stack frame in a collapsed stack.
+
+    Parameters
+    ----------
+    frame : obj
+        A frame object
+
+    Returns
+    -------
+    label : str
+        The file name and function name of the frame (e.g.
+        ``platon_wrapper.py:retrieve``)
+    """
+
+    return '{}:{}'.format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+
+
+def forward_environment(command):
+    """Return the given command, prefixed so that it is profiled when
+    profiling is enabled in this process.  Used for commands run on an
+    executing machine.
+
+    Parameters
+    ----------
+    command : str
+        The command to run (e.g. ``python run_myscript.py``)
+
+    Returns
+    -------
+    command : str
+        The (possibly prefixed) command
+    """
+
+    if profiling_enabled():
+        command = '{}=1 {}'.format(PROFILE_VARIABLE, command)
+
+    return command
+
+
+@contextlib.contextmanager
+def profile(filename, enabled=True, interval=PROFILE_INTERVAL):
+    """Profile the calling thread for the duration of a ``with`` block,
+    then write the collapsed stacks to the given file.
+
+    Parameters
+    ----------
+    filename : str
+        The path of the collapsed stack file to write
+    enabled : bool
+        Whether to profile at all.  If ``False``, the block is run as
+        is and no file is written.
+    interval : float
+        The number of seconds between samples
+
+    Yields
+    ------
+    profiler : obj
+        The ``SamplingProfiler`` object, or ``None`` if not enabled
+    """
+
+    if not enabled:
+        yield None
+        return
+
+    profiler = SamplingProfiler(interval)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        profiler.write_collapsed(filename)
+
+        logging.info('Profile of {} samples saved to {}'.format(profiler.n_samples, filename))
+        for label, count in profiler.get_top_functions(5):
+            logging.info('    {:5.1f}% {}'.format(100. * count / max(profiler.n_samples, 1), label))
+
+
+def profiling_enabled():
+    """Return whether profiling is enabled by the ``EXO_BESPIN_PROFILE``
+    environment variable.
+
+    Returns
+    -------
+    enabled : bool
+        ``True`` unless the variable is unset, empty, ``0``, or
+        ``false``
+    """
+
+    return os.environ.get(PROFILE_VARIABLE, '').lower() not in ['', '0', 'false']
+
+
+class SamplingProfiler():
+    """Periodically samples the call stack of a thread from a
+    background thread."""
+
+    def __init__(self, interval=PROFILE_INTERVAL, thread_id=None):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        interval : float
+            The number of seconds between samples
+        thread_id : int
+            The identifier of the thread to profile.  Defaults to the
+            thread that calls ``start``.
+        """
+
+        self.interval = interval
+        self.thread_id = thread_id
+        self.n_samples = 0
+        self.stacks = collections.Counter()
+
+        self._start_time = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run(self):
+        """Take samples until stopped."""
+
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def get_top_functions(self, n=10):
+        """Return the functions that the profiled thread spent the most
+        time in, excluding the functions they called.
+
+        Parameters
+        ----------
+        n : int
+            The number of functions to return
+
+        Returns
+        -------
+        top_functions : list
+            A ``(label, samples)`` tuple for each function, most
+            samples first
+        """
+
+        functions = collections.Counter()
+        for stack, count in self.stacks.items():
+            functions[stack[-1]] += count
+
+        return functions.most_common(n)
+
+    def sample(self):
+        """Record the current call stack of the profiled thread."""
+
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame))
+            frame = frame.f_back
+
+        self.stacks[tuple(reversed(labels))] += 1
+        self.n_samples += 1
+
+    def start(self):
+        """Start sampling."""
+
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='exo-bespin-profiler', daemon=True)
+        self._start_time = time.time()
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling."""
+
+        self._stopped.set()
+        self._thread.join()
+        logging.debug('Profiled {} samples over {:.1f} seconds'.format(self.n_samples,
+                                                                        time.time() - self._start_time))
+
+    def write_collapsed(self, filename):
+        """Write the samples to a file in the collapsed stack format.
+
+        Parameters
+        ----------
+        filename : str
+            The path of the file to write
+        """
+
+        with open(filename, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('{} {}\n'.format(';'.join(stack), count))
@@ -0,0 +1,322 @@
+"""This module contains a logging mode for parallel worker processes, in
+which a single listener writes the log records of every worker to one
+log file.
+
+Configuring each worker with ``configure_logging`` would have every
+worker open (and truncate) the same per-minute log file, and write to
+it synchronously.  Instead, in this mode:
+
+    - Each worker's root logger only has a ``QueueHandler``, so logging
+      a record only puts it on an in-memory queue.  A background thread
+      in the worker sends queued records to the listener.
+    - A single ``LogListener`` thread in the parent process receives
+      the records of all workers over a local socket and writes them
+      to the log file.
+    - Each record is tagged with the ID of the job and the name of the
+      worker that logged it.
+
+Records are sent as lines of JSON.  A worker that crashes only loses
+the records it had not yet sent, and the listener drops the worker's
+connection (and any partial or malformed record) and carries on.  If the listener
+goes away, workers discard their records rather than fail.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script is inteneded to be imported and used by other modules,
+    for example:
+
+        from exo_bespin.logging.queue_logging import LogListener
+
+        with LogListener('batch.log') as listener:
+            env = dict(os.environ, **listener.worker_environment('hd209458b', 'worker-0'))
+            subprocess.run(['python', 'my_script.py'], env=env)
+
+    where ``my_script.py`` configures its logging with
+    ``configure_logging`` (or ``PlatonWrapper``), which uses this mode
+    whenever the ``EXO_BESPIN_LOG_ADDRESS`` environment variable is set,
+    or calls ``configure_queue_logging`` directly.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import socket
+import threading
+
+JOB_ID_VARIABLE = 'EXO_BESPIN_JOB_ID'
+LOG_ADDRESS_VARIABLE = 'EXO_BESPIN_LOG_ADDRESS'
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(job_id)s %(worker)s]: %(message)s'
+WORKER_VARIABLE = 'EXO_BESPIN_WORKER'
+
+
+def configure_queue_logging(address=None, job_id=None, worker=None, level=logging.INFO):
+    """Configure the root logger of a worker to send its records to a
+    ``LogListener``.
+
+    Parameters
+    ----------
+    address : str
+        The ``host:port`` address of the listener.  Defaults to the
+        ``EXO_BESPIN_LOG_ADDRESS`` environment variable.
+    job_id : str
+        The job ID to tag records with.  Defaults to the
+        ``EXO_BESPIN_JOB_ID`` environment variable.
+    worker : str
+        The worker name to tag records with.  Defaults to the
+        ``EXO_BESPIN_WORKER`` environment variable, or the process ID.
+    level : int
+        The level of the root logger
+
+    Returns
+    -------
+    forwarder : obj
+        The ``logging.handlers.QueueListener`` that forwards queued
+        records to the listener.  It is stopped, flushing any queued
+        records, when the worker exits.
+    """
+
+    address = address or os.environ[LOG_ADDRESS_VARIABLE]
+    job_id = job_id or os.environ.get(JOB_ID_VARIABLE, '-')
+    worker = worker or os.environ.get(WORKER_VARIABLE, 'pid-{}'.format(os.getpid()))
+
+    # Make sure no other root handlers exist before configuring the logger
+    for handler in logging.root.handlers[:]:
+        logging.root.removeHandler(handler)
+
+    records = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(ContextFilter(job_id, worker))
+    logging.root.addHandler(queue_handler)
+    logging.root.setLevel(level)
+
+    forwarder = logging.handlers.QueueListener(records, SocketJSONHandler(address))
+    forwarder.start()
+    atexit.register(forwarder.stop)
+
+    return forwarder
+
+
+class ContextFilter(logging.Filter):
+    """Tags log records with a job ID and worker name, unless they are
+    already tagged."""
+
+    def __init__(self, job_id='-', worker='-'):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        job_id : str
+            The job ID
+        worker : str
+            The worker name
+        """
+
+        super().__init__()
+        self.job_id = job_id
+        self.worker = worker
+
+    def filter(self, record):
+        if not hasattr(record, 'job_id'):
+            record.job_id = self.job_id
+        if not hasattr(record, 'worker'):
+            record.worker = self.worker
+        return True
+
+
+class LogListener():
+    """Receives the log records of workers over a local socket and
+    writes them to a single log file."""
+
+    def __init__(self, log_file, level=logging.INFO):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        log_file : str
+            The path of the log file
+        level : int
+            The minimum level of records to write
+        """
+
+        self.log_file = log_file
+        self.level = level
+        self.address = None
+
+        self._connections = []
+        self._handler = None
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _accept(self):
+        """Accept connections from workers until the server is closed."""
+
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            thread = threading.Thread(target=self._receive, args=(connection,), daemon=True)
+            self._connections.append((connection, thread))
+            thread.start()
+
+    def _receive(self, connection):
+        """Write the records received on the given connection until the
+        worker disconnects.
+
+        Parameters
+        ----------
+        connection : obj
+            A connected ``socket.socket`` object
+        """
+
+        with connection, connection.makefile('r', encoding='utf-8') as lines:
+            try:
+                for line in lines:
+                    self.handle(line)
+            except (OSError, UnicodeDecodeError):
+                pass
+
+    def handle(self, line):
+        """Write a record received from a worker.  Malformed records
+        are dropped.
+
+        Parameters
+        ----------
+        line : str
+            The JSON encoded record
+        """
+
+        try:
+            record = logging.makeLogRecord(json.loads(line))
+            if record.levelno < self.level:
+                return
+        except (ValueError, TypeError):
+            return
+
+        self._handler.handle(record)
+
+    def start(self):
+        """Open the log file and start listening for workers."""
+
+        self._handler = logging.FileHandler(self.log_file)
+        self._handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt='%m/%d/%Y %H:%M:%S %p'))
+        self._handler.addFilter(ContextFilter())
+
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen()
+        self.address = '{}:{}'.format(*self._server.getsockname())
+
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop listening, wait for connected workers to disconnect, and
+        close the log file.
+
+        Parameters
+        ----------
+        timeout : float
+            The number of seconds to wait for each connected worker
+        """
+
+        # Shutting down the socket wakes up the thread blocked on accepting connections
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server.close()
+        self._thread.join()
+        for connection, thread in self._connections:
+            thread.join(timeout)
+            if thread.is_alive():
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                thread.join()
+        self._handler.close()
+
+    def worker_environment(self, job_id, worker):
+        """Return the environment variables that configure a worker
+        process to log to this listener.
+
+        Parameters
+        ----------
+        job_id : str
+            The job ID to tag the worker's records with
+        worker : str
+            The worker name to tag the worker's records with
+
+        Returns
+        -------
+        variables : dict
+            The environment variables
+        """
+
+        return {LOG_ADDRESS_VARIABLE: self.address, JOB_ID_VARIABLE: str(job_id), WORKER_VARIABLE: str(worker)}
+
+
+class SocketJSONHandler(logging.Handler):
+    """Sends log records to a ``LogListener`` as lines of JSON."""
+
+    def __init__(self, address):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        address : str
+            The ``host:port`` address of the listener
+        """
+
+        super().__init__()
+        host, port = address.rsplit(':', 1)
+        self.address = (host, int(port))
+        self._socket = None
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        super().close()
+
+    def emit(self, record):
+        message = {
+            'name': record.name,
+            'msg': record.getMessage(),
+            'levelname': record.levelname,
+            'levelno': record.levelno,
+            'created': record.created,
+            'msecs': record.msecs,
+            'process': record.process,
+            'thread': record.thread,
+            'job_id': getattr(record, 'job_id', '-'),
+            'worker': getattr(record, 'worker', '-')}
+        if record.exc_info:
+            message['msg'] += '\n' + logging.Formatter().formatException(record.exc_info)
+
+        # Records are discarded, rather than raising, if the listener is gone
+        try:
+            if self._socket is None:
+                self._socket = socket.create_connection(self.address, timeout=5)
+            self._socket.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        except OSError:
+            if self._socket is not None:
+                self._socket.close()
+            self._socket = None
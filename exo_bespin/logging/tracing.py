@@ -0,0 +1,339 @@
+"""This module contains a tracing facility that records nested, timed
+spans of the execution of ``exo_bespin`` software.
+
+A span is a named, timed section of code, with optional attributes
+(e.g. the retrieval method, or the file being transferred).  Spans are
+opened with the ``span`` context manager or the ``trace`` decorator,
+and spans opened while another span is open in the same thread are
+nested within it.  Each span records its start time and its duration
+(measured with ``time.perf_counter``, so with sub-millisecond
+precision), and the process and thread it ran in, so that spans from
+several threads, or from the user's machine and an executing machine,
+can be combined into a single timeline.
+
+Finished spans are kept in memory by a ``Tracer`` and can be exported
+to JSON, or to the Chrome trace format, which can be viewed with
+``chrome://tracing`` or ``https://ui.perfetto.dev``.  Only the last
+``MAX_SPANS`` spans are kept, so that long-running processes (e.g. the
+workers of the ``bespin`` web app) do not grow without bound; processes
+that run many jobs should export and ``clear`` the spans of each job.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This script is inteneded to be imported and used by other modules,
+    for example:
+
+        from exo_bespin.logging import tracing
+
+        @tracing.trace()
+        def retrieve(method):
+            with tracing.span('fit', method=method):
+                ...
+
+        retrieve('multinest')
+        tracing.export_chrome_trace('trace.json')
+
+    Spans exported to JSON by another process (e.g. by a job on an
+    executing machine) can be added to the timeline with
+    ``tracing.load_json``.
+"""
+
+import collections
+import contextlib
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+MAX_SPANS = 10000
+
+
+def clear():
+    """Discard all finished spans of the default tracer."""
+
+    _tracer.clear()
+
+
+def export_chrome_trace(filename):
+    """Write the finished spans of the default tracer to a file in the
+    Chrome trace format.  See ``Tracer.export_chrome_trace``."""
+
+    _tracer.export_chrome_trace(filename)
+
+
+def export_json(filename):
+    """Write the finished spans of the default tracer to a JSON file.
+    See ``Tracer.export_json``."""
+
+    _tracer.export_json(filename)
+
+
+def get_span_name(func):
+    """Return the name of the spans of calls to the given function: the
+    name of its module and its qualified name (e.g.
+    ``aws_tools.start_ec2``).
+
+    Parameters
+    ----------
+    func : func
+        The function
+
+    Returns
+    -------
+    name : str
+        The name of the spans
+    """
+
+    return '{}.{}'.format(func.__module__.split('.')[-1], func.__qualname__)
+
+
+def get_spans():
+    """Return the finished spans of the default tracer.  See
+    ``Tracer.get_spans``."""
+
+    return _tracer.get_spans()
+
+
+def load_json(filename):
+    """Add the spans in a JSON file to the default tracer.  See
+    ``Tracer.load_json``."""
+
+    _tracer.load_json(filename)
+
+
+def span(name, **attributes):
+    """Open a span of the default tracer.  See ``Tracer.span``."""
+
+    return _tracer.span(name, **attributes)
+
+
+def trace(name=None, **attributes):
+    """Decorate a function so that each call is a span of the default
+    tracer.  See ``Tracer.trace``."""
+
+    return _tracer.trace(name, **attributes)
+
+
+class Span():
+    """A named, timed section of code."""
+
+    def __init__(self, name, span_id, parent_id=None, attributes=None):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        name : str
+            The name of the span
+        span_id : str
+            A unique identifier for the span
+        parent_id : str
+            The identifier of the span that this span is nested in, if
+            any
+        attributes : dict
+            Attributes of the span
+        """
+
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.pid = os.getpid()
+        self.tid = threading.get_ident()
+        self.start_time = time.time()
+        self.duration = None
+        self._start = time.perf_counter()
+
+    def finish(self):
+        """Record the duration of the span."""
+
+        self.duration = time.perf_counter() - self._start
+
+    def to_dict(self):
+        """Return the span as a dictionary.
+
+        Returns
+        -------
+        span : dict
+            The ``name``, ``span_id``, ``parent_id``, ``attributes``,
+            ``pid``, ``tid``, ``start_time`` (in seconds since the
+            epoch), and ``duration`` (in seconds) of the span
+        """
+
+        return {'name': self.name, 'span_id': self.span_id, 'parent_id': self.parent_id,
+                'attributes': self.attributes, 'pid': self.pid, 'tid': self.tid,
+                'start_time': self.start_time, 'duration': self.duration}
+
+
+class Tracer():
+    """Records nested spans.  A single tracer may be shared by multiple
+    threads; spans are only nested within spans of the same thread."""
+
+    def __init__(self, max_spans=MAX_SPANS):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        max_spans : int
+            The number of finished spans to keep, beyond which the
+            oldest are discarded
+        """
+
+        self._counter = itertools.count()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._spans = collections.deque(maxlen=max_spans)
+
+    def clear(self):
+        """Discard all finished spans."""
+
+        with self._lock:
+            self._spans.clear()
+
+    def export_chrome_trace(self, filename):
+        """Write the finished spans to a file in the Chrome trace
+        format.
+
+        Parameters
+        ----------
+        filename : str
+            The path of the file to write
+        """
+
+        events = []
+        for finished_span in self.get_spans():
+            events.append({
+                'name': finished_span['name'],
+                'cat': 'exo_bespin',
+                'ph': 'X',
+                'ts': finished_span['start_time'] * 1e6,
+                'dur': finished_span['duration'] * 1e6,
+                'pid': finished_span['pid'],
+                'tid': finished_span['tid'],
+                'args': finished_span['attributes']})
+
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+    def export_json(self, filename):
+        """Write the finished spans to a JSON file.
+
+        Parameters
+        ----------
+        filename : str
+            The path of the file to write
+        """
+
+        with open(filename, 'w') as f:
+            json.dump(self.get_spans(), f, indent=1, default=str)
+
+    def get_spans(self):
+        """Return the finished spans, in the order they finished, up to
+        the last ``max_spans`` of them.
+
+        Returns
+        -------
+        spans : list
+            A dictionary for each span (see ``Span.to_dict``)
+        """
+
+        with self._lock:
+            return list(self._spans)
+
+    def load_json(self, filename):
+        """Add the spans in a JSON file written by ``export_json`` (e.g.
+        by another process) to the finished spans.
+
+        Parameters
+        ----------
+        filename : str
+            The path of the file to read
+        """
+
+        with open(filename, 'r') as f:
+            spans = json.load(f)
+
+        with self._lock:
+            self._spans.extend(spans)
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """Open a span for the duration of a ``with`` block.
+
+        If an exception is raised within the block, its type is
+        recorded in the ``error`` attribute of the span.
+
+        Parameters
+        ----------
+        name : str
+            The name of the span
+        **attributes
+            Attributes of the span
+
+        Yields
+        ------
+        span : obj
+            The ``Span`` object, to which further attributes may be
+            added
+        """
+
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        stack = self._local.stack
+        parent_id = stack[-1].span_id if stack else None
+        new_span = Span(name, '{}-{}'.format(os.getpid(), next(self._counter)), parent_id, attributes)
+
+        stack.append(new_span)
+        try:
+            yield new_span
+        except BaseException as error:
+            new_span.attributes['error'] = type(error).__name__
+            raise
+        finally:
+            new_span.finish()
+            stack.pop()
+            with self._lock:
+                self._spans.append(new_span.to_dict())
+            logging.debug('Span {} took {:.6f} seconds'.format(name, new_span.duration))
+
+    def trace(self, name=None, **attributes):
+        """Decorate a function so that each call is a span.
+
+        Parameters
+        ----------
+        name : str
+            The name of the span.  Defaults to the name of the
+            function's module and its qualified name (see
+            ``get_span_name``).
+        **attributes
+            Attributes of the span
+
+        Returns
+        -------
+        decorator : func
+            The decorator
+        """
+
+        def decorator(func):
+
+            @functools.wraps(func)
+            def wrapped(*args, **kwargs):
+                span_name = name or get_span_name(func)
+                with self.span(span_name, **attributes):
+                    return func(*args, **kwargs)
+
+            return wrapped
+
+        return decorator
+
+
+# The tracer used by ``exo_bespin``
+_tracer = Tracer()
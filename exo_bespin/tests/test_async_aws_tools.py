@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""Tests for the ``async_aws_tools`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_async_aws_tools.py
+
+Dependencies
+------------
+
+    - ``pytest``
+    - ``moto`` (for ``test_start_many``)
+"""
+
+import asyncio
+import io
+import subprocess
+
+import boto3
+import paramiko
+import pytest
+
+from exo_bespin.aws import session_manager
+from exo_bespin.aws.async_aws_tools import AsyncEC2Manager, gather_limited
+
+
+class LocalSSHClient():
+    """Stands in for a ``paramiko.SSHClient`` by running commands
+    locally in a given directory."""
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+
+    def connect(self, **kwargs):
+        pass
+
+    def exec_command(self, command):
+        process = subprocess.run(command, shell=True, cwd=self.work_dir, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+        return None, io.BytesIO(process.stdout), io.BytesIO(process.stderr)
+
+
+class LocalInstance():
+    """Stands in for a ``boto3`` EC2 instance object."""
+
+    public_dns_name = 'localhost'
+
+
+def test_gather_limited():
+    """Assert that ``gather_limited`` never runs more than ``limit``
+    coroutines at once, and returns results in order"""
+
+    running = []
+    peak = []
+
+    async def task(value):
+        running.append(value)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(value)
+        return value
+
+    loop = asyncio.new_event_loop()
+    results = loop.run_until_complete(gather_limited([task(value) for value in range(10)], 3))
+    loop.close()
+
+    assert results == list(range(10))
+    assert max(peak) == 3
+
+
+def test_start_many(tmpdir, monkeypatch):
+    """Assert that ``start_many`` boots several instances from a
+    launch template against a mocked EC2 API, and terminates them if
+    any fails to start"""
+
+    moto = pytest.importorskip('moto')
+    for variable in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SECURITY_TOKEN', 'AWS_SESSION_TOKEN']:
+        monkeypatch.setenv(variable, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+
+    ssh_file = str(tmpdir.join('key.pem'))
+    paramiko.RSAKey.generate(1024).write_private_key_file(ssh_file)
+
+    # Discard any clients created outside of the mocked API
+    session_manager.reset()
+
+    with moto.mock_aws():
+        client = boto3.client('ec2')
+        image_id = client.describe_images(Owners=['amazon'])['Images'][0]['ImageId']
+        template = client.create_launch_template(LaunchTemplateName='exo-bespin-test',
+                                                 LaunchTemplateData={'ImageId': image_id,
+                                                                     'InstanceType': 't2.micro'})
+        ec2_id = template['LaunchTemplate']['LaunchTemplateId']
+
+        manager = AsyncEC2Manager(max_api_calls=2, poll_interval=0)
+
+        async def main():
+            instances = await manager.start_many(ssh_file, ec2_id, 3)
+            running = [instance.state['Name'] == 'running' for instance, _, _ in instances]
+            await asyncio.gather(*[manager.stop_ec2(ec2_id, instance) for instance, _, _ in instances])
+            return instances, running
+
+        loop = asyncio.new_event_loop()
+        instances, running = loop.run_until_complete(main())
+        loop.close()
+        manager.close()
+
+        assert len({instance.id for instance, _, _ in instances}) == 3
+        assert all(running)
+
+        states = [instance['State']['Name'] for reservation in client.describe_instances()['Reservations']
+                  for instance in reservation['Instances']]
+        assert states == ['terminated'] * 3
+
+        # Instances that started are terminated when another does not
+        manager = AsyncEC2Manager(max_api_calls=2, poll_interval=0)
+        wait_until_running = manager.wait_until_running
+        calls = []
+
+        async def fail_once(instance, timeout):
+            calls.append(instance)
+            if len(calls) == 2:
+                raise RuntimeError('EC2 instance {} is terminated'.format(instance.id))
+            await wait_until_running(instance, timeout)
+
+        monkeypatch.setattr(manager, 'wait_until_running', fail_once)
+        loop = asyncio.new_event_loop()
+        with pytest.raises(RuntimeError):
+            loop.run_until_complete(manager.start_many(ssh_file, ec2_id, 3))
+        loop.close()
+        manager.close()
+
+        states = [instance['State']['Name'] for reservation in client.describe_instances()['Reservations']
+                  for instance in reservation['Instances']]
+        assert states == ['terminated'] * 6
+
+    session_manager.reset()
+
+
+def test_wait_for_file(tmpdir):
+    """Assert that ``wait_for_file`` polls a (local stand-in) instance
+    until the file exists"""
+
+    manager = AsyncEC2Manager(poll_interval=0.05)
+    client = LocalSSHClient(str(tmpdir))
+
+    async def create_file():
+        await asyncio.sleep(0.2)
+        tmpdir.join('done.txt').write('')
+
+    async def main():
+        file_exists, _ = await asyncio.gather(
+            manager.wait_for_file(LocalInstance(), None, client, 'done.txt'), create_file())
+        missing = await manager.wait_for_file(LocalInstance(), None, client, 'missing.txt', max_polls=2)
+        return file_exists, missing
+
+    loop = asyncio.new_event_loop()
+    file_exists, missing = loop.run_until_complete(main())
+    loop.close()
+    manager.close()
+
+    assert file_exists
+    assert not missing
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""Tests for the ``aws_tools`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_aws_tools.py
+
+Dependencies
+------------
+
+    - ``pytest``
+    - ``moto`` (for ``test_create_ec2_launch_template``)
+"""
+
+import json
+
+import pytest
+
+from exo_bespin.aws import aws_tools, session_manager
+
+
+def test_build_environment_image_failure(monkeypatch):
+    """Assert that the builder instance is terminated when building the
+    environment image fails"""
+
+    moto = pytest.importorskip('moto')
+    for variable in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SECURITY_TOKEN', 'AWS_SESSION_TOKEN']:
+        monkeypatch.setenv(variable, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setattr(session_manager, '_session_manager', session_manager.SessionManager('aws_config.json'))
+
+    def fail(*args):
+        raise TimeoutError('The environment was never built')
+
+    with moto.mock_aws():
+        ec2 = session_manager.get_resource('ec2')
+        image_id = session_manager.get_client('ec2').describe_images()['Images'][0]['ImageId']
+        instance = ec2.create_instances(ImageId=image_id, MinCount=1, MaxCount=1)[0]
+        monkeypatch.setattr(aws_tools, 'find_environment_image', lambda ec2_id: None)
+        monkeypatch.setattr(aws_tools, 'start_ec2', lambda ssh_file, ec2_id, use_image: (instance, None, None))
+        monkeypatch.setattr(aws_tools, 'wait_for_instance', fail)
+
+        with pytest.raises(TimeoutError):
+            aws_tools.build_environment_image('lt-0123456789abcdef0', 'key.pem')
+        instance.reload()
+        assert instance.state['Name'] in ['shutting-down', 'terminated']
+
+
+def test_create_ec2_launch_template(tmpdir, monkeypatch):
+    """Assert that a launch template is created once, from any working
+    directory, and then reused"""
+
+    moto = pytest.importorskip('moto')
+    for variable in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SECURITY_TOKEN', 'AWS_SESSION_TOKEN']:
+        monkeypatch.setenv(variable, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.chdir(str(tmpdir))
+
+    config_file = tmpdir.join('aws_config.json')
+    config_file.write(json.dumps({'key_pair_name': 'exo-bespin', 'security_group_id': 'sg-1'}))
+    monkeypatch.setattr(session_manager, '_session_manager', session_manager.SessionManager(str(config_file)))
+
+    with moto.mock_aws():
+        template_id = aws_tools.create_ec2_launch_template('linux', 'c5.large')
+        assert aws_tools.create_ec2_launch_template('linux', 'c5.large') == template_id
+        assert aws_tools.create_ec2_launch_template('linux') != template_id
+
+    aws_tools.update_config(ec2_id=template_id)
+    assert json.loads(config_file.read()) == {'key_pair_name': 'exo-bespin', 'security_group_id': 'sg-1',
+                                              'ec2_id': template_id}
+
+
+def test_get_environment_key(monkeypatch):
+    """Assert that the environment key can be computed without the
+    ``environment.yml`` file of a source checkout"""
+
+    key = aws_tools.get_environment_key()
+    assert key == aws_tools.get_environment_key()
+
+    isfile = aws_tools.os.path.isfile
+    monkeypatch.setattr(aws_tools.os.path, 'isfile', lambda path: not path.endswith('environment.yml') and isfile(path))
+    assert len(aws_tools.get_environment_key()) == 64
+    assert aws_tools.get_environment_key() != key
+
+
+def test_sync_directory(tmpdir):
+    """Assert that ``sync_directory`` copies a directory, and then only
+    transfers the blocks that changed and removes the files that were
+    removed"""
+
+    local_dir = tmpdir.mkdir('local')
+    remote_dir = tmpdir.mkdir('remote')
+    local_dir.join('small.txt').write('Hello World!')
+    local_dir.mkdir('sub').join('large.dat').write(b'0' * 10000, mode='wb')
+    local_dir.join('ignored.pyc').write('')
+    filesystem = aws_tools.LocalFileSystem()
+
+    stats = aws_tools.sync_directory(str(local_dir), str(remote_dir), filesystem, block_size=1000)
+    assert stats == {'files': 2, 'blocks': 11, 'bytes': 10012, 'deleted': 0}
+    assert remote_dir.join('sub', 'large.dat').read() == '0' * 10000
+    assert not remote_dir.join('ignored.pyc').exists()
+
+    # Change one block and shorten the file
+    local_dir.join('sub', 'large.dat').write(b'0' * 5000 + b'1' + b'0' * 3999, mode='wb')
+    stats = aws_tools.sync_directory(str(local_dir), str(remote_dir), filesystem, block_size=1000)
+    assert stats == {'files': 1, 'blocks': 1, 'bytes': 1000, 'deleted': 0}
+    assert remote_dir.join('sub', 'large.dat').read() == local_dir.join('sub', 'large.dat').read()
+
+    # Nothing changed
+    stats = aws_tools.sync_directory(str(local_dir), str(remote_dir), filesystem, block_size=1000)
+    assert stats['files'] == 0
+
+    # Files removed locally are removed remotely, but files that were not synced are kept
+    remote_dir.join('remote_only.txt').write('Not synced')
+    local_dir.join('small.txt').remove()
+    stats = aws_tools.sync_directory(str(local_dir), str(remote_dir), filesystem, block_size=1000)
+    assert stats == {'files': 0, 'blocks': 0, 'bytes': 0, 'deleted': 1}
+    assert not remote_dir.join('small.txt').exists()
+    assert remote_dir.join('remote_only.txt').exists()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""Tests for the ``batch_runner`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_batch_runner.py
+
+Dependencies
+------------
+
+    - ``pytest``
+"""
+
+import io
+import json
+import os
+import tarfile
+
+import pytest
+
+from exo_bespin.atmospheric_retrievals import batch_runner
+from exo_bespin.execution.executors import LocalExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class InvalidWrapper():
+    """A stand-in for a ``PlatonWrapper`` whose job specification can
+    not be retrieved from"""
+
+    def save_job_spec(self, job_dir):
+        with open(os.path.join(job_dir, 'job.json'), 'w') as f:
+            f.write('{}')
+
+
+def test_extract(tmpdir):
+    """Assert that archive members outside of the destination are
+    refused"""
+
+    archive = str(tmpdir.join('evil.tar.gz'))
+    with tarfile.open(archive, 'w:gz') as tar:
+        info = tarfile.TarInfo('../evil.txt')
+        info.size = 4
+        tar.addfile(info, io.BytesIO(b'evil'))
+
+    with pytest.raises(tarfile.TarError):
+        batch_runner._extract(archive, str(tmpdir.mkdir('output')))
+    assert not tmpdir.join('evil.txt').exists()
+
+
+def test_get_concurrency():
+    """Assert that jobs are packed such that jobs x threads per job does
+    not exceed the number of vCPUs"""
+
+    assert batch_runner.get_concurrency(1, vcpus=8) == 8
+    assert batch_runner.get_concurrency(3, vcpus=8) == 2
+    assert batch_runner.get_concurrency(16, vcpus=8) == 1
+
+
+def test_run_jobs(tmpdir):
+    """Assert that each job is run in its own directory with the given
+    number of threads, and that all outputs are collected into one
+    archive"""
+
+    script = tmpdir.join('retrieve.py')
+    script.write('import logging, os, sys\n'
+                 'sys.path.insert(0, {!r})\n'
+                 'from exo_bespin.logging.queue_logging import configure_queue_logging\n'
+                 'configure_queue_logging()\n'
+                 'logging.info("Retrieving")\n'
+                 'with open(sys.argv[1] + "_results.dat", "w") as f:\n'
+                 '    f.write(os.environ["OMP_NUM_THREADS"])\n'.format(REPO_DIR))
+
+    batch_dir = tmpdir.mkdir('batch')
+    job_dirs = []
+    for job_id in ['job-a', 'job-b', 'job-c']:
+        job_dir = batch_dir.mkdir(job_id)
+        job_dir.join('job.json').write('{}')
+        job_dirs.append(str(job_dir))
+
+    log_file = str(tmpdir.join('batch.log'))
+    return_codes = batch_runner.run_jobs(job_dirs, 'multinest', threads_per_job=2, script=str(script),
+                                         log_file=log_file)
+    assert list(return_codes.values()) == [0, 0, 0]
+
+    # The records of every job are written to the one log file, tagged with the job
+    with open(log_file, 'r') as f:
+        log = f.read()
+    for job_id in ['job-a', 'job-b', 'job-c']:
+        assert '[{} worker_'.format(job_id) in log
+
+    archive = str(tmpdir.join('batch_results.tar.gz'))
+    batch_runner.archive_results(job_dirs, archive, log_file, return_codes)
+    with tarfile.open(archive, 'r:gz') as tar:
+        names = sorted(tar.getnames())
+        assert tar.extractfile('job-b/multinest_results.dat').read() == b'2'
+        assert json.load(tar.extractfile('return_codes.json')) == {'job-a': 0, 'job-b': 0, 'job-c': 0}
+
+    assert names == sorted(['batch.log', 'return_codes.json'] +
+                           [os.path.join(job_id, filename) for job_id in ['job-a', 'job-b', 'job-c']
+                            for filename in ['multinest_results.dat', 'output.log']])
+
+
+def test_run_batch_failures(tmpdir, monkeypatch):
+    """Assert that ``run_batch`` saves the results of every retrieval
+    and then raises an error naming those that failed"""
+
+    monkeypatch.setenv('PYTHONPATH', REPO_DIR)
+    output_dir = tmpdir.mkdir('output')
+    wrappers = {'job-a': InvalidWrapper(), 'job-b': InvalidWrapper()}
+
+    with pytest.raises(RuntimeError, match='2 of 2 retrievals failed: job-a, job-b'):
+        batch_runner.run_batch(LocalExecutor(), wrappers, 'multinest', output_dir=str(output_dir))
+    assert output_dir.join('job-a', 'output.log').exists()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Tests for the ``executors`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_executors.py
+
+Dependencies
+------------
+
+    - ``pytest``
+"""
+
+import os
+
+import pytest
+
+from exo_bespin.execution import executors
+
+
+def test_get_executor():
+    """Assert that ``get_executor`` returns the requested backend and
+    rejects unknown backends"""
+
+    assert isinstance(executors.get_executor('local'), executors.LocalExecutor)
+
+    with pytest.raises(AssertionError):
+        executors.get_executor('unknown')
+
+
+def test_failed_boot_is_released():
+    """Assert that an executor whose boot fails within a ``with``
+    statement is released"""
+
+    class UnreachableExecutor(executors.LocalExecutor):
+        def boot(self):
+            super().boot()
+            self.booted_dir = self.work_dir
+            raise ConnectionError('Never became reachable')
+
+    executor = UnreachableExecutor()
+    with pytest.raises(ConnectionError):
+        with executor:
+            pass
+
+    assert not os.path.exists(executor.booted_dir)
+
+
+def test_local_executor_lifecycle(tmpdir):
+    """Assert that the ``LocalExecutor`` can upload, run, and download
+    files, and cleans up its working directory when released"""
+
+    input_file = tmpdir.join('input.txt')
+    input_file.write('Hello World!')
+
+    with executors.LocalExecutor() as executor:
+        work_dir = executor.work_dir
+        executor.upload(str(input_file))
+        output, errors = executor.run('mkdir results && cp ~/input.txt results/output.txt && cat results/output.txt')
+        executor.download('results/output.txt', str(tmpdir))
+
+    assert output[0] == 'Hello World!'
+    assert tmpdir.join('output.txt').read() == 'Hello World!'
+    assert not os.path.exists(work_dir)
+
+
+def test_local_executor_run_python():
+    """Assert that ``run_python`` runs scripts relative to the
+    repository"""
+
+    with executors.LocalExecutor() as executor:
+        output, errors = executor.run_python('setup.py', '--name')
+
+    assert 'exo_bespin' in output
+
+
+def test_local_executor_streams_output():
+    """Assert that ``run`` passes each line of output, including the
+    updates of a progress bar, to ``on_line`` as it is produced"""
+
+    lines = []
+    with executors.LocalExecutor() as executor:
+        output, errors = executor.run("printf '%s\\r%s\\n' ' 50%|#  |' '100%|## |'; echo done; echo warning >&2",
+                                      on_line=lines.append)
+
+    assert sorted(lines) == sorted([' 50%|#  |', '100%|## |', 'done', 'warning'])
+    assert 'done' in output
+    assert errors[0] == 'warning'
+
+
+@pytest.mark.parametrize('on_line', [None, print])
+def test_local_executor_failed_command(on_line):
+    """Assert that ``run`` raises a ``CommandError`` holding the exit
+    status and output of a command that fails"""
+
+    with executors.LocalExecutor() as executor:
+        with pytest.raises(executors.CommandError) as error:
+            executor.run('echo partial; echo broken >&2; exit 3', on_line=on_line)
+
+    assert error.value.status == 3
+    assert 'partial' in error.value.output
+    assert 'broken' in str(error.value)
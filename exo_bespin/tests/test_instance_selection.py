@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Tests for the ``instance_selection`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_instance_selection.py
+
+Dependencies
+------------
+
+    - ``pytest``
+"""
+
+import numpy as np
+
+from exo_bespin.aws.instance_selection import calibrate, estimate_job_time, recommend_instance
+
+
+def test_calibrate():
+    """Assert that ``calibrate`` recovers the coefficients of timings
+    that follow the cost model"""
+
+    coefficients = [5., 1e-3, 1e-4]
+    records = []
+    for n_bins in [10, 20, 40]:
+        for n_walkers, n_steps in [(20, 100), (50, 500)]:
+            evaluations = n_walkers * n_steps
+            wall_time = coefficients[0] + coefficients[1] * evaluations + coefficients[2] * evaluations * n_bins
+            records.append({'method': 'emcee', 'n_bins': n_bins, 'n_params': 8, 'n_walkers': n_walkers,
+                            'n_steps': n_steps, 'wall_time': wall_time})
+
+    model = calibrate(records, filename=None)
+    assert np.allclose(model['emcee'], coefficients)
+    assert np.isclose(estimate_job_time('emcee', 30, 8, n_walkers=50, n_steps=1000, model=model),
+                      5 + 50 + 150)
+
+
+def test_recommend_instance():
+    """Assert that ``recommend_instance`` picks the cheapest option that
+    meets the target, and the fastest option otherwise"""
+
+    instance_types = {
+        'slow': {'vcpus': 2, 'memory': 4, 'price': 0.05, 'speed': 1.0, 'baseline': 0.5},
+        'fast': {'vcpus': 8, 'memory': 16, 'price': 0.40, 'speed': 1.0, 'baseline': 1.0}}
+
+    # A short job easily meets the target on the cheapest instance
+    recommendation = recommend_instance(60, n_jobs=1, target_time=3600, instance_types=instance_types)
+    assert (recommendation['instance_type'], recommendation['instances']) == ('slow', 1)
+    assert recommendation['meets_target']
+
+    # Many long jobs need several of the larger instances
+    recommendation = recommend_instance(3000, n_jobs=32, target_time=3600, instance_types=instance_types)
+    assert recommendation['instance_type'] == 'fast'
+    assert recommendation['instances'] == 4
+    assert recommendation['meets_target']
+
+    # An impossible target falls back to the fastest option
+    recommendation = recommend_instance(3000, n_jobs=32, target_time=60, max_instances=2,
+                                        instance_types=instance_types)
+    assert not recommendation['meets_target']
+    assert (recommendation['instance_type'], recommendation['instances']) == ('fast', 2)
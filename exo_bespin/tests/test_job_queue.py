@@ -0,0 +1,557 @@
+#!/usr/bin/env python
+"""Tests for the ``job_queue`` module of the ``bespin`` web app.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_job_queue.py
+
+Dependencies
+------------
+
+    - ``django``
+    - ``pytest``
+"""
+
+import csv
+import functools
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+
+import pytest
+
+django = pytest.importorskip('django')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'exo_bespin.website.bespin_proj.settings')
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+
+from exo_bespin.execution.executors import LocalExecutor
+
+FIT_TIME = 0.1
+
+
+class StandInExecutor(LocalExecutor):
+    """Stands in for an executing machine, taking ``FIT_TIME`` seconds
+    to "fit" the parameters in the given workspace rather than running
+    ``juliet``, and reporting its progress like the progress bar of
+    the sampler"""
+
+    def run_python(self, script, *args, on_line=None):
+        workspace = os.path.join(self.work_dir, args[args.index('--workspace') + 1])
+        with open(os.path.join(workspace, 'params.json'), 'r') as f:
+            params = f.read()
+        for percent in range(0, 101, 25):
+            time.sleep(FIT_TIME / 5)
+            if on_line is not None:
+                on_line('{:3d}%|{:<4}| {}/100'.format(percent, '#' * (percent // 25), percent))
+        os.makedirs(os.path.join(workspace, 'results'), exist_ok=True)
+        with open(os.path.join(workspace, 'results', 'lc.dat'), 'w') as f:
+            f.write('0.0 1.0 {}\n'.format(params))
+        return ['fit of {} complete'.format(script)], []
+
+
+@pytest.fixture(scope='module')
+def database():
+    """Set up the web app with a temporary database"""
+
+    database_dir = tempfile.mkdtemp()
+    settings.DATABASES['default']['NAME'] = os.path.join(database_dir, 'db.sqlite3')
+    django.setup()
+    call_command('migrate', verbosity=0)
+
+    yield
+
+    connection.close()
+
+
+def test_batch_submission(database, tmpdir, monkeypatch):
+    """Assert that many fits can be submitted at once, as JSON or as a
+    CSV file, by the web app or by scripts, and that their batch tracks their combined status and
+    bundles their results"""
+
+    from exo_bespin.website.bespin_app import job_queue
+    from exo_bespin.website.bespin_app.models import Batch, FitJob
+
+    monkeypatch.setattr(settings, 'BESPIN_WORKSPACE_DIR', os.path.join(str(tmpdir), 'workspaces'), raising=False)
+
+    # No jobs are created unless every row is valid
+    n_batches = Batch.objects.count()
+    response = Client().post('/batch/', json.dumps({'jobs': [{'rp': 0.2}, {'rp': -1}, {}]}),
+                             content_type='application/json')
+    assert response.status_code == 400
+    assert set(response.json()['errors']) == {'1', '2'}
+    assert Client().post('/batch/', 'not json', content_type='application/json').status_code == 400
+    assert Batch.objects.count() == n_batches
+
+    # Scripts send an API key in place of a CSRF token
+    monkeypatch.setattr(settings, 'BESPIN_API_KEYS', {'script-key': 'script'}, raising=False)
+    client = Client(enforce_csrf_checks=True)
+    body = json.dumps({'jobs': [{'rp': 0.2}]})
+    assert client.post('/batch/', body, content_type='application/json').status_code == 403
+    response = client.post('/batch/', body, content_type='application/json', HTTP_X_BESPIN_API_KEY='script-key')
+    assert response.status_code == 202
+
+    # Submit a sweep as JSON, and a table of targets as a CSV file
+    sweep = [{'rp': 1 + 0.01 * number} for number in range(30)]
+    json_batch = Client().post('/batch/', json.dumps({'jobs': sweep}), content_type='application/json').json()
+    csv_file = io.BytesIO(b'target,rp\nWASP-18b,0.097\nHAT-P-7b,0.078\nWASP-18b again,0.097\n')
+    csv_file.name = 'targets.csv'
+    csv_batch = Client().post('/batch/', {'file': csv_file}).json()
+    assert json_batch['n_jobs'] == 30 and csv_batch['n_jobs'] == 2
+
+    status = Client().get(json_batch['status_url']).json()
+    assert status['status'] == 'queued' and status['counts']['queued'] == 30
+    assert Client().get(csv_batch['status_url']).json()['n_jobs'] == 2
+
+    pool = job_queue.WorkerPool(4, functools.partial(StandInExecutor, os.path.join(str(tmpdir), 'host')),
+                                poll_interval=0.05)
+    pool.start()
+    start_time = time.time()
+    while FitJob.objects.filter(status__in=['queued', 'running']).exists() and time.time() - start_time < 60:
+        time.sleep(0.1)
+    pool.stop()
+
+    status = Client().get(json_batch['status_url']).json()
+    assert status['status'] == 'done' and status['counts']['done'] == 30
+    assert [job['status'] for job in status['jobs']] == ['done'] * 30
+
+    # The bundle holds a summary and the results of every job
+    response = Client().get(json_batch['bundle_url'])
+    assert response['Content-Type'] == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(response.content)) as bundle:
+        summary = list(csv.DictReader(io.StringIO(bundle.read('summary.csv').decode())))
+        assert len(summary) == 30
+        for row in summary:
+            assert json.loads(row['params'])['rp'] == pytest.approx(
+                float(bundle.read('{}/lc.dat'.format(row['job_id'])).decode().split()[-1].rstrip('}')))
+    assert Client().get('/batch/00000000-0000-0000-0000-000000000000/status/').status_code == 404
+
+
+def test_concurrent_submissions(database, tmpdir, monkeypatch):
+    """Assert that submissions return immediately under concurrent
+    load, and that the worker pool runs every job to completion, in
+    parallel, without the jobs' files colliding"""
+
+    from exo_bespin.website.bespin_app import job_queue
+    from exo_bespin.website.bespin_app.models import FitJob
+
+    monkeypatch.setattr(settings, 'BESPIN_WORKSPACE_DIR', os.path.join(str(tmpdir), 'workspaces'), raising=False)
+
+    # Submit jobs from many clients at once
+    n_jobs = 20
+    responses, response_times = [], []
+
+    def submit(rp):
+        start_time = time.time()
+        response = Client().post('/', {'rp': rp}, HTTP_ACCEPT='application/json')
+        response_times.append(time.time() - start_time)
+        responses.append(response)
+        connection.close()
+
+    threads = [threading.Thread(target=submit, args=(0.01 * (number + 1),)) for number in range(n_jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(response.status_code == 202 for response in responses)
+    assert max(response_times) < n_jobs * FIT_TIME
+    job_ids = [response.json()['job_id'] for response in responses]
+    assert Client().get('/job/{}/status/'.format(job_ids[0])).json()['status'] == 'queued'
+
+    # Run the jobs, with every worker using the same executing machine
+    start_time = time.time()
+    n_workers = 4
+    host_dir = os.path.join(str(tmpdir), 'host')
+    pool = job_queue.WorkerPool(n_workers, functools.partial(StandInExecutor, host_dir), poll_interval=0.05)
+    pool.start()
+    while FitJob.objects.filter(status__in=['queued', 'running']).exists() and time.time() - start_time < 60:
+        time.sleep(0.1)
+    pool.stop()
+    elapsed = time.time() - start_time
+    print('Ran {} jobs on {} workers in {:.2f} seconds'.format(n_jobs, n_workers, elapsed))
+
+    statuses = [Client().get('/job/{}/status/'.format(job_id)).json() for job_id in job_ids]
+    assert [status['status'] for status in statuses] == ['done'] * n_jobs
+    assert elapsed < n_jobs * FIT_TIME
+    for job in FitJob.objects.filter(id__in=job_ids):
+        assert job.get_params()['rp'] == pytest.approx(float(job.get_source().results.split()[-1].rstrip('}')))
+    assert not os.listdir(os.path.join(host_dir, 'jobs'))
+    assert not os.listdir(settings.BESPIN_WORKSPACE_DIR)
+    assert Client().get('/job/00000000-0000-0000-0000-000000000000/status/').status_code == 404
+
+
+def test_result_cache(database, tmpdir, monkeypatch):
+    """Assert that identical submissions are coalesced onto one job,
+    that resubmissions are served from the cache, and that cache
+    entries expire"""
+
+    from exo_bespin.website.bespin_app import job_queue, result_cache
+    from exo_bespin.website.bespin_app.models import FitJob
+
+    monkeypatch.setattr(settings, 'BESPIN_WORKSPACE_DIR', os.path.join(str(tmpdir), 'workspaces'), raising=False)
+    assert result_cache.get_key({'rp': 0.3}) == result_cache.get_key({'rp': 0.1 + 0.2})
+    assert result_cache.get_key({'rp': 0.3}) != result_cache.get_key({'rp': 0.31})
+    stats = Client().get('/cache/stats/').json()
+
+    # Identical submissions made while the first is in flight share its job
+    job_ids = {Client().post('/', {'rp': 0.5}, HTTP_ACCEPT='application/json').json()['job_id'] for _ in range(3)}
+    assert len(job_ids) == 1
+    assert FitJob.objects.filter(status='queued').count() == 1
+
+    pool = job_queue.WorkerPool(1, functools.partial(StandInExecutor, os.path.join(str(tmpdir), 'host')),
+                                poll_interval=0.05)
+    pool.start()
+    start_time = time.time()
+    while FitJob.objects.filter(status__in=['queued', 'running']).exists() and time.time() - start_time < 60:
+        time.sleep(0.1)
+    pool.stop()
+
+    # A resubmission is done at once, with the same results
+    response = Client().post('/', {'rp': 0.5}, HTTP_ACCEPT='application/json').json()
+    assert response['job_id'] not in job_ids
+    cached_job = FitJob.objects.get(id=response['job_id'])
+    assert cached_job.status == 'done' and cached_job.cached
+    assert cached_job.get_source() == FitJob.objects.get(id=job_ids.pop())
+    assert cached_job.results == '' and cached_job.get_source().results
+    assert Client().get('/job/{}/results/'.format(cached_job.id)).json()['n_rows'] > 0
+
+    new_stats = Client().get('/cache/stats/').json()
+    assert new_stats['misses'] - stats['misses'] == 1
+    assert new_stats['coalesced'] - stats['coalesced'] == 2
+    assert new_stats['hits'] - stats['hits'] == 1
+    assert new_stats['entries'] >= 1
+
+    # Entries are evicted once they expire, while the job that ran the fit keeps its results
+    assert result_cache.evict(max_age=0) == new_stats['entries']
+    assert cached_job.get_source().results
+    assert result_cache.lookup(cached_job.key) is None
+
+
+def test_progress_stream(database, tmpdir, monkeypatch):
+    """Assert that the stages and sampling progress of a running job
+    are streamed as server-sent events, resuming from the last event
+    the browser received"""
+
+    from exo_bespin.website.bespin_app import job_queue
+    from exo_bespin.website.bespin_app.models import FitJob
+
+    monkeypatch.setattr(settings, 'BESPIN_WORKSPACE_DIR', os.path.join(str(tmpdir), 'workspaces'), raising=False)
+    job_id = Client().post('/', {'rp': 0.7}, HTTP_ACCEPT='application/json').json()['job_id']
+    events_url = '/job/{}/events/'.format(job_id)
+    assert Client().get(events_url).content.decode() == 'retry: 2000\n\n'
+
+    pool = job_queue.WorkerPool(1, functools.partial(StandInExecutor, os.path.join(str(tmpdir), 'host')),
+                                poll_interval=0.05)
+    pool.start()
+    start_time = time.time()
+    while FitJob.objects.filter(status__in=['queued', 'running']).exists() and time.time() - start_time < 60:
+        time.sleep(0.1)
+    pool.stop()
+
+    response = Client().get(events_url)
+    assert response['Content-Type'] == 'text/event-stream'
+    blocks = response.content.decode().strip().split('\n\n')
+    events = [json.loads(block.split('data: ')[1]) for block in blocks if block.startswith('id: ')]
+    assert [event['stage'] for event in events] == ['booting', 'uploading', 'sampling'] + ['sampling'] * 5 + \
+        ['downloading', 'done']
+    assert [event['progress'] for event in events if event['progress'] is not None] == [0, 25, 50, 75, 100]
+    assert blocks[-1].startswith('event: end')
+
+    # A reconnecting browser only gets the events it has not yet seen
+    last_event_id = blocks[-3].split('\n')[0].split(': ')[1]
+    response = Client().get(events_url, HTTP_LAST_EVENT_ID=last_event_id)
+    blocks = response.content.decode().strip().split('\n\n')
+    assert len(blocks) == 3 and json.loads(blocks[1].split('data: ')[1])['stage'] == 'done'
+
+    status = Client().get('/job/{}/status/'.format(job_id)).json()
+    assert status['stage'] == 'done' and status['progress'] == 100
+
+
+def test_worker_failures(database, tmpdir, monkeypatch):
+    """Assert that a job whose executor can not be created fails
+    without stopping its worker, and that only the jobs of stopped
+    worker pools on this host are put back on the queue"""
+
+    import socket
+    import subprocess
+    import sys
+
+    from exo_bespin.website.bespin_app import job_queue
+    from exo_bespin.website.bespin_app.models import FitJob
+
+    monkeypatch.setattr(settings, 'BESPIN_WORKSPACE_DIR', os.path.join(str(tmpdir), 'workspaces'), raising=False)
+    executors = iter([None])
+
+    def executor_factory():
+        if next(executors, True) is None:
+            raise FileNotFoundError('aws_config.json')
+        return StandInExecutor(os.path.join(str(tmpdir), 'host'))
+
+    first = Client().post('/', {'rp': 0.81}, HTTP_ACCEPT='application/json').json()['job_id']
+    second = Client().post('/', {'rp': 0.82}, HTTP_ACCEPT='application/json').json()['job_id']
+    pool = job_queue.WorkerPool(1, executor_factory, poll_interval=0.05)
+    pool.start()
+    start_time = time.time()
+    while FitJob.objects.filter(status__in=['queued', 'running']).exists() and time.time() - start_time < 60:
+        time.sleep(0.1)
+    pool.stop()
+    assert FitJob.objects.get(id=first).status == 'failed'
+    assert 'aws_config.json' in FitJob.objects.get(id=first).error
+    assert FitJob.objects.get(id=second).status == 'done'
+
+    # Jobs left running by a stopped pool, a running pool, and a pool on another host
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    workers = ['{}-{}-worker-0'.format(socket.gethostname(), process.pid),
+               '{}-{}-worker-0'.format(socket.gethostname(), os.getpid()),
+               'elsewhere-{}-worker-0'.format(process.pid)]
+    jobs = [FitJob.objects.create(params='{}', status='running', worker=worker) for worker in workers]
+    assert job_queue.requeue_running_jobs() == 1
+    assert [FitJob.objects.get(id=job.id).status for job in jobs] == ['queued', 'running', 'running']
+    FitJob.objects.filter(id__in=[job.id for job in jobs]).delete()
+
+
+def test_unparsable_results(database, tmpdir, monkeypatch):
+    """Assert that a job whose results can not be parsed into a light
+    curve, or can not be cached, still succeeds"""
+
+    from django.db import DatabaseError
+
+    from exo_bespin.website.bespin_app import job_queue, light_curves, result_cache
+    from exo_bespin.website.bespin_app.models import FitJob
+
+    monkeypatch.setattr(settings, 'BESPIN_WORKSPACE_DIR', os.path.join(str(tmpdir), 'workspaces'), raising=False)
+    store_light_curve, store = light_curves.store_light_curve, result_cache.store
+
+    def run(rp):
+        job_id = Client().post('/', {'rp': rp}, HTTP_ACCEPT='application/json').json()['job_id']
+        job = job_queue.claim_job('test-worker')
+        assert str(job.id) == job_id
+        assert job_queue.run_job(job, StandInExecutor(os.path.join(str(tmpdir), 'host')))
+        return FitJob.objects.get(id=job_id)
+
+    def fail(error, *args):
+        raise error
+
+    # The results of a job whose light curve can not be parsed are still cached
+    monkeypatch.setattr(light_curves, 'store_light_curve', functools.partial(fail, ValueError('Ragged rows')))
+    unparsable_job = run(0.91)
+    assert result_cache.lookup(unparsable_job.key).job == unparsable_job
+
+    # The light curve of a job whose results can not be cached is still stored
+    monkeypatch.setattr(light_curves, 'store_light_curve', store_light_curve)
+    monkeypatch.setattr(result_cache, 'store', functools.partial(fail, DatabaseError('Database is locked')))
+    uncached_job = run(0.92)
+    monkeypatch.setattr(result_cache, 'store', store)
+    assert result_cache.lookup(uncached_job.key) is None
+    assert light_curves.LightCurve.objects.filter(job=uncached_job).exists()
+    assert unparsable_job.status == uncached_job.status == 'done'
+
+
+def test_results_api(database):
+    """Assert that the results API serves slices of the light curve of
+    a job that are downsampled without losing their extremes, as
+    compressed JSON or binary"""
+
+    import numpy as np
+
+    from exo_bespin.website.bespin_app.models import FitJob
+
+    # A long light curve with a transit and an outlier
+    n_points = 100000
+    times = np.linspace(-0.1, 0.1, n_points)
+    fluxes = 1 - 0.01 * (np.abs(times) < 0.02) + 1e-4 * np.sin(np.arange(n_points))
+    fluxes[12345] = 1.05
+    results = ''.join('{:.8f} {:.8f} 0.0001 inst\n'.format(time, flux) for time, flux in zip(times, fluxes))
+    job = FitJob.objects.create(params='{}', status='done', results=results)
+    results_url = '/job/{}/results/'.format(job.id)
+
+    response = Client().get(results_url, {'width': 500}, HTTP_ACCEPT_ENCODING='gzip')
+    assert response['Content-Encoding'] == 'gzip'
+    content = json.loads(gzip.decompress(response.content))
+    assert content['columns'] == ['time', 'flux', 'flux_error']
+    assert content['n_rows'] == n_points and content['n_points'] <= 2 * 500 + 2
+    assert len(response.content) < len(results) / 100
+    assert max(content['data']['flux']) == pytest.approx(1.05)
+    assert min(content['data']['flux']) == pytest.approx(fluxes.min(), abs=1e-8)
+    assert content['data']['time'] == sorted(content['data']['time'])
+
+    # A slice, as binary
+    response = Client().get(results_url, {'start': -0.01, 'stop': 0.01, 'width': 100, 'format': 'binary'})
+    columns = response['X-Columns'].split(',')
+    data = np.frombuffer(response.content, dtype='<f8').reshape(len(columns), -1)
+    assert data.shape[1] == int(response['X-Points']) <= 202
+    assert int(response['X-Rows']) == n_points
+    assert data[0].min() >= -0.01 and data[0].max() <= 0.01
+
+    # A slice too narrow for the overview is served from every point
+    response = Client().get(results_url, {'start': 0.05, 'stop': 0.0501, 'width': 100}).json()
+    assert response['n_points'] == np.sum((times >= 0.05) & (times <= 0.0501))
+
+    assert Client().get(results_url, {'width': 0}).status_code == 400
+    assert Client().get(results_url, {'column': 'unknown'}).status_code == 400
+    assert Client().get(results_url, {'format': 'csv'}).status_code == 400
+    queued_job = FitJob.objects.create(params='{}')
+    assert Client().get('/job/{}/results/'.format(queued_job.id)).status_code == 409
+    queued_job.delete()
+
+
+def test_fair_share_scheduling(database, tmpdir, monkeypatch):
+    """Assert that queued jobs are run by priority and then in turns by
+    owner, no more than ``BESPIN_MAX_INSTANCES`` at once, and that
+    submissions are refused while the queue is full"""
+
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+
+    from exo_bespin.website.bespin_app import job_queue, scheduling
+    from exo_bespin.website.bespin_app.models import FitJob
+
+    monkeypatch.setattr(settings, 'BESPIN_WORKSPACE_DIR', os.path.join(str(tmpdir), 'workspaces'), raising=False)
+    monkeypatch.setattr(settings, 'BESPIN_MAX_INSTANCES', 2)
+    monkeypatch.setattr(settings, 'BESPIN_API_KEYS', {'heavy-key': 'heavy', 'light-key': 'light'})
+    monkeypatch.setattr(settings, 'BESPIN_TRUSTED_PROXIES', ['10.0.0.1'])
+
+    # Clients can only name themselves through an API key or a trusted proxy
+    def owner(rp, **headers):
+        job_id = Client().post('/', {'rp': rp}, HTTP_ACCEPT='application/json', **headers).json()['job_id']
+        return FitJob.objects.get(id=job_id).owner
+
+    assert owner(1.5, HTTP_X_BESPIN_USER='someone') == '127.0.0.1'
+    assert owner(1.6, HTTP_X_BESPIN_USER='someone', REMOTE_ADDR='10.0.0.1') == 'someone'
+    assert owner(1.7, HTTP_X_BESPIN_API_KEY='light-key') == 'light'
+    assert owner(1.8, HTTP_X_BESPIN_API_KEY='wrong-key') == '127.0.0.1'
+    FitJob.objects.filter(status='queued').delete()
+
+    # One user submits a large batch, and then another submits a few fits
+    heavy = Client().post('/batch/', json.dumps({'jobs': [{'rp': 2 + 0.01 * number} for number in range(12)]}),
+                          content_type='application/json', HTTP_X_BESPIN_API_KEY='heavy-key').json()
+    assert heavy['queue_position'] == 0
+    light = [Client().post('/', {'rp': 3 + 0.01 * number}, HTTP_ACCEPT='application/json',
+                           HTTP_X_BESPIN_API_KEY='light-key').json() for number in range(3)]
+    assert [response['queue_position'] for response in light] == [1, 3, 5]
+
+    # Only staff can raise the priority of a fit
+    assert Client().post('/?priority=5', {'rp': 4}, HTTP_ACCEPT='application/json',
+                         HTTP_X_BESPIN_API_KEY='heavy-key').status_code == 403
+    staff = Client()
+    staff.force_login(User.objects.create_user('staff', is_staff=True))
+    urgent = staff.post('/?priority=5', {'rp': 4}, HTTP_ACCEPT='application/json').json()
+    assert urgent['queue_position'] == 0
+    assert Client().get(light[0]['status_url']).json()['queue_position'] == 2
+
+    # The positions counted for each job agree with the order of the whole
+    # queue, also while one owner has recently started jobs
+    for started in [None, timezone.now()]:
+        FitJob.objects.filter(owner='light').update(started=started)
+        order = scheduling.get_queue_order()
+        assert [scheduling.get_queue_position(job) for job in order] == list(range(len(order)))
+    FitJob.objects.filter(owner='light').update(started=None)
+
+    # Submissions beyond the limit of the queue are refused
+    monkeypatch.setattr(settings, 'BESPIN_MAX_QUEUED', 16)
+    response = Client().post('/', {'rp': 5}, HTTP_ACCEPT='application/json')
+    assert response.status_code == 429 and int(response['Retry-After']) > 0
+    assert response.json()['queue_length'] == 16
+    assert Client().post('/batch/', json.dumps({'jobs': [{'rp': 5}]}),
+                         content_type='application/json').status_code == 429
+    assert Client().post('/?priority=high', {'rp': 5}, HTTP_ACCEPT='application/json').status_code == 400
+
+    # Batches submitted at once are admitted one after another
+    monkeypatch.setattr(settings, 'BESPIN_MAX_QUEUED', 21)
+    status_codes = []
+
+    def submit_batch(number):
+        status_codes.append(Client().post('/batch/', json.dumps({'jobs': [{'rp': 6 + number}, {'rp': 6.5 + number}]}),
+                                          content_type='application/json').status_code)
+        connection.close()
+
+    threads = [threading.Thread(target=submit_batch, args=(number,)) for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(status_codes) == [202, 202, 429, 429]
+    assert FitJob.objects.filter(status='queued').count() == 20
+    FitJob.objects.filter(status='queued', owner='127.0.0.1').delete()
+
+    # Count the fits running at once on the executing machines
+    lock = threading.Lock()
+    running = {'now': 0, 'max': 0}
+
+    class CountingExecutor(StandInExecutor):
+        def run_python(self, *args, **kwargs):
+            with lock:
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+            try:
+                return super().run_python(*args, **kwargs)
+            finally:
+                with lock:
+                    running['now'] -= 1
+
+    pool = job_queue.WorkerPool(4, functools.partial(CountingExecutor, os.path.join(str(tmpdir), 'host')),
+                                poll_interval=0.05)
+    pool.start()
+    start_time = time.time()
+    while FitJob.objects.filter(status__in=['queued', 'running']).exists() and time.time() - start_time < 60:
+        time.sleep(0.1)
+    pool.stop()
+
+    jobs = list(FitJob.objects.filter(owner__in=['heavy', 'light', 'staff']).order_by('started', 'id'))
+    assert len(jobs) == 16 and all(job.status == 'done' for job in jobs)
+    assert str(jobs[0].id) == urgent['job_id']
+    assert running['max'] == 2
+
+    # The light user's fits did not wait for the heavy user's batch.  Each
+    # starts once the previous one finishes, while up to two of the heavy
+    # user's fits start on the other instance.
+    owners = [job.owner for job in jobs]
+    assert owners.index('light') <= 2 and len(owners) - owners[::-1].index('light') <= 9
+
+
+def test_fair_share_simulation(database):
+    """Assert that, under a simulated load, the fair-share scheduler
+    keeps a light user from waiting behind a heavy user's backlog"""
+
+    from exo_bespin.website.bespin_app import scheduling
+
+    # A heavy user submits 100 fits at once, and a light user submits
+    # a fit every 15 minutes, to four instances running 30 minute fits
+    submissions = [(0, 'heavy', 0)] * 100 + [(60 + 900 * number, 'light', 0) for number in range(10)]
+    waits = {}
+    for fair_share in [True, False]:
+        starts = scheduling.simulate(submissions, capacity=4, duration=1800, fair_share=fair_share)
+        waits[fair_share] = [start - submitted for start, (submitted, owner, _) in zip(starts, submissions)
+                             if owner == 'light']
+        assert all(sum(other <= start < other + 1800 for other in starts) <= 4 for start in starts)
+    print('Mean wait of the light user: {:.0f} s with fair share, {:.0f} s without'.format(
+        sum(waits[True]) / 10, sum(waits[False]) / 10))
+    assert max(waits[True]) <= 1800
+    assert min(waits[False]) > 10 * 1800
+
+    # Higher priorities go first, and the capacity is never exceeded
+    starts = scheduling.simulate([(0, 'a', 0)] * 3 + [(0, 'b', 1)], capacity=1, duration=10)
+    assert starts == [10, 20, 30, 0]
+    starts = scheduling.simulate([(0, 'a', 0)] * 9, capacity=3, duration=10)
+    assert starts == [0, 0, 0, 10, 10, 10, 20, 20, 20]
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Tests for the ``log_index`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_log_index.py
+
+Dependencies
+------------
+
+    - ``pytest``
+"""
+
+import json
+import logging
+import os
+
+from exo_bespin.logging import logging_tools
+from exo_bespin.logging.log_index import LogIndex, parse_since
+
+
+def test_jsonl_log_format(tmpdir):
+    """Assert that ``configure_logging`` writes structured records with
+    their job ID, stage, and duration"""
+
+    log_file = logging_tools.configure_logging('test_log_index', str(tmpdir), log_format='jsonl', job_id='job-1')
+    logging.info('Retrieval Execution Time: 0:0:12', extra={'stage': 'retrieve', 'method': 'emcee', 'duration': 12.})
+    logging.shutdown()
+    for handler in logging.root.handlers[:]:
+        logging.root.removeHandler(handler)
+
+    assert log_file.endswith('.jsonl')
+    with open(log_file, 'r') as f:
+        records = [json.loads(line) for line in f]
+    record = records[-1]
+    assert record['message'] == 'Retrieval Execution Time: 0:0:12'
+    assert (record['job_id'], record['stage'], record['method'], record['duration']) == ('job-1', 'retrieve', 'emcee', 12.)
+
+
+def test_log_index(tmpdir):
+    """Assert that the index is updated incrementally and answers
+    percentile queries"""
+
+    log_dir = os.path.join(str(tmpdir), 'logs')
+    os.makedirs(log_dir)
+
+    def write_records(filename, durations, mode='a', created=1e9):
+        with open(os.path.join(log_dir, filename), mode) as f:
+            for duration in durations:
+                f.write(json.dumps({'created': created, 'level': 'INFO', 'message': '', 'stage': 'retrieve',
+                                    'method': 'multinest', 'duration': duration}) + '\n')
+            f.write(json.dumps({'created': created, 'message': 'no stage'}) + '\n')
+
+    write_records('a.jsonl', range(1, 51))
+    write_records('b.jsonl', range(51, 101))
+    with LogIndex(os.path.join(str(tmpdir), 'index.sqlite')) as index:
+        assert index.update([log_dir]) == 100
+        assert index.update([log_dir]) == 0
+        assert index.percentile('retrieve', 50, method='multinest') == 50.5
+        assert index.percentile('retrieve', 95, method='emcee') is None
+
+        # Appended records are added, and a partially written line waits for the next update
+        write_records('a.jsonl', [1000])
+        with open(os.path.join(log_dir, 'a.jsonl'), 'a') as f:
+            f.write('{"created": 1e9, "stage": "retr')
+        assert index.update([log_dir]) == 1
+        assert index.durations('retrieve')[-1] == 1000
+
+        # Rewritten and removed files are re-indexed and forgotten
+        write_records('a.jsonl', [5], mode='w', created=2e9)
+        os.remove(os.path.join(log_dir, 'b.jsonl'))
+        assert index.update([log_dir]) == 1
+        assert index.durations('retrieve') == [5]
+        assert index.durations('retrieve', since=parse_since('1d', now=2e9)) == [5]
+        assert index.durations('retrieve', since=parse_since('1d', now=3e9)) == []
@@ -22,7 +22,13 @@ Dependencies
     - ``pytest``
 """
 
+import functools
+import logging
 import os
+import threading
+import time
+
+import pytest
 
 from exo_bespin.logging import logging_tools
 
@@ -36,3 +42,111 @@ def test_configure_logging():
 
     # Remove the log file
     os.remove(log_file)
+
+
+def test_get_environment_snapshot(tmpdir):
+    """Assert that the environment snapshot is captured once and then
+    reused from the cache"""
+
+    snapshot_dir = str(tmpdir)
+    snapshot = logging_tools.get_environment_snapshot(snapshot_dir, wait=True)
+    assert os.path.getsize(snapshot) > 0
+
+    modified_time = os.path.getmtime(snapshot)
+    assert logging_tools.get_environment_snapshot(snapshot_dir) == snapshot
+    assert not logging_tools._snapshot_threads
+    assert os.path.getmtime(snapshot) == modified_time
+
+
+def test_get_environment_snapshot_failure(tmpdir, monkeypatch, caplog):
+    """Assert that a failure to capture the environment snapshot is
+    logged, rather than the path of a snapshot that does not exist, and
+    is not retried"""
+
+    def fail(*args, **kwargs):
+        raise OSError('conda is broken')
+
+    monkeypatch.setattr(logging_tools.subprocess, 'check_output', fail)
+    monkeypatch.setattr(logging_tools, '_snapshot_errors', {})
+    monkeypatch.setattr(logging_tools, 'get_environment_snapshot',
+                        functools.partial(logging_tools.get_environment_snapshot, str(tmpdir)))
+
+    snapshot = logging_tools.get_environment_snapshot(wait=True)
+    assert not os.path.exists(snapshot)
+    assert logging_tools.get_environment_snapshot() == snapshot
+    assert not logging_tools._snapshot_threads
+
+    with caplog.at_level(logging.INFO):
+        logging_tools._log_environment_info()
+    assert 'Environment: could not be captured (conda is broken)' in caplog.text
+    assert 'Environment: {}'.format(snapshot) not in caplog.text
+
+
+def test_memory_tracker():
+    """Assert that the memory tracker records the peak memory and
+    allocation sites of a stage, and fails fast when its budget is
+    exceeded"""
+
+    with logging_tools.MemoryTracker('allocate', trace_allocations=True) as tracker:
+        data = bytearray(50 * 1024 * 1024)
+    assert tracker.peak_rss_mb >= tracker.start_rss_mb
+    assert tracker.peak_traced_mb >= 50
+    assert 'test_logging_tools.py' in tracker.top_allocations[0][0]
+    assert tracker.top_allocations[0][1] >= 50
+    del data
+
+    # Keep allocating until the budget is exceeded
+    blocks = []
+    budget_mb = logging_tools._read_rss()[0] / 1e6 + 100
+    with pytest.raises(logging_tools.MemoryBudgetError, match='allocate'):
+        with logging_tools.MemoryTracker('allocate', budget_mb, interval=0.05) as tracker:
+            for _ in range(100):
+                blocks.append(b'x' * 10 * 1024 * 1024)
+                time.sleep(0.02)
+                tracker.check()
+    assert len(blocks) < 100
+    assert tracker.peak_traced_mb is None
+
+    # A stage in the main thread is interrupted without checking
+    blocks = []
+    with pytest.raises(logging_tools.MemoryBudgetError, match='allocate'):
+        with logging_tools.MemoryTracker('allocate', budget_mb, interval=0.05):
+            for _ in range(100):
+                blocks.append(b'x' * 10 * 1024 * 1024)
+                time.sleep(0.02)
+    assert len(blocks) < 100
+    del blocks
+
+    # A stage in another thread that does not check fails when it finishes
+    errors = []
+
+    def run_stage():
+        stage_blocks = []
+        try:
+            with logging_tools.MemoryTracker('allocate', budget_mb, interval=0.05):
+                for _ in range(20):
+                    stage_blocks.append(b'x' * 10 * 1024 * 1024)
+                time.sleep(0.2)
+        except logging_tools.MemoryBudgetError as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=run_stage)
+    thread.start()
+    thread.join()
+    assert len(errors) == 1
+
+
+def test_nested_memory_trackers():
+    """Assert that a tracker started within another does not wipe
+    the peak of the outer one"""
+
+    with logging_tools.MemoryTracker('outer', interval=0.05) as outer:
+        data = bytearray(100 * 1024 * 1024)
+        data[::4096] = b'x' * len(data[::4096])
+        time.sleep(0.2)
+        del data
+        with logging_tools.MemoryTracker('inner', interval=0.05) as inner:
+            time.sleep(0.1)
+
+    assert outer.peak_rss_mb >= outer.start_rss_mb + 90
+    assert inner.peak_rss_mb < outer.peak_rss_mb
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Tests for the ``pipeline`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_pipeline.py
+
+Dependencies
+------------
+
+    - ``pytest``
+"""
+
+import time
+
+import pytest
+
+from exo_bespin.execution.executors import LocalExecutor
+from exo_bespin.execution.pipeline import Pipeline
+from exo_bespin.execution.scheduler import Job
+
+
+class SlowBootExecutor(LocalExecutor):
+    """A ``LocalExecutor`` that takes a while to boot"""
+
+    def boot(self):
+        time.sleep(0.5)
+        super().boot()
+
+
+class FailingExecutor(LocalExecutor):
+    """A ``LocalExecutor`` that fails to run jobs and to be released"""
+
+    def run_python(self, script, *args, on_line=None):
+        raise ConnectionError('Lost connection to instance')
+
+    def release(self):
+        super().release()
+        raise ConnectionError('Could not stop instance')
+
+
+def test_pipeline(tmpdir):
+    """Assert that the ``Pipeline`` runs every job, overlaps preparing
+    inputs with booting, and reports the timing of each stage"""
+
+    jobs = []
+    for job_id in ['job-a', 'job-b']:
+        input_file = tmpdir.join('{}.txt'.format(job_id))
+        job = Job(job_id, 'setup.py', args=['--name', '> {}/name.txt'.format(job_id)],
+                  prepare=lambda input_file=input_file: input_file.write('input'),
+                  uploads=[(str(input_file), '{}/input.txt'.format(job_id))],
+                  downloads=['{}/name.txt'.format(job_id), '{}/input.txt'.format(job_id)])
+        jobs.append(job)
+
+    output_dir = tmpdir.mkdir('output')
+    pipeline = Pipeline(SlowBootExecutor())
+    outputs = pipeline.run(jobs, str(output_dir))
+    pipeline.wait()
+
+    assert set(outputs) == {'job-a', 'job-b'}
+    assert 'exo_bespin' in output_dir.join('name.txt').read()
+    assert output_dir.join('input.txt').read() == 'input'
+
+    timings = {(job_id, stage): (start, end) for job_id, stage, start, end in pipeline.timings}
+    assert timings[('job-a', 'prepare')][1] < timings[('executor', 'boot')][1]
+    assert timings[('job-b', 'compute')][0] >= timings[('job-a', 'compute')][1]
+    assert ('executor', 'release') in timings
+
+    report = pipeline.report()
+    for stage in ['boot', 'prepare', 'upload', 'compute', 'download', 'release']:
+        assert stage in report
+
+
+def test_pipeline_failure(tmpdir):
+    """Assert that when a stage fails, the executor is released only
+    once the stages under way have finished, and that an error
+    releasing it is raised by ``wait``"""
+
+    slow_job = Job('job-b', 'setup.py', prepare=lambda: time.sleep(0.5))
+    pipeline = Pipeline(FailingExecutor())
+    with pytest.raises(ConnectionError, match='Lost connection'):
+        pipeline.run([Job('job-a', 'setup.py'), slow_job], str(tmpdir))
+    with pytest.raises(ConnectionError, match='Could not stop'):
+        pipeline.wait()
+
+    timings = {(job_id, stage): (start, end) for job_id, stage, start, end in pipeline.timings}
+    assert timings[('executor', 'release')][0] >= timings[('job-b', 'prepare')][1]
+
+
+def test_pipeline_teardown(tmpdir):
+    """Assert that the teardown function is run before the executor is
+    released, and that the executor is released even if it fails"""
+
+    calls = []
+
+    class RecordingExecutor(LocalExecutor):
+        def release(self):
+            calls.append('release')
+            super().release()
+
+    def teardown(executor):
+        calls.append('teardown')
+        raise ConnectionError('Could not stop daemon')
+
+    pipeline = Pipeline(RecordingExecutor(), setup=lambda executor: calls.append('setup'), teardown=teardown)
+    pipeline.run([Job('job-a', 'setup.py', args=['--name'])], str(tmpdir))
+    with pytest.raises(ConnectionError, match='Could not stop daemon'):
+        pipeline.wait()
+
+    assert calls == ['setup', 'teardown', 'release']
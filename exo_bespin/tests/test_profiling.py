@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Tests for the ``profiling`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_profiling.py
+
+Dependencies
+------------
+
+    - ``pytest``
+"""
+
+import os
+import time
+
+from exo_bespin.logging import profiling
+
+
+def _busy_function(duration):
+    """Keep the CPU busy for the given number of seconds"""
+
+    start_time = time.time()
+    total = 0
+    while time.time() - start_time < duration:
+        total += sum(range(1000))
+
+    return total
+
+
+def test_environment_variable(monkeypatch):
+    """Assert that the environment variable enables profiling, and is
+    passed on to remote commands"""
+
+    monkeypatch.delenv(profiling.PROFILE_VARIABLE, raising=False)
+    assert not profiling.profiling_enabled()
+    assert profiling.forward_environment('python run_fit.py') == 'python run_fit.py'
+
+    monkeypatch.setenv(profiling.PROFILE_VARIABLE, '1')
+    assert profiling.profiling_enabled()
+    assert profiling.forward_environment('python run_fit.py') == 'EXO_BESPIN_PROFILE=1 python run_fit.py'
+
+
+def test_profile(tmpdir):
+    """Assert that profiling writes collapsed stacks in which the busy
+    function appears"""
+
+    filename = os.path.join(str(tmpdir), 'test.folded')
+    with profiling.profile(filename, interval=0.005) as profiler:
+        _busy_function(0.5)
+
+    assert profiler.n_samples > 10
+    with open(filename, 'r') as f:
+        lines = f.read().splitlines()
+
+    busy_samples = 0
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        assert all(':' in frame for frame in stack.split(';'))
+        if 'test_profiling.py:_busy_function' in stack:
+            busy_samples += int(count)
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in lines) == profiler.n_samples
+    assert busy_samples > 0.8 * profiler.n_samples
+
+    # Nothing is written when profiling is not enabled
+    disabled_filename = os.path.join(str(tmpdir), 'disabled.folded')
+    with profiling.profile(disabled_filename, enabled=False) as profiler:
+        _busy_function(0.01)
+    assert profiler is None
+    assert not os.path.exists(disabled_filename)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Tests for the ``queue_logging`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_queue_logging.py
+
+Dependencies
+------------
+
+    - ``pytest``
+"""
+
+import os
+import socket
+import subprocess
+import sys
+
+from exo_bespin.logging.queue_logging import LogListener
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_log_listener(tmpdir):
+    """Assert that the listener writes the tagged records of several
+    workers to one file, and survives workers that crash or send
+    malformed records"""
+
+    worker = ('import logging, os, sys, time\n'
+              'sys.path.insert(0, {!r})\n'
+              'from exo_bespin.logging.queue_logging import configure_queue_logging\n'
+              'configure_queue_logging()\n'
+              'for index in range(100):\n'
+              '    logging.info("record %d", index)\n'
+              'if sys.argv[1] == "crash":\n'
+              '    time.sleep(0.5)\n'
+              '    os._exit(1)\n').format(REPO_DIR)
+
+    log_file = str(tmpdir.join('workers.log'))
+    with LogListener(log_file) as listener:
+
+        # A connection that sends garbage and then a partial record
+        host, port = listener.address.split(':')
+        garbage = socket.create_connection((host, int(port)))
+        garbage.sendall(b'not json\n\xff\xfe\n[1, 2]\n{"msg": "partial')
+        garbage.close()
+
+        processes = []
+        for job_id, mode in [('job-a', 'exit'), ('job-b', 'crash')]:
+            env = dict(os.environ, **listener.worker_environment(job_id, 'worker-{}'.format(job_id[-1])))
+            processes.append(subprocess.Popen([sys.executable, '-c', worker, mode], env=env))
+        return_codes = [process.wait() for process in processes]
+
+    assert return_codes == [0, 1]
+    with open(log_file, 'r') as f:
+        lines = f.read().splitlines()
+
+    assert len([line for line in lines if '[job-a worker-a]: record' in line]) == 100
+    assert len([line for line in lines if '[job-b worker-b]: record' in line]) == 100
+    assert lines[0].split(' ', 3)[-1].startswith('INFO [')
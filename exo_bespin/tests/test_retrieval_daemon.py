@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Tests for the ``retrieval_daemon`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_retrieval_daemon.py
+
+Dependencies
+------------
+
+    - ``pytest``
+"""
+
+import os
+import threading
+import time
+
+from exo_bespin.atmospheric_retrievals import retrieval_daemon
+from exo_bespin.execution.executors import REPO_DIR, LocalExecutor
+
+
+def test_daemon_lifecycle(tmpdir, monkeypatch):
+    """Assert that the daemon answers a ping with the fingerprint of its
+    code, and stops once the last executor attached to it detaches"""
+
+    monkeypatch.setattr(retrieval_daemon, '_preload', lambda: (None, None))
+    socket_path = str(tmpdir.join('daemon.sock'))
+    daemon = threading.Thread(target=retrieval_daemon.serve, args=(socket_path,), daemon=True)
+    daemon.start()
+
+    start_time = time.time()
+    while retrieval_daemon.ping(socket_path) is None:
+        assert time.time() - start_time < 10
+        time.sleep(0.1)
+    assert retrieval_daemon.ping(socket_path) == retrieval_daemon._get_fingerprint()
+
+    assert retrieval_daemon._request('attach', socket_path)['attached'] == 1
+    assert retrieval_daemon._request('attach', socket_path)['attached'] == 2
+    assert retrieval_daemon._request('detach', socket_path)['attached'] == 1
+    assert retrieval_daemon.ping(socket_path) is not None
+
+    assert retrieval_daemon._request('detach', socket_path)['attached'] == 0
+    daemon.join(timeout=10)
+    assert not daemon.is_alive()
+    assert not os.path.exists(socket_path)
+    assert retrieval_daemon.ping(socket_path) is None
+
+
+def test_stale_daemon(monkeypatch):
+    """Assert that a daemon running other code than that on the
+    executing machine is found to be stale"""
+
+    monkeypatch.setattr(retrieval_daemon, '_preload', lambda: (None, None))
+    monkeypatch.setattr(retrieval_daemon, '_get_fingerprint', lambda: 'code loaded before a sync')
+    monkeypatch.setenv('PYTHONPATH', REPO_DIR)
+
+    with LocalExecutor() as executor:
+        assert retrieval_daemon._ping_remote(executor) == 'not running'
+
+        socket_path = os.path.join(executor.work_dir, '.exo_bespin_daemon.sock')
+        daemon = threading.Thread(target=retrieval_daemon.serve, args=(socket_path,), daemon=True)
+        daemon.start()
+        while retrieval_daemon.ping(socket_path) is None:
+            time.sleep(0.1)
+        assert retrieval_daemon._ping_remote(executor) == 'stale'
+
+        executor.run_python(retrieval_daemon.DAEMON_SCRIPT, 'stop')
+        daemon.join(timeout=10)
+        assert not daemon.is_alive()
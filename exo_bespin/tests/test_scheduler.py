@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Tests for the ``scheduler`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_scheduler.py
+
+Dependencies
+------------
+
+    - ``pytest``
+"""
+
+from exo_bespin.execution.executors import LocalExecutor
+from exo_bespin.execution.scheduler import Job, Scheduler
+
+
+class FlakyExecutor(LocalExecutor):
+    """A ``LocalExecutor`` that fails the first command it runs"""
+
+    failures = []
+
+    def run(self, command):
+        if not FlakyExecutor.failures:
+            FlakyExecutor.failures.append(command)
+            raise ConnectionError('Lost connection to instance')
+        return super().run(command)
+
+
+def test_scheduler(tmpdir):
+    """Assert that the ``Scheduler`` runs every job, downloads the
+    outputs into per-job directories, and requeues jobs whose executor
+    fails"""
+
+    scheduler = Scheduler(FlakyExecutor, n_executors=2, database=str(tmpdir.join('jobs.db')),
+                          output_dir=str(tmpdir))
+    for index in range(6):
+        job = Job('job-{}'.format(index), 'setup.py', args=['--name', '> name.txt'], downloads=['name.txt'])
+        scheduler.submit(job)
+    report = scheduler.run()
+
+    assert len(FlakyExecutor.failures) == 1
+    assert report['jobs_completed'] == 6
+    assert report['jobs_failed'] == 0
+    assert set(report['utilization']) == {'executor-0', 'executor-1'}
+    for index in range(6):
+        assert scheduler.database.status('job-{}'.format(index)) == 'done'
+        assert 'exo_bespin' in tmpdir.join('job-{}'.format(index), 'name.txt').read()
+
+    # Finished jobs are not run again, nor counted in the next report
+    scheduler.submit(Job('job-0', 'setup.py'))
+    scheduler.submit(Job('job-6', 'setup.py', args=['--name']))
+    report = scheduler.run()
+    assert report['jobs_completed'] == 1
+    assert report['jobs_failed'] == 0
+
+
+def test_scheduler_failed_job(tmpdir):
+    """Assert that a job that exits with a non-zero status is marked as
+    failed without being retried, and that its executor is kept"""
+
+    executors = []
+
+    def executor_factory():
+        executors.append(LocalExecutor())
+        return executors[-1]
+
+    scheduler = Scheduler(executor_factory, n_executors=1, database=str(tmpdir.join('jobs.db')),
+                          output_dir=str(tmpdir), max_attempts=3)
+    scheduler.submit(Job('broken', 'setup.py', downloads=['name.txt']))
+    scheduler.submit(Job('fine', 'setup.py', args=['--name', '> name.txt'], downloads=['name.txt']))
+    report = scheduler.run()
+
+    assert report['jobs_failed'] == 1
+    assert report['jobs_completed'] == 1
+    assert scheduler.database.status('broken') == 'failed'
+    assert scheduler.database.status('fine') == 'done'
+    assert not tmpdir.join('broken').check()
+    assert len(executors) == 1
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""Tests for the ``session_manager`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_session_manager.py
+
+Dependencies
+------------
+
+    - ``pytest``
+"""
+
+import json
+import threading
+
+import paramiko
+
+from exo_bespin.aws.session_manager import SessionManager
+
+
+def test_get_config(tmpdir):
+    """Assert that the configuration is cached until the file changes"""
+
+    config_file = tmpdir.join('aws_config.json')
+    config_file.write(json.dumps({'ec2_id': 'lt-1'}))
+    manager = SessionManager(str(config_file))
+
+    settings = manager.get_config()
+    settings['ec2_id'] = 'modified'
+    assert manager.get_config() == {'ec2_id': 'lt-1'}
+    assert manager.get_config() is not manager.get_config()
+
+    config_file.write(json.dumps({'ec2_id': 'lt-22'}))
+    assert manager.get_config() == {'ec2_id': 'lt-22'}
+
+
+def test_get_key(tmpdir):
+    """Assert that each key file is only parsed once"""
+
+    ssh_file = str(tmpdir.join('key.pem'))
+    paramiko.RSAKey.generate(1024).write_private_key_file(ssh_file)
+    manager = SessionManager()
+
+    assert manager.get_key(ssh_file) is manager.get_key(ssh_file)
+
+
+def test_clients_and_resources(monkeypatch):
+    """Assert that clients are shared across threads, and resources are
+    created once per thread"""
+
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    manager = SessionManager()
+    clients = []
+    resources = []
+
+    def use_manager():
+        clients.append(manager.get_client('ec2'))
+        resources.append(manager.get_resource('ec2'))
+        resources.append(manager.get_resource('ec2'))
+
+    threads = [threading.Thread(target=use_manager) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(client) for client in clients}) == 1
+    assert len({id(resource) for resource in resources}) == 3
+
+
+def test_update_config(tmpdir):
+    """Assert that updating the configuration keeps its other values,
+    and that the change is seen"""
+
+    config_file = tmpdir.join('aws_config.json')
+    config_file.write(json.dumps({'ec2_id': 'lt-1', 'key_pair_name': 'exo-bespin'}))
+    manager = SessionManager(str(config_file))
+    manager.get_config()
+
+    manager.update_config(ec2_id='lt-2')
+
+    assert manager.get_config() == {'ec2_id': 'lt-2', 'key_pair_name': 'exo-bespin'}
+    assert tmpdir.listdir() == [config_file]
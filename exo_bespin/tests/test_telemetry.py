@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Tests for the ``telemetry`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_telemetry.py
+
+Dependencies
+------------
+
+    - ``pytest``
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from exo_bespin.execution.telemetry import sample, sample_process, summarize
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/stat'), reason='Requires /proc')
+def test_sample(tmpdir):
+    """Assert that ``sample`` records the resource use of a job and its
+    children until the job finishes"""
+
+    output = str(tmpdir.join('telemetry.csv'))
+    job = ('import subprocess, sys, time\n'
+           'child = subprocess.Popen([sys.executable, "-c", "x = bytearray(100 * 10**6); import time; time.sleep(0.6)"])\n'
+           'child.wait()\n'
+           'sys.exit(3)\n')
+    return_code = sample([sys.executable, '-c', job], output, interval=0.1)
+    assert return_code == 3
+
+    summary = summarize(output)
+    assert summary['samples'] >= 3
+    assert summary['peak_rss_mb'] > 100
+    assert summary['duration'] >= 0.6
+    assert 0 <= summary['mean_cpu'] <= 100
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/stat'), reason='Requires /proc')
+def test_sample_process(tmpdir):
+    """Assert that ``sample_process`` records the resource use of a
+    process that samples itself from a background thread"""
+
+    output = str(tmpdir.join('telemetry.csv'))
+    finished = threading.Event()
+    sampler = threading.Thread(target=sample_process, args=(os.getpid(), finished.wait, output, 0.1))
+    sampler.start()
+    data = bytearray(100 * 10**6)
+    time.sleep(0.4)
+    finished.set()
+    sampler.join()
+    del data
+
+    summary = summarize(output)
+    assert summary['samples'] >= 3
+    assert summary['peak_rss_mb'] > 100
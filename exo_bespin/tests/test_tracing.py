@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Tests for the ``tracing`` module.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    These tests can be run via the command line (omit the -s to
+    suppress verbose output to stdout):
+
+    ::
+
+        pytest -s test_tracing.py
+
+Dependencies
+------------
+
+    - ``pytest``
+"""
+
+import json
+import threading
+
+import pytest
+
+from exo_bespin.logging import tracing
+from exo_bespin.logging.logging_tools import log_timing
+from exo_bespin.logging.tracing import Tracer
+
+
+def test_nested_spans():
+    """Assert that spans nest within the same thread, record errors,
+    and keep return values"""
+
+    tracer = Tracer()
+
+    @tracer.trace(kind='inner')
+    def inner(value):
+        return value * 2
+
+    with tracer.span('outer', target='hd209458b') as outer:
+        assert inner(21) == 42
+        with pytest.raises(ValueError):
+            with tracer.span('failing'):
+                raise ValueError()
+
+    thread = threading.Thread(target=inner, args=(1,))
+    thread.start()
+    thread.join()
+
+    spans = {(span['name'], span['tid']): span for span in tracer.get_spans()}
+    main, other = outer.tid, thread.ident
+    assert spans[('test_tracing.test_nested_spans.<locals>.inner', main)]['parent_id'] == outer.span_id
+    assert spans[('test_tracing.test_nested_spans.<locals>.inner', main)]['attributes'] == {'kind': 'inner'}
+    assert spans[('failing', main)]['attributes'] == {'error': 'ValueError'}
+    assert spans[('outer', main)]['parent_id'] is None
+    assert spans[('outer', main)]['duration'] >= spans[('failing', main)]['duration']
+    assert spans[('test_tracing.test_nested_spans.<locals>.inner', other)]['parent_id'] is None
+
+
+def test_export(tmpdir):
+    """Assert that spans are exported to JSON and the Chrome trace
+    format, and can be loaded into another tracer"""
+
+    tracer = Tracer()
+    with tracer.span('outer', method='multinest'):
+        with tracer.span('inner'):
+            pass
+
+    json_file, chrome_file = str(tmpdir.join('spans.json')), str(tmpdir.join('trace.json'))
+    tracer.export_json(json_file)
+    tracer.export_chrome_trace(chrome_file)
+
+    other = Tracer()
+    other.load_json(json_file)
+    assert other.get_spans() == tracer.get_spans()
+
+    with open(chrome_file, 'r') as f:
+        events = json.load(f)['traceEvents']
+    assert [event['name'] for event in events] == ['inner', 'outer']
+    assert all(event['ph'] == 'X' for event in events)
+    assert events[1]['args'] == {'method': 'multinest'}
+    assert events[1]['ts'] <= events[0]['ts']
+
+
+def test_log_timing():
+    """Assert that ``log_timing`` returns the value of the wrapped
+    function"""
+
+    @log_timing
+    def add(a, b):
+        return a + b
+
+    assert add(1, 2) == 3
+    assert add.__name__ == 'add'
+    assert tracing.get_spans()[-1]['name'] == 'test_tracing.test_log_timing.<locals>.add'
+
+
+def test_max_spans():
+    """Assert that a tracer keeps only its most recent spans"""
+
+    tracer = Tracer(max_spans=3)
+    for number in range(5):
+        with tracer.span('span-{}'.format(number)):
+            pass
+
+    assert [span['name'] for span in tracer.get_spans()] == ['span-2', 'span-3', 'span-4']
+    tracer.clear()
+    assert tracer.get_spans() == []
@@ -0,0 +1,182 @@
+"""Bulk submission of fits to the ``bespin`` web app.
+
+Rather than one value per form submission, many fits can be submitted
+in one request, either as JSON, for example:
+::
+
+    {"jobs": [{"rp": 0.1}, {"rp": 0.2}, {"rp": 0.3}]}
+
+or as an uploaded CSV file, with a header row naming the parameters of
+the form (any other columns, such as the name of a target, are
+ignored):
+::
+
+    target,rp
+    WASP-18b,0.097
+    HAT-P-7b,0.078
+
+Every row is validated with the same form as a single submission, and
+no job is created unless all of them are valid.  The jobs are then
+submitted to the job queue (see ``job_queue.submit_batch``), where the
+worker pool spreads them across its workers, and each worker across its
+own executing machine.  They are grouped under a ``Batch``, whose
+combined status can be polled, and whose results can be downloaded as
+a single zip bundle.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This module is used by the views of the web app, for example:
+    ::
+
+        from exo_bespin.website.bespin_app import batches
+
+        params, errors = batches.validate(batches.parse_json(request.body))
+
+Dependencies
+------------
+
+    - ``django``
+"""
+
+import csv
+import io
+import json
+import zipfile
+
+from exo_bespin.website.bespin_app.form_validation import ExampleForm
+
+SUMMARY_FIELDS = ['job_id', 'status', 'cached', 'params', 'error']
+
+
+def get_bundle(batch):
+    """Return a zip bundle of the results of the given batch.
+
+    The bundle contains a ``summary.csv`` file, listing the ID, status,
+    and parameters of every job (and the last line of its error, if it
+    failed), and a directory for each finished job, named by its ID,
+    containing its ``lc.dat`` results and ``output.txt`` output.
+
+    Parameters
+    ----------
+    batch : obj
+        The ``Batch`` object
+
+    Returns
+    -------
+    bundle : bytes
+        The contents of the zip file
+    """
+
+    summary = io.StringIO()
+    writer = csv.DictWriter(summary, SUMMARY_FIELDS)
+    writer.writeheader()
+
+    bundle = io.BytesIO()
+    with zipfile.ZipFile(bundle, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for job in batch.jobs.select_related('source').order_by('submitted'):
+            error = job.error.strip().split('\n')[-1] if job.status == 'failed' else ''
+            writer.writerow({'job_id': job.id, 'status': job.status, 'cached': job.cached, 'params': job.params,
+                             'error': error})
+            if job.status == 'done':
+                zip_file.writestr('{}/lc.dat'.format(job.id), job.get_source().results)
+                zip_file.writestr('{}/output.txt'.format(job.id), job.get_source().output)
+        zip_file.writestr('summary.csv', summary.getvalue())
+
+    return bundle.getvalue()
+
+
+def parse_csv(csv_file):
+    """Return the rows of the given uploaded CSV file.
+
+    Parameters
+    ----------
+    csv_file : obj
+        The uploaded file, whose first row names the columns
+
+    Returns
+    -------
+    rows : list
+        A dictionary of the values of each row, keyed by column name
+
+    Raises
+    ------
+    ValueError
+        If the file is not UTF-8 encoded text
+    """
+
+    try:
+        text = csv_file.read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise ValueError('The CSV file must be UTF-8 encoded')
+
+    reader = csv.DictReader(io.StringIO(text))
+    rows = [{key.strip(): value for key, value in row.items() if key is not None} for row in reader]
+
+    return [row for row in rows if any(value and value.strip() for value in row.values())]
+
+
+def parse_json(body):
+    """Return the rows of the given JSON request body.
+
+    Parameters
+    ----------
+    body : bytes
+        The body of the request: either a list of the parameters of
+        each fit, or an object with such a list as its ``jobs``
+
+    Returns
+    -------
+    rows : list
+        The parameters of each fit
+
+    Raises
+    ------
+    ValueError
+        If the body is not JSON of either form
+    """
+
+    try:
+        data = json.loads(body.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError) as error:
+        raise ValueError('The request body is not valid JSON: {}'.format(error))
+
+    rows = data.get('jobs') if isinstance(data, dict) else data
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError('The request body must be a list of objects, or an object with such a list as its "jobs"')
+
+    return rows
+
+
+def validate(rows):
+    """Validate the parameters of each fit with the form used for single
+    submissions.
+
+    Parameters
+    ----------
+    rows : list
+        The parameters of each fit
+
+    Returns
+    -------
+    params : list
+        The cleaned parameters of each fit
+    errors : dict
+        The errors of each invalid row, keyed by the (zero-based)
+        index of the row
+    """
+
+    params, errors = [], {}
+    for index, row in enumerate(rows):
+        form = ExampleForm(row)
+        if form.is_valid():
+            params.append(form.get_cleaned_data())
+        else:
+            errors[index] = {field: list(messages) for field, messages in form.errors.items()}
+
+    return params, errors
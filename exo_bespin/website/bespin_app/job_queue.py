@@ -0,0 +1,544 @@
+"""The job queue of the ``bespin`` web app.
+
+Fitting a submission boots an executing machine, runs ``run_fit.py``
+on it, and releases it, which takes tens of minutes.  Rather than doing
+this within the HTTP request, a submission is recorded as a queued
+``FitJob`` row and the request returns immediately.  A pool of worker
+threads, run separately from the web server (see the ``run_workers``
+management command), claims queued jobs from the database, runs them,
+and records their results, which the browser polls for.
+
+Every job has its own workspace, named by its job ID, both on the web
+host (under the ``BESPIN_WORKSPACE_DIR`` setting) and on the executing
+machine (under ``jobs/``).  Its parameters are written to, and its
+results are read from, its workspace only, so any number of jobs can
+run at once, on separate or shared executing machines.  The remote
+workspace of a job is removed once its results are downloaded, and
+the local workspace once its results are recorded in the database,
+or kept for inspection if the job failed.  When ``aws_config.json``
+names an existing EC2 instance rather than a launch template, the
+workers of a pool share that instance, which is stopped once the last
+of their jobs is done (see ``EC2Executor``); only one pool should then
+use it.
+
+A queued job is claimed with a conditional ``UPDATE`` of its status, so
+any number of worker pools (in any number of processes or hosts
+sharing the database) can take jobs from the same queue without
+running a job twice.  Jobs are claimed in the order set by the
+fair-share scheduler (see ``scheduling``), and no more than the
+``BESPIN_MAX_INSTANCES`` setting are run at once by all pools together.
+
+Submissions are checked against the result cache (see
+``result_cache``) first: a submission whose results are cached is
+recorded as a job that is already done, and a submission identical to
+a queued or running job is coalesced onto that job, so that only new
+parameters cost a fit.  A job served from the cache refers to the job
+that ran the fit for its output and results, rather than copying
+them.  Each submission (or batch) is made in one
+transaction, which writes before it reads, so that on SQLite (which
+lets one transaction write at a time) concurrent submissions are
+admitted one after another and can not together queue more than the
+``BESPIN_MAX_QUEUED`` setting allows.
+
+The stages and sampling progress of a running job are recorded as it
+runs (see ``progress``), for the browser to follow.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    Jobs are submitted by the views of the web app, for example:
+    ::
+
+        from exo_bespin.website.bespin_app import job_queue
+        job = job_queue.submit_job({'rp': 0.1})
+
+    and are run by a worker pool, usually started with:
+    ::
+
+        python manage.py run_workers --workers 4
+
+Dependencies
+------------
+
+    - ``django``
+    - ``exo_bespin``
+"""
+
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from exo_bespin.execution.executors import get_executor
+from exo_bespin.execution.pipeline import Pipeline
+from exo_bespin.execution.scheduler import Job
+from exo_bespin.logging import tracing
+from exo_bespin.website.bespin_app import light_curves, result_cache, scheduling
+from exo_bespin.website.bespin_app.models import Batch, FitJob
+from exo_bespin.website.bespin_app.progress import ProgressRecorder
+
+POLL_INTERVAL = 2
+REMOTE_WORKSPACE_DIR = 'jobs'
+
+
+def _get_pool_name(pid=None):
+    """Return the name of the worker pool of the given process on this
+    host, which prefixes the names of its workers.
+
+    Parameters
+    ----------
+    pid : int
+        The process ID.  Defaults to that of this process.
+
+    Returns
+    -------
+    name : str
+        The name of the worker pool
+    """
+
+    return '{}-{}'.format(socket.gethostname(), os.getpid() if pid is None else pid)
+
+
+def _is_stopped(worker):
+    """Return whether the given worker belongs to a worker pool on
+    this host whose process is no longer running.
+
+    Parameters
+    ----------
+    worker : str
+        The name of the worker
+
+    Returns
+    -------
+    stopped : bool
+        Whether the worker has stopped.  Workers on other hosts are
+        never known to have stopped.
+    """
+
+    pool_name, _, _ = worker.rpartition('-worker-')
+    _, _, pid = pool_name.rpartition('-')
+    if not pid.isdigit() or pool_name != _get_pool_name(int(pid)):
+        return False
+
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return False
+
+    return False
+
+
+def _submit(params, owner, priority, admit=False):
+    """Add a fit of the given parameters to the queue, within the
+    transaction of ``submit_job`` or ``submit_batch``.
+
+    Parameters
+    ----------
+    params : dict
+        The cleaned data of the submitted form
+    owner : str
+        The user who submitted the fit
+    priority : int
+        The priority of the fit
+    admit : bool
+        Whether to check that the queue has room for the fit
+
+    Returns
+    -------
+    job : obj
+        The ``FitJob`` object
+
+    Raises
+    ------
+    QueueFullError
+        If ``admit`` is set and the queue is full
+    """
+
+    key = result_cache.get_key(params)
+
+    # The new job is written first, so that the transaction holds the
+    # write lock of the database before it reads anything, and
+    # concurrent submissions are admitted one after another
+    job = FitJob.objects.create(params=json.dumps(params, sort_keys=True), key=key, owner=owner, priority=priority)
+
+    # Serve cached results at once
+    entry = result_cache.lookup(key)
+    if entry is not None:
+        job.started = job.finished = timezone.now()
+        job.status, job.worker, job.cached, job.source = 'done', 'cache', True, entry.job
+        job.save(update_fields=['started', 'finished', 'status', 'worker', 'cached', 'source'])
+        logging.info('Served fit job {} from the cache'.format(job.id))
+        return job
+
+    if admit:
+        rejection = scheduling.check_admission(1, exclude=job)
+        if rejection is not None:
+            raise scheduling.QueueFullError(rejection)
+
+    # Coalesce onto the oldest identical job in flight.  The job in
+    # flight takes on the higher priority of the two.
+    in_flight = FitJob.objects.filter(key=key, status__in=['queued', 'running']).order_by('submitted', 'id').first()
+    if in_flight is not None and in_flight.id != job.id:
+        job.delete()
+        if FitJob.objects.filter(id=in_flight.id, priority__lt=priority).update(priority=priority):
+            in_flight.priority = priority
+        result_cache.record('coalesced')
+        logging.info('Coalesced submission onto fit job {}'.format(in_flight.id))
+        return in_flight
+
+    result_cache.record('misses')
+    logging.info('Queued fit job {}'.format(job.id))
+
+    return job
+
+
+def claim_job(worker):
+    """Claim the queued job that should run next (see ``scheduling``)
+    for the given worker, unless the ``BESPIN_MAX_INSTANCES`` limit of
+    running jobs has been reached.
+
+    Parameters
+    ----------
+    worker : str
+        The name of the worker
+
+    Returns
+    -------
+    job : obj
+        The claimed ``FitJob`` object, or ``None`` if the queue is
+        empty or the limit has been reached
+    """
+
+    max_instances = settings.BESPIN_MAX_INSTANCES
+    while True:
+        if max_instances and FitJob.objects.filter(status='running').count() >= max_instances:
+            return None
+
+        job = scheduling.next_job()
+        if job is None:
+            return None
+
+        # Another worker may have claimed the job in the meantime.  The
+        # claim is written before the running jobs are counted, so that
+        # claims made at once are counted one after another, and a claim
+        # beyond the limit is undone.
+        fields = {'status': 'running', 'worker': worker, 'started': timezone.now()}
+        with transaction.atomic():
+            claimed = FitJob.objects.filter(id=job.id, status='queued').update(**fields)
+            if claimed and max_instances and FitJob.objects.filter(status='running').count() > max_instances:
+                FitJob.objects.filter(id=job.id).update(status='queued', worker='', started=None)
+                return None
+        if claimed:
+            for field, value in fields.items():
+                setattr(job, field, value)
+            return job
+
+
+def requeue_running_jobs():
+    """Put jobs that were left running by workers that stopped (e.g.
+    crashed) back on the queue.
+
+    Only the workers of this host are considered, and of those only
+    the workers of processes that are no longer running, so that the
+    jobs of worker pools that are still running (on this host or any
+    other sharing the database) are left alone.
+
+    Returns
+    -------
+    n_jobs : int
+        The number of jobs put back on the queue
+    """
+
+    running = FitJob.objects.filter(status='running', worker__startswith='{}-'.format(socket.gethostname()))
+    stopped = [job_id for job_id, worker in running.values_list('id', 'worker') if _is_stopped(worker)]
+
+    return FitJob.objects.filter(id__in=stopped, status='running').update(status='queued', worker='', started=None)
+
+
+@tracing.trace()
+def run_fit(job_id, params, executor, workspace, recorder=None):
+    """Run a fit of the given parameters on the given executor.
+
+    Parameters
+    ----------
+    job_id : str
+        The job ID, which names the job's workspace on the executing
+        machine
+    params : dict
+        The cleaned data of the submitted form
+    executor : obj
+        An un-booted ``Executor`` object, which is released once the
+        results have been downloaded
+    workspace : str
+        The local directory in which to write the parameters and
+        download the results
+    recorder : obj
+        An optional ``ProgressRecorder`` object, which records the
+        stages and sampling progress of the fit
+
+    Returns
+    -------
+    output : list
+        The lines of output of the fit
+    data : list
+        The lines of the resulting ``lc.dat`` file
+    """
+
+    # The parameters are saved to a json file while the executing machine boots
+    os.makedirs(workspace, exist_ok=True)
+    params_file = os.path.join(workspace, 'params.json')
+    remote_workspace = '{}/{}'.format(REMOTE_WORKSPACE_DIR, job_id)
+
+    def write_params():
+        with open(params_file, 'w') as f:
+            json.dump(params, f)
+
+    # Transfer the parameter file, run the code, and get the results back.
+    # The executing machine is released in the background.
+    job = Job(job_id, 'run_fit.py', args=['--workspace', remote_workspace], prepare=write_params,
+              uploads=[(params_file, '{}/params.json'.format(remote_workspace))],
+              downloads=['{}/results/lc.dat'.format(remote_workspace)], cleanup=[remote_workspace])
+    callbacks = {} if recorder is None else {'on_stage': recorder.on_stage, 'on_output': recorder.on_output}
+    pipeline = Pipeline(executor, **callbacks)
+    output, errors = pipeline.run([job], local_dir=workspace)[job.job_id]
+
+    # Parse the results
+    with tracing.span('job_queue.parse_results'):
+        with open(os.path.join(workspace, 'lc.dat'), 'r') as f:
+            data = f.readlines()
+
+    # The fit has succeeded even if the executing machine could not be
+    # released, but it may still be running, so this is logged as an error
+    try:
+        pipeline.wait()
+    except Exception:
+        logging.exception('Could not release the executing machine of fit job {}'.format(job_id))
+
+    return output, data
+
+
+def run_job(job, executor):
+    """Run the given claimed job and record its results.
+
+    Parameters
+    ----------
+    job : obj
+        A ``FitJob`` object, claimed with ``claim_job``
+    executor : obj
+        An un-booted ``Executor`` object
+
+    Returns
+    -------
+    succeeded : bool
+        Whether the job succeeded
+    """
+
+    logging.info('Running fit job {} on {}'.format(job.id, job.worker))
+    workspace = os.path.join(settings.BESPIN_WORKSPACE_DIR, str(job.id))
+    recorder = ProgressRecorder(job)
+    try:
+        output, data = run_fit(str(job.id), job.get_params(), executor, workspace, recorder)
+    except Exception:
+        job.status = 'failed'
+        job.error = traceback.format_exc()
+        logging.error('Fit job {} failed (see {}):\n{}'.format(job.id, workspace, job.error))
+        recorder.record('failed', 'Failed')
+    else:
+        job.status = 'done'
+        job.output = '\n'.join(output)
+        job.results = ''.join(data)
+        recorder.record('done', 'Done')
+    recorder.close()
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'output', 'results', 'error', 'finished'])
+
+    if job.status == 'done':
+        shutil.rmtree(workspace, ignore_errors=True)
+
+        # A job whose results could not be cached or parsed has still
+        # succeeded.  Its results are parsed when first requested instead,
+        # and a failure to parse them does not stop them being cached.
+        try:
+            result_cache.store(job.key or result_cache.get_key(job.get_params()), job)
+        except DatabaseError as error:
+            logging.warning('Could not cache the results of fit job {}: {}'.format(job.id, error))
+        try:
+            light_curves.store_light_curve(job)
+        except (DatabaseError, ValueError, IndexError) as error:
+            logging.warning('Could not store the light curve of fit job {}: {}'.format(job.id, error))
+
+    return job.status == 'done'
+
+
+def submit_batch(params_list, owner='', priority=0):
+    """Add fits of each of the given parameters to the queue, grouped
+    under one batch.
+
+    Each fit is submitted as with ``submit_job``, so fits whose results
+    are cached are done at once, and identical fits (within the batch
+    or not) share one job.
+
+    Parameters
+    ----------
+    params_list : list
+        The cleaned data of the form for each fit
+    owner : str
+        The user who submitted the fits
+    priority : int
+        The priority of the fits
+
+    Returns
+    -------
+    batch : obj
+        The ``Batch`` object
+
+    Raises
+    ------
+    QueueFullError
+        If the queue has no room for every fit of the batch, in which
+        case none are submitted
+    """
+
+    # Like in ``_submit``, the batch is written first, so that
+    # concurrent submissions are admitted one after another
+    with transaction.atomic():
+        batch = Batch.objects.create()
+        rejection = scheduling.check_admission(len(params_list))
+        if rejection is not None:
+            raise scheduling.QueueFullError(rejection)
+        batch.jobs.add(*[_submit(params, owner, priority) for params in params_list])
+    logging.info('Submitted batch {} of {} fits'.format(batch.id, len(params_list)))
+
+    return batch
+
+
+def submit_job(params, owner='', priority=0):
+    """Add a fit of the given parameters to the queue, unless its
+    results are cached or an identical fit is already queued or
+    running.
+
+    Parameters
+    ----------
+    params : dict
+        The cleaned data of the submitted form
+    owner : str
+        The user who submitted the fit, whose share of the queue it
+        counts against
+    priority : int
+        The priority of the fit.  Fits of a higher priority are run
+        first.
+
+    Returns
+    -------
+    job : obj
+        The ``FitJob`` object, which is either new (and done, if its
+        results were cached) or the identical job already in flight
+
+    Raises
+    ------
+    QueueFullError
+        If the fit would be queued but the queue is full
+    """
+
+    with transaction.atomic():
+        return _submit(params, owner, priority, admit=True)
+
+
+class WorkerPool():
+    """A pool of worker threads that run the jobs of the queue."""
+
+    def __init__(self, n_workers=None, executor_factory=None, poll_interval=POLL_INTERVAL):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        n_workers : int
+            The number of worker threads, each of which runs one job at
+            a time.  Defaults to the ``BESPIN_WORKERS`` setting.
+        executor_factory : func
+            A function, taking no arguments, that returns a new
+            un-booted ``Executor`` object for each job.  Defaults to
+            the backend named by the ``BESPIN_EXECUTOR`` setting.
+        poll_interval : float
+            The number of seconds an idle worker waits before checking
+            the queue again
+        """
+
+        self.n_workers = n_workers or settings.BESPIN_WORKERS
+        self.executor_factory = executor_factory or (lambda: get_executor(settings.BESPIN_EXECUTOR))
+        self.poll_interval = poll_interval
+        self.name = _get_pool_name()
+
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def _work(self, worker):
+        """Run jobs from the queue until the pool is stopped.
+
+        Parameters
+        ----------
+        worker : str
+            The name of the worker
+        """
+
+        try:
+            while not self._stopped.is_set():
+                try:
+                    job = claim_job(worker)
+                except DatabaseError as error:
+                    logging.warning('{} could not claim a job: {}'.format(worker, error))
+                    job = None
+                if job is None:
+                    self._stopped.wait(self.poll_interval)
+                    continue
+
+                # A job that could not be run (e.g. its executor could not
+                # be created) fails, rather than the worker
+                try:
+                    run_job(job, self.executor_factory())
+                except Exception:
+                    error = traceback.format_exc()
+                    logging.error('{} could not run fit job {}:\n{}'.format(worker, job.id, error))
+                    try:
+                        FitJob.objects.filter(id=job.id, status='running').update(
+                            status='failed', error=error, finished=timezone.now())
+                    except DatabaseError as error:
+                        logging.warning('{} could not record the failure of fit job {}: {}'.format(
+                            worker, job.id, error))
+        finally:
+            connection.close()
+
+    def start(self):
+        """Start the worker threads."""
+
+        self._stopped.clear()
+        for number in range(self.n_workers):
+            worker = '{}-worker-{}'.format(self.name, number)
+            thread = threading.Thread(target=self._work, args=(worker,), name=worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info('Started {} workers'.format(self.n_workers))
+
+    def stop(self):
+        """Stop the worker threads once they have finished their current
+        jobs."""
+
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        logging.info('Stopped workers')
@@ -0,0 +1,436 @@
+"""Parses, stores, and downsamples the light curves that result from
+the fits of the ``bespin`` web app.
+
+The ``lc.dat`` file that a fit produces has a row for every point of
+the light curve, which is too much to put into a webpage as text once
+light curves get long.  Instead, the file is parsed once, when the job
+is done (or when its results are first requested), into a ``float64``
+array for each of its numeric columns, which are stored together,
+compressed, as a ``LightCurve`` row.  An overview of the light curve,
+downsampled (as below) to the widest plot that is served, is stored
+alongside it.
+
+The text of the file is kept as well (in ``FitJob.results``), since
+the light curve is not a lossless copy of it: columns that are not
+numeric, comments, and the formatting of the values are left out of
+the arrays, while the file is downloaded as it was written (see
+``batches.get_bundle``).
+
+The results API (see the ``job_results`` view) serves a slice of the
+light curve (between two times) that is downsampled to the width of
+the plot it is drawn in: the points are split into as many buckets as
+the plot is pixels wide, and only the points with the lowest and
+highest flux of each bucket are kept.  The plot then looks the same as
+one of every point, including every transit and outlier, while the
+size of the response, and so the time to load the page, does not grow
+with the length of the light curve.  Slices are downsampled from the
+overview, so that the time to serve them does not grow either, unless
+they are so narrow that the overview has too few points for the plot,
+in which case the full light curve is used.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This module is used by the job queue and the views of the web app,
+    for example:
+    ::
+
+        from exo_bespin.website.bespin_app import light_curves
+
+        columns, data, n_rows = light_curves.get_slice(job, start=-0.05, stop=0.05, width=800)
+
+Dependencies
+------------
+
+    - ``django``
+    - ``numpy``
+"""
+
+import io
+import json
+import zlib
+
+from django.db import IntegrityError
+import numpy as np
+
+from exo_bespin.website.bespin_app.models import LightCurve
+
+COLUMN_NAMES = ['time', 'flux', 'flux_error']
+COMPRESSION_LEVEL = 6
+DEFAULT_WIDTH = 1000
+DTYPE = np.dtype('<f8')
+MAX_WIDTH = 10000
+OVERVIEW_WIDTH = MAX_WIDTH
+
+
+def _column_names(n_columns):
+    """Return the default names of the numeric columns of a light curve
+    whose file has no header.
+
+    Parameters
+    ----------
+    n_columns : int
+        The number of numeric columns
+
+    Returns
+    -------
+    names : list
+        ``time``, ``flux``, ``flux_error``, and then ``column_<index>``
+    """
+
+    return [COLUMN_NAMES[index] if index < len(COLUMN_NAMES) else 'column_{}'.format(index)
+            for index in range(n_columns)]
+
+
+def _encode(data):
+    """Return the given arrays as compressed bytes.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        The arrays, with a row for each column
+
+    Returns
+    -------
+    compressed : bytes
+        The values of each column in turn, compressed
+    """
+
+    return zlib.compress(np.ascontiguousarray(data, dtype=DTYPE).tobytes(), COMPRESSION_LEVEL)
+
+
+def _parse_rows(header, rows):
+    """Parse the split lines of an ``lc.dat`` file into arrays, one
+    column at a time.  This is slower than ``numpy.loadtxt``, but
+    copes with rows that have different numbers of columns.
+
+    Parameters
+    ----------
+    header : list
+        The names given by the header of the file, if any
+    rows : list
+        The values of each row, as strings
+
+    Returns
+    -------
+    columns : list
+        The name of each numeric column
+    data : numpy.ndarray
+        The numeric columns, with a row for each column
+    """
+
+    n_columns = min([len(row) for row in rows]) if rows else 0
+    numeric, data = [], []
+    for index in range(n_columns):
+        try:
+            data.append(np.array([row[index] for row in rows]).astype(DTYPE))
+        except ValueError:
+            continue
+        numeric.append(index)
+
+    columns = [header[index] for index in numeric] if len(header) == n_columns else _column_names(len(numeric))
+
+    return columns, np.array(data, dtype=DTYPE).reshape(len(numeric), len(rows))
+
+
+def _select(data, start, stop):
+    """Return the points of the given light curve between the given
+    times.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        The light curve, with a row for each column, the first of which
+        is the time
+    start : float
+        The earliest time to include, or ``None``
+    stop : float
+        The latest time to include, or ``None``
+
+    Returns
+    -------
+    data : numpy.ndarray
+        The selected points
+    """
+
+    if start is None and stop is None:
+        return data
+
+    mask = np.ones(data.shape[1], dtype=bool)
+    if start is not None:
+        mask &= data[0] >= start
+    if stop is not None:
+        mask &= data[0] <= stop
+
+    return data[:, mask]
+
+
+def decode(light_curve, overview=False):
+    """Return the arrays of the given stored light curve.
+
+    Parameters
+    ----------
+    light_curve : obj
+        The ``LightCurve`` object
+    overview : bool
+        Whether to return the overview of the light curve rather than
+        every point
+
+    Returns
+    -------
+    data : numpy.ndarray
+        The light curve, with a row for each column of the file
+    """
+
+    blob, n_rows = (light_curve.overview, light_curve.n_overview) if overview else \
+        (light_curve.data, light_curve.n_rows)
+    data = np.frombuffer(zlib.decompress(bytes(blob)), dtype=DTYPE)
+
+    return data.reshape(len(light_curve.get_columns()), n_rows)
+
+
+def downsample(y, width):
+    """Return the indices of the points to keep to plot the given values
+    at the given width without losing their extremes.
+
+    The points are split, in order, into at most ``width`` buckets of
+    equal size, and the points with the lowest and highest value of
+    each bucket are kept, along with the first and last points.
+
+    Parameters
+    ----------
+    y : numpy.ndarray
+        The values to preserve the extremes of (e.g. the flux)
+    width : int
+        The width of the plot, in pixels
+
+    Returns
+    -------
+    indices : numpy.ndarray
+        The indices of at most ``2 * width + 2`` points, in order
+    """
+
+    n_points = len(y)
+    if n_points <= 2 * width:
+        return np.arange(n_points)
+
+    # The last bucket is padded with its last value to fill it
+    size = -(-n_points // width)
+    n_buckets = -(-n_points // size)
+    buckets = np.pad(y, (0, n_buckets * size - n_points), mode='edge').reshape(n_buckets, size)
+    offsets = np.arange(n_buckets) * size
+    indices = np.concatenate([offsets + buckets.argmin(axis=1), offsets + buckets.argmax(axis=1), [0, n_points - 1]])
+
+    return np.unique(np.minimum(indices, n_points - 1))
+
+
+def encode_light_curve(results):
+    """Parse the contents of an ``lc.dat`` file into an (unsaved) light
+    curve, with its overview.
+
+    Parameters
+    ----------
+    results : str
+        The contents of the file
+
+    Returns
+    -------
+    light_curve : obj
+        The ``LightCurve`` object, without a job
+    """
+
+    columns, data = parse_results(results)
+    overview = data[:, downsample(data[min(1, len(columns) - 1)], OVERVIEW_WIDTH)] if columns else data
+
+    return LightCurve(columns=json.dumps(columns), n_rows=data.shape[1], data=_encode(data),
+                      n_overview=overview.shape[1], overview=_encode(overview))
+
+
+def get_light_curve(job):
+    """Return the stored light curve of the given job, parsing and
+    storing it first if it has not been yet.  The light curve of a job
+    served from the cache is that of the job that ran the fit.
+
+    Parameters
+    ----------
+    job : obj
+        A ``FitJob`` object that is done
+
+    Returns
+    -------
+    light_curve : obj
+        The ``LightCurve`` object
+    """
+
+    job = job.get_source()
+    try:
+        return LightCurve.objects.get(job=job)
+    except LightCurve.DoesNotExist:
+        return store_light_curve(job)
+
+
+def get_slice(job, start=None, stop=None, width=DEFAULT_WIDTH, column=None):
+    """Return the points of the light curve of the given job between
+    the given times, downsampled to the given width (see
+    ``slice_light_curve``).
+
+    Parameters
+    ----------
+    job : obj
+        A ``FitJob`` object that is done
+    start : float
+        The earliest time to include.  Defaults to the first point.
+    stop : float
+        The latest time to include.  Defaults to the last point.
+    width : int
+        The width of the plot, in pixels
+    column : str
+        The column whose extremes are preserved.  Defaults to the
+        second column (the flux).
+
+    Returns
+    -------
+    columns : list
+        The name of each column
+    data : numpy.ndarray
+        The points of the slice, with a row for each column
+    n_rows : int
+        The number of points of the whole light curve
+    """
+
+    return slice_light_curve(get_light_curve(job), start, stop, width, column)
+
+
+def parse_results(results):
+    """Parse the contents of an ``lc.dat`` file into arrays.
+
+    Columns that are not numeric in every row (e.g. the name of the
+    instrument) are left out.  The last comment line (starting with
+    ``#``) is used as the header if it names every column.
+
+    Parameters
+    ----------
+    results : str
+        The contents of the file
+
+    Returns
+    -------
+    columns : list
+        The name of each numeric column
+    data : numpy.ndarray
+        The numeric columns, with a row for each column
+    """
+
+    header, rows = [], []
+    for line in results.splitlines():
+        line = line.strip()
+        if line.startswith('#'):
+            header = line.lstrip('#').split()
+        elif line:
+            rows.append(line)
+
+    if not rows:
+        return _parse_rows(header, [])
+
+    # The numeric columns are found from the first row, and then read
+    # all at once
+    first_row = rows[0].split()
+    numeric = []
+    for index, value in enumerate(first_row):
+        try:
+            float(value)
+        except ValueError:
+            continue
+        numeric.append(index)
+
+    try:
+        data = np.loadtxt(io.StringIO('\n'.join(rows)), dtype=DTYPE, usecols=numeric, ndmin=2).T
+    except (ValueError, IndexError):
+        return _parse_rows(header, [row.split() for row in rows])
+
+    columns = [header[index] for index in numeric] if len(header) == len(first_row) else _column_names(len(numeric))
+
+    return columns, data.reshape(len(numeric), len(rows))
+
+
+def slice_light_curve(light_curve, start=None, stop=None, width=DEFAULT_WIDTH, column=None):
+    """Return the points of the given light curve between the given
+    times, downsampled to the given width.
+
+    Parameters
+    ----------
+    light_curve : obj
+        The ``LightCurve`` object
+    start : float
+        The earliest time to include.  Defaults to the first point.
+    stop : float
+        The latest time to include.  Defaults to the last point.
+    width : int
+        The width of the plot, in pixels
+    column : str
+        The column whose extremes are preserved.  Defaults to the
+        second column (the flux).
+
+    Returns
+    -------
+    columns : list
+        The name of each column
+    data : numpy.ndarray
+        The points of the slice, with a row for each column
+    n_rows : int
+        The number of points of the whole light curve
+
+    Raises
+    ------
+    ValueError
+        If the width is out of range or the column is unknown
+    """
+
+    if not 1 <= width <= MAX_WIDTH:
+        raise ValueError('The width must be between 1 and {}'.format(MAX_WIDTH))
+
+    columns = light_curve.get_columns()
+    if column is not None and column not in columns:
+        raise ValueError('Unknown column: {}'.format(column))
+    if not columns:
+        return columns, decode(light_curve), light_curve.n_rows
+    index = columns.index(column or columns[min(1, len(columns) - 1)])
+
+    # The overview has enough points for all but the narrowest slices
+    data = _select(decode(light_curve, overview=True), start, stop)
+    if data.shape[1] < 2 * width and light_curve.n_overview < light_curve.n_rows:
+        data = _select(decode(light_curve), start, stop)
+
+    return columns, data[:, downsample(data[index], width)], light_curve.n_rows
+
+
+def store_light_curve(job):
+    """Parse the results of the given job and store them as its light
+    curve.
+
+    Parameters
+    ----------
+    job : obj
+        A ``FitJob`` object that is done
+
+    Returns
+    -------
+    light_curve : obj
+        The ``LightCurve`` object
+    """
+
+    light_curve = encode_light_curve(job.results)
+    light_curve.job = job
+
+    # Another request may have stored it in the meantime
+    try:
+        light_curve.save(force_insert=True)
+    except IntegrityError:
+        return LightCurve.objects.get(job=job)
+
+    return light_curve
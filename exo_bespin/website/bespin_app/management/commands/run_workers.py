@@ -0,0 +1,62 @@
+"""Runs a pool of workers that execute the fit jobs submitted through
+the ``bespin`` web app (see ``job_queue``).
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This command is run alongside the web server, from the ``website``
+    directory, as such:
+
+        >>> python manage.py run_workers --workers 4 --executor ec2
+
+    With ``--requeue``, jobs left running by a previous pool on this
+    host that stopped unexpectedly are put back on the queue first.
+
+Dependencies
+------------
+
+    - ``django``
+    - ``exo_bespin``
+"""
+
+import functools
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from exo_bespin.execution.executors import get_executor
+from exo_bespin.website.bespin_app import job_queue
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of workers that execute queued fit jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.BESPIN_WORKERS,
+                            help='The number of jobs to run at once')
+        parser.add_argument('--executor', type=str, default=settings.BESPIN_EXECUTOR,
+                            help='The execution backend (local, ssh, or ec2)')
+        parser.add_argument('--requeue', action='store_true',
+                            help='Put jobs left running by a stopped pool back on the queue')
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            n_jobs = job_queue.requeue_running_jobs()
+            self.stdout.write('Put {} running jobs back on the queue'.format(n_jobs))
+
+        pool = job_queue.WorkerPool(options['workers'], functools.partial(get_executor, options['executor']))
+        pool.start()
+        self.stdout.write('Started {} workers using the {} executor'.format(options['workers'], options['executor']))
+
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping workers once their current jobs finish')
+            pool.stop()
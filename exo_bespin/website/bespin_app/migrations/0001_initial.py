@@ -0,0 +1,36 @@
+"""Creates the ``FitJob`` table of the job queue."""
+
+import uuid
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name='FitJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('params', models.TextField()),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'),
+                                                     ('failed', 'failed')], default='queued', max_length=16)),
+                ('worker', models.CharField(blank=True, max_length=64)),
+                ('submitted', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('output', models.TextField(blank=True)),
+                ('results', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ['submitted'],
+                'indexes': [models.Index(fields=['status', 'submitted'], name='fitjob_status_submitted')],
+            },
+        ),
+    ]
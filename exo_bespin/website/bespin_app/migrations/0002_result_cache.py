@@ -0,0 +1,50 @@
+"""Adds the result cache: the ``CachedResult`` and ``CacheStatistic``
+tables, and the cache key and ``source`` job of each ``FitJob``."""
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bespin_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedResult',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_used', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('hits', models.IntegerField(default=0)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                          to='bespin_app.FitJob')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CacheStatistic',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='fitjob',
+            name='key',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='fitjob',
+            name='cached',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='fitjob',
+            name='source',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT,
+                                    related_name='copies', to='bespin_app.FitJob'),
+        ),
+    ]
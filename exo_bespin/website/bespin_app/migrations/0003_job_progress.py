@@ -0,0 +1,41 @@
+"""Adds the progress of each ``FitJob``: its current stage and sampling
+progress, and the ``JobEvent`` table."""
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bespin_app', '0002_result_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fitjob',
+            name='stage',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='fitjob',
+            name='progress',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='JobEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=32)),
+                ('message', models.CharField(blank=True, max_length=256)),
+                ('progress', models.IntegerField(blank=True, null=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events',
+                                          to='bespin_app.FitJob')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+"""Adds the ``Batch`` table, which groups fits submitted together."""
+
+import uuid
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bespin_app', '0003_job_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Batch',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('submitted', models.DateTimeField(default=django.utils.timezone.now)),
+                ('jobs', models.ManyToManyField(related_name='batches', to='bespin_app.FitJob')),
+            ],
+            options={
+                'ordering': ['submitted'],
+            },
+        ),
+    ]
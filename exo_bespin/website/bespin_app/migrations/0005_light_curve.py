@@ -0,0 +1,29 @@
+"""Adds the ``LightCurve`` table, which holds the parsed results of each
+finished ``FitJob``."""
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bespin_app', '0004_batch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LightCurve',
+            fields=[
+                ('job', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True,
+                                             related_name='light_curve', serialize=False, to='bespin_app.FitJob')),
+                ('columns', models.TextField()),
+                ('n_rows', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('n_overview', models.IntegerField(default=0)),
+                ('overview', models.BinaryField(default=b'')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+"""Adds the ``owner`` and ``priority`` of each ``FitJob``, by which the
+fair-share scheduler orders the queue."""
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bespin_app', '0005_light_curve'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fitjob',
+            name='owner',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='fitjob',
+            name='priority',
+            field=models.IntegerField(default=0),
+        ),
+    ]
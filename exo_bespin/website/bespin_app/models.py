@@ -0,0 +1,242 @@
+"""Defines the database models for the ``bespin`` web app.
+
+Each fit submitted through the website is recorded as a ``FitJob``
+row, which the worker pool (see ``job_queue``) picks up and executes
+outside of the HTTP request.  The row holds the submitted parameters,
+the status of the job, and, once it is done, its output and results.
+
+The finished fits whose results are cached are referenced by
+``CachedResult`` rows, keyed by a hash of the normalized parameters,
+and hits and misses of the cache are counted in ``CacheStatistic`` rows
+(see ``result_cache``).  A job served from the cache has no output or
+results of its own, but refers to the ``source`` job that ran the fit.
+
+Queued jobs are run in the order set by the fair-share scheduler (see
+``scheduling``), by their ``priority`` and the load of their ``owner``.
+
+Jobs submitted together (see ``batches``) are grouped under a
+``Batch``, which tracks their combined status.
+
+While a job runs, each stage it enters and each step of the sampler's
+progress is recorded as a ``JobEvent`` row, which the browser follows
+(see ``progress``).
+
+Once a job is done, its ``lc.dat`` results are parsed into arrays and
+stored compactly as a ``LightCurve`` row, from which the results API
+serves downsampled slices (see ``light_curves``).  The text of the
+file is kept in the ``FitJob`` row too, as the light curve leaves out
+its columns that are not numeric, for downloads of the file itself.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This module is used by other modules of the web app, for example:
+    ::
+
+        from exo_bespin.website.bespin_app.models import FitJob
+        queued = FitJob.objects.filter(status='queued').count()
+
+References
+----------
+    For more information please see:
+        ``https://docs.djangoproject.com/en/2.2/topics/db/models/``
+
+Dependencies
+------------
+
+    - ``django``
+"""
+
+import json
+import uuid
+
+from django.db import models
+from django.utils import timezone
+
+STATUSES = ['queued', 'running', 'done', 'failed']
+
+
+class Batch(models.Model):
+    """A group of fits submitted together."""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    submitted = models.DateTimeField(default=timezone.now)
+    jobs = models.ManyToManyField('FitJob', related_name='batches')
+
+    class Meta:
+        ordering = ['submitted']
+
+    def to_dict(self):
+        """Return the combined status of the jobs of the batch, for the
+        status API.
+
+        Returns
+        -------
+        batch : dict
+            The ``batch_id``, ``submitted`` time (in ISO 8601 format),
+            number of jobs (``n_jobs``), the number of jobs with each
+            status (``counts``), and the ``status`` of the batch, which
+            is ``queued`` until a job starts, ``running`` until every
+            job has finished, and then ``done``, or ``failed`` if any
+            job failed
+        """
+
+        counts = {status: 0 for status in STATUSES}
+        counts.update(self.jobs.order_by().values_list('status').annotate(count=models.Count('id')))
+        n_jobs = sum(counts.values())
+
+        if counts['queued'] == n_jobs:
+            status = 'queued'
+        elif counts['queued'] or counts['running']:
+            status = 'running'
+        else:
+            status = 'failed' if counts['failed'] else 'done'
+
+        return {'batch_id': str(self.id), 'submitted': self.submitted.isoformat(), 'n_jobs': n_jobs,
+                'counts': counts, 'status': status}
+
+
+class CachedResult(models.Model):
+    """A finished fit whose results are cached, keyed by its
+    parameters."""
+
+    key = models.CharField(max_length=64, primary_key=True)
+    job = models.ForeignKey('FitJob', on_delete=models.CASCADE, related_name='+')
+    created = models.DateTimeField(default=timezone.now)
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+    hits = models.IntegerField(default=0)
+
+
+class CacheStatistic(models.Model):
+    """A counter of the result cache (e.g. of hits or misses)."""
+
+    name = models.CharField(max_length=32, primary_key=True)
+    count = models.IntegerField(default=0)
+
+
+class FitJob(models.Model):
+    """A fit submitted through the website."""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    params = models.TextField()
+    key = models.CharField(max_length=64, blank=True, db_index=True)
+    cached = models.BooleanField(default=False)
+    owner = models.CharField(max_length=64, blank=True, db_index=True)
+    priority = models.IntegerField(default=0)
+    stage = models.CharField(max_length=32, blank=True)
+    progress = models.IntegerField(null=True, blank=True)
+    status = models.CharField(max_length=16, default='queued', choices=[(status, status) for status in STATUSES])
+    worker = models.CharField(max_length=64, blank=True)
+    submitted = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    output = models.TextField(blank=True)
+    results = models.TextField(blank=True)
+    source = models.ForeignKey('self', on_delete=models.PROTECT, null=True, blank=True, related_name='copies')
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['submitted']
+        indexes = [models.Index(fields=['status', 'submitted'], name='fitjob_status_submitted')]
+
+    def get_params(self):
+        """Return the submitted parameters.
+
+        Returns
+        -------
+        params : dict
+            The cleaned data of the submitted form
+        """
+
+        return json.loads(self.params)
+
+    def get_source(self):
+        """Return the job that ran the fit of this job.
+
+        Returns
+        -------
+        job : obj
+            The ``FitJob`` whose ``output`` and ``results`` this job
+            was served from the cache, or this job itself
+        """
+
+        return self.source or self
+
+    def to_dict(self):
+        """Return the status of the job, for the status API.
+
+        Returns
+        -------
+        job : dict
+            The ``job_id``, ``owner``, ``priority``, ``status``,
+            current ``stage`` and sampling ``progress`` (in percent),
+            and ``submitted``,
+            ``started``, and ``finished`` times (in ISO 8601 format) of
+            the job, whether its results were ``cached``, and its
+            ``error``, if it failed
+        """
+
+        job = {'job_id': str(self.id), 'owner': self.owner, 'priority': self.priority, 'status': self.status,
+               'stage': self.stage, 'progress': self.progress, 'cached': self.cached}
+        for field in ['submitted', 'started', 'finished']:
+            value = getattr(self, field)
+            job[field] = value.isoformat() if value else None
+        if self.status == 'failed':
+            job['error'] = self.error
+
+        return job
+
+
+class JobEvent(models.Model):
+    """A stage transition or progress update of a ``FitJob``."""
+
+    job = models.ForeignKey(FitJob, on_delete=models.CASCADE, related_name='events')
+    stage = models.CharField(max_length=32)
+    message = models.CharField(max_length=256, blank=True)
+    progress = models.IntegerField(null=True, blank=True)
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['id']
+
+    def to_dict(self):
+        """Return the event, for the event stream.
+
+        Returns
+        -------
+        event : dict
+            The ``stage``, ``message``, sampling ``progress`` (in
+            percent, if known), and ``created`` time (in ISO 8601
+            format) of the event
+        """
+
+        return {'stage': self.stage, 'message': self.message, 'progress': self.progress,
+                'created': self.created.isoformat()}
+
+
+class LightCurve(models.Model):
+    """The results of a finished ``FitJob``, parsed into arrays."""
+
+    job = models.OneToOneField(FitJob, on_delete=models.CASCADE, primary_key=True, related_name='light_curve')
+    columns = models.TextField()
+    n_rows = models.IntegerField()
+    data = models.BinaryField()
+    n_overview = models.IntegerField(default=0)
+    overview = models.BinaryField(default=b'')
+    created = models.DateTimeField(default=timezone.now)
+
+    def get_columns(self):
+        """Return the names of the columns of the light curve.
+
+        Returns
+        -------
+        columns : list
+            The name of each column (e.g. ``time``)
+        """
+
+        return json.loads(self.columns)
@@ -0,0 +1,229 @@
+"""Records and streams the progress of the fit jobs of the ``bespin``
+web app.
+
+While a worker runs a job (see ``job_queue``), a ``ProgressRecorder``
+is told of each stage of the ``Pipeline`` as it starts (booting,
+uploading, sampling, and downloading) and is given each line of output
+of the fit as it arrives from the executing machine.  The progress bar
+of the sampler is parsed from the output, and each stage transition and
+each new percentage of sampling is recorded as a ``JobEvent`` row.
+Events are written by a thread of the recorder's own, several at a time
+when they arrive faster than the database takes them, so that neither
+the ``Pipeline`` nor the output of the fit ever waits on the database.
+
+The browser follows the events of a job as a stream of server-sent
+events (see the ``job_events`` view).  Rather than holding a request
+open, and with it a synchronous worker of the web server, for each
+viewer, every response carries only the events the browser has not yet
+seen and then ends, with a ``retry`` interval after which the browser's
+``EventSource`` reconnects, passing the ID of the last event it
+received in the ``Last-Event-ID`` header.  Once the job is done or has
+failed, an ``end`` event tells the browser to stop reconnecting.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This module is used by the job queue and the views of the web app,
+    for example:
+    ::
+
+        from exo_bespin.website.bespin_app.progress import ProgressRecorder
+
+        recorder = ProgressRecorder(job)
+        pipeline = Pipeline(executor, on_stage=recorder.on_stage, on_output=recorder.on_output)
+
+Dependencies
+------------
+
+    - ``django``
+"""
+
+import json
+import logging
+import queue
+import re
+import threading
+
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from exo_bespin.website.bespin_app.models import FitJob, JobEvent
+
+PROGRESS_PATTERN = re.compile(r'(\d{1,3})%\|')
+RETRY_INTERVAL = 2000
+STAGES = {'boot': 'booting', 'upload': 'uploading', 'compute': 'sampling', 'download': 'downloading'}
+
+
+def format_events(events, finished=False, retry=RETRY_INTERVAL):
+    """Return the given events in the ``text/event-stream`` format.
+
+    Parameters
+    ----------
+    events : list
+        The ``JobEvent`` objects to send
+    finished : bool
+        Whether the job is done or has failed, in which case an ``end``
+        event is sent after the given events
+    retry : int
+        The number of milliseconds after which the browser reconnects
+
+    Returns
+    -------
+    stream : str
+        The events, each with its ID, and the ``retry`` interval
+    """
+
+    lines = ['retry: {}'.format(retry), '']
+    for event in events:
+        lines.extend(['id: {}'.format(event.id), 'data: {}'.format(json.dumps(event.to_dict())), ''])
+    if finished:
+        lines.extend(['event: end', 'data: {}', ''])
+
+    return '\n'.join(lines) + '\n'
+
+
+def parse_progress(line):
+    """Return the percentage of sampling shown by the given line of
+    output, if it is a line of the sampler's progress bar.
+
+    Parameters
+    ----------
+    line : str
+        A line of output of the fit (e.g. ``45%|####5     | 450/1000``)
+
+    Returns
+    -------
+    progress : int
+        The percentage, or ``None`` if the line shows no progress
+    """
+
+    match = PROGRESS_PATTERN.search(line)
+    if match is None or int(match.group(1)) > 100:
+        return None
+
+    return int(match.group(1))
+
+
+class ProgressRecorder():
+    """Records the stages and sampling progress of a running job."""
+
+    def __init__(self, job):
+        """Initialize the class object, and start the thread that
+        writes the events of the job to the database.
+
+        Parameters
+        ----------
+        job : obj
+            The running ``FitJob`` object
+        """
+
+        self.job = job
+        self.progress = None
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write, name='progress-{}'.format(job.id), daemon=True)
+        self._writer.start()
+
+    def _save(self, events):
+        """Save the given events, and the stage and progress of the job
+        after them, in one transaction.  Failing to save them does not
+        fail the job.
+
+        Parameters
+        ----------
+        events : list
+            The ``JobEvent`` objects to save
+        """
+
+        fields = {'stage': events[-1].stage}
+        progress = [event.progress for event in events if event.progress is not None]
+        if progress:
+            fields['progress'] = progress[-1]
+
+        try:
+            with transaction.atomic():
+                JobEvent.objects.bulk_create(events)
+                FitJob.objects.filter(id=self.job.id).update(**fields)
+        except DatabaseError as error:
+            logging.warning('Could not record the progress of fit job {}: {}'.format(self.job.id, error))
+
+    def _write(self):
+        """Save events as they are recorded, until the recorder is
+        closed."""
+
+        try:
+            closed = False
+            while not closed:
+                events = [self._events.get()]
+                while not self._events.empty():
+                    events.append(self._events.get())
+                if events[-1] is None:
+                    closed = True
+                    events.pop()
+                if events:
+                    self._save(events)
+        finally:
+            connection.close()
+
+    def close(self):
+        """Wait for every recorded event to be saved, and stop the
+        writing thread."""
+
+        self._events.put(None)
+        self._writer.join()
+
+    def on_output(self, job_id, line):
+        """Record the sampling progress shown by a line of output of the
+        fit, if it has changed.
+
+        Parameters
+        ----------
+        job_id : str
+            The ID of the ``Pipeline`` job
+        line : str
+            A line of output of the fit
+        """
+
+        progress = parse_progress(line)
+        with self._lock:
+            if progress is None or progress == self.progress:
+                return
+            self.progress = progress
+        self.record('sampling', 'Sampling at {}%'.format(progress), progress)
+
+    def on_stage(self, job_id, stage):
+        """Record the start of a stage of the ``Pipeline``.
+
+        Parameters
+        ----------
+        job_id : str
+            The ID of the ``Pipeline`` job
+        stage : str
+            The name of the stage (e.g. ``boot``).  Stages that the
+            browser is not shown (e.g. ``release``) are ignored.
+        """
+
+        if stage in STAGES:
+            self.record(STAGES[stage], STAGES[stage].capitalize())
+
+    def record(self, stage, message, progress=None):
+        """Record an event of the job, to be saved, with the current
+        stage and progress of the job, by the writing thread.
+
+        Parameters
+        ----------
+        stage : str
+            The stage of the job (e.g. ``sampling`` or ``done``)
+        message : str
+            A description of the event
+        progress : int
+            The percentage of sampling, if known
+        """
+
+        self._events.put(JobEvent(job_id=self.job.id, stage=stage, message=message[:256], progress=progress,
+                                  created=timezone.now()))
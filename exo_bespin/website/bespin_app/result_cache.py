@@ -0,0 +1,241 @@
+"""The result cache of the ``bespin`` web app.
+
+Users often resubmit the same parameters, and each submission would
+otherwise cost a full fit on a new executing machine.  Instead, the
+submitted parameters are normalized (keys sorted, numbers rounded to 12
+significant digits, so that e.g. ``0.1`` and ``0.10000000000000001``
+are the same submission) and hashed, and:
+
+    - If the results of a fit of the same parameters are cached, they
+      are served at once.
+    - If a fit of the same parameters is already queued or running,
+      the submission is coalesced onto that job.
+    - Otherwise, a new job is queued, and its results are cached once
+      it finishes.
+
+Cached results are stored in the database as ``CachedResult`` rows,
+which refer to the job that ran the fit rather than copying its output
+and results, and a job served from the cache refers to that job in
+turn (as its ``source``), so that serving a fit from the cache stores
+nothing but the new job.  Entries older than the
+``BESPIN_CACHE_MAX_AGE`` setting are evicted, after which the fit is
+run again when next submitted.
+
+The cache itself holds no results, so it has no size limit: evicting
+an entry frees nothing, since the job that ran the fit keeps its
+output and results for as long as it is kept itself.  The storage
+used by results is therefore bounded by how long jobs are kept, not by
+the cache.  The number of hits,
+misses, coalesced submissions, and evictions are counted in the
+database, and are served by the ``cache_stats`` view.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This module is used by the job queue, for example:
+    ::
+
+        from exo_bespin.website.bespin_app import result_cache
+
+        key = result_cache.get_key({'rp': 0.1})
+        entry = result_cache.lookup(key)
+
+Dependencies
+------------
+
+    - ``django``
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from exo_bespin.website.bespin_app.models import CachedResult, CacheStatistic
+
+SIGNIFICANT_DIGITS = 12
+
+
+def _normalize(value):
+    """Return the normalized form of a submitted value.
+
+    Parameters
+    ----------
+    value : obj
+        The submitted value
+
+    Returns
+    -------
+    value : obj
+        The value, with numbers rounded to ``SIGNIFICANT_DIGITS``
+        significant digits, strings stripped, and dictionaries and
+        lists normalized recursively
+    """
+
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float('{:.{}g}'.format(value, SIGNIFICANT_DIGITS))
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return {str(key): _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+
+    return value
+
+
+def evict(max_age=None):
+    """Evict expired entries.
+
+    Parameters
+    ----------
+    max_age : float
+        The maximum age of an entry, in seconds.  Defaults to the
+        ``BESPIN_CACHE_MAX_AGE`` setting.
+
+    Returns
+    -------
+    n_evicted : int
+        The number of entries evicted
+    """
+
+    max_age = settings.BESPIN_CACHE_MAX_AGE if max_age is None else max_age
+
+    expired = CachedResult.objects.filter(created__lt=timezone.now() - datetime.timedelta(seconds=max_age))
+    n_evicted = expired.delete()[0]
+
+    if n_evicted:
+        record('evicted', n_evicted)
+        logging.info('Evicted {} cached results'.format(n_evicted))
+
+    return n_evicted
+
+
+def get_key(params):
+    """Return the cache key of the given parameters.
+
+    Parameters
+    ----------
+    params : dict
+        The cleaned data of the submitted form
+
+    Returns
+    -------
+    key : str
+        The SHA-256 hash of the normalized parameters
+    """
+
+    normalized = json.dumps(_normalize(params), sort_keys=True, separators=(',', ':'))
+
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def get_stats():
+    """Return the statistics of the cache.
+
+    Returns
+    -------
+    stats : dict
+        The number of ``hits``, ``misses``, ``coalesced``
+        submissions, and ``evicted`` entries, the ``hit_rate`` (the
+        fraction of submissions that did not need a new fit), and the
+        number of ``entries``
+    """
+
+    stats = {name: 0 for name in ['hits', 'misses', 'coalesced', 'evicted']}
+    stats.update(CacheStatistic.objects.values_list('name', 'count'))
+
+    submissions = stats['hits'] + stats['misses'] + stats['coalesced']
+    stats['hit_rate'] = (stats['hits'] + stats['coalesced']) / submissions if submissions else 0.
+    stats['entries'] = CachedResult.objects.count()
+
+    return stats
+
+
+def lookup(key):
+    """Return the cached results of the given key, if any, and count
+    the hit.
+
+    Parameters
+    ----------
+    key : str
+        The cache key (see ``get_key``)
+
+    Returns
+    -------
+    entry : obj
+        The ``CachedResult`` object, whose ``job`` ran the fit, or
+        ``None`` if there is no (unexpired) entry
+    """
+
+    entry = CachedResult.objects.select_related('job').filter(key=key).first()
+    if entry is None:
+        return None
+
+    if timezone.now() - entry.created > datetime.timedelta(seconds=settings.BESPIN_CACHE_MAX_AGE):
+        entry.delete()
+        record('evicted')
+        return None
+
+    CachedResult.objects.filter(key=key).update(hits=F('hits') + 1, last_used=timezone.now())
+    record('hits')
+
+    return entry
+
+
+def record(name, count=1):
+    """Add to the given counter of the cache.
+
+    Parameters
+    ----------
+    name : str
+        The name of the counter (e.g. ``hits``)
+    count : int
+        The amount to add
+    """
+
+    if CacheStatistic.objects.filter(name=name).update(count=F('count') + count):
+        return
+
+    # The first count creates the counter, unless another process got there first
+    try:
+        CacheStatistic.objects.create(name=name, count=count)
+    except IntegrityError:
+        CacheStatistic.objects.filter(name=name).update(count=F('count') + count)
+
+
+def store(key, job):
+    """Cache the results of a finished fit, and evict expired
+    entries.
+
+    Parameters
+    ----------
+    key : str
+        The cache key (see ``get_key``)
+    job : obj
+        The ``FitJob`` object that ran the fit
+    """
+
+    now = timezone.now()
+    fields = {'job': job, 'created': now, 'last_used': now}
+
+    # Like ``record``, this avoids a transaction, which SQLite would
+    # refuse rather than wait for while a worker is writing
+    if not CachedResult.objects.filter(key=key).update(**fields):
+        try:
+            CachedResult.objects.create(key=key, **fields)
+        except IntegrityError:
+            CachedResult.objects.filter(key=key).update(**fields)
+    evict()
@@ -0,0 +1,406 @@
+"""The fair-share scheduler and admission control of the job queue of
+the ``bespin`` web app.
+
+Run in the order they were submitted, one user's batch of hundreds of
+fits would hold every executing machine until it is done, while
+everyone else waits.  Instead, the next job to run is chosen as such:
+
+    - Jobs of a higher ``priority`` always run first.
+    - Among jobs of the same priority, the owner with the fewest
+      running jobs goes first, then the owner who has started the
+      fewest jobs within the last ``BESPIN_FAIR_SHARE_WINDOW`` seconds,
+      and then the owner whose oldest job has waited the longest.  So
+      owners take turns, however many jobs each has queued.
+    - Each owner's jobs run in the order they were submitted.
+
+Every executing machine runs one job at a time, so no more than
+``BESPIN_MAX_INSTANCES`` jobs are run at once, however many worker
+pools share the queue, to stay within the number of instances the AWS
+account allows.
+
+Submissions are refused once ``BESPIN_MAX_QUEUED`` jobs are queued
+(see ``job_queue.submit_job``, which admits submissions one at a time,
+with a ``QueueFullError``).  The refusal, like every accepted submission, tells the client where it
+stands: the position of a job in the queue and an estimate of when it
+will start, from the number of jobs ahead of it, the number of jobs
+run at once, and the average duration of recent jobs.
+
+How a given load would be scheduled can be simulated, without a
+database or executing machines, with ``simulate``.
+
+Authors
+-------
+
+    - Matthew Bourque
+
+Use
+---
+
+    This module is used by the job queue and the views of the web app,
+    for example:
+    ::
+
+        from exo_bespin.website.bespin_app import scheduling
+
+        job = scheduling.next_job()
+        position = scheduling.get_queue_position(job)
+
+Dependencies
+------------
+
+    - ``django``
+"""
+
+import collections
+import datetime
+import math
+
+from django.conf import settings
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from exo_bespin.website.bespin_app.models import FitJob
+
+N_RECENT_JOBS = 50
+
+SimulatedJob = collections.namedtuple('SimulatedJob', ['index', 'submitted', 'owner', 'priority'])
+
+
+def _get_usage():
+    """Return the number of running jobs of each owner, and the number
+    of jobs each owner has started within the fair-share window.
+
+    Returns
+    -------
+    running : dict
+        The number of running jobs, keyed by owner
+    recent : dict
+        The number of recently started jobs, keyed by owner
+    """
+
+    running = FitJob.objects.filter(status='running').order_by().values_list('owner').annotate(Count('id'))
+    since = timezone.now() - datetime.timedelta(seconds=settings.BESPIN_FAIR_SHARE_WINDOW)
+    recent = FitJob.objects.filter(started__gte=since, cached=False).order_by().values_list('owner').annotate(
+        Count('id'))
+
+    return dict(running), dict(recent)
+
+
+def check_admission(n_jobs, exclude=None):
+    """Return whether the given number of new jobs can be queued, and
+    if not, when to try again.
+
+    Parameters
+    ----------
+    n_jobs : int
+        The number of jobs to queue
+    exclude : obj
+        A new ``FitJob`` object that is already queued, but is one of
+        the jobs to admit rather than one of the jobs ahead of them
+
+    Returns
+    -------
+    rejection : dict
+        ``None`` if the jobs can be queued, and otherwise the number of
+        jobs queued (``queue_length``), the maximum
+        (``max_queued``), and the number of seconds after which enough
+        of the queue should have started for the jobs to be queued
+        (``retry_after``)
+    """
+
+    queue_length = FitJob.objects.filter(status='queued').exclude(id=getattr(exclude, 'id', None)).count()
+    excess = queue_length + n_jobs - settings.BESPIN_MAX_QUEUED
+    if excess <= 0:
+        return None
+
+    retry_after = math.ceil(excess / get_capacity()) * get_average_duration()
+
+    return {'queue_length': queue_length, 'max_queued': settings.BESPIN_MAX_QUEUED,
+            'retry_after': max(1, int(math.ceil(retry_after)))}
+
+
+def estimate_start(position):
+    """Return an estimate of when the job at the given position of the
+    queue will start.
+
+    The jobs ahead of it start as running jobs finish, as many at a
+    time as the capacity allows, each wave taking the average duration
+    of a job.
+
+    Parameters
+    ----------
+    position : int
+        The (zero-based) position of the job in the queue
+
+    Returns
+    -------
+    start : datetime.datetime
+        The estimated start time
+    """
+
+    capacity = get_capacity()
+    free = max(0, capacity - FitJob.objects.filter(status='running').count())
+    if position < free:
+        return timezone.now()
+
+    waves = (position - free) // capacity + 1
+
+    return timezone.now() + datetime.timedelta(seconds=waves * get_average_duration())
+
+
+def get_average_duration():
+    """Return the average duration of recent jobs that ran.
+
+    Returns
+    -------
+    duration : float
+        The average number of seconds between the start and end of the
+        last ``N_RECENT_JOBS`` jobs that are done, or the
+        ``BESPIN_DEFAULT_JOB_DURATION`` setting if none are
+    """
+
+    jobs = FitJob.objects.filter(status='done', cached=False).exclude(started=None).exclude(finished=None)
+    times = jobs.order_by('-finished').values_list('started', 'finished')[:N_RECENT_JOBS]
+    durations = [(finished - started).total_seconds() for started, finished in times]
+
+    return sum(durations) / len(durations) if durations else settings.BESPIN_DEFAULT_JOB_DURATION
+
+
+def get_capacity():
+    """Return the number of jobs that can run at once.
+
+    Returns
+    -------
+    capacity : int
+        The ``BESPIN_MAX_INSTANCES`` setting, or, if it is not set, the
+        ``BESPIN_WORKERS`` setting
+    """
+
+    return settings.BESPIN_MAX_INSTANCES or settings.BESPIN_WORKERS
+
+
+def get_queue_order():
+    """Return the queued jobs in the order they will be run, if no more
+    are submitted and none finish.
+
+    Returns
+    -------
+    jobs : list
+        The queued ``FitJob`` objects, in order
+    """
+
+    running, recent = _get_usage()
+    queued = FitJob.objects.filter(status='queued').order_by('submitted', 'id').only('id', 'owner', 'priority',
+                                                                                      'submitted')
+
+    return list(order_jobs(queued, running, recent))
+
+
+def get_queue_position(job):
+    """Return the position of the given job in the queue.
+
+    Rather than ordering the whole queue (see ``get_queue_order``),
+    which would be slow for the status of every job to poll, the jobs
+    ahead of the given job are counted.  Among jobs of the same
+    priority, ``order_jobs`` runs the ``i``-th queued job of each owner
+    in the order of ``(running + i, recent, submitted)``, so the jobs of
+    each owner that are ahead follow from how many jobs the owner has
+    running and queued.
+
+    Parameters
+    ----------
+    job : obj
+        The ``FitJob`` object
+
+    Returns
+    -------
+    position : int
+        The (zero-based) position of the job, or ``None`` if it is not
+        queued
+    """
+
+    queued = FitJob.objects.filter(status='queued')
+    job = queued.filter(id=job.id).only('id', 'owner', 'priority', 'submitted').first()
+    if job is None:
+        return None
+
+    # Jobs of a higher priority, and the owner's own older jobs, are
+    # ahead.  The jobs of a higher priority count as running by the time
+    # the jobs of this priority are ordered.
+    same_priority = queued.filter(priority=job.priority).order_by()
+    earlier = same_priority.filter(submitted__lt=job.submitted) | same_priority.filter(submitted=job.submitted,
+                                                                                          id__lt=job.id)
+    n_higher = dict(queued.filter(priority__gt=job.priority).order_by().values_list('owner').annotate(Count('id')))
+    n_older = dict(earlier.values_list('owner').annotate(Count('id')))
+    n_queued = dict(same_priority.values_list('owner').annotate(Count('id')))
+    running, recent = _get_usage()
+    running = collections.Counter(running) + collections.Counter(n_higher)
+    position = sum(n_higher.values()) + n_older.get(job.owner, 0)
+
+    # Of the queued jobs of each other owner, those that would run while
+    # their owner has fewer jobs running than this job's owner are ahead,
+    # as is the next one if its owner has started fewer recent jobs, or
+    # as many and it is older
+    turn = running[job.owner] + n_older.get(job.owner, 0)
+    for owner, count in n_queued.items():
+        if owner == job.owner:
+            continue
+        index = turn - running[owner]
+        position += min(max(index, 0), count)
+        if 0 <= index < count:
+            fewer_recent = recent.get(owner, 0) < recent.get(job.owner, 0)
+            older = recent.get(owner, 0) == recent.get(job.owner, 0) and n_older.get(owner, 0) > index
+            position += fewer_recent or older
+
+    return position
+
+
+def next_job():
+    """Return the queued job that should run next.
+
+    Only the oldest job of each owner at the highest queued priority
+    can be next, so only those are considered.
+
+    Returns
+    -------
+    job : obj
+        The ``FitJob`` object, or ``None`` if the queue is empty
+    """
+
+    queued = FitJob.objects.filter(status='queued')
+    oldest = queued.order_by().values_list('priority', 'owner').annotate(Min('submitted'))
+    if not oldest:
+        return None
+
+    priority = max(priority for priority, _, _ in oldest)
+    candidates = [FitJob(owner=owner, priority=priority, submitted=submitted)
+                  for job_priority, owner, submitted in oldest if job_priority == priority]
+
+    # The usage of owners only matters when there is more than one
+    if len(candidates) > 1:
+        running, recent = _get_usage()
+        owner = next(order_jobs(candidates, running, recent)).owner
+    else:
+        owner = candidates[0].owner
+
+    return queued.filter(priority=priority, owner=owner).order_by('submitted', 'id').first()
+
+
+def order_jobs(jobs, running, recent):
+    """Yield the given queued jobs in the order the fair-share
+    scheduler would run them.
+
+    Each job is assumed to keep running once started, so that owners
+    take turns.
+
+    Parameters
+    ----------
+    jobs : iterable
+        The queued jobs, in the order they were submitted.  Each has an
+        ``owner``, a ``priority``, and a ``submitted`` time.
+    running : dict
+        The number of running jobs, keyed by owner
+    recent : dict
+        The number of jobs started within the fair-share window, keyed
+        by owner
+
+    Yields
+    ------
+    job : obj
+        The next job to run
+    """
+
+    queues = collections.defaultdict(collections.OrderedDict)
+    for job in jobs:
+        queues[job.priority].setdefault(job.owner, collections.deque()).append(job)
+
+    running = collections.Counter(running)
+    for priority in sorted(queues, reverse=True):
+        owners = queues[priority]
+        while owners:
+            owner = min(owners, key=lambda owner: (running[owner], recent.get(owner, 0), owners[owner][0].submitted))
+            job = owners[owner].popleft()
+            if not owners[owner]:
+                del owners[owner]
+            running[owner] += 1
+            yield job
+
+
+def simulate(submissions, capacity, duration, fair_share=True, window=None):
+    """Simulate the running of the given submissions, to compare the
+    fair-share scheduler with running jobs in the order they were
+    submitted under a given load.
+
+    Parameters
+    ----------
+    submissions : list
+        The ``(submitted, owner, priority)`` of each job, where
+        ``submitted`` is the time (in seconds) it is submitted
+    capacity : int
+        The number of jobs run at once
+    duration : float
+        The number of seconds each job runs for
+    fair_share : bool
+        Whether to use the fair-share scheduler, rather than running
+        the oldest queued job first
+    window : float
+        The fair-share window, in seconds.  Defaults to the
+        ``BESPIN_FAIR_SHARE_WINDOW`` setting.
+
+    Returns
+    -------
+    starts : list
+        The time each job starts, in the order of ``submissions``
+    """
+
+    assert capacity >= 1, 'The capacity must be at least 1'
+
+    window = settings.BESPIN_FAIR_SHARE_WINDOW if window is None else window
+    jobs = [SimulatedJob(index, submitted, owner, priority)
+            for index, (submitted, owner, priority) in enumerate(submissions)]
+    jobs.sort(key=lambda job: (job.submitted, job.index))
+
+    starts = [None] * len(jobs)
+    running, started = [], []
+    now, n_submitted = 0., 0
+    while len(started) < len(jobs):
+        running = [(finish, owner) for finish, owner in running if finish > now]
+        while n_submitted < len(jobs) and jobs[n_submitted].submitted <= now:
+            n_submitted += 1
+        queued = [job for job in jobs[:n_submitted] if starts[job.index] is None]
+
+        # Start the next job if there is room for it, and otherwise wait
+        # for a job to finish or be submitted
+        if queued and len(running) < capacity:
+            if fair_share:
+                recent = collections.Counter(owner for start, owner in started if start >= now - window)
+                job = next(order_jobs(queued, collections.Counter(owner for _, owner in running), recent))
+            else:
+                job = queued[0]
+            starts[job.index] = now
+            started.append((now, job.owner))
+            running.append((now + duration, job.owner))
+        else:
+            events = [finish for finish, _ in running]
+            if n_submitted < len(jobs):
+                events.append(jobs[n_submitted].submitted)
+            now = min(events)
+
+    return starts
+
+
+class QueueFullError(Exception):
+    """Raised when a submission is refused because the queue is full."""
+
+    def __init__(self, rejection):
+        """Initialize the class object.
+
+        Parameters
+        ----------
+        rejection : dict
+            The rejection (see ``check_admission``)
+        """
+
+        super().__init__('The queue is full ({} of at most {} fits are queued)'.format(
+            rejection['queue_length'], rejection['max_queued']))
+        self.rejection = rejection
@@ -18,4 +18,55 @@ function update_results() {
             $("#results")[0].innerHTML = 'Process Complete!!'
         }
     });
-};
\ No newline at end of file
+};
+/**
+ * Plots the light curve of a job, as served by the results API,
+ * downsampled to the width of the canvas
+ * @param {String} results_url - The URL of the results of the job
+ * @param {String} canvas_id - The ID of the canvas to plot in
+ */
+function plot_results(results_url, canvas_id) {
+    var canvas = document.getElementById(canvas_id);
+    canvas.width = canvas.clientWidth;
+    $.ajax({
+        url: results_url,
+        data: {width: canvas.width},
+        success: function(results){
+            var time = results.data[results.columns[0]];
+            var flux = results.data[results.columns[1]];
+            var finite = function(values) { return values.filter(function(value) { return value !== null; }); };
+            var t_min = Math.min.apply(null, finite(time)), t_max = Math.max.apply(null, finite(time));
+            var f_min = Math.min.apply(null, finite(flux)), f_max = Math.max.apply(null, finite(flux));
+            var context = canvas.getContext('2d');
+            context.beginPath();
+            for (var i = 0; i < time.length; i++) {
+                if (time[i] === null || flux[i] === null) { continue; }
+                var x = (time[i] - t_min) / ((t_max - t_min) || 1) * canvas.width;
+                var y = canvas.height - (flux[i] - f_min) / ((f_max - f_min) || 1) * canvas.height;
+                context.lineTo(x, y);
+            }
+            context.stroke();
+        }
+    });
+};
+/**
+ * Follows the progress of a job, showing each stage and the progress
+ * of sampling as it happens, and reloads the page once the job is done
+ * or has failed.  The server ends each response at once, and the
+ * browser reconnects, asking only for the events it has not yet seen.
+ * @param {String} events_url - The URL of the events of the job
+ */
+function stream_job(events_url) {
+    var source = new EventSource(events_url);
+    source.onmessage = function(event) {
+        var data = JSON.parse(event.data);
+        $("#status")[0].innerHTML = data.message;
+        if (data.progress === null) {
+            $("#events").append($("<li>").text(data.message));
+        }
+    };
+    source.addEventListener('end', function() {
+        source.close();
+        window.location.reload();
+    });
+};
@@ -49,4 +49,18 @@ urlpatterns = [
 
     # Home
     path('', views.home, name='home'),
+
+    # Batches
+    path('batch/', views.batch, name='batch'),
+    path('batch/<uuid:batch_id>/bundle/', views.batch_bundle, name='batch_bundle'),
+    path('batch/<uuid:batch_id>/status/', views.batch_status, name='batch_status'),
+
+    # Result cache
+    path('cache/stats/', views.cache_stats, name='cache_stats'),
+
+    # Jobs
+    path('job/<uuid:job_id>/', views.job, name='job'),
+    path('job/<uuid:job_id>/events/', views.job_events, name='job_events'),
+    path('job/<uuid:job_id>/results/', views.job_results, name='job_results'),
+    path('job/<uuid:job_id>/status/', views.job_status, name='job_status'),
 ]
@@ -34,64 +34,414 @@ Dependencies
 
 """
 
+import gzip
+import hmac
 import json
-import os
+import math
 
-from django.http import HttpResponse, HttpResponseRedirect
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.http import HttpRequest as request
+from django.middleware.csrf import CsrfViewMiddleware
 from django.shortcuts import render
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
 
-from exo_bespin.aws import aws_tools
+from exo_bespin.logging import tracing
+from exo_bespin.website.bespin_app import batches, job_queue, light_curves, progress, result_cache, scheduling
 from exo_bespin.website.bespin_app.form_validation import ExampleForm
+from exo_bespin.website.bespin_app.models import Batch, FitJob
 
 
-def _process_request(form):
+def _get_api_user(request):
+    """Return the user whose API key (one of the ``BESPIN_API_KEYS``
+    setting) the given request carries in its ``X-Bespin-Api-Key``
+    header.
+
+    Parameters
+    ----------
+    request : HttpRequest object
+        Incoming request from the webpage
+
+    Returns
+    -------
+    user : str
+        The name of the user, or ``None`` if the request carries no
+        known key
+    """
+
+    api_key = request.META.get('HTTP_X_BESPIN_API_KEY', '')
+    if not api_key:
+        return None
+
+    for key, user in settings.BESPIN_API_KEYS.items():
+        if hmac.compare_digest(key.encode('utf-8'), api_key.encode('utf-8')):
+            return user
+
+    return None
+
+
+def _check_csrf(request):
+    """Check the CSRF token of the given request, unless it carries an
+    API key (see ``_get_api_user``).
+
+    Browsers send the session cookie of the web app with forged
+    requests, but can not send an API key with them, so requests made
+    by scripts with an API key need no CSRF token.
+
+    Parameters
+    ----------
+    request : HttpRequest object
+        Incoming request from the webpage
+
+    Returns
+    -------
+    JsonResponse object
+        The ``errors`` of a request that failed the check, or ``None``
+        if it passed
+    """
+
+    if _get_api_user(request) is not None:
+        return None
+
+    reason = _CsrfCheck(lambda request: None).process_view(request, None, (), {})
+    if reason is not None:
+        return JsonResponse({'errors': 'CSRF verification failed ({}); scripts must send an API key'.format(
+            reason)}, status=403)
+
+    return None
+
+
+def _get_batch(batch_id):
+    """Return the batch with the given ID.
+
+    Parameters
+    ----------
+    batch_id : obj
+        The ``uuid.UUID`` of the batch
+
+    Returns
+    -------
+    batch : obj
+        The ``Batch`` object
+
+    Raises
+    ------
+    Http404
+        If there is no such batch
+    """
+
+    try:
+        return Batch.objects.get(id=batch_id)
+    except Batch.DoesNotExist:
+        raise Http404('No such batch: {}'.format(batch_id))
+
+
+def _get_job(job_id):
+    """Return the job with the given ID.
+
+    Parameters
+    ----------
+    job_id : obj
+        The ``uuid.UUID`` of the job
+
+    Returns
+    -------
+    job : obj
+        The ``FitJob`` object
+
+    Raises
+    ------
+    Http404
+        If there is no such job
+    """
+
+    try:
+        return FitJob.objects.get(id=job_id)
+    except FitJob.DoesNotExist:
+        raise Http404('No such job: {}'.format(job_id))
+
+
+def _get_owner(request):
+    """Return the user who made the given request, whose share of the
+    job queue their submissions count against.
+
+    Parameters
+    ----------
+    request : HttpRequest object
+        Incoming request from the webpage
+
+    Returns
+    -------
+    owner : str
+        The name of the logged in user, or else the user of the API key
+        of the request, or else the ``X-Bespin-User`` header if the
+        request came through one of the ``BESPIN_TRUSTED_PROXIES``, or
+        else the address of the client.  Clients can not otherwise name
+        themselves, so that they can not take more than their share.
+    """
+
+    remote_address = request.META.get('REMOTE_ADDR', '')
+    user = getattr(request, 'user', None)
+    api_user = _get_api_user(request)
+    if user is not None and user.is_authenticated:
+        owner = user.get_username()
+    elif api_user is not None:
+        owner = api_user
+    elif remote_address in settings.BESPIN_TRUSTED_PROXIES and request.META.get('HTTP_X_BESPIN_USER'):
+        owner = request.META['HTTP_X_BESPIN_USER']
+    else:
+        owner = remote_address
+
+    return owner.strip()[:64]
+
+
+def _get_priority(request):
+    """Return the priority asked for by the given request.
+
+    Only staff users can raise the priority of their fits, as fits of a
+    higher priority always run first.
+
+    Parameters
+    ----------
+    request : HttpRequest object
+        Incoming request from the webpage
+
+    Returns
+    -------
+    priority : int
+        The ``priority`` of the query string or form, between 0 (the
+        default) and the ``BESPIN_MAX_PRIORITY`` setting
+
+    Raises
+    ------
+    ValueError
+        If the priority is not an integer
+    PermissionDenied
+        If a user who is not staff asks for a priority above 0
+    """
+
+    try:
+        priority = int(request.GET.get('priority', request.POST.get('priority', 0)))
+    except ValueError:
+        raise ValueError('The priority must be an integer')
+
+    priority = min(max(priority, 0), settings.BESPIN_MAX_PRIORITY)
+    user = getattr(request, 'user', None)
+    if priority and not (user is not None and user.is_authenticated and user.is_staff):
+        raise PermissionDenied('Only staff can raise the priority of fits')
+
+    return priority
+
+
+def _get_queue_info(job):
+    """Return the position of the given job in the queue and when it is
+    expected to start.
+
+    Parameters
+    ----------
+    job : obj
+        The ``FitJob`` object
+
+    Returns
+    -------
+    info : dict
+        The ``queue_position`` and ``estimated_start`` (in ISO 8601
+        format) of the job, or an empty dictionary if it is not queued
+    """
+
+    position = scheduling.get_queue_position(job) if job.status == 'queued' else None
+    if position is None:
+        return {}
+
+    return {'queue_position': position, 'estimated_start': scheduling.estimate_start(position).isoformat()}
+
+
+def _reject(error):
+    """Return the response to a submission refused by admission
+    control.
+
+    Parameters
+    ----------
+    error : obj
+        The ``scheduling.QueueFullError`` of the submission
+
+    Returns
+    -------
+    JsonResponse object
+        The ``errors`` of the submission and the state of the queue,
+        with the number of seconds after which to try again in the
+        ``Retry-After`` header
+    """
+
+    content = {'errors': '{}; try again later'.format(error)}
+    content.update(error.rejection)
+    response = JsonResponse(content, status=429)
+    response['Retry-After'] = error.rejection['retry_after']
+
+    return response
+
+
+def _wants_json(request):
+    """Return whether the client asked for a JSON response.
+
+    Parameters
+    ----------
+    request : HttpRequest object
+        Incoming request from the webpage
+
+    Returns
+    -------
+    wants_json : bool
+        Whether ``application/json`` is in the ``Accept`` header
     """
+
+    return 'application/json' in request.META.get('HTTP_ACCEPT', '')
+
+
+@csrf_exempt
+@tracing.trace()
+def batch(request):
+    """Submit many fits at once, either as a JSON list of their
+    parameters or as an uploaded CSV file (the ``file`` field of a
+    multipart form), and return the ID of their batch.
+
+    Submissions from the web app carry a CSRF token as usual.  Scripts
+    instead send one of the ``BESPIN_API_KEYS`` in the
+    ``X-Bespin-Api-Key`` header (see ``_check_csrf``).
+
+    Parameters
+    ----------
+    request : HttpRequest object
+        Incoming request from the webpage
+
+    Returns
+    -------
+    JsonResponse object
+        The ``batch_id``, number of jobs (identical fits share one
+        job), URLs of the status and result bundle of the batch, and the queue position and estimated start
+        of its first queued job, or the ``errors`` of the submission
+        (by row, if rows are invalid), with a status of 429 if the queue
+        is full
     """
 
-    # Get the parameters from the form and save them to a json file
-    params = form.get_cleaned_data()
-    params_file = os.path.join(os.path.expanduser("~"), 'params.json')
-    with open(params_file, 'w') as f:
-        json.dump(params, f)
+    if request.method != 'POST':
+        return JsonResponse({'errors': 'Submit fits with a POST request'}, status=405)
 
-    # Get info from config file
-    ssh_file = aws_tools.get_config()['ssh_file']
-    ec2_id = aws_tools.get_config()['ec2_id']
+    rejection = _check_csrf(request)
+    if rejection is not None:
+        return rejection
 
-    # Boot up the EC2 instance
-    instance, key, client = aws_tools.start_ec2(ssh_file, ec2_id)
-    aws_tools.wait_for_instance(instance, key, client)
+    try:
+        priority = _get_priority(request)
+        if 'file' in request.FILES:
+            rows = batches.parse_csv(request.FILES['file'])
+        else:
+            rows = batches.parse_json(request.body)
+    except ValueError as error:
+        return JsonResponse({'errors': str(error)}, status=400)
+    except PermissionDenied as error:
+        return JsonResponse({'errors': str(error)}, status=403)
+
+    if not rows:
+        return JsonResponse({'errors': 'No fits were submitted'}, status=400)
+    if len(rows) > settings.BESPIN_BATCH_MAX_JOBS:
+        return JsonResponse({'errors': 'At most {} fits can be submitted at once'.format(
+            settings.BESPIN_BATCH_MAX_JOBS)}, status=400)
+
+    params, errors = batches.validate(rows)
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+
+    try:
+        fit_batch = job_queue.submit_batch(params, _get_owner(request), priority)
+    except scheduling.QueueFullError as error:
+        return _reject(error)
+    content = {'batch_id': str(fit_batch.id), 'n_jobs': fit_batch.jobs.count(),
+               'status_url': reverse('bespin_app:batch_status', args=[fit_batch.id]),
+               'bundle_url': reverse('bespin_app:batch_bundle', args=[fit_batch.id])}
+    first_queued = fit_batch.jobs.filter(status='queued').order_by('submitted', 'id').first()
+    if first_queued is not None:
+        content.update(_get_queue_info(first_queued))
+
+    return JsonResponse(content, status=202)
+
+
+def batch_bundle(request, batch_id):
+    """Return a zip bundle of the results of a batch (see
+    ``batches.get_bundle``).  Jobs that have not finished are listed in
+    its summary without results.
 
-    # Transfer the parameter file to EC2
-    aws_tools.transfer_to_ec2(instance, key, client, params_file)
+    Parameters
+    ----------
+    request : HttpRequest object
+        Incoming request from the webpage
+    batch_id : obj
+        The ``uuid.UUID`` of the batch
 
-    # Run the code on EC2
-    command = './exo_bespin/exo_bespin/aws/exo_bespin-env-init.sh python exo_bespin/run_fit.py'
-    output, errors = aws_tools.run_command(command, instance, key, client)
+    Returns
+    -------
+    HttpResponse object
+        The zip file
+    """
 
-    # Get the results back
-    aws_tools.transfer_from_ec2(instance, key, client, 'results/lc.dat')
+    fit_batch = _get_batch(batch_id)
+    response = HttpResponse(batches.get_bundle(fit_batch), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="batch_{}.zip"'.format(fit_batch.id)
 
-    # Stop the EC2 instance
-    aws_tools.stop_ec2(ec2_id, instance)
+    return response
 
-    # Parse the results
-    # posteriors file
-    with open('lc.dat', 'r') as f:
-        data = f.readlines()
-    results = {
-        'data' : data,
-        'output': output
-    }
 
-    print(results)
+def batch_status(request, batch_id):
+    """Return the combined status of a batch, and the status of each of
+    its jobs, as JSON.
 
-    return results
+    Parameters
+    ----------
+    request : HttpRequest object
+        Incoming request from the webpage
+    batch_id : obj
+        The ``uuid.UUID`` of the batch
 
+    Returns
+    -------
+    JsonResponse object
+        The status of the batch (see ``Batch.to_dict``), with the
+        status of each job (see ``FitJob.to_dict``) as its ``jobs``
+    """
 
+    fit_batch = _get_batch(batch_id)
+    status = fit_batch.to_dict()
+    status['jobs'] = [job.to_dict() for job in fit_batch.jobs.order_by('submitted')]
+
+    return JsonResponse(status)
+
+
+def cache_stats(request):
+    """Return the statistics of the result cache as JSON.
+
+    Parameters
+    ----------
+    request : HttpRequest object
+        Incoming request from the webpage
+
+    Returns
+    -------
+    JsonResponse object
+        The statistics of the cache (see ``result_cache.get_stats``)
+    """
+
+    return JsonResponse(result_cache.get_stats())
+
+
+@tracing.trace()
 def home(request):
-    """Generate the home page.
+    """Generate the home page.  A submitted form is added to the job
+    queue, and the client is redirected to the page of the job (or, if
+    it asked for JSON, given the job's ID and its place in the queue).
+    Submissions are refused, with a status of 429, while the queue is
+    full.
 
     Parameters
     ----------
@@ -113,9 +463,22 @@ def home(request):
     elif request.method == 'POST':
         form = ExampleForm(request.POST)
         if form.is_valid():
-            results = _process_request(form)
-            context = {'results': results}
-            return render(request, 'results.html', context)
+            try:
+                priority = _get_priority(request)
+                job = job_queue.submit_job(form.get_cleaned_data(), _get_owner(request), priority)
+            except ValueError as error:
+                return JsonResponse({'errors': str(error)}, status=400)
+            except PermissionDenied as error:
+                return JsonResponse({'errors': str(error)}, status=403)
+            except scheduling.QueueFullError as error:
+                return _reject(error)
+            job_url = reverse('bespin_app:job', args=[job.id])
+            if _wants_json(request):
+                content = {'job_id': str(job.id), 'job_url': job_url,
+                           'status_url': reverse('bespin_app:job_status', args=[job.id])}
+                content.update(_get_queue_info(job))
+                return JsonResponse(content, status=202)
+            return HttpResponseRedirect(job_url)
         else:
             context = {}
             return render(request, '404.html', context)
@@ -123,3 +486,171 @@ def home(request):
     else:
         context = {}
         return render(request, '404.html', context)
+
+
+@tracing.trace()
+def job(request, job_id):
+    """Generate the page of a job, which shows the results of the job
+    once it is done, and otherwise follows the progress of the job.
+
+    Parameters
+    ----------
+    request : HttpRequest object
+        Incoming request from the webpage
+    job_id : obj
+        The ``uuid.UUID`` of the job
+
+    Returns
+    -------
+    HttpResponse object
+        Outgoing response sent to the webpage
+    """
+
+    fit_job = _get_job(job_id)
+
+    # The light curve is loaded by the page from the results API
+    if fit_job.status == 'done':
+        results = {
+            'url': reverse('bespin_app:job_results', args=[fit_job.id]),
+            'output': fit_job.get_source().output.split('\n')
+        }
+        context = {'results': results, 'job': fit_job}
+        return render(request, 'results.html', context)
+
+    context = {'job': fit_job, 'events_url': reverse('bespin_app:job_events', args=[fit_job.id])}
+    return render(request, 'job.html', context)
+
+
+def job_events(request, job_id):
+    """Return the events of a job that the browser has not yet seen,
+    as server-sent events.
+
+    The response ends at once, rather than holding a worker of the web
+    server for as long as the job runs; the browser reconnects after
+    the ``retry`` interval, passing the ID of the last event it
+    received (see ``progress``).
+
+    Parameters
+    ----------
+    request : HttpRequest object
+        Incoming request from the webpage
+    job_id : obj
+        The ``uuid.UUID`` of the job
+
+    Returns
+    -------
+    HttpResponse object
+        The events, in the ``text/event-stream`` format
+    """
+
+    fit_job = _get_job(job_id)
+    last_event_id = request.META.get('HTTP_LAST_EVENT_ID', request.GET.get('last_event_id', ''))
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else 0
+
+    # The status is read first, so that no event recorded before the
+    # job finished is missed
+    finished = fit_job.status in ['done', 'failed']
+    events = fit_job.events.filter(id__gt=last_event_id)
+
+    response = HttpResponse(progress.format_events(events, finished), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+
+    return response
+
+
+def job_results(request, job_id):
+    """Return the light curve of a job that is done, between the given
+    times and downsampled to the given plot width (see
+    ``light_curves.get_slice``).
+
+    The query string may give the ``start`` and ``stop`` times, the
+    ``width`` of the plot in pixels, the ``column`` whose extremes are
+    preserved, and the ``format``: ``json`` (the default), which is
+    gzipped if the client accepts it, or ``binary``, which is the
+    ``float64`` (little-endian) values of each column in turn, with the
+    names of the columns in the ``X-Columns`` header, the number of
+    points served in ``X-Points``, and the number of points of the
+    whole light curve in ``X-Rows``.
+
+    Parameters
+    ----------
+    request : HttpRequest object
+        Incoming request from the webpage
+    job_id : obj
+        The ``uuid.UUID`` of the job
+
+    Returns
+    -------
+    HttpResponse object
+        The light curve, or the ``errors`` of the request
+    """
+
+    fit_job = _get_job(job_id)
+    if fit_job.status != 'done':
+        return JsonResponse({'errors': 'Job {} is {}'.format(fit_job.id, fit_job.status)}, status=409)
+
+    try:
+        start = float(request.GET['start']) if 'start' in request.GET else None
+        stop = float(request.GET['stop']) if 'stop' in request.GET else None
+        width = int(request.GET.get('width', light_curves.DEFAULT_WIDTH))
+        output_format = request.GET.get('format', 'json')
+        if output_format not in ['json', 'binary']:
+            raise ValueError('Unknown format: {}'.format(output_format))
+        columns, data, n_rows = light_curves.get_slice(fit_job, start, stop, width, request.GET.get('column'))
+    except ValueError as error:
+        return JsonResponse({'errors': str(error)}, status=400)
+
+    if output_format == 'binary':
+        response = HttpResponse(data.astype(light_curves.DTYPE).tobytes(), content_type='application/octet-stream')
+        response['X-Columns'] = ','.join(columns)
+        response['X-Points'] = data.shape[1]
+        response['X-Rows'] = n_rows
+    else:
+        # NaN is not valid JSON
+        content = {'columns': columns, 'n_rows': n_rows, 'n_points': data.shape[1],
+                   'data': {name: [value if math.isfinite(value) else None for value in values]
+                            for name, values in zip(columns, data.tolist())}}
+        content = json.dumps(content).encode('utf-8')
+        if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response = HttpResponse(gzip.compress(content), content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(content, content_type='application/json')
+        response['Vary'] = 'Accept-Encoding'
+
+    # The results of a job never change
+    response['Cache-Control'] = 'max-age=86400'
+
+    return response
+
+
+def job_status(request, job_id):
+    """Return the status of a job as JSON, for polling.
+
+    Parameters
+    ----------
+    request : HttpRequest object
+        Incoming request from the webpage
+    job_id : obj
+        The ``uuid.UUID`` of the job
+
+    Returns
+    -------
+    JsonResponse object
+        The status of the job (see ``FitJob.to_dict``), with its
+        ``queue_position`` and ``estimated_start`` while it is queued
+    """
+
+    fit_job = _get_job(job_id)
+    status = fit_job.to_dict()
+    status.update(_get_queue_info(fit_job))
+
+    return JsonResponse(status)
+
+
+class _CsrfCheck(CsrfViewMiddleware):
+    """Checks the CSRF token of a request, returning the reason it
+    failed rather than rendering the CSRF failure page."""
+
+    def _reject(self, request, reason):
+        return reason
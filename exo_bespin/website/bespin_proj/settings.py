@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import json
 import os
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -123,6 +124,49 @@ USE_L10N = True
 USE_TZ = True
 
 
+# Execution backend used to run fits submitted through the web app.  Can be
+# 'ec2' (the default), 'ssh', or 'local'.  See exo_bespin.execution.executors
+BESPIN_EXECUTOR = os.environ.get('BESPIN_EXECUTOR', 'ec2')
+
+# Number of fits the worker pool (manage.py run_workers) runs at once
+BESPIN_WORKERS = int(os.environ.get('BESPIN_WORKERS', 1))
+
+# Directory in which each fit gets its own workspace, named by its job ID
+BESPIN_WORKSPACE_DIR = os.environ.get('BESPIN_WORKSPACE_DIR',
+                                      os.path.join(os.path.expanduser('~'), 'exo_bespin_workspaces'))
+
+# Age (in seconds) beyond which cached results of fits expire.  The cache
+# refers to the jobs that ran the fits, which keep their results, so it has
+# no size limit of its own.
+BESPIN_CACHE_MAX_AGE = int(os.environ.get('BESPIN_CACHE_MAX_AGE', 30 * 24 * 60 * 60))
+
+# Maximum number of fits that can be submitted in one batch
+BESPIN_BATCH_MAX_JOBS = int(os.environ.get('BESPIN_BATCH_MAX_JOBS', 1000))
+
+# Maximum number of fits run at once by all worker pools together, which
+# should not exceed the number of executing machines (e.g. EC2 instances)
+# that can run at once.  If unset, each worker pool runs BESPIN_WORKERS fits.
+BESPIN_MAX_INSTANCES = int(os.environ['BESPIN_MAX_INSTANCES']) if os.environ.get('BESPIN_MAX_INSTANCES') else None
+
+# Admission control and fair-share scheduling of the queue: the number of
+# queued fits beyond which submissions are refused, the highest priority a
+# submission can ask for, the period (in seconds) over which each user's
+# recent usage counts against them, and the duration (in seconds) assumed
+# for a fit until some have finished
+BESPIN_MAX_QUEUED = int(os.environ.get('BESPIN_MAX_QUEUED', 10000))
+BESPIN_MAX_PRIORITY = int(os.environ.get('BESPIN_MAX_PRIORITY', 9))
+BESPIN_FAIR_SHARE_WINDOW = int(os.environ.get('BESPIN_FAIR_SHARE_WINDOW', 60 * 60))
+BESPIN_DEFAULT_JOB_DURATION = int(os.environ.get('BESPIN_DEFAULT_JOB_DURATION', 30 * 60))
+
+# Identities of the users of the web app who are not logged in: API keys
+# for scripts, given as a JSON object mapping each key to the name of its
+# user and sent in the X-Bespin-Api-Key header, and the addresses of
+# proxies trusted to name the user in the X-Bespin-User header.  Other
+# users are known by their address.
+BESPIN_API_KEYS = json.loads(os.environ.get('BESPIN_API_KEYS', '{}'))
+BESPIN_TRUSTED_PROXIES = [address for address in os.environ.get('BESPIN_TRUSTED_PROXIES', '').split(',') if address]
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
@@ -1,3 +1,4 @@
+import argparse
 import json
 import os
 import random
@@ -8,7 +9,22 @@ import numpy as np
 
 random.seed(42)
 
-with open(os.path.join(os.path.expanduser("~"), 'params.json'), 'r') as f:
+# Each job reads its parameters from, and writes its results to, its own
+# workspace, so that concurrent jobs do not collide.  Without a workspace,
+# ~/params.json is read and results are written to results/
+parser = argparse.ArgumentParser()
+parser.add_argument('--workspace', type=str, default=None,
+                    help='The directory containing params.json, in which results/ is written')
+args = parser.parse_args()
+
+if args.workspace:
+    params_file = os.path.join(args.workspace, 'params.json')
+    out_folder = os.path.join(args.workspace, 'results')
+else:
+    params_file = os.path.join(os.path.expanduser("~"), 'params.json')
+    out_folder = 'results'
+
+with open(params_file, 'r') as f:
     user_params = json.load(f)
 
 # Create dataset:
@@ -63,7 +79,7 @@ starting_point['mflux_inst'] = 0.
 starting_point['sigma_w_inst'] = 100.
 
 # Load and fit dataset with juliet:
-dataset = juliet.load(priors=priors, t_lc=times, y_lc=fluxes, yerr_lc=errors, out_folder='results', starting_point=starting_point)
+dataset = juliet.load(priors=priors, t_lc=times, y_lc=fluxes, yerr_lc=errors, out_folder=out_folder, starting_point=starting_point)
 results = dataset.fit(sampler='emcee', progress=True)
 
 print(results)
@@ -11,12 +11,14 @@ REQUIRES = ['awscli',
             'numpy',
             'paramiko',
             'platon',
+            'scipy',
             'scp']
 
 setup(name='exo_bespin',
       version='0.0.0',
       description='',
       packages=find_packages(".", exclude=["*.tests"]),
+      package_data={'exo_bespin.aws': ['build-exo_bespin-env-cpu.sh', 'exo_bespin-env-ready.sh']},
       install_requires=REQUIRES,
       author='Matthew Bourque, Rachel Cooper, Néstor Espinoza',
       license='BSD 3',